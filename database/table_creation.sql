@@ -17,4 +17,31 @@ CREATE TABLE documents (
     ip VARCHAR(127) NULL,
     PRIMARY KEY (filename, bucket),
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE ocr_leases (
+    lease_key VARCHAR(64) NOT NULL PRIMARY KEY,
+    owner VARCHAR(36) NOT NULL,
+    expires_at BIGINT NOT NULL,
+    result TEXT NULL
+);
+
+CREATE TABLE ocr_jobs (
+    job_id VARCHAR(36) NOT NULL PRIMARY KEY,
+    principal_id VARCHAR(255) NOT NULL,
+    doc_type VARCHAR(255) NOT NULL,
+    options TEXT NOT NULL,
+    pages INT NOT NULL,
+    status VARCHAR(15) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE ocr_job_pages (
+    job_id VARCHAR(36) NOT NULL,
+    page_index INT NOT NULL,
+    status VARCHAR(15) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    result TEXT NULL,
+    PRIMARY KEY (job_id, page_index),
+    FOREIGN KEY (job_id) REFERENCES ocr_jobs(job_id) ON DELETE CASCADE
 );
\ No newline at end of file
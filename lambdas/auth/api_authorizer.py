@@ -1,5 +1,20 @@
+import os
 import re
+import logging
 import boto3
+from jwt_util import get_verifier, JwksUnavailableError, TokenError
+from trace_util import traced_handler
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+COGNITO_USER_POOL_ID = os.environ.get("COGNITO_USER_POOL_ID")
+# The Cognito group whose members may use the admin routes, as in LoginPage.tsx
+ADMIN_GROUP = os.environ.get("ADMIN_GROUP", "admin")
+# Routes only admins may call. Denied for everyone else with and without a base
+# path in front of them, since "*" in the policy matches any of it
+ADMIN_ROUTES = [("POST", "auth/register/bulk"), ("POST", "*/auth/register/bulk"),
+                ("DELETE", "users"), ("DELETE", "*/users")]
 
 cognito_client = boto3.client("cognito-idp")
 cognito_errors = (
@@ -14,6 +29,7 @@ cognito_errors = (
     cognito_client.exceptions.ForbiddenException
 )
 
+@traced_handler
 def lambda_handler(event, context):
     print("Client token: " + event['authorizationToken'])
     print("Method ARN: " + event['methodArn'])
@@ -58,10 +74,20 @@ def lambda_handler(event, context):
     policy.stage = apiGatewayArnTmp[1]
 
     try:
-        if validate_token(event['authorizationToken']) != None:
+        claims = validate_token(event['authorizationToken'])
+        if claims != None:
+            # The user's sub, which handlers see as requestContext.authorizer.principalId
+            policy.principalId = token_principal(claims)
+            groups = token_groups(claims)
             policy.allowAllMethods()
+            if ADMIN_GROUP not in groups:
+                for verb, resource in ADMIN_ROUTES:
+                    policy.denyMethod(verb, resource)
         else:
             raise Exception('Unauthorized')
+    except TokenError as e:
+        logger.info(f"Rejected token: {e}")
+        raise Exception('Unauthorized')
     except cognito_errors:
         raise Exception('Unauthorized')
 
@@ -82,13 +108,61 @@ def lambda_handler(event, context):
     # context['obj'] = {'foo':'bar'} <- also invalid
 
     # authResponse['context'] = context
+    authResponse['context'] = {'groups': ",".join(groups)}
 
     return authResponse
 
 # validate token against Cognito users
 def validate_token(token):
+    """
+    A Utility Function that checks an access token. The signature and claims are
+    verified locally against the user pool's keys; Cognito is only called when no
+    pool is configured or its keys can't be fetched
+
+    Input:
+        token = the access token from the Authorization header
+
+    Output:
+        returns the token's claims, or the get_user response on the fallback path.
+        Raises TokenError or a Cognito error if the token is not valid
+    """
+    verifier = get_verifier()
+    if verifier is not None:
+        try:
+            return verifier.verify(token, "access")
+        except JwksUnavailableError as e:
+            logger.warning(f"{e}, validating the token with Cognito instead")
     return cognito_client.get_user(AccessToken=token)
 
+def token_principal(claims):
+    """
+    A Utility Function that returns the user id of a validated token's user: the sub
+    claim, or the sub attribute on the fallback path
+    """
+    if "sub" in claims:
+        return claims["sub"]
+    attributes = {attribute["Name"]: attribute["Value"] for attribute in claims.get("UserAttributes", [])}
+    return attributes.get("sub", claims.get("Username"))
+
+def token_groups(claims):
+    """
+    A Utility Function that returns the Cognito groups of a validated token's user
+
+    Input:
+        claims = what validate_token returned
+
+    Output:
+        returns the list of group names. On the fallback path they are looked up with
+        admin_list_groups_for_user, or left empty if no pool is configured
+    """
+    if "cognito:groups" in claims or "Username" not in claims:
+        return list(claims.get("cognito:groups", []))
+    if not COGNITO_USER_POOL_ID:
+        return []
+    response = cognito_client.admin_list_groups_for_user(Username=claims["Username"],
+                                                         UserPoolId=COGNITO_USER_POOL_ID)
+    return [group["GroupName"] for group in response.get("Groups", [])]
+
 
 class HttpVerb:
     GET = 'GET'
@@ -0,0 +1,307 @@
+import os
+import io
+import csv
+import json
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+from db_util import execute_statement, execute_batch_statement
+from db_util import CORS_HEADERS
+from rate_util import TokenBucket, call_with_backoff
+from trace_util import traced_handler
+from request_util import request_body
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+COGNITO_USER_POOL_ID = os.environ.get("COGNITO_USER_POOL_ID")
+
+# Cognito calls per second across all workers, below the pool's admin API quota
+COGNITO_RATE = float(os.environ.get("BULK_REGISTER_RATE", 20))
+CONCURRENCY = int(os.environ.get("BULK_REGISTER_CONCURRENCY", 8))
+# Users inserted per database request
+INSERT_BATCH_SIZE = 100
+# Stop starting new users when the Lambda has less time left than this, leaving
+# room for the inserts and the response
+TIME_MARGIN_MS = 30_000
+
+INSERT_USER_SQL = "INSERT INTO users (user_id, email, firstname, lastname) VALUES (:user_id, :email, :firstname, :lastname)"
+REQUIRED_FIELDS = ("email", "password", "firstName", "lastName")
+
+CREATED = "created"
+ALREADY_DONE = "already_done"
+FAILED = "failed"
+NOT_STARTED = "not_started"
+
+cognito_client = boto3.client("cognito-idp")
+
+
+def parse_users(body: dict) -> list:
+    """
+    A Utility Function that reads the users to register from the request
+
+    Input:
+        body = the request body, with "users" (a list of objects with email, password,
+            firstName and lastName) or "csv" (the same columns, with a header row)
+
+    Output:
+        returns the list of user dicts
+    """
+    if body.get("csv"):
+        return [{key.strip(): (value or "").strip() for key, value in row.items() if key}
+                for row in csv.DictReader(io.StringIO(body["csv"]))]
+    users = body.get("users")
+    if not isinstance(users, list):
+        raise ValueError("Expected 'users' (a list) or 'csv'")
+    return users
+
+
+def create_cognito_user(user: dict, bucket: TokenBucket) -> str:
+    """
+    A Utility Function that creates a confirmed Cognito user with a permanent password,
+    the same two calls register makes, under the shared rate limit. If the password
+    can't be set the new user is deleted again
+
+    Output:
+        returns the new user's Cognito username
+    """
+    attempts = 0
+
+    def create_user(**kwargs):
+        nonlocal attempts
+        attempts += 1
+        try:
+            return cognito_client.admin_create_user(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "UsernameExistsException" or attempts == 1:
+                raise
+            # An earlier attempt created the user but its response was lost; creating
+            # isn't idempotent, so carry on with the user it made
+            logger.info(f"{kwargs['Username']} was created by an earlier attempt")
+            existing = cognito_client.admin_get_user(UserPoolId=kwargs["UserPoolId"], Username=kwargs["Username"])
+            return {"User": {"Username": existing["Username"]}}
+
+    response = call_with_backoff(
+        create_user,
+        bucket=bucket,
+        UserPoolId=COGNITO_USER_POOL_ID,
+        Username=user["email"],
+        TemporaryPassword=user["password"],
+        MessageAction='SUPPRESS',
+        UserAttributes=[
+            {"Name": "email", "Value": user["email"]},
+            {"Name": "email_verified", "Value": "true"},
+            {"Name": "given_name", "Value": user["firstName"]},
+            {"Name": "family_name", "Value": user["lastName"]},
+        ]
+    )
+    try:
+        call_with_backoff(
+            cognito_client.admin_set_user_password,
+            bucket=bucket,
+            UserPoolId=COGNITO_USER_POOL_ID,
+            Username=user["email"],
+            Password=user["password"],
+            Permanent=True
+        )
+    except ClientError:
+        # Remove the half-made user so a later run can create it again
+        call_with_backoff(cognito_client.admin_delete_user, bucket=bucket,
+                          UserPoolId=COGNITO_USER_POOL_ID, Username=user["email"])
+        raise
+    return response["User"]["Username"]
+
+
+def insert_users(created: list) -> dict:
+    """
+    A Utility Function that adds registered users to the users table, a batch at a time.
+    When a batch fails, its rows are retried one by one so only the bad rows fail
+
+    Input:
+        created = list of (user_id, user) tuples
+
+    Output:
+        returns a dict of email to error message for the rows that could not be inserted
+    """
+    errors = {}
+    for start in range(0, len(created), INSERT_BATCH_SIZE):
+        batch = created[start:start + INSERT_BATCH_SIZE]
+        parameter_sets = [{
+            'user_id': user_id,
+            'email': user["email"],
+            'firstname': user["firstName"],
+            'lastname': user["lastName"]
+        } for user_id, user in batch]
+
+        response = execute_batch_statement(INSERT_USER_SQL, parameter_sets)
+        if response.get("statusCode", 200) == 200:
+            continue
+
+        logger.warning(f"Batch insert failed, inserting {len(batch)} users one by one: {response['body']}")
+        for parameters in parameter_sets:
+            row_response = execute_statement(INSERT_USER_SQL, parameters)
+            if row_response.get("statusCode", 200) != 200:
+                errors[parameters["email"]] = row_response["body"]["ErrorMessage"]
+    return errors
+
+
+def bulk_register(users: list, checkpoint: dict = None, remaining_time_ms=None) -> tuple:
+    """
+    A Utility Function that registers many users: the Cognito calls run concurrently
+    under a token bucket with backoff, then the database rows are inserted in batches
+
+    Input:
+        users = the user dicts, each with email, password, firstName and lastName
+        checkpoint = the checkpoint returned by an earlier, unfinished run over the same
+            list, so finished users are skipped and half-finished ones completed
+        remaining_time_ms = a function returning the milliseconds left to run in, if any
+
+    Output:
+        returns a tuple of the per-user results, in input order, and the new checkpoint:
+        "done" lists the emails fully registered, "pending_insert" maps the emails that
+        have a Cognito user but no database row yet to their user id
+    """
+    checkpoint = checkpoint or {}
+    done = set(checkpoint.get("done", []))
+    pending_insert = dict(checkpoint.get("pending_insert", {}))
+    results = {}
+    to_create = []
+
+    for index, user in enumerate(users):
+        email = user.get("email") if isinstance(user, dict) else None
+        missing = [field for field in REQUIRED_FIELDS if not isinstance(user, dict) or not user.get(field)]
+        if missing:
+            results[index] = {"email": email, "status": FAILED, "error": f"Missing {', '.join(missing)}"}
+        elif email in done:
+            results[index] = {"email": email, "status": ALREADY_DONE}
+        elif email in pending_insert:
+            # Created in Cognito by the earlier run; only the database row is left
+            results[index] = {"email": email, "status": CREATED, "user_id": pending_insert[email]}
+        else:
+            to_create.append((index, user))
+
+    bucket = TokenBucket(COGNITO_RATE)
+
+    def register(item):
+        index, user = item
+        if remaining_time_ms is not None and remaining_time_ms() < TIME_MARGIN_MS:
+            return index, {"email": user["email"], "status": NOT_STARTED}
+        try:
+            user_id = create_cognito_user(user, bucket)
+            return index, {"email": user["email"], "status": CREATED, "user_id": user_id}
+        except ClientError as e:
+            return index, {"email": user["email"], "status": FAILED, "code": e.response["Error"]["Code"],
+                           "error": e.response["Error"]["Message"]}
+        except Exception as e:
+            # Anything else fails this user alone, so the rest still finish and the
+            # checkpoint is written
+            logger.exception(f"Registering {user['email']} failed: {e}")
+            return index, {"email": user["email"], "status": FAILED, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        for index, result in executor.map(register, to_create):
+            results[index] = result
+            if result["status"] == CREATED:
+                pending_insert[result["email"]] = result["user_id"]
+
+    by_email = {user["email"]: user for user in users if isinstance(user, dict) and user.get("email")}
+    insert_errors = insert_users([(user_id, by_email[email]) for email, user_id in pending_insert.items()
+                                  if email in by_email])
+
+    for result in results.values():
+        email = result["email"]
+        if result["status"] != CREATED:
+            continue
+        if email in insert_errors:
+            result["status"] = FAILED
+            result["error"] = f"Created in Cognito but not in the database: {insert_errors[email]}"
+        else:
+            done.add(email)
+            pending_insert.pop(email, None)
+
+    new_checkpoint = {"done": sorted(done), "pending_insert": pending_insert}
+    return [results[index] for index in range(len(users))], new_checkpoint
+
+
+@traced_handler
+def lambda_handler(event, context):
+    try:
+        if event.get("httpMethod") == "OPTIONS":
+            return {
+                "statusCode": 200,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "CORS preflight success"})
+            }
+
+        body = request_body(event)
+        try:
+            users = parse_users(body)
+        except (ValueError, csv.Error) as e:
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": str(e)})
+            }
+
+        remaining_time_ms = context.get_remaining_time_in_millis if context is not None else None
+        results, checkpoint = bulk_register(users, body.get("checkpoint"), remaining_time_ms)
+
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        logger.info(f"Bulk registration of {len(users)} users: {counts}")
+
+        return {
+            "statusCode": 200,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({
+                "message": "Bulk registration finished" if NOT_STARTED not in counts
+                else "Ran out of time, send the request again with the checkpoint to continue",
+                "complete": NOT_STARTED not in counts,
+                "counts": counts,
+                "results": results,
+                "checkpoint": checkpoint
+            }, default=str)
+        }
+
+    except Exception as ex:
+        return {
+            "statusCode": 500,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({
+                "message": "Internal Server Error",
+                "error": str(ex)
+            })
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registers the users in a CSV or JSON file")
+    parser.add_argument("file", help="a CSV with email,password,firstName,lastName columns, or a JSON list")
+    parser.add_argument("--checkpoint", default="bulk_register_checkpoint.json",
+                        help="where progress is saved; an existing checkpoint is resumed")
+    args = parser.parse_args()
+
+    with open(args.file, encoding="utf-8") as file:
+        content = file.read()
+    users = parse_users({"users": json.loads(content)} if args.file.endswith(".json") else {"csv": content})
+
+    checkpoint = None
+    if os.path.exists(args.checkpoint):
+        with open(args.checkpoint, encoding="utf-8") as file:
+            checkpoint = json.load(file)
+
+    results, checkpoint = bulk_register(users, checkpoint)
+    with open(args.checkpoint, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file, indent=2)
+
+    for result in results:
+        if result["status"] == FAILED:
+            print(f"{result['email']}: {result.get('error')}")
+    print(f"{len(checkpoint['done'])} registered, checkpoint saved to {args.checkpoint}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from botocore.exceptions import ClientError
+from jwt_util import decode_unverified, TokenError
+from trace_util import traced_handler
+from request_util import request_body
 
 COGNITO_USER_POOL_ID = os.environ.get("COGNITO_USER_POOL_ID")
 COGNITO_CLIENT_ID = os.environ.get("COGNITO_CLIENT_ID")
@@ -13,6 +17,64 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+# ID token claims that describe the token rather than the user
+TOKEN_CLAIMS = {"iss", "aud", "exp", "iat", "nbf", "auth_time", "token_use", "jti", "origin_jti", "event_id", "at_hash"}
+
+def user_from_id_token(id_token):
+    """
+    A Utility Function that builds the login response's user details from the ID
+    token, which carries the same attributes and groups as get_user and
+    admin_list_groups_for_user. The token is read without verifying it because it
+    came straight from Cognito in this request
+
+    Input:
+        id_token = the IdToken from initiate_auth
+
+    Output:
+        returns a tuple of the user info, shaped like the get_user response, and the
+        user's groups, shaped like admin_list_groups_for_user's Groups; or None if the
+        token doesn't carry them
+    """
+    try:
+        _, claims, _, _ = decode_unverified(id_token)
+    except TokenError:
+        return None
+    if "cognito:username" not in claims or "email" not in claims:
+        return None
+
+    attributes = []
+    for name, value in claims.items():
+        if name in TOKEN_CLAIMS or name.startswith("cognito:"):
+            continue
+        # get_user returns every attribute as a string, booleans as "true"/"false"
+        if isinstance(value, bool):
+            value = str(value).lower()
+        attributes.append({"Name": name, "Value": str(value)})
+
+    user_info = {"Username": claims["cognito:username"], "UserAttributes": attributes}
+    # Cognito leaves the claim out for users without groups
+    user_groups = [{"GroupName": group, "UserPoolId": COGNITO_USER_POOL_ID}
+                   for group in claims.get("cognito:groups", [])]
+    return user_info, user_groups
+
+def fetch_user(access_token, username):
+    """
+    A Utility Function that looks the user and their groups up in Cognito, both
+    requests at once, for when the ID token can't be used
+
+    Output:
+        returns a tuple of the get_user response and the user's groups
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        user_info = executor.submit(cognito_client.get_user, AccessToken=access_token)
+        user_groups = executor.submit(
+            cognito_client.admin_list_groups_for_user,
+            Username=username,
+            UserPoolId=COGNITO_USER_POOL_ID
+        )
+        return user_info.result(), user_groups.result().get("Groups", [])
+
+@traced_handler
 def lambda_handler(event, context):
     try:
         if event.get("httpMethod") == "OPTIONS":
@@ -22,7 +84,7 @@ def lambda_handler(event, context):
                 "body": json.dumps({"message": "CORS preflight success"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
         username = body["email"]
         password = body["password"]
 
@@ -36,16 +98,12 @@ def lambda_handler(event, context):
         )
 
         auth_result = response["AuthenticationResult"]
-        
-        user_info = cognito_client.get_user(
-            AccessToken=auth_result["AccessToken"]
-        )
 
-        user_groups = cognito_client.admin_list_groups_for_user(
-            Username=username,
-            UserPoolId=COGNITO_USER_POOL_ID
-        )
-        
+        user = user_from_id_token(auth_result.get("IdToken", ""))
+        if user is None:
+            user = fetch_user(auth_result["AccessToken"], username)
+        user_info, user_groups = user
+
         return {
             "statusCode": 200,
             "headers": CORS_HEADERS,
@@ -55,7 +113,7 @@ def lambda_handler(event, context):
                 "accessToken": auth_result["AccessToken"],
                 "refreshToken": auth_result.get("RefreshToken", None),
                 "user_info": user_info,
-                "user_groups": user_groups.get("Groups", []),
+                "user_groups": user_groups,
             }, default=str)
         }
 
@@ -4,12 +4,15 @@ import boto3
 from db_util import execute_statement
 from db_util import CORS_HEADERS
 from botocore.exceptions import ClientError
+from trace_util import traced_handler
+from request_util import request_body
 
 COGNITO_USER_POOL_ID = os.environ.get("COGNITO_USER_POOL_ID")
 COGNITO_CLIENT_ID = os.environ.get("COGNITO_CLIENT_ID")
 
 cognito_client = boto3.client("cognito-idp")
 
+@traced_handler
 def lambda_handler(event, context):
         
     try:
@@ -20,7 +23,7 @@ def lambda_handler(event, context):
                 "body": json.dumps({"message": "CORS preflight success"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
 
         if not body.get("email") or not body.get("password"):
             return {
@@ -1,5 +1,7 @@
 import boto3
 import botocore.exceptions as ex
+# Hooks the default session before the client below is created, so its calls are traced
+import trace_util  # noqa: F401
 
 rds_client = boto3.client('rds-data')
 database_name: str = 'owldb'
@@ -67,6 +69,40 @@ def execute(sql: str):
 
     return response
 
+def execute_batch_statement(sql: str, parameter_sets: list):
+    """
+    A Utility Function that executes a line of sql once per set of parameters, in a
+    single request to the database
+    """
+    print(f"Sending batch of {len(parameter_sets)} SQL statements to the database...")
+    response = None
+    try:
+        response = rds_client.batch_execute_statement(
+            secretArn=db_credentials_secrets_store_arn,
+            database=database_name,
+            resourceArn=db_cluster_arn,
+            sql=sql,
+            parameterSets=[
+                [{'name': key, 'value': {'stringValue': value}} for key, value in parameters.items()]
+                for parameters in parameter_sets
+            ]
+        )
+        print("Success!")
+    except ex.ClientError as e:
+        if (e.response['Error']['Code'] == "DatabaseResumingException"):
+            print("Failed! Database Cold Started, Trying Again... ")
+            return execute_batch_statement(sql, parameter_sets)
+        response = {
+            'statusCode': 400,
+            'body': {
+                "Error": e.response['Error']['Code'],
+                "ErrorMessage": e.response['Error']['Message']
+            }
+        }
+        print("Failed!")
+
+    return response
+
 def checkColdStart() -> bool:
     """
     A Utility Function that checks whether or not the RDS database is starting Cold
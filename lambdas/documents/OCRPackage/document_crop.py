@@ -0,0 +1,196 @@
+import logging
+import numpy as np
+import cv2
+from image_budget import decode_within_budget
+
+logger = logging.getLogger(__name__)
+
+# Edge detection runs on a copy no larger than this
+DETECTION_SIZE = 800
+# The document must cover at least this share of the frame to be trusted
+MIN_AREA_FRACTION = 0.2
+# A quadrilateral covering more than this share leaves nothing worth cropping
+MAX_AREA_FRACTION = 0.95
+# Width in detection pixels of the bands compared either side of the document edge
+EDGE_BAND = 6
+# Colour distance (Lab) between the inside and outside bands for the edge to be a real
+# document edge rather than a box printed on the page
+MIN_EDGE_CONTRAST = 25.0
+JPEG_QUALITY = 92
+
+
+class CropTransform:
+    """
+    Maps coordinates in a perspective-corrected crop back to the original image
+    """
+
+    def __init__(self, inverse_matrix: np.ndarray, crop_size: tuple, original_size: tuple, corners: np.ndarray):
+        self.inverse_matrix = inverse_matrix
+        self.crop_width, self.crop_height = crop_size
+        self.original_width, self.original_height = original_size
+        self.corners = corners
+
+    def remap_bbox(self, bbox: dict) -> dict:
+        """
+        A Utility Function that maps a normalized bounding box on the crop to the
+        normalized axis-aligned box that covers it on the original image
+
+        Input:
+            bbox = a dict with Left, Top, Width and Height relative to the crop
+
+        Output:
+            returns a dict with the same keys relative to the original image
+        """
+        left = bbox.get("Left", 0.0) * self.crop_width
+        top = bbox.get("Top", 0.0) * self.crop_height
+        right = left + bbox.get("Width", 0.0) * self.crop_width
+        bottom = top + bbox.get("Height", 0.0) * self.crop_height
+
+        points = np.array([[[left, top], [right, top], [right, bottom], [left, bottom]]], dtype=np.float64)
+        mapped = cv2.perspectiveTransform(points, self.inverse_matrix)[0]
+        min_x, min_y = mapped.min(axis=0)
+        max_x, max_y = mapped.max(axis=0)
+
+        min_x, max_x = np.clip([min_x, max_x], 0, self.original_width)
+        min_y, max_y = np.clip([min_y, max_y], 0, self.original_height)
+        return {
+            "Left": float(min_x / self.original_width),
+            "Top": float(min_y / self.original_height),
+            "Width": float((max_x - min_x) / self.original_width),
+            "Height": float((max_y - min_y) / self.original_height)
+        }
+
+    def to_dict(self) -> dict:
+        """
+        A Utility Function that describes the crop for the response, with the document
+        corners normalized to the original image
+        """
+        return {
+            "Corners": [
+                {"X": float(x / self.original_width), "Y": float(y / self.original_height)}
+                for x, y in self.corners
+            ],
+            "Width": self.crop_width,
+            "Height": self.crop_height
+        }
+
+
+def order_corners(points: np.ndarray) -> np.ndarray:
+    """
+    A Utility Function that orders four points as top-left, top-right, bottom-right, bottom-left
+    """
+    points = points.reshape(4, 2).astype(np.float32)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)],
+        points[np.argmin(diffs)],
+        points[np.argmax(sums)],
+        points[np.argmax(diffs)]
+    ], dtype=np.float32)
+
+
+def find_document_quad(image: np.ndarray):
+    """
+    A Utility Function that finds the outline of a document photographed against a background
+
+    Input:
+        image = the decoded BGR image
+
+    Output:
+        returns the four corners in original pixel coordinates ordered clockwise from
+        the top left, or None if no document edge stands out from the background
+    """
+    height, width = image.shape[:2]
+    scale = min(1.0, DETECTION_SIZE / max(width, height))
+    small = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    frame_area = small.shape[0] * small.shape[1]
+
+    gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    median = float(np.median(gray))
+    edges = cv2.Canny(gray, int(max(0, 0.66 * median)), int(min(255, 1.33 * median)))
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=2)
+
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        hull = cv2.convexHull(contour)
+        area = cv2.contourArea(hull)
+        if area < MIN_AREA_FRACTION * frame_area:
+            break
+        if area > MAX_AREA_FRACTION * frame_area:
+            continue
+
+        approx = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+        if len(approx) != 4:
+            # Rounded or partly occluded corners; fall back to the tightest rectangle
+            approx = cv2.boxPoints(cv2.minAreaRect(hull))
+        corners = order_corners(approx)
+
+        if not _is_document_edge(small, corners):
+            continue
+        return corners / scale
+
+    return None
+
+
+def _is_document_edge(image: np.ndarray, corners: np.ndarray) -> bool:
+    """
+    Compares the colour just inside the outline with the colour just outside it. A
+    document on a table differs from the table; a box printed on a scanned page has
+    the same paper on both sides
+    """
+    mask = np.zeros(image.shape[:2], np.uint8)
+    cv2.fillConvexPoly(mask, corners.astype(np.int32), 255)
+    # The bands stay one band-width clear of the outline, which sits on the dilated edge
+    near = np.ones((EDGE_BAND, EDGE_BAND), np.uint8)
+    far = np.ones((3 * EDGE_BAND, 3 * EDGE_BAND), np.uint8)
+    outside = cv2.dilate(mask, far) & ~cv2.dilate(mask, near)
+    inside = cv2.erode(mask, near) & ~cv2.erode(mask, far)
+    if not outside.any() or not inside.any():
+        return False
+
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB).astype(np.float32)
+    outside_color = np.median(lab[outside > 0], axis=0)
+    inside_color = np.median(lab[inside > 0], axis=0)
+    return float(np.linalg.norm(outside_color - inside_color)) >= MIN_EDGE_CONTRAST
+
+
+def crop_document(image_bytes: bytes) -> tuple:
+    """
+    A Utility Function that crops a photographed document out of its background and
+    corrects its perspective
+
+    Input:
+        image_bytes = the encoded image
+
+    Output:
+        returns a tuple of the encoded crop and its CropTransform, or the original
+        bytes and None when no document outline was found
+    """
+    image = decode_within_budget(image_bytes, cv2.IMREAD_COLOR)
+    if image is None:
+        return image_bytes, None
+
+    corners = find_document_quad(image)
+    if corners is None:
+        return image_bytes, None
+
+    top_left, top_right, bottom_right, bottom_left = corners
+    crop_width = int(round(max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))))
+    crop_height = int(round(max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))))
+    if crop_width < 1 or crop_height < 1:
+        return image_bytes, None
+
+    target = np.array([[0, 0], [crop_width, 0], [crop_width, crop_height], [0, crop_height]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners.astype(np.float32), target)
+    cropped = cv2.warpPerspective(image, matrix, (crop_width, crop_height), flags=cv2.INTER_LINEAR)
+
+    ok, encoded = cv2.imencode(".jpg", cropped, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        return image_bytes, None
+
+    original_height, original_width = image.shape[:2]
+    logger.info(f"Cropped document from {original_width}x{original_height} to {crop_width}x{crop_height}")
+    transform = CropTransform(np.linalg.inv(matrix), (crop_width, crop_height),
+                              (original_width, original_height), corners)
+    return encoded.tobytes(), transform
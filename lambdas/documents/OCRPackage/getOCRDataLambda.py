@@ -1,18 +1,31 @@
 import json
 import base64
 import logging
+import time
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from io import BytesIO
-import zxingcpp
-import numpy as np
-import cv2
+from lazy_util import lazy_import
+from trace_util import span, traced_handler
+from request_util import request_body
+from singleflight import coalesce, work_key
+from textract_limiter import Throttled, limiter, request_deadline
+
+# The imaging and barcode modules load on first use, so preflights and text layer
+# only requests don't import OpenCV, NumPy or zxing
+zxingcpp = lazy_import("zxingcpp")
+cv2 = lazy_import("cv2")
+document_crop = lazy_import("document_crop")
+page_filter = lazy_import("page_filter")
+image_budget = lazy_import("image_budget")
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Get the boto3 Textract client
-textract_client = boto3.client('textract')
+# Get the boto3 Textract client. textract_limiter does the retrying, of network
+# failures as well, so botocore's own retries don't hide throttling from it
+textract_client = boto3.client('textract', config=Config(retries={"total_max_attempts": 1}))
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -20,6 +33,7 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST, GET"
 }
 
+@traced_handler
 def lambda_handler(event, context):
     try:
         # Handle CORS preflight request
@@ -31,9 +45,16 @@ def lambda_handler(event, context):
             }
 
         # Parse the request body
-        body = json.loads(event.get("body", "{}"))
+        body = request_body(event, {})
         images_base64 = body.get("images")
         doc_type = body.get("docType")
+        # Phone captures are cropped to the document before OCR unless the caller opts out
+        crop_enabled = body.get("crop", True)
+        # Blank and repeated pages are skipped unless the caller opts out
+        skip_enabled = body.get("skipPages", True)
+        # Fields pdf_to_images read from digital PDF pages, aligned with the images;
+        # pages with fields here skip OCR, None entries are OCR'd as usual
+        text_layer = body.get("textLayer") or []
 
         # Validate required fields
         if not images_base64 or not isinstance(images_base64, list) or not doc_type:
@@ -46,39 +67,57 @@ def lambda_handler(event, context):
                 })
             }
 
+        # Throttled Textract calls are retried until shortly before the request times out
+        deadline = request_deadline(context)
         results = []
+        # Pages answered from the text layer need no imaging at all
+        needs_ocr = any(not isinstance(text_layer[idx] if idx < len(text_layer) else None, list)
+                        for idx in range(len(images_base64)))
+        skipped_pages = {}
+        if skip_enabled and needs_ocr:
+            with span("plan_pages", pages=len(images_base64)):
+                skipped_pages = page_filter.plan_pages(images_base64)
 
         for idx, image_base64 in enumerate(images_base64):
-            try:
-                image_bytes = base64.b64decode(image_base64)
-                extracted_data = []
-
-                barcode_data = scan_barcode(image_bytes)
-                if barcode_data:
-                    for barcode in barcode_data:
-                        barcode["PageNumber"] = idx + 1
-                        extracted_data.append(barcode)
-
-                image = {'Bytes': image_bytes}
-
-                if doc_type == "id":
-                    textract_data = extract_form_details(image)
-                elif doc_type == "form":
-                    textract_data = extract_form_details(image)
-                else:
-                    textract_data = {
-                        "Error": "Invalid doctype",
-                        "ErrorMessage": "The specified doctype is not supported."
-                    }
+            text_fields = text_layer[idx] if idx < len(text_layer) else None
+            if isinstance(text_fields, list):
+                results.append({
+                    "DocumentIndex": idx,
+                    "Result": [dict(field, PageNumber=idx + 1) for field in text_fields],
+                    "Source": "textLayer"
+                })
+                continue
 
-                if isinstance(textract_data, list):
-                    for field in textract_data:
-                        field["PageNumber"] = idx + 1
-                    extracted_data.extend(textract_data)
+            skip = skipped_pages.get(idx)
+            if skip is not None:
+                results.append(skipped_result(idx, skip, results))
+                continue
 
-                results.append({
+            try:
+                with span("base64_decode", page=idx + 1) as decode:
+                    image_bytes = base64.b64decode(image_base64)
+                    decode.set(bytes=len(image_bytes))
+                with span("process_page", page=idx + 1):
+                    extracted_data, crop = process_page(image_bytes, doc_type, idx + 1, crop_enabled,
+                                                          deadline)
+
+                result = {
                     "DocumentIndex": idx,
                     "Result": extracted_data
+                }
+                if crop is not None:
+                    result["Crop"] = crop
+                results.append(result)
+            except Throttled as e:
+                # Only this page failed; the caller can send it again on its own
+                logger.warning(f"Textract throttled document {idx}: {str(e)}")
+                results.append({
+                    "DocumentIndex": idx,
+                    "Result": {
+                        "Error": "Throttled",
+                        "ErrorMessage": str(e),
+                        "Retryable": True
+                    }
                 })
             except Exception as e:
                 logger.error(f"Error processing document {idx}: {str(e)}")
@@ -90,10 +129,12 @@ def lambda_handler(event, context):
                     }
                 })
 
+        with span("serialize"):
+            response_body = json.dumps(results)
         return {
             "statusCode": 200,
             "headers": CORS_HEADERS,
-            "body": json.dumps(results)
+            "body": response_body
         }
 
     except ClientError as err:
@@ -119,16 +160,108 @@ def lambda_handler(event, context):
             })
         }
 
+def skipped_result(idx, skip, results):
+    """
+    A Utility Function that builds the result for a page that was not sent to OCR.
+    Blank pages have no fields; duplicate pages get a copy of the fields of the
+    page they repeat, renumbered to their own page, or its error if it failed
+    """
+    extracted_data = []
+    if skip["Reason"] == "duplicate":
+        original = results[skip["DuplicateOf"]]
+        if isinstance(original["Result"], list):
+            extracted_data = [dict(field, PageNumber=idx + 1) for field in original["Result"]]
+        else:
+            # The failure applies to this page too, so it mustn't read as an empty page
+            extracted_data = dict(original["Result"])
+
+    return {
+        "DocumentIndex": idx,
+        "Result": extracted_data,
+        "Skipped": skip
+    }
+
+def process_page(image_bytes, doc_type, page_number, crop_enabled=True, deadline=None):
+    """
+    A Utility Function that runs barcode scanning and Textract on one page. Identical
+    pages in flight at the same time, such as from a double click or a retry, share
+    one analysis through singleflight
+
+    Input:
+        image_bytes = the encoded page image
+        doc_type = "id" or "form"
+        page_number = the 1-based page number stamped on each field
+        crop_enabled = whether to crop a photographed document out of its background first
+        deadline = the time.monotonic() value Textract calls stop retrying at
+
+    Output:
+        returns a tuple of the extracted fields, with bounding boxes relative to the
+        original image, and the crop that was applied (see CropTransform.to_dict) or None
+    """
+    key = work_key(image_bytes, doc_type=doc_type, crop=bool(crop_enabled))
+
+    def retry(error):
+        # Throttled came from the deadline of the request that ran the analysis;
+        # this one runs it again itself if it still has time
+        return isinstance(error, Throttled) and (deadline is None or time.monotonic() < deadline)
+
+    analysis = coalesce(key, lambda: analyze_page(image_bytes, doc_type, crop_enabled, deadline), retry)
+    # The analysis may be shared with other requests, so each gets its own fields
+    extracted_data = [dict(field, PageNumber=page_number) for field in analysis["Fields"]]
+    return extracted_data, analysis["Crop"]
+
+def analyze_page(image_bytes, doc_type, crop_enabled=True, deadline=None):
+    """
+    A Utility Function that crops, scans and sends one page to Textract
+
+    Output:
+        returns a dict of the page's Fields, with bounding boxes relative to the
+        original image, and its Crop or None
+    """
+    crop = None
+    if crop_enabled:
+        with span("crop"):
+            image_bytes, crop = document_crop.crop_document(image_bytes)
+
+    extracted_data = []
+
+    barcode_data = scan_barcode(image_bytes)
+    if barcode_data:
+        extracted_data.extend(barcode_data)
+
+    image = {'Bytes': image_bytes}
+
+    if doc_type == "id":
+        textract_data = extract_form_details(image, deadline)
+    elif doc_type == "form":
+        textract_data = extract_form_details(image, deadline)
+    else:
+        textract_data = {
+            "Error": "Invalid doctype",
+            "ErrorMessage": "The specified doctype is not supported."
+        }
+
+    if isinstance(textract_data, list):
+        extracted_data.extend(textract_data)
+
+    if crop is not None:
+        for field in extracted_data:
+            field["BBox"] = crop.remap_bbox(field["BBox"])
+
+    return {"Fields": extracted_data, "Crop": crop.to_dict() if crop is not None else None}
+
+@span("scan_barcode")
 def scan_barcode(image_bytes):
     """Scan for barcodes and return data if found, including position information"""
     try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        cv_image = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
-        _, binary_image = cv2.threshold(cv_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
+        # Oversized scans are decoded at a reduced scale to stay within the memory budget
+        cv_image = image_budget.decode_within_budget(image_bytes, cv2.IMREAD_GRAYSCALE)
+
         if cv_image is None:
             logger.warning("Failed to decode image bytes with OpenCV")
             return None
+
+        _, binary_image = cv2.threshold(cv_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         
         img_height, img_width = cv_image.shape[:2]
         detected_barcodes = []
@@ -208,10 +341,13 @@ def calculate_bbox(position, img_width, img_height):
         }
 
 
-def extract_form_details(image):
-    response = textract_client.analyze_document(
+@span("extract_form_details")
+def extract_form_details(image, deadline=None):
+    response = limiter.call(
+        textract_client.analyze_document,
         Document=image,
-        FeatureTypes=["FORMS", "SIGNATURES"]
+        FeatureTypes=["FORMS", "SIGNATURES"],
+        deadline=deadline
     )
 
     blocks = response['Blocks']
@@ -0,0 +1,60 @@
+import json
+from ocr_jobs import get_job
+from trace_util import traced_handler
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+    "Access-Control-Allow-Methods": "OPTIONS,GET,POST"
+}
+
+@traced_handler
+def lambda_handler(event, context):
+    """
+    Reports the progress of an OCR job started with POST /documents/OCR/jobs
+
+    Input:
+        jobId = the job's id, in the query string
+
+    Output:
+        returns the job's Status, each page's Progress and the Results of the pages
+        read so far
+    """
+    try:
+        if event.get("httpMethod") == "OPTIONS":
+            return {
+                "statusCode": 200,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "CORS preflight success"})
+            }
+
+        job_id = (event.get("queryStringParameters") or {}).get("jobId")
+        if not job_id:
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "jobId is required"})
+            }
+
+        # Only the caller that submitted the job can read it
+        authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+        job = get_job(job_id, authorizer.get("principalId"))
+        if job is None:
+            return {
+                "statusCode": 404,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "OCR job not found"})
+            }
+
+        return {
+            "statusCode": 200,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({"message": "OCR job retrieval successful", "data": job}, default=str)
+        }
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({"message": "Unexpected error", "error": str(e)})
+        }
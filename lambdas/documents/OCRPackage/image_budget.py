@@ -0,0 +1,79 @@
+import os
+import struct
+import logging
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Most pixels OpenCV may decode for one page; larger pages are decoded at a reduced scale
+PIXEL_BUDGET = int(os.environ.get("OCR_PIXEL_BUDGET", 40_000_000))
+
+# OpenCV's reduced decoding flags by reduction factor
+REDUCED_FLAGS = {
+    cv2.IMREAD_GRAYSCALE: {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                           8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+    cv2.IMREAD_COLOR: {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                       8: cv2.IMREAD_REDUCED_COLOR_8}
+}
+
+# JPEG start-of-frame markers, which carry the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_dimensions(image_bytes: bytes):
+    """
+    A Utility Function that reads the width and height from a PNG or JPEG header
+    without decoding the image
+
+    Input:
+        image_bytes = the encoded image
+
+    Output:
+        returns a tuple of (width, height), or None for other formats
+    """
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n" and len(image_bytes) >= 24:
+        return struct.unpack(">II", image_bytes[16:24])
+
+    if image_bytes[:2] == b"\xff\xd8":
+        position = 2
+        while position + 9 <= len(image_bytes):
+            if image_bytes[position] != 0xFF:
+                return None
+            marker = image_bytes[position + 1]
+            if marker == 0xFF:
+                position += 1
+                continue
+            length = struct.unpack(">H", image_bytes[position + 2:position + 4])[0]
+            if marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack(">HH", image_bytes[position + 5:position + 9])
+                return width, height
+            position += 2 + length
+    return None
+
+
+def decode_within_budget(image_bytes: bytes, flags: int = cv2.IMREAD_GRAYSCALE, max_pixels: int = PIXEL_BUDGET):
+    """
+    A Utility Function that decodes an image with OpenCV, reducing it by 2, 4 or 8 while
+    decoding when it is over the pixel budget. JPEGs are reduced in the DCT domain, so
+    the full-size image is never held in memory; OpenCV reduces other formats after
+    decoding, which still bounds every copy the caller makes
+
+    Input:
+        image_bytes = the encoded image
+        flags = cv2.IMREAD_GRAYSCALE or cv2.IMREAD_COLOR
+        max_pixels = the pixel budget
+
+    Output:
+        returns the decoded image, or None if it could not be decoded
+    """
+    buffer = np.frombuffer(image_bytes, np.uint8)
+    dimensions = image_dimensions(image_bytes)
+    if dimensions is None or dimensions[0] * dimensions[1] <= max_pixels:
+        return cv2.imdecode(buffer, flags)
+
+    width, height = dimensions
+    # The smallest reduction that fits, or the largest available
+    factor = next((factor for factor in REDUCED_FLAGS[flags] if (width // factor) * (height // factor) <= max_pixels), 8)
+    logger.info(f"Decoding {width}x{height} image at 1/{factor} scale")
+    return cv2.imdecode(buffer, REDUCED_FLAGS[flags][factor])
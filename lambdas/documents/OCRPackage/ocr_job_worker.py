@@ -0,0 +1,32 @@
+import json
+import logging
+from ocr_jobs import process_message
+from trace_util import traced_handler
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+@traced_handler
+def lambda_handler(event, context):
+    """
+    Reads the pages of OCR jobs from the SQS queue ocr_jobs sends them to. Messages
+    that fail, or whose page was throttled, are reported back to SQS to be delivered
+    again; the event source mapping needs ReportBatchItemFailures
+
+    Input:
+        event = an SQS event, each record's body a {"JobId", "Page"} message
+
+    Output:
+        returns the batchItemFailures for SQS
+    """
+    failures = []
+    for record in event.get("Records", []):
+        try:
+            message = json.loads(record["body"])
+            if not process_message(message["JobId"], int(message["Page"]), context):
+                failures.append({"itemIdentifier": record["messageId"]})
+        except Exception as e:
+            logger.exception(f"Could not process OCR job message {record.get('messageId')}: {e}")
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    return {"batchItemFailures": failures}
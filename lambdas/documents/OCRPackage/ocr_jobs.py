@@ -0,0 +1,480 @@
+"""
+OCR jobs read in the background, for documents too large to read within API Gateway's
+29 second limit.
+
+submit_ocr_job stores a job and its pages and answers straight away with the job's
+id. Each page becomes one queue message, and ocr_job_worker reads it with the same
+analysis as getOCRDataLambda. get_ocr_job reports the progress of every page and the
+results of the ones that are finished.
+
+- Jobs and pages are rows of ocr_jobs and ocr_job_pages (see
+  database/table_creation.sql). A page's result is stored in its row once it's read.
+- Page images wait in OCR_JOBS_BUCKET under jobs/<job id>/ until their page is
+  finished.
+- OCR_JOB_QUEUE picks the queue:
+  - "sqs": the queue at OCR_JOB_QUEUE_URL, with ocr_job_worker subscribed to it. The
+    event source mapping's maximum concurrency is how many pages are read at once.
+    Turn on ReportBatchItemFailures, and keep the queue's visibility timeout above
+    the worker's timeout
+  - "memory": OCR_JOB_WORKERS threads in this process, a stand-in for the local
+    server
+- A page Textract keeps throttling goes back on the queue, and a page whose worker
+  died is delivered again, up to OCR_JOB_MAX_ATTEMPTS times. Other errors fail the
+  page alone, as on the synchronous route.
+"""
+import base64
+import binascii
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from db_util import execute_statement, execute_batch_statement
+from lazy_util import lazy_import
+from rate_util import backoff_delay
+from textract_limiter import Throttled, request_deadline
+from trace_util import span
+
+# The analysis and page filter load OpenCV, so the status route doesn't import them
+getOCRDataLambda = lazy_import("getOCRDataLambda")
+page_filter = lazy_import("page_filter")
+
+logger = logging.getLogger()
+
+OCR_JOB_QUEUE = os.environ.get("OCR_JOB_QUEUE", "sqs").lower()
+OCR_JOB_QUEUE_URL = os.environ.get("OCR_JOB_QUEUE_URL")
+OCR_JOBS_BUCKET = os.environ.get("OCR_JOBS_BUCKET", "owl-ocr-jobs")
+# Pages read at once by the memory queue
+OCR_JOB_WORKERS = int(os.environ.get("OCR_JOB_WORKERS", 4))
+# Deliveries of a page before it's failed
+OCR_JOB_MAX_ATTEMPTS = int(os.environ.get("OCR_JOB_MAX_ATTEMPTS", 3))
+# Page images uploaded at once while a job is submitted
+UPLOAD_CONCURRENCY = 8
+# Most messages SQS takes per SendMessageBatch
+SQS_BATCH_SIZE = 10
+# Most keys S3 takes per DeleteObjects
+S3_DELETE_BATCH = 1000
+# How long the memory queue lets a worker run, like the deployed worker's timeout
+WORKER_TIMEOUT_SECONDS = 300
+
+# Job states. A job row is only ever queued or failed (its pages couldn't be stored or queued);
+# the rest are worked out from its pages
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# Pages that didn't need OCR, see page_filter
+SKIPPED = "skipped"
+FINISHED = (DONE, FAILED, SKIPPED)
+
+INSERT_JOB_SQL = ("INSERT INTO ocr_jobs (job_id, principal_id, doc_type, options, pages, status, created_at) "
+                  "VALUES (:job_id, :principal_id, :doc_type, :options, CAST(:pages AS INT), :status, NOW())")
+INSERT_PAGE_SQL = ("INSERT INTO ocr_job_pages (job_id, page_index, status, attempts) "
+                   "VALUES (:job_id, CAST(:page_index AS INT), :status, 0)")
+INSERT_FINISHED_PAGE_SQL = ("INSERT INTO ocr_job_pages (job_id, page_index, status, attempts, result) "
+                            "VALUES (:job_id, CAST(:page_index AS INT), :status, 0, :result)")
+FAIL_JOB_SQL = "UPDATE ocr_jobs SET status = 'failed' WHERE job_id = :job_id"
+JOB_SQL = ("SELECT doc_type, options, pages, status, created_at, principal_id FROM ocr_jobs "
+           "WHERE job_id = :job_id")
+PAGES_SQL = ("SELECT page_index, status, attempts, result FROM ocr_job_pages WHERE job_id = :job_id "
+             "ORDER BY page_index")
+# A page is only taken while it's unfinished, so a message delivered twice is read once
+START_PAGE_SQL = ("UPDATE ocr_job_pages SET status = 'running', attempts = attempts + 1 "
+                  "WHERE job_id = :job_id AND page_index = CAST(:page_index AS INT) "
+                  "AND status IN ('queued', 'running') RETURNING attempts")
+FINISH_PAGE_SQL = ("UPDATE ocr_job_pages SET status = :status, result = :result "
+                   "WHERE job_id = :job_id AND page_index = CAST(:page_index AS INT) AND status = 'running'")
+REQUEUE_PAGE_SQL = ("UPDATE ocr_job_pages SET status = 'queued' "
+                    "WHERE job_id = :job_id AND page_index = CAST(:page_index AS INT) AND status = 'running'")
+
+s3_client = boto3.client("s3")
+
+
+class JobError(Exception):
+    """
+    Raised when a job can't be stored or queued
+    """
+
+
+def _execute(sql: str, parameters: dict) -> dict:
+    response = execute_statement(sql, parameters)
+    if response is None or "statusCode" in response:
+        raise JobError((response or {}).get("body", "No response from the database"))
+    return response
+
+
+def _execute_batch(sql: str, parameter_sets: list) -> None:
+    if not parameter_sets:
+        return
+    response = execute_batch_statement(sql, parameter_sets)
+    if response is None or "statusCode" in response:
+        raise JobError((response or {}).get("body", "No response from the database"))
+
+
+def _value(field: dict):
+    return None if field.get("isNull") else next(iter(field.values()))
+
+
+def page_key(job_id: str, index: int) -> str:
+    """
+    A Utility Function that returns the S3 key of a job's page image
+    """
+    return f"jobs/{job_id}/{index}"
+
+
+def page_error(index: int, error: str, message: str, retryable: bool = False) -> dict:
+    """
+    A Utility Function that builds a failed page's result, as getOCRDataLambda does
+    """
+    result = {"DocumentIndex": index, "Result": {"Error": error, "ErrorMessage": message}}
+    if retryable:
+        result["Result"]["Retryable"] = True
+    return result
+
+
+def delete_page_images(job_id: str, indexes: list) -> None:
+    """
+    A Utility Function that removes a job's staged page images, for a job that
+    couldn't be stored or queued. Failures are only logged
+    """
+    keys = [{"Key": page_key(job_id, idx)} for idx in indexes]
+    for start in range(0, len(keys), S3_DELETE_BATCH):
+        try:
+            response = s3_client.delete_objects(Bucket=OCR_JOBS_BUCKET,
+                                                Delete={"Objects": keys[start:start + S3_DELETE_BATCH], "Quiet": True})
+            for error in response.get("Errors", []):
+                logger.warning(f"Could not delete {error['Key']} of OCR job {job_id}: {error['Message']}")
+        except Exception as e:
+            logger.warning(f"Could not delete the page images of OCR job {job_id}: {e}")
+
+
+class SqsQueue:
+    """
+    Page messages sent to the SQS queue ocr_job_worker reads
+    """
+
+    def __init__(self, url: str):
+        if not url:
+            raise ValueError("OCR_JOB_QUEUE_URL has to be set to queue OCR jobs on SQS")
+        self.url = url
+        self.client = boto3.client("sqs")
+
+    def send(self, bodies: list) -> None:
+        for start in range(0, len(bodies), SQS_BATCH_SIZE):
+            entries = [{"Id": str(number), "MessageBody": json.dumps(body)}
+                       for number, body in enumerate(bodies[start:start + SQS_BATCH_SIZE])]
+            response = self.client.send_message_batch(QueueUrl=self.url, Entries=entries)
+            if response.get("Failed"):
+                raise JobError(f"SQS refused {len(response['Failed'])} page messages: "
+                               f"{response['Failed'][0].get('Message')}")
+
+
+class _WorkerContext:
+    """
+    The parts of the Lambda context ocr_job_worker uses, for the memory queue
+    """
+
+    invoked_function_arn = "arn:aws:lambda:local:000000000000:function:ocr_job_worker"
+
+    def __init__(self):
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + WORKER_TIMEOUT_SECONDS
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class MemoryQueue:
+    """
+    Page messages in this process. A pool of threads hands them to ocr_job_worker the
+    way SQS does, and failed messages are delivered again after a backoff. Like a
+    queue with a redrive policy, a message still failing after OCR_JOB_MAX_ATTEMPTS
+    redeliveries is dropped
+    """
+
+    def __init__(self, workers: int = OCR_JOB_WORKERS):
+        self.messages = queue.Queue()
+        self.workers = workers
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def send(self, bodies: list) -> None:
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"ocr-job-{len(self.threads)}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        for body in bodies:
+            self.messages.put({"messageId": str(uuid.uuid4()), "body": json.dumps(body), "receives": 0})
+
+    def _work(self) -> None:
+        import ocr_job_worker
+        while True:
+            message = self.messages.get()
+            message["receives"] += 1
+            event = {"Records": [{
+                "messageId": message["messageId"],
+                "body": message["body"],
+                "eventSource": "aws:sqs",
+                "attributes": {"ApproximateReceiveCount": str(message["receives"])}
+            }]}
+            try:
+                failed = ocr_job_worker.lambda_handler(event, _WorkerContext()).get("batchItemFailures")
+            except Exception as e:
+                logger.exception(f"OCR job worker failed: {e}")
+                failed = True
+            if failed and message["receives"] > OCR_JOB_MAX_ATTEMPTS:
+                # The last delivery fails the page, so this one couldn't even do that,
+                # e.g. the database is down
+                logger.error(f"Dropping OCR job message {message['body']} after {message['receives']} receives")
+            elif failed:
+                retry = threading.Timer(backoff_delay(message["receives"], base=1.0, cap=30.0),
+                                        self.messages.put, [message])
+                retry.daemon = True
+                retry.start()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """
+    A Utility Function that returns the queue OCR_JOB_QUEUE names
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if OCR_JOB_QUEUE == "sqs":
+                _queue = SqsQueue(OCR_JOB_QUEUE_URL)
+            elif OCR_JOB_QUEUE == "memory":
+                _queue = MemoryQueue()
+            else:
+                raise ValueError(f"Unknown OCR_JOB_QUEUE {OCR_JOB_QUEUE!r}, expected sqs or memory")
+        return _queue
+
+
+def submit(images_base64: list, doc_type: str, crop_enabled: bool = True, skip_enabled: bool = True,
+           text_layer: list = None, principal_id: str = None) -> dict:
+    """
+    A Utility Function that stores a new job and queues its pages
+
+    Input:
+        images_base64 = the base64 encoded page images, in order
+        doc_type = "id" or "form"
+        crop_enabled = whether photographed pages are cropped before OCR
+        skip_enabled = whether blank and repeated pages are skipped
+        text_layer = fields pdf_to_images read from digital pages, aligned with the
+                     images; those pages need no OCR
+        principal_id = the authorizer's principal for the caller, the only one who
+                       can read the job
+
+    Output:
+        returns a dict of the JobId, its Status and the number of Pages and Queued
+        pages. Raises JobError if the job couldn't be stored or queued
+    """
+    job_id = str(uuid.uuid4())
+    text_layer = text_layer or []
+    # Pages finished without OCR, by index: (status, result)
+    finished = {}
+    to_read = []
+
+    needs_ocr = any(not isinstance(text_layer[idx] if idx < len(text_layer) else None, list)
+                    for idx in range(len(images_base64)))
+    skipped_pages = {}
+    if skip_enabled and needs_ocr:
+        with span("plan_pages", pages=len(images_base64)):
+            skipped_pages = page_filter.plan_pages(images_base64)
+
+    for idx in range(len(images_base64)):
+        text_fields = text_layer[idx] if idx < len(text_layer) else None
+        if isinstance(text_fields, list):
+            finished[idx] = (DONE, {"DocumentIndex": idx,
+                                    "Result": [dict(field, PageNumber=idx + 1) for field in text_fields],
+                                    "Source": "textLayer"})
+        elif idx in skipped_pages:
+            # Duplicates are matched to their page's result when the job is read
+            finished[idx] = (SKIPPED, {"DocumentIndex": idx, "Result": [], "Skipped": skipped_pages[idx]})
+        else:
+            to_read.append(idx)
+
+    def upload(idx):
+        try:
+            image_bytes = base64.b64decode(images_base64[idx])
+        except (binascii.Error, TypeError, ValueError) as e:
+            return idx, page_error(idx, "ProcessingError", str(e))
+        try:
+            s3_client.put_object(Bucket=OCR_JOBS_BUCKET, Key=page_key(job_id, idx), Body=image_bytes)
+        except Exception as e:
+            # Fails this page alone, like an image that can't be decoded
+            logger.error(f"Could not store page {idx} of OCR job {job_id}: {e}")
+            return idx, page_error(idx, "ProcessingError", f"Could not store the page image: {e}")
+        return idx, None
+
+    with span("upload_pages", pages=len(to_read)):
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+            for idx, error in list(executor.map(upload, to_read)):
+                if error is not None:
+                    finished[idx] = (FAILED, error)
+    to_read = [idx for idx in to_read if idx not in finished]
+
+    options = json.dumps({"crop": bool(crop_enabled)})
+    try:
+        _execute(INSERT_JOB_SQL, {"job_id": job_id, "principal_id": principal_id or "", "doc_type": doc_type,
+                                  "options": options, "pages": str(len(images_base64)), "status": QUEUED})
+    except Exception:
+        delete_page_images(job_id, to_read)
+        raise
+    try:
+        _execute_batch(INSERT_PAGE_SQL, [{"job_id": job_id, "page_index": str(idx), "status": QUEUED}
+                                         for idx in to_read])
+        _execute_batch(INSERT_FINISHED_PAGE_SQL, [{"job_id": job_id, "page_index": str(idx), "status": status,
+                                                   "result": json.dumps(result)}
+                                                  for idx, (status, result) in sorted(finished.items())])
+        get_queue().send([{"JobId": job_id, "Page": idx} for idx in to_read])
+    except Exception:
+        # The job row exists, so mark it failed rather than leave it queued forever.
+        # Pages queued before the failure find the job failed and skip their work
+        try:
+            _execute(FAIL_JOB_SQL, {"job_id": job_id})
+        except Exception as e:
+            logger.error(f"Could not mark OCR job {job_id} failed: {e}")
+        delete_page_images(job_id, to_read)
+        raise
+
+    logger.info(f"Submitted OCR job {job_id}: {len(to_read)} of {len(images_base64)} pages queued")
+    return {
+        "JobId": job_id,
+        "Status": QUEUED if to_read else DONE,
+        "Pages": len(images_base64),
+        "Queued": len(to_read)
+    }
+
+
+def process_message(job_id: str, index: int, context=None) -> bool:
+    """
+    A Utility Function that reads one queued page and stores its result
+
+    Input:
+        job_id = the page's job
+        index = the page's 0-based index in the job
+        context = the worker's Lambda context, for its deadline
+
+    Output:
+        returns True once the page is finished (now or by an earlier delivery), False
+        if it should be delivered again later. Raises on errors storing the result,
+        which also leave it to be delivered again
+    """
+    records = _execute(START_PAGE_SQL, {"job_id": job_id, "page_index": str(index)}).get("records") or []
+    if not records:
+        logger.info(f"Page {index} of OCR job {job_id} is already finished")
+        return True
+    attempts = int(_value(records[0][0]))
+    parameters = {"job_id": job_id, "page_index": str(index)}
+
+    job = _execute(JOB_SQL, {"job_id": job_id}).get("records") or []
+    if not job:
+        raise JobError(f"OCR job {job_id} doesn't exist")
+    doc_type, options, job_status = _value(job[0][0]), json.loads(_value(job[0][1])), _value(job[0][3])
+
+    if attempts > OCR_JOB_MAX_ATTEMPTS:
+        # Earlier deliveries died without finishing it, e.g. out of memory or time
+        result, status = page_error(index, "ProcessingError", f"Gave up after {attempts - 1} attempts"), FAILED
+    elif job_status == FAILED:
+        # submit failed partway through and has removed the page images
+        result, status = page_error(index, "ProcessingError", "The job could not be queued"), FAILED
+    else:
+        image_bytes = s3_client.get_object(Bucket=OCR_JOBS_BUCKET, Key=page_key(job_id, index))["Body"].read()
+
+        try:
+            with span("process_page", page=index + 1):
+                extracted_data, crop = getOCRDataLambda.process_page(
+                    image_bytes, doc_type, index + 1, options.get("crop", True),
+                    request_deadline(context, limit=None))
+            result, status = {"DocumentIndex": index, "Result": extracted_data}, DONE
+            if crop is not None:
+                result["Crop"] = crop
+        except Throttled as e:
+            if attempts < OCR_JOB_MAX_ATTEMPTS:
+                logger.warning(f"Textract throttled page {index} of OCR job {job_id}, queueing it again")
+                _execute(REQUEUE_PAGE_SQL, parameters)
+                return False
+            result, status = page_error(index, "Throttled", str(e), retryable=True), FAILED
+        except Exception as e:
+            logger.error(f"Error processing page {index} of OCR job {job_id}: {str(e)}")
+            result, status = page_error(index, "ProcessingError", str(e)), FAILED
+
+    _execute(FINISH_PAGE_SQL, dict(parameters, status=status, result=json.dumps(result)))
+    try:
+        s3_client.delete_object(Bucket=OCR_JOBS_BUCKET, Key=page_key(job_id, index))
+    except Exception as e:
+        logger.warning(f"Could not delete the image of page {index} of OCR job {job_id}: {e}")
+    return True
+
+
+def get_job(job_id: str, principal_id: str = None):
+    """
+    A Utility Function that reads a job's progress and finished results
+
+    Input:
+        job_id = the job's id
+        principal_id = the caller's principal, which has to be the one that submitted it
+
+    Output:
+        returns a dict of the job's Status, the Status of each page under Progress,
+        and the Results of its finished pages in the synchronous route's format; or
+        None if there is no such job for the caller
+    """
+    job = _execute(JOB_SQL, {"job_id": job_id}).get("records") or []
+    if not job:
+        return None
+    doc_type, _, pages, job_status, created_at, owner = [_value(field) for field in job[0]]
+    if (owner or "") != (principal_id or ""):
+        # Someone else's job looks the same as one that doesn't exist
+        return None
+    rows = [[_value(field) for field in record]
+            for record in _execute(PAGES_SQL, {"job_id": job_id}).get("records") or []]
+
+    statuses, attempts, results = {}, {}, {}
+    for index, status, tries, result in rows:
+        index = int(index)
+        statuses[index], attempts[index] = status, int(tries)
+        if status in (DONE, FAILED):
+            results[index] = json.loads(result)
+    for index, status, _, result in rows:
+        index = int(index)
+        if status != SKIPPED:
+            continue
+        skip = json.loads(result)["Skipped"]
+        if skip["Reason"] == "duplicate":
+            # A repeated page is as far along as the page it repeats
+            statuses[index] = statuses.get(skip["DuplicateOf"], SKIPPED)
+            if skip["DuplicateOf"] not in results:
+                continue
+        results[index] = getOCRDataLambda.skipped_result(index, skip, results)
+
+    done = sum(status in FINISHED for status in statuses.values())
+    if job_status == FAILED:
+        status = FAILED
+    elif done == len(statuses):
+        status = DONE
+    elif done or any(attempts.values()):
+        status = RUNNING
+    else:
+        status = QUEUED
+
+    return {
+        "JobId": job_id,
+        "Status": status,
+        "DocType": doc_type,
+        "CreatedAt": created_at,
+        "Pages": int(pages),
+        "PagesDone": done,
+        "Progress": [{"DocumentIndex": index, "Status": statuses[index], "Attempts": attempts[index]}
+                     for index in sorted(statuses)],
+        "Results": [results[index] for index in sorted(results)]
+    }
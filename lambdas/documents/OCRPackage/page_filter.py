@@ -0,0 +1,111 @@
+import base64
+import binascii
+import hashlib
+import logging
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Ink is measured on a grayscale thumbnail no larger than this
+THUMBNAIL_SIZE = 512
+# Margin ignored on each side, as a share of the page, to skip scanner edges and punch holes
+MARGIN_FRACTION = 0.04
+# A pixel is ink when it is this much darker than the paper
+INK_CONTRAST = 60
+# Pages with less ink coverage than this are blank
+BLANK_INK_FRACTION = 0.002
+
+BLANK = "blank"
+DUPLICATE = "duplicate"
+
+
+class PageSignature:
+    """
+    The statistics of one page that blank and duplicate detection need
+    """
+
+    def __init__(self, ink_fraction: float, digest: str):
+        self.ink_fraction = ink_fraction
+        self.digest = digest
+
+    @property
+    def is_blank(self) -> bool:
+        return self.ink_fraction < BLANK_INK_FRACTION
+
+
+def page_signature(image_bytes: bytes):
+    """
+    A Utility Function that computes a page's ink coverage and content hash
+
+    Input:
+        image_bytes = the encoded page image
+
+    Output:
+        returns a PageSignature, or None if the image could not be decoded
+    """
+    # Reduced decoding lets libjpeg skip most of the work on large scans
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if gray is None:
+        return None
+
+    height, width = gray.shape
+    scale = min(1.0, THUMBNAIL_SIZE / max(width, height))
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        height, width = gray.shape
+
+    margin_y, margin_x = int(height * MARGIN_FRACTION), int(width * MARGIN_FRACTION)
+    interior = gray[margin_y:height - margin_y, margin_x:width - margin_x]
+    if interior.size == 0:
+        interior = gray
+
+    paper = float(np.percentile(interior, 90))
+    ink_fraction = float(np.mean(interior < paper - INK_CONTRAST))
+
+    # Only byte-identical images count as the same page. Filled copies of one form
+    # differ in a few words, which no thumbnail comparison can tell from scan noise,
+    # and a false match would copy one person's fields onto another's page
+    digest = hashlib.sha256(image_bytes).hexdigest()
+
+    return PageSignature(ink_fraction, digest)
+
+
+def plan_pages(images_base64: list) -> dict:
+    """
+    A Utility Function that decides which pages of a request do not need OCR
+
+    Input:
+        images_base64 = the base64 encoded page images, in order
+
+    Output:
+        returns a dict mapping the index of each skipped page to a dict with its
+        "Reason" (blank or duplicate) and, for duplicates, "DuplicateOf", the index
+        of the earlier page whose results it should reuse
+    """
+    skipped = {}
+    # The first page with each content hash
+    kept = {}
+    for idx, image_base64 in enumerate(images_base64):
+        try:
+            signature = page_signature(base64.b64decode(image_base64))
+        except (binascii.Error, TypeError, cv2.error):
+            signature = None
+        if signature is None:
+            # Let the OCR step report the decoding error
+            continue
+
+        if signature.is_blank:
+            skipped[idx] = {"Reason": BLANK, "InkCoverage": round(signature.ink_fraction, 5)}
+            continue
+
+        original = kept.get(signature.digest)
+        if original is not None:
+            skipped[idx] = {"Reason": DUPLICATE, "DuplicateOf": original}
+            continue
+
+        kept[signature.digest] = idx
+
+    if skipped:
+        logger.info(f"Skipping {len(skipped)} of {len(images_base64)} pages: {skipped}")
+    return skipped
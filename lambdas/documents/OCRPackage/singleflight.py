@@ -0,0 +1,320 @@
+"""
+Coalesces identical OCR work, so a page sent twice while the first request is still
+running (a double click, a client retry) is only scanned and sent to Textract once.
+
+Work is keyed by the page's content hash and the options that change its result.
+Within a worker, concurrent callers with the same key share one call (the router and
+local server run many requests per process). Across Lambda containers, an optional
+lease makes the second caller wait for the first one's result instead of repeating
+it; OCR_LEASE_STORE picks where the lease is kept:
+- "rds": a row in the ocr_leases table, taken with a conditional insert. The result
+  is kept in the row for OCR_LEASE_RESULT_SECONDS, so retries arriving just after the
+  first request finished get it too
+- "memory": the same rules in this process, a stand-in for running locally
+- unset: no lease, only coalescing within the worker
+
+The lease fails open: if the store can't be reached, or the holder takes longer than
+MAX_WAIT_SECONDS, the caller does the work itself.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from trace_util import span
+
+logger = logging.getLogger()
+
+OCR_LEASE_STORE = os.environ.get("OCR_LEASE_STORE", "").lower()
+# How long a lease is held while its work runs, in case the holder dies
+LEASE_SECONDS = int(os.environ.get("OCR_LEASE_SECONDS", 60))
+# How long a finished result stays available to identical requests
+RESULT_SECONDS = int(os.environ.get("OCR_LEASE_RESULT_SECONDS", 120))
+POLL_SECONDS = 0.5
+# Longest wait for another worker's result, leaving time to do the work within API
+# Gateway's 29 second limit
+MAX_WAIT_SECONDS = 15
+# Expired lease rows are deleted at most this often per container
+PURGE_INTERVAL_SECONDS = 300
+
+# Lease states returned by lookup
+RUNNING = "running"
+DONE = "done"
+MISSING = "missing"
+
+
+class LeaseError(Exception):
+    """
+    Raised when the lease store can't be read or written
+    """
+
+
+def work_key(data: bytes, **options) -> str:
+    """
+    A Utility Function that names a unit of work by its input and options
+
+    Input:
+        data = the input bytes, e.g. an encoded page
+        options = everything else that changes the result
+
+    Output:
+        returns a hex SHA-256 digest
+    """
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs a function once per key among the threads that ask for it at the same time;
+    the others wait and get the same result or exception
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key: str, function, retry=None) -> tuple:
+        """
+        Returns a tuple of the result and whether it came from another caller's call.
+        retry, if given, is called with another caller's exception; when it returns
+        True that exception belonged to the other caller (e.g. it ran out of time),
+        so this caller runs the call again instead of raising it
+        """
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self.calls[key] = _Call()
+            if leader:
+                break
+
+            call.done.wait()
+            if call.error is None:
+                return call.result, True
+            if retry is None or not retry(call.error):
+                raise call.error
+            # Lead a new call, or join one another waiter started
+
+        try:
+            call.result = function()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+class MemoryLeaseStore:
+    """
+    Leases in this process, with the same rules as RdsLeaseStore
+    """
+
+    def __init__(self):
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str, owner: str, seconds: int) -> bool:
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is not None and lease["expires_at"] >= time.time():
+                return False
+            self.leases[key] = {"owner": owner, "expires_at": time.time() + seconds, "result": None}
+            return True
+
+    def lookup(self, key: str) -> tuple:
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is None or lease["expires_at"] < time.time():
+                return MISSING, None
+            return (DONE, json.loads(lease["result"])) if lease["result"] is not None else (RUNNING, None)
+
+    def complete(self, key: str, owner: str, result, seconds: int) -> None:
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is not None and lease["owner"] == owner:
+                lease.update(result=json.dumps(result), expires_at=time.time() + seconds)
+            now = time.time()
+            for expired in [name for name, lease in self.leases.items() if lease["expires_at"] < now]:
+                del self.leases[expired]
+
+    def release(self, key: str, owner: str) -> None:
+        with self.lock:
+            if self.leases.get(key, {}).get("owner") == owner:
+                del self.leases[key]
+
+
+class RdsLeaseStore:
+    """
+    Leases as rows of the ocr_leases table (see database/table_creation.sql). A lease
+    is taken by inserting its row, or by taking over a row whose time is up, in one
+    conditional statement
+    """
+
+    ACQUIRE_SQL = ("INSERT INTO ocr_leases (lease_key, owner, expires_at, result) "
+                   "VALUES (:lease_key, :owner, CAST(:expires_at AS BIGINT), NULL) "
+                   "ON CONFLICT (lease_key) DO UPDATE SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at, "
+                   "result = NULL WHERE ocr_leases.expires_at < CAST(:now AS BIGINT) RETURNING owner")
+    LOOKUP_SQL = "SELECT expires_at, result FROM ocr_leases WHERE lease_key = :lease_key"
+    COMPLETE_SQL = ("UPDATE ocr_leases SET result = :result, expires_at = CAST(:expires_at AS BIGINT) "
+                    "WHERE lease_key = :lease_key AND owner = :owner")
+    RELEASE_SQL = "DELETE FROM ocr_leases WHERE lease_key = :lease_key AND owner = :owner"
+    PURGE_SQL = "DELETE FROM ocr_leases WHERE expires_at < CAST(:now AS BIGINT)"
+
+    def __init__(self):
+        # Only containers configured for the lease need the RDS Data client
+        from db_util import execute_statement
+        self.execute_statement = execute_statement
+        self.purged_at = 0.0
+
+    def _execute(self, sql: str, parameters: dict) -> dict:
+        try:
+            response = self.execute_statement(sql, parameters)
+        except Exception as e:
+            raise LeaseError(str(e)) from e
+        if response is None or "statusCode" in response:
+            raise LeaseError((response or {}).get("body", "No response from the database"))
+        return response
+
+    def acquire(self, key: str, owner: str, seconds: int) -> bool:
+        now = int(time.time())
+        response = self._execute(self.ACQUIRE_SQL, {"lease_key": key, "owner": owner,
+                                                    "expires_at": str(now + seconds), "now": str(now)})
+        return bool(response.get("records"))
+
+    def lookup(self, key: str) -> tuple:
+        records = self._execute(self.LOOKUP_SQL, {"lease_key": key}).get("records") or []
+        if not records:
+            return MISSING, None
+        expires_at, result = records[0]
+        if int(next(iter(expires_at.values()))) < time.time():
+            return MISSING, None
+        if result.get("isNull"):
+            return RUNNING, None
+        return DONE, json.loads(result["stringValue"])
+
+    def complete(self, key: str, owner: str, result, seconds: int) -> None:
+        now = time.time()
+        self._execute(self.COMPLETE_SQL, {"lease_key": key, "owner": owner, "result": json.dumps(result),
+                                          "expires_at": str(int(now) + seconds)})
+        if now - self.purged_at > PURGE_INTERVAL_SECONDS:
+            self.purged_at = now
+            self._execute(self.PURGE_SQL, {"now": str(int(now))})
+
+    def release(self, key: str, owner: str) -> None:
+        self._execute(self.RELEASE_SQL, {"lease_key": key, "owner": owner})
+
+
+_flight = SingleFlight()
+_lease_store = None
+_lease_store_lock = threading.Lock()
+
+
+def get_lease_store():
+    """
+    A Utility Function that returns the lease store OCR_LEASE_STORE names, or None
+    """
+    global _lease_store
+    if not OCR_LEASE_STORE:
+        return None
+    with _lease_store_lock:
+        if _lease_store is None:
+            if OCR_LEASE_STORE == "rds":
+                _lease_store = RdsLeaseStore()
+            elif OCR_LEASE_STORE == "memory":
+                _lease_store = MemoryLeaseStore()
+            else:
+                raise ValueError(f"Unknown OCR_LEASE_STORE {OCR_LEASE_STORE!r}, expected rds or memory")
+        return _lease_store
+
+
+def run_leased(key: str, function, store) -> tuple:
+    """
+    A Utility Function that runs function under the key's lease, or waits for the
+    result of the worker holding it
+
+    Output:
+        returns a tuple of the result and where it came from: "computed" or "lease"
+    """
+    owner = str(uuid.uuid4())
+    deadline = time.monotonic() + MAX_WAIT_SECONDS
+    try:
+        while time.monotonic() < deadline:
+            if store.acquire(key, owner, LEASE_SECONDS):
+                break
+            state, result = store.lookup(key)
+            while state == RUNNING and time.monotonic() < deadline:
+                time.sleep(POLL_SECONDS)
+                state, result = store.lookup(key)
+            if state == DONE:
+                return result, "lease"
+            # The holder gave up or its lease ran out; try to take it over
+        else:
+            logger.warning(f"Gave up waiting for another worker's OCR of {key[:12]}, running it here")
+            return function(), "computed"
+    except LeaseError as e:
+        logger.warning(f"OCR lease unavailable, running without it: {e}")
+        return function(), "computed"
+
+    try:
+        result = function()
+    except Exception:
+        try:
+            store.release(key, owner)
+        except LeaseError as e:
+            logger.warning(f"Could not release the OCR lease of {key[:12]}: {e}")
+        raise
+    try:
+        store.complete(key, owner, result, RESULT_SECONDS)
+    except LeaseError as e:
+        logger.warning(f"Could not store the OCR result of {key[:12]}: {e}")
+    return result, "computed"
+
+
+def coalesce(key: str, function, retry=None):
+    """
+    A Utility Function that runs function once for identical work in flight: once per
+    worker, and once across workers when a lease store is configured. function's
+    result must be JSON serializable to be shared across workers, and callers must
+    not modify the result they get, since it may be shared
+
+    Input:
+        key = the work's key, from work_key
+        function = the work, called without arguments
+        retry = called with the exception of a call this one joined; True runs the
+                work again rather than raising it, for errors that depend on the
+                caller, such as its deadline
+
+    Output:
+        returns function's result, or the result of the identical call it joined
+    """
+    with span("coalesce") as coalesced:
+        store = get_lease_store()
+        source = {}
+
+        def leader():
+            if store is None:
+                return function()
+            result, source["from"] = run_leased(key, function, store)
+            return result
+
+        result, shared = _flight.do(key, leader, retry)
+        origin = "worker" if shared else source.get("from", "computed")
+        coalesced.set(source=origin)
+        if origin != "computed":
+            logger.info(f"Reused the OCR of {key[:12]} from an identical request ({origin})")
+        return result
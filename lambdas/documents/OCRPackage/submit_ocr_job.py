@@ -0,0 +1,69 @@
+import json
+import logging
+from ocr_jobs import submit
+from trace_util import traced_handler
+from request_util import request_body
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+    "Access-Control-Allow-Methods": "OPTIONS,GET,POST"
+}
+
+@traced_handler
+def lambda_handler(event, context):
+    """
+    Starts an OCR job for the pages of a document and returns its id straight away;
+    the pages are read in the background (see ocr_jobs). The body is the same as
+    getOCRDataLambda's
+
+    Input:
+        images = the base64 encoded page images
+        docType = "id" or "form"
+        crop, skipPages, textLayer = as for getOCRDataLambda
+
+    Output:
+        returns 202 with the JobId to poll GET /documents/OCR/jobs with
+    """
+    try:
+        if event.get("httpMethod") == "OPTIONS":
+            return {
+                "statusCode": 200,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "CORS preflight success"})
+            }
+
+        body = request_body(event, {})
+        images_base64 = body.get("images")
+        doc_type = body.get("docType")
+
+        if not images_base64 or not isinstance(images_base64, list) or not doc_type:
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({
+                    "Error": "Missing required fields",
+                    "ErrorMessage": "Both 'images' (list) and 'docType' are required."
+                })
+            }
+
+        authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+        job = submit(images_base64, doc_type, body.get("crop", True), body.get("skipPages", True),
+                     body.get("textLayer"), authorizer.get("principalId"))
+
+        return {
+            "statusCode": 202,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({"message": "OCR job submitted", "data": job})
+        }
+
+    except Exception as e:
+        logger.exception(f"Could not submit the OCR job: {e}")
+        return {
+            "statusCode": 500,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({"message": "Internal Server Error", "error": str(e)})
+        }
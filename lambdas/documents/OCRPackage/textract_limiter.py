@@ -0,0 +1,211 @@
+"""
+Client-side rate limiting of Textract calls, so a busy container slows itself down
+instead of failing pages with ThrottlingException.
+
+Each call takes a token from a bucket refilled at the current rate, which starts at
+TEXTRACT_TPS. The rate adapts AIMD style: every throttled call halves it (at most once
+per DECREASE_COOLDOWN_SECONDS, since one overload throttles every call in flight), and
+each successful call wins a little back, about ADDITIVE_INCREASE_TPS per second at
+full speed, up to TEXTRACT_TPS again. Throttled calls, transient errors and network
+failures are retried with jittered backoff until the request's deadline; a page that
+still can't be sent raises Throttled, which the handler reports for that page alone.
+
+TEXTRACT_TPS applies per container. Textract's quota is per account, so set it to the
+account's AnalyzeDocument TPS divided by the containers expected to run at once; the
+adaptive rate covers the rest.
+
+The limiter's state is added to each traced invocation's EMF record: TextractRate,
+TextractThrottles, TextractRetries, TextractRateLimitWait and TextractGaveUp.
+"""
+import logging
+import os
+import threading
+import time
+from botocore.exceptions import ClientError, ConnectionError, EndpointConnectionError, ReadTimeoutError
+from rate_util import MAX_ATTEMPTS, RETRYABLE_ERROR_CODES, TokenBucket, backoff_delay
+from trace_util import metric
+
+logger = logging.getLogger()
+
+# Calls per second a container makes before any throttling
+TEXTRACT_TPS = float(os.environ.get("TEXTRACT_TPS", 5))
+# The rate never drops below this, so a container always makes some progress
+MIN_TPS = float(os.environ.get("TEXTRACT_MIN_TPS", 0.5))
+ADDITIVE_INCREASE_TPS = 0.5
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN_SECONDS = 1.0
+
+# Error codes that mean Textract wants us to slow down
+THROTTLE_ERROR_CODES = {
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "TooManyRequestsException",
+    "Throttling",
+    "RequestLimitExceeded"
+}
+RETRY_ERROR_CODES = RETRYABLE_ERROR_CODES | {"InternalServerError"}
+# Network failures, retried here since the Textract client has botocore's retries off
+NETWORK_ERRORS = (ConnectionError, EndpointConnectionError, ReadTimeoutError)
+
+# API Gateway gives up on a request after 29 seconds
+REQUEST_TIMEOUT_SECONDS = 29.0
+# Kept back from the deadline to finish the rest of the response
+DEADLINE_MARGIN_SECONDS = 2.0
+
+
+class Throttled(Exception):
+    """
+    Raised when a call couldn't be made before the request's deadline because
+    Textract kept throttling it, or the limiter had no token for it in time
+    """
+
+    def __init__(self, message: str, code: str = None):
+        super().__init__(message)
+        self.code = code
+
+
+class AdaptiveRateLimiter:
+    """
+    A TokenBucket whose rate is lowered when the service throttles and raised again
+    as calls succeed. Shared by every thread in the container
+    """
+
+    def __init__(self, max_rate: float = TEXTRACT_TPS, min_rate: float = MIN_TPS,
+                 increase: float = ADDITIVE_INCREASE_TPS, decrease: float = DECREASE_FACTOR):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = max_rate
+        self.bucket = TokenBucket(max_rate)
+        self.lock = threading.Lock()
+        self.decreased_at = float("-inf")
+        # Totals since the container started
+        self.calls = self.throttles = self.retries = self.gave_up = 0
+
+    def acquire(self, deadline: float = None) -> bool:
+        """
+        Waits for a token. Returns False if none will be free before deadline, a
+        time.monotonic() value
+        """
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        start = time.perf_counter()
+        acquired = self.bucket.acquire(timeout=timeout)
+        metric("TextractRateLimitWait", (time.perf_counter() - start) * 1000, "Milliseconds")
+        return acquired
+
+    def on_success(self) -> None:
+        with self.lock:
+            self.calls += 1
+            if self.rate < self.max_rate:
+                # Spread over the calls a second brings, so recovery doesn't depend on the rate
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+                self.bucket.set_rate(self.rate)
+
+    def on_throttle(self, code: str) -> None:
+        with self.lock:
+            self.calls += 1
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self.decreased_at >= DECREASE_COOLDOWN_SECONDS:
+                self.decreased_at = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.bucket.set_rate(self.rate)
+                logger.warning(f"{code} from Textract, lowered the rate to {self.rate:.2f} TPS")
+        # Every thread waits out the overload, not only the one that was refused
+        self.bucket.penalize()
+        metric("TextractThrottles", 1)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the limiter's state: the current rate and totals since the container
+        started
+        """
+        with self.lock:
+            return {
+                "rate": round(self.rate, 3),
+                "max_rate": self.max_rate,
+                "calls": self.calls,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "gave_up": self.gave_up
+            }
+
+    def call(self, function, *args, deadline: float = None, **kwargs):
+        """
+        Calls a Textract client method under the limit, retrying throttling, transient
+        errors and network failures with jittered exponential backoff until deadline
+
+        Input:
+            function = the client method, e.g. textract_client.analyze_document
+            deadline = the time.monotonic() value to give up by, or None to retry
+                       until rate_util.MAX_ATTEMPTS
+            args, kwargs = the method's arguments
+
+        Output:
+            returns the method's response. Raises Throttled when out of time, and
+            other errors straight away
+        """
+        attempt = 0
+        try:
+            while True:
+                if not self.acquire(deadline):
+                    self._give_up("No Textract capacity left before the request's deadline")
+                try:
+                    response = function(*args, **kwargs)
+                except (ClientError, *NETWORK_ERRORS) as e:
+                    if isinstance(e, ClientError):
+                        code = e.response.get("Error", {}).get("Code")
+                        if code not in RETRY_ERROR_CODES:
+                            raise
+                        if code in THROTTLE_ERROR_CODES:
+                            self.on_throttle(code)
+                    else:
+                        code = type(e).__name__
+                    delay = backoff_delay(attempt)
+                    attempt += 1
+                    out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+                    if out_of_time or (deadline is None and attempt >= MAX_ATTEMPTS):
+                        self._give_up(f"Textract is still refusing calls ({code}) after {attempt} attempts", code)
+                    with self.lock:
+                        self.retries += 1
+                    metric("TextractRetries", 1)
+                    logger.info(f"{code} from Textract, retrying in {delay:.2f}s")
+                    time.sleep(delay)
+                    continue
+                self.on_success()
+                return response
+        finally:
+            metric("TextractRate", self.rate, "Count/Second", add=False)
+
+    def _give_up(self, message: str, code: str = None) -> None:
+        with self.lock:
+            self.gave_up += 1
+        metric("TextractGaveUp", 1)
+        raise Throttled(message, code)
+
+
+limiter = AdaptiveRateLimiter()
+
+
+def request_deadline(context, limit: float = REQUEST_TIMEOUT_SECONDS) -> float:
+    """
+    A Utility Function that returns when a request's Textract calls have to stop
+    retrying: a margin before the Lambda's timeout or API Gateway's, whichever is
+    first
+
+    Input:
+        context = the Lambda context, or None when there isn't one
+        limit = the longest the caller waits, in seconds; None for invocations no
+                client is waiting on, such as queue workers
+
+    Output:
+        returns a time.monotonic() value
+    """
+    remaining = limit if limit is not None else float("inf")
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining is not None:
+        remaining = min(remaining, get_remaining() / 1000)
+    if remaining == float("inf"):
+        remaining = REQUEST_TIMEOUT_SECONDS
+    return time.monotonic() + max(0.0, remaining - DEADLINE_MARGIN_SECONDS)
@@ -1,7 +1,20 @@
+from __future__ import annotations
 import base64
 import json
+import logging
 from io import BytesIO
-from PIL import Image
+from lazy_util import lazy_import
+from trace_util import span, traced_handler
+from request_util import request_body
+
+# Loaded on first use, so preflights don't import NumPy, Pillow or the imaging engines
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+image_util = lazy_import("image_util")
+imaging_backend = lazy_import("imaging_backend")
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -9,31 +22,255 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+# Textract's synchronous AnalyzeDocument limit for raw image bytes
+TEXTRACT_SYNC_LIMIT = 5 * 1024 * 1024
+
+# Search space for the target-size mode
+BUDGET_SCALES = (1.0, 0.85, 0.7, 0.55, 0.4)
+MIN_QUALITY = 25
+MAX_QUALITY = 90
+DEFAULT_MIN_SSIM = 0.92
+
+# Size of the thumbnail and of the full-resolution detail crop the perceptual check runs on
+SSIM_THUMBNAIL_SIZE = 256
+SSIM_DETAIL_SIZE = 256
 
-def compress_base64_image(base64_str: str, quality: int = 60) -> str:
+# "auto" routes black-and-white and grayscale pages to smaller encodings, any other value keeps colour
+AUTO_PROFILE = "auto"
+
+
+def compress_base64_image(base64_str: str, quality: int = 60, profile: str = AUTO_PROFILE, backend: str = None) -> str:
     # Decode base64 string to bytes
-    image_data = base64.b64decode(base64_str)
-    image = Image.open(BytesIO(image_data))
+    with span("base64_decode"):
+        image_data = base64.b64decode(base64_str)
+    engine = imaging_backend.get_backend(backend)
+    # Oversized scans are reduced while decoding so they stay within the memory budget
+    with span("image_decode", engine=engine.name):
+        image, source_format, _ = engine.decode(image_data)
 
-    # Convert to RGB if necessary (e.g. for PNGs with alpha)
-    if image.mode in ("RGBA", "P"):
-        image = image.convert("RGB")
+    # Black-and-white and grayscale pages don't need 24-bit colour
+    if profile == AUTO_PROFILE:
+        content_class = engine.classify(image)
+        if content_class != image_util.COLOR:
+            compressed_bytes, _ = engine.encode_for_content(image, content_class, source_format, quality)
+            return base64.b64encode(compressed_bytes).decode('utf-8')
 
-    # Save image to buffer with compression
-    buffer = BytesIO()
-    format = image.format if image.format else "JPEG"  # Default to JPEG
+    format = source_format if source_format else "JPEG"  # Default to JPEG
 
+    # Images with transparency (e.g. PNGs with alpha) are flattened and stored as JPEG
+    if engine.needs_flattening(image):
+        format = "JPEG"
+
+    # Encode the image with compression
     if format.upper() == "PNG":
-        image.save(buffer, format="PNG", optimize=True)
+        compressed_bytes = engine.encode(image, "PNG")
     else:
-        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        compressed_bytes = engine.encode(image, "JPEG", quality)
 
     # Get base64 encoded result
-    compressed_bytes = buffer.getvalue()
     compressed_base64 = base64.b64encode(compressed_bytes).decode('utf-8')
     return compressed_base64
 
 
+def compress_base64_image_to_budget(base64_str: str, max_bytes: int = TEXTRACT_SYNC_LIMIT,
+                                    min_ssim: float = DEFAULT_MIN_SSIM, profile: str = AUTO_PROFILE) -> dict:
+    """
+    Finds the smallest encoding of the image that fits within max_bytes while keeping
+    the SSIM (measured on a thumbnail) at or above min_ssim
+
+    Input:
+        base64_str = the image to compress, in base64
+        max_bytes = the byte budget for the encoded image
+        min_ssim = the quality floor, between 0 and 1
+        profile = "auto" to encode black-and-white and grayscale pages without colour
+
+    Output:
+        returns a dict with the compressed image in base64 and the chosen parameters.
+        Raises ValueError if no candidate fits within max_bytes
+    """
+    with span("base64_decode"):
+        image_data = base64.b64decode(base64_str)
+    with span("image_decode", engine="pillow"):
+        image, _, decode_factor = image_util.open_within_budget(image_data)
+    content_class = image_util.classify_content(image) if profile == AUTO_PROFILE else image_util.COLOR
+    grayscale = content_class != image_util.COLOR or image.mode in ("1", "L", "LA", "I", "I;16")
+    image = image.convert("L" if grayscale else "RGB")
+    reference = _perceptual_reference(image)
+
+    candidates = []
+    for scale in BUDGET_SCALES:
+        scaled = image
+        if scale < 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            scaled = image.resize(size, Image.LANCZOS)
+
+        candidates.extend(_search_jpeg_quality(scaled, scale, reference, max_bytes, min_ssim))
+
+        palette_candidate = _palette_png_candidate(scaled, scale, reference)
+        if palette_candidate["bytes"] <= max_bytes:
+            candidates.append(palette_candidate)
+
+        if content_class == image_util.BILEVEL:
+            bilevel_data = image_util.encode_image(image_util.to_bilevel(scaled), "PNG")
+            if len(bilevel_data) <= max_bytes:
+                candidates.append(_make_candidate(bilevel_data, "PNG", None, scale, scaled.size, reference))
+
+        # Once a scale fits the budget but misses the floor, smaller scales will too
+        fitted = [c for c in candidates if c["scale"] == scale]
+        if fitted and all(c["ssim"] < min_ssim for c in fitted):
+            break
+
+    if not candidates:
+        raise ValueError(f"No encoding of the image fits within {max_bytes} bytes")
+
+    passing = [c for c in candidates if c["ssim"] >= min_ssim]
+    if passing:
+        best = min(passing, key=lambda c: c["bytes"])
+    else:
+        best = max(candidates, key=lambda c: c["ssim"])
+
+    logger.info(f"Budget compression: {len(image_data)} -> {best['bytes']} bytes "
+                f"({best['format']}, quality={best['quality']}, scale={best['scale']}, ssim={best['ssim']:.4f})")
+
+    return {
+        "image": base64.b64encode(best.pop("data")).decode('utf-8'),
+        "parameters": {
+            "format": best["format"],
+            "quality": best["quality"],
+            "scale": best["scale"],
+            "width": best["width"],
+            "height": best["height"],
+            "ssim": round(best["ssim"], 4),
+            "bytes": best["bytes"],
+            "original_bytes": len(image_data),
+            "max_bytes": max_bytes,
+            "min_ssim": min_ssim,
+            "content_class": content_class,
+            "decode_factor": round(decode_factor, 3),
+            "met_quality_floor": best["ssim"] >= min_ssim
+        }
+    }
+
+
+def _search_jpeg_quality(image: Image.Image, scale: float, reference: dict,
+                         max_bytes: int, min_ssim: float) -> list:
+    """
+    Binary searches for the lowest JPEG quality that still meets min_ssim within the budget.
+    Returns every candidate that fit the budget so the caller can fall back on the best one
+    """
+    candidates = []
+    low, high = MIN_QUALITY, MAX_QUALITY
+    while low <= high:
+        quality = (low + high) // 2
+        data = image_util.encode_image(image, "JPEG", quality)
+        if len(data) > max_bytes:
+            high = quality - 1
+            continue
+
+        candidate = _make_candidate(data, "JPEG", quality, scale, image.size, reference)
+        candidates.append(candidate)
+        if candidate["ssim"] >= min_ssim:
+            high = quality - 1
+        else:
+            low = quality + 1
+    return candidates
+
+
+def _palette_png_candidate(image: Image.Image, scale: float, reference: dict) -> dict:
+    """
+    Screenshots and flat forms compress far better as a 256 colour palette PNG than as
+    JPEG, so every scale also gets a palette candidate
+    """
+    if image.mode == "L":
+        data = image_util.encode_image(image, "PNG")
+    else:
+        data = image_util.encode_image(image.quantize(colors=256), "PNG")
+    return _make_candidate(data, "PNG", None, scale, image.size, reference)
+
+
+def _make_candidate(data: bytes, format: str, quality, scale: float, size: tuple, reference: dict) -> dict:
+    decoded = Image.open(BytesIO(data))
+    return {
+        "data": data,
+        "format": format,
+        "quality": quality,
+        "scale": scale,
+        "width": size[0],
+        "height": size[1],
+        "bytes": len(data),
+        "ssim": _perceptual_score(reference, decoded)
+    }
+
+
+def _perceptual_reference(image: Image.Image) -> dict:
+    """
+    Builds what candidates are compared against: a luminance thumbnail of the whole
+    image, and a full-resolution crop of its busiest region. The thumbnail alone
+    can't see the detail a downscale throws away
+    """
+    ratio = SSIM_THUMBNAIL_SIZE / max(image.width, image.height)
+    size = (max(8, round(image.width * ratio)), max(8, round(image.height * ratio)))
+    gray = image.convert("L")
+    thumbnail = np.asarray(gray.resize(size, Image.BILINEAR), dtype=np.float64)
+
+    # Centre the detail crop on the third of the image with the most texture
+    rows, cols = np.array_split(np.arange(thumbnail.shape[0]), 3), np.array_split(np.arange(thumbnail.shape[1]), 3)
+    row, col = max(((r, c) for r in rows for c in cols), key=lambda rc: thumbnail[np.ix_(rc[0], rc[1])].std())
+    center_x = (col[0] + col[-1] + 1) / 2 / ratio
+    center_y = (row[0] + row[-1] + 1) / 2 / ratio
+    half_width, half_height = min(SSIM_DETAIL_SIZE, image.width) / 2, min(SSIM_DETAIL_SIZE, image.height) / 2
+    left = int(min(max(center_x - half_width, 0), image.width - 2 * half_width))
+    top = int(min(max(center_y - half_height, 0), image.height - 2 * half_height))
+    box = (left, top, left + int(2 * half_width), top + int(2 * half_height))
+
+    return {
+        "thumbnail": thumbnail,
+        "detail": np.asarray(gray.crop(box), dtype=np.float64),
+        "box": box,
+        "width": image.width
+    }
+
+
+def _perceptual_score(reference: dict, candidate: Image.Image) -> float:
+    """
+    Returns the lower of the thumbnail SSIM and the detail-crop SSIM of a decoded candidate
+    """
+    gray = candidate.convert("L")
+    thumbnail_shape = reference["thumbnail"].shape
+    thumbnail = np.asarray(gray.resize((thumbnail_shape[1], thumbnail_shape[0]), Image.BILINEAR), dtype=np.float64)
+
+    # Scale the candidate's matching region back up to the reference crop
+    scale = candidate.width / reference["width"]
+    box = tuple(coordinate * scale for coordinate in reference["box"])
+    detail_shape = reference["detail"].shape
+    detail = np.asarray(gray.resize((detail_shape[1], detail_shape[0]), Image.BILINEAR, box=box), dtype=np.float64)
+
+    return min(ssim(reference["thumbnail"], thumbnail), ssim(reference["detail"], detail))
+
+
+def ssim(reference: np.ndarray, candidate: np.ndarray, window: int = 8) -> float:
+    """
+    Mean structural similarity of two luminance arrays over non-overlapping windows
+    """
+    height = (reference.shape[0] // window) * window
+    width = (reference.shape[1] // window) * window
+    if height == 0 or width == 0:
+        return 1.0
+
+    def blocks(array):
+        return array[:height, :width].reshape(height // window, window, width // window, window).swapaxes(1, 2)
+
+    x, y = blocks(reference), blocks(candidate)
+    mu_x, mu_y = x.mean(axis=(2, 3)), y.mean(axis=(2, 3))
+    var_x, var_y = x.var(axis=(2, 3)), y.var(axis=(2, 3))
+    cov = ((x - mu_x[..., None, None]) * (y - mu_y[..., None, None])).mean(axis=(2, 3))
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    score = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(score.mean())
+
+
+@traced_handler
 def lambda_handler(event, context):
     try:
         if event.get("httpMethod") == "OPTIONS":
@@ -47,11 +284,13 @@ def lambda_handler(event, context):
             return {
                 'statusCode': 400,
                 "headers": CORS_HEADERS,
-                'body': json.dumps({'error': f"event is a string: {e}"})
+                'body': json.dumps({'error': f"event is a string: {event}"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
         image_base64 = body.get('image_base64')
+        max_bytes = body.get('max_bytes')
+        profile = body.get('profile', AUTO_PROFILE)
 
         if not image_base64:
             logger.error("Missing 'image_base64' in input event.")
@@ -61,21 +300,58 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': "Input Error: 'image_base64' key not found or is empty in the event payload."})
             }
 
-        compressed_image = compress_base64_image(image_base64)
+        if max_bytes is None:
+            compressed_image = compress_base64_image(image_base64, profile=profile, backend=body.get('backend'))
+            return {
+                'statusCode': 200,
+                "headers": CORS_HEADERS,
+                'body': json.dumps({
+                    'message': 'File converted successfully.',
+                    'compressed_image': compressed_image
+                })
+            }
+
+        try:
+            result = compress_base64_image_to_budget(
+                image_base64,
+                max_bytes=int(max_bytes),
+                min_ssim=float(body.get('min_ssim', DEFAULT_MIN_SSIM)),
+                profile=profile
+            )
+        except image_util.ImageTooLargeError:
+            raise
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                "headers": CORS_HEADERS,
+                'body': json.dumps({'error': f"Input Error: {e}"})
+            }
 
         return {
             'statusCode': 200,
             "headers": CORS_HEADERS,
             'body': json.dumps({
                 'message': 'File converted successfully.',
-                'compressed_image': compressed_image
+                'compressed_image': result["image"],
+                'parameters': result["parameters"]
             })
         }
 
+    except imaging_backend.UnknownBackendError as e:
+        return {
+            'statusCode': 400,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({'error': f"Input Error: {e}"})
+        }
+    except image_util.ImageTooLargeError as e:
+        return {
+            'statusCode': 413,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({'error': f"Image too large: {e}"})
+        }
     except Exception as e:
         return {
             'statusCode': 500,
             "headers": CORS_HEADERS,
             'body': f'Error processing PDF: {str(e)}'
         }
-
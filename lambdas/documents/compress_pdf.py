@@ -1,7 +1,32 @@
+from __future__ import annotations
 import base64
+import importlib.util
 import json
+import logging
+import math
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from pypdf import PdfReader, PdfWriter
+from lazy_util import lazy_import
+from trace_util import span, traced_handler
+from request_util import request_body
+
+# Loaded on first use, so preflights don't import pypdf, Pillow or the imaging helpers
+pypdf = lazy_import("pypdf")
+generic = lazy_import("pypdf.generic")
+Image = lazy_import("PIL.Image")
+image_util = lazy_import("image_util")
+
+# PyMuPDF (fitz) is only used to rewrite the output with object and xref streams.
+# Licensed under GPL v3 (or AGPL v3) - verify your version.
+# See THIRD_PARTY_LICENSES.md for full attribution details.
+fitz = lazy_import("fitz") if importlib.util.find_spec("fitz") is not None else None
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -9,41 +34,392 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+# PDFs smaller than this are returned untouched
+SIZE_THRESHOLD = 500 * 1024
+JPEG_QUALITY = 40
+
+# Images drawn above these resolutions are downsampled. 1-bit images are cheap
+# enough to keep at print resolution
+TARGET_DPI = int(os.environ.get("PDF_TARGET_DPI", 150))
+BILEVEL_TARGET_DPI = 300
+# Leave images alone unless they are meaningfully above the target
+DOWNSAMPLE_SLACK = 1.15
+
+# Image recompression runs on a thread pool; Pillow releases the GIL while coding
+MAX_WORKERS = int(os.environ.get("PDF_COMPRESS_WORKERS", min(4, os.cpu_count() or 1)))
+# Images extracted ahead of the pool, per worker, bounding how many are held at once
+PREFETCH_PER_WORKER = 2
+
+# Images are only recompressed when the estimated saving clears both thresholds
+MIN_ESTIMATED_GAIN_BYTES = 16 * 1024
+MIN_ESTIMATED_GAIN_RATIO = 0.1
+# Rough size of a quality 40 JPEG, in bytes per colour sample
+JPEG_BYTES_PER_SAMPLE = 0.04
+
+IDENTITY_MATRIX = (1, 0, 0, 1, 0, 0)
+
+COLOR_SPACE_COMPONENTS = {
+    "/DeviceGray": 1, "/CalGray": 1,
+    "/DeviceRGB": 3, "/CalRGB": 3, "/Lab": 3,
+    "/DeviceCMYK": 4
+}
+
+
+def decoded_length(data_base64: str) -> int:
+    """
+    A Utility Function that returns the size of base64 data once decoded, without decoding it
+    """
+    padding = len(data_base64) - len(data_base64.rstrip("="))
+    return (len(data_base64) * 3) // 4 - padding
+
+
 # https://pypdf.readthedocs.io/en/latest/user/file-size.html
 def compress_pdf(input_pdf_base64: str) -> str:
-    # Decode base64 to bytes
-    pdf_bytes = base64.b64decode(input_pdf_base64)
-    
-    # Check size threshold (500 KB)
-    if len(pdf_bytes) < 500 * 1024:
-        return input_pdf_base64
-    
-    # Use BytesIO to treat the bytes like a file
-    input_pdf_stream = BytesIO(pdf_bytes)
-    
-    # Create a PdfReader from the stream
-    reader = PdfReader(input_pdf_stream)
-    writer = PdfWriter()
-    
+    compressed_pdf_base64, _ = compress_pdf_with_report(input_pdf_base64)
+    return compressed_pdf_base64
+
+
+def compress_pdf_with_report(input_pdf_base64: str, quality: int = JPEG_QUALITY,
+                             max_workers: int = MAX_WORKERS, target_dpi: int = TARGET_DPI) -> tuple:
+    """
+    Compresses a PDF by deduplicating objects, compressing content streams and
+    recompressing its images on a worker pool. Images are downsampled to target_dpi
+    based on how large they are drawn, and black-and-white images become 1-bit
+
+    Input:
+        input_pdf_base64 = the PDF to compress, in base64
+        quality = the JPEG quality for recompressed images
+        max_workers = the size of the worker pool
+        target_dpi = the resolution images are downsampled to
+
+    Output:
+        returns a tuple of the compressed PDF in base64 and a report with the
+        bytes saved per page and the time spent
+    """
+    start_time = time.perf_counter()
+    input_size = decoded_length(input_pdf_base64)
+
+    # Check size threshold on the base64 length, before decoding anything
+    if input_size < SIZE_THRESHOLD:
+        return input_pdf_base64, {
+            "compressed": False,
+            "input_bytes": input_size,
+            "output_bytes": input_size,
+            "pages": [],
+            "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 1)
+        }
+
+    with span("base64_decode"):
+        pdf_bytes = base64.b64decode(input_pdf_base64)
+    reader = pypdf.PdfReader(BytesIO(pdf_bytes))
+    writer = pypdf.PdfWriter()
+
     for page in reader.pages:
         writer.add_page(page)
-    
+
     writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
 
+    # Largest size, in points, each image is drawn at anywhere in the document
+    placements = {}
     for page in writer.pages:
+        _collect_placements(writer, page, page.get_contents(), IDENTITY_MATRIX, placements)
+
+    page_reports = []
+    jobs = []
+    seen_images = set()
+    for page_number, page in enumerate(writer.pages, start=1):
         page.compress_content_streams()
-        for img in page.images:
-            img.replace(img.image, quality=40)
-    
+        page_report = {"page": page_number, "images": 0, "recompressed": 0, "skipped": 0,
+                       "bytes_before": 0, "bytes_after": 0}
+        page_reports.append(page_report)
+
+        for key in page.images.keys():
+            # Inline images ("~0~") live in the content stream and are left alone
+            if isinstance(key, str) and key.startswith("~"):
+                continue
+            xobject = _image_xobject(page, key)
+            reference = getattr(xobject, "indirect_reference", None)
+            # Images shared between pages are only counted on the first one
+            if reference is None or reference.idnum in seen_images:
+                continue
+            seen_images.add(reference.idnum)
+
+            stored_size = len(xobject._data)
+            page_report["images"] += 1
+            page_report["bytes_before"] += stored_size
+
+            effective_dpi = _effective_dpi(xobject, placements.get(reference.idnum))
+            skip_reason = _skip_reason(xobject, stored_size, _downsample_factor(effective_dpi, target_dpi))
+            if skip_reason:
+                logger.info(f"Page {page_number} image {key}: skipped ({skip_reason})")
+                page_report["skipped"] += 1
+                page_report["bytes_after"] += stored_size
+                continue
+
+            jobs.append({"page": page, "key": key, "xobject": xobject, "effective_dpi": effective_dpi,
+                         "stored_size": stored_size, "report": page_report})
+
+    def finish(job, encoded):
+        page_report = job["report"]
+        if encoded is None or len(encoded["data"]) >= job["stored_size"]:
+            page_report["skipped"] += 1
+            page_report["bytes_after"] += job["stored_size"]
+            return
+
+        # Read before the XObject is rewritten in place
+        downsampled = encoded["width"] < job["xobject"]["/Width"]
+        _replace_image(writer, job["xobject"], encoded)
+        page_report["recompressed"] += 1
+        page_report["bytes_after"] += len(encoded["data"])
+        if encoded["mode"] == "1":
+            page_report["bilevel"] = page_report.get("bilevel", 0) + 1
+        if downsampled:
+            page_report["downsampled"] = page_report.get("downsampled", 0) + 1
+
+    # pypdf isn't thread-safe, so images are pulled out of the document on this thread
+    # and the workers only get the Pillow image
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        for job in jobs:
+            image = _extract_image(job)
+            future = None
+            if image is not None:
+                future = pool.submit(_recompress_image, image, job["key"], job["effective_dpi"], quality, target_dpi)
+            pending.append((job, future))
+            if len(pending) > max_workers * PREFETCH_PER_WORKER:
+                done, future = pending.popleft()
+                finish(done, future.result() if future is not None else None)
+        while pending:
+            done, future = pending.popleft()
+            finish(done, future.result() if future is not None else None)
+
     # Write the output to a BytesIO stream
     output_pdf_stream = BytesIO()
     writer.write(output_pdf_stream)
-    
+
     # Get the bytes and encode back to base64
-    compressed_pdf_bytes = output_pdf_stream.getvalue()
-    return base64.b64encode(compressed_pdf_bytes).decode("utf-8")
+    compressed_pdf_bytes = _pack_object_streams(output_pdf_stream.getvalue())
+
+    for page_report in page_reports:
+        page_report["bytes_saved"] = page_report["bytes_before"] - page_report["bytes_after"]
+
+    report = {
+        "compressed": True,
+        "input_bytes": input_size,
+        "output_bytes": len(compressed_pdf_bytes),
+        "workers": max_workers,
+        "target_dpi": target_dpi,
+        "pages": page_reports,
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 1)
+    }
+    logger.info(f"Compressed PDF from {input_size} to {len(compressed_pdf_bytes)} bytes in {report['elapsed_ms']} ms")
+
+    return base64.b64encode(compressed_pdf_bytes).decode("utf-8"), report
+
+
+def _image_xobject(page, key):
+    """
+    Looks up the image XObject behind a key of page.images without decoding it.
+    Keys are a name, or a tuple of names for images inside form XObjects
+    """
+    names = [key] if isinstance(key, str) else list(key)
+    obj = page
+    for name in names:
+        obj = obj["/Resources"]["/XObject"][name].get_object()
+    return obj
+
+
+def _multiply(first, second) -> tuple:
+    a, b, c, d, e, f = first
+    A, B, C, D, E, F = second
+    return (a * A + b * C, a * B + b * D,
+            c * A + d * C, c * B + d * D,
+            e * A + f * C + E, e * B + f * D + F)
+
+
+def _collect_placements(writer: pypdf.PdfWriter, owner, contents, ctm: tuple, placements: dict, depth: int = 0) -> None:
+    """
+    Walks a content stream tracking the current transformation matrix and records the
+    drawn size, in points, of every image it paints. Form XObjects are followed with
+    their /Matrix applied
+    """
+    if contents is None or depth > 8:
+        return
+    try:
+        resources = owner["/Resources"].get_object()
+        xobjects = resources["/XObject"].get_object() if "/XObject" in resources else {}
+        operations = contents.operations
+    except Exception as e:
+        logger.warning(f"Could not read content stream for image placement: {e}")
+        return
+
+    stack = []
+    for operands, operator in operations:
+        if operator == b"q":
+            stack.append(ctm)
+        elif operator == b"Q":
+            ctm = stack.pop() if stack else ctm
+        elif operator == b"cm":
+            ctm = _multiply(tuple(float(x) for x in operands), ctm)
+        elif operator == b"Do" and operands[0] in xobjects:
+            xobject = xobjects[operands[0]].get_object()
+            subtype = xobject.get("/Subtype")
+            reference = getattr(xobject, "indirect_reference", None)
+            if subtype == "/Image" and reference is not None:
+                # The image's unit square is mapped through the CTM
+                width = math.hypot(ctm[0], ctm[1])
+                height = math.hypot(ctm[2], ctm[3])
+                drawn_width, drawn_height = placements.get(reference.idnum, (0.0, 0.0))
+                placements[reference.idnum] = (max(drawn_width, width), max(drawn_height, height))
+            elif subtype == "/Form":
+                matrix = tuple(float(x) for x in xobject.get("/Matrix", IDENTITY_MATRIX))
+                _collect_placements(writer, xobject, generic.ContentStream(xobject, writer),
+                                    _multiply(matrix, ctm), placements, depth + 1)
+
+
+def _effective_dpi(xobject, placement):
+    """
+    Returns the resolution an image is drawn at, or None if it isn't drawn from a content stream
+    """
+    if not placement or min(placement) <= 0:
+        return None
+    return min(xobject.get("/Width", 0) / (placement[0] / 72), xobject.get("/Height", 0) / (placement[1] / 72))
+
+
+def _downsample_factor(effective_dpi, target_dpi: int) -> float:
+    if effective_dpi is None or effective_dpi <= target_dpi * DOWNSAMPLE_SLACK:
+        return 1.0
+    return target_dpi / effective_dpi
+
+
+def _pack_object_streams(pdf_bytes: bytes) -> bytes:
+    """
+    Rewrites the PDF with object streams and a cross-reference stream, which pypdf
+    can't write. Skipped when PyMuPDF isn't available
+    """
+    if fitz is None:
+        return pdf_bytes
+    try:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            packed = doc.tobytes(garbage=3, deflate=True, use_objstms=1)
+        return packed if len(packed) < len(pdf_bytes) else pdf_bytes
+    except Exception as e:
+        logger.warning(f"Could not write object streams: {e}")
+        return pdf_bytes
+
+
+def _components(color_space) -> int:
+    color_space = color_space.get_object() if color_space is not None else None
+    if isinstance(color_space, list):
+        family = color_space[0]
+        if family == "/ICCBased":
+            return int(color_space[1].get_object().get("/N", 3))
+        if family == "/Indexed":
+            return _components(color_space[1])
+        color_space = family
+    return COLOR_SPACE_COMPONENTS.get(color_space, 3)
+
+
+def _skip_reason(xobject, stored_size: int, downsample_factor: float = 1.0):
+    """
+    Returns why an image isn't worth recompressing, or None if it is
+    """
+    filters = xobject.get("/Filter")
+    filters = [filters] if isinstance(filters, str) else list(filters or [])
+
+    if xobject.get("/ImageMask"):
+        return "stencil mask"
+    if xobject.get("/BitsPerComponent", 8) == 1 or "/CCITTFaxDecode" in filters or "/JBIG2Decode" in filters:
+        return "bilevel image"
+    if isinstance(xobject.get("/Mask"), list):
+        return "colour key mask"
+    decode = xobject.get("/Decode")
+    if decode is not None and list(decode) != [0, 1] * _components(xobject.get("/ColorSpace")):
+        # Only partly applied on decoding, and expressed in the old colour space
+        return "decode array"
+
+    samples = xobject.get("/Width", 0) * xobject.get("/Height", 0) * min(_components(xobject.get("/ColorSpace")), 3)
+    samples *= downsample_factor ** 2
+    estimated_gain = stored_size - samples * JPEG_BYTES_PER_SAMPLE
+    if estimated_gain < MIN_ESTIMATED_GAIN_BYTES or estimated_gain < stored_size * MIN_ESTIMATED_GAIN_RATIO:
+        return f"estimated gain {int(estimated_gain)} bytes"
+    return None
+
+
+def _extract_image(job: dict):
+    """
+    Reads one image out of the document as a Pillow image, or None if pypdf can't.
+    Runs on the main thread; JPEG data is only decoded once a worker uses it
+    """
+    try:
+        return job["page"].images[job["key"]].image
+    except Exception as e:
+        logger.warning(f"Could not read image {job['key']}: {e}")
+        return None
+
+
+def _recompress_image(image, key, effective_dpi, quality: int, target_dpi: int):
+    """
+    Downsamples one image to the target resolution and encodes it as 1-bit Flate
+    when it looks black and white, JPEG otherwise. Runs on the worker pool, so it
+    only touches the Pillow image, never the document
+    """
+    try:
+        # Alpha stays in the image's /SMask, which is kept on replacement
+        image = image.convert("L" if image.mode in ("1", "L", "LA", "I", "I;16") else "RGB")
+        bilevel = image_util.classify_content(image) == image_util.BILEVEL
+
+        factor = _downsample_factor(effective_dpi, BILEVEL_TARGET_DPI if bilevel else target_dpi)
+        if factor < 1.0:
+            size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+        if bilevel:
+            image = image_util.to_bilevel(image)
+            data = zlib.compress(image.tobytes(), 9)
+        else:
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=quality, optimize=True)
+            data = buffer.getvalue()
+        return {"data": data, "width": image.width, "height": image.height, "mode": image.mode}
+    except Exception as e:
+        logger.warning(f"Could not recompress image {key}: {e}")
+        return None
+
+
+def _replace_image(writer: pypdf.PdfWriter, xobject, encoded: dict) -> None:
+    """
+    Rewrites an image XObject in place with already encoded JPEG or 1-bit Flate data,
+    so every page that references it gets the new image
+    """
+    from pypdf.generic import EncodedStreamObject, NameObject, NumberObject, StreamObject
+
+    stream = writer.get_object(xobject.indirect_reference)
+    # An explicit /Mask is a stencil image of its own, so it applies at any size
+    kept = {NameObject(key): stream.raw_get(key) for key in ("/SMask", "/Mask", "/Interpolate", "/Intent")
+            if key in stream}
+
+    bilevel = encoded["mode"] == "1"
+    stream.clear()
+    stream.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(encoded["width"]),
+        NameObject("/Height"): NumberObject(encoded["height"]),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB" if encoded["mode"] == "RGB" else "/DeviceGray"),
+        NameObject("/BitsPerComponent"): NumberObject(1 if bilevel else 8),
+        NameObject("/Filter"): NameObject("/FlateDecode" if bilevel else "/DCTDecode"),
+        **kept
+    })
+    # The data is already encoded for the new /Filter. EncodedStreamObject.set_data
+    # would Flate-encode it again, so the plain StreamObject one stores it as is
+    StreamObject.set_data(stream, encoded["data"])
+    if isinstance(stream, EncodedStreamObject):
+        # Drop the copy decoded from the old data when the image was extracted
+        stream.decoded_self = None
 
 
+@traced_handler
 def lambda_handler(event, context):
     try:
         if event.get("httpMethod") == "OPTIONS":
@@ -57,10 +433,10 @@ def lambda_handler(event, context):
             return {
                 'statusCode': 400,
                 "headers": CORS_HEADERS,
-                'body': json.dumps({'error': f"event is a string: {e}"})
+                'body': json.dumps({'error': f"event is a string: {event}"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
         pdf_base64 = body.get('pdf_base64')
 
         if not pdf_base64:
@@ -71,14 +447,15 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': "Input Error: 'pdf_base64' key not found or is empty in the event payload."})
             }
 
-        compressed_pdf = compress_pdf(pdf_base64)
+        compressed_pdf, report = compress_pdf_with_report(pdf_base64, target_dpi=int(body.get('target_dpi', TARGET_DPI)))
 
         return {
             'statusCode': 200,
             "headers": CORS_HEADERS,
             'body': json.dumps({
                 'message': 'File converted successfully.',
-                'compressed_pdf': compressed_pdf
+                'compressed_pdf': compressed_pdf,
+                'report': report
             })
         }
 
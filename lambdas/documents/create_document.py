@@ -2,6 +2,8 @@ import json
 import uuid
 # Internal module - licensed under the project's license.
 from db_util import execute_statement
+from trace_util import traced_handler
+from request_util import request_body
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -9,6 +11,7 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+@traced_handler
 def lambda_handler(event, context):
     """
     Handles the lambda for adding a document
@@ -35,7 +38,7 @@ def lambda_handler(event, context):
             "body": json.dumps({"message": "CORS preflight success"})
         }
 
-    body = json.loads(event["body"])
+    body = request_body(event)
 
     original_filename = body.get('original_filename')
     bucket = body.get('bucket')
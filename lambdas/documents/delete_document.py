@@ -5,7 +5,10 @@ from db_util import CORS_HEADERS
 # Licensed under the Apache License 2.0.
 # See LICENSE.md for full details
 import boto3
+from trace_util import traced_handler
+from request_util import request_body
 
+@traced_handler
 def lambda_handler(event, context):
     """
     Handles the lambda for deleting specific documents
@@ -28,7 +31,7 @@ def lambda_handler(event, context):
             "body": json.dumps({"message": "CORS preflight success"})
         }
         
-    body = json.loads(event["body"])
+    body = request_body(event)
     
     # Get the array of filenames to delete
     filenames = body.get('filenames')
@@ -0,0 +1,435 @@
+import base64
+import binascii
+import json
+import logging
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from trace_util import traced_handler
+from request_util import request_body
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+    "Access-Control-Allow-Methods": "OPTIONS,POST"
+}
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W14 = "{http://schemas.microsoft.com/office/word/2010/wordml}"
+
+# Fields read straight from the document are exact, like decoded barcodes
+FIELD_CONFIDENCE = 100.0
+# Share of fields that must have a label for the extraction to be trusted
+MIN_LABELED_FRACTION = 0.8
+
+# Textract's words for the state of a selection element
+SELECTED = "SELECTED"
+NOT_SELECTED = "NOT_SELECTED"
+
+# A typed-in "Label: value" paragraph
+LABEL_VALUE = re.compile(r"^([^:]{1,60}:)\s*(\S.*)$")
+
+# Run content that reads as whitespace
+WHITESPACE_TAGS = {W + "tab": " ", W + "br": " ", W + "cr": " ", W + "noBreakHyphen": "-"}
+
+
+class Field:
+    """
+    A form field found in the document, before its label is resolved
+    """
+
+    def __init__(self, value: str, page: int, checkbox: bool = False, label: str = ""):
+        self.value = value
+        self.page = page
+        self.checkbox = checkbox
+        self.label = label
+
+
+class Paragraph:
+    """
+    A paragraph as a sequence of text and Field tokens
+    """
+
+    def __init__(self):
+        self.tokens = []
+
+    @property
+    def fields(self) -> list:
+        return [token for token in self.tokens if isinstance(token, Field)]
+
+    @property
+    def text(self) -> str:
+        return _clean("".join(token for token in self.tokens if isinstance(token, str)))
+
+
+class DocxReader:
+    """
+    Walks the body of a DOCX in document order, collecting its legacy form fields
+    (FORMTEXT, FORMCHECKBOX) and content controls, and giving each a label from the
+    text around it
+    """
+
+    def __init__(self):
+        self.page = 1
+        self.after_page_break = False
+        self.fields = []
+
+    def read_body(self, body: ET.Element) -> None:
+        self._read_blocks(body)
+
+    def _read_blocks(self, parent: ET.Element) -> list:
+        """
+        Reads the paragraphs, tables and block content controls under parent, and
+        returns the paragraphs read directly (not inside tables)
+        """
+        paragraphs = []
+        for child in parent:
+            if child.tag == W + "p":
+                paragraph = self._read_paragraph(child)
+                self._label_inline(paragraph)
+                self._read_label_value(paragraph)
+                paragraphs.append(paragraph)
+            elif child.tag == W + "tbl":
+                self._read_table(child)
+            elif child.tag == W + "sdt":
+                content = child.find(W + "sdtContent")
+                if _is_control(child):
+                    self._add_control(child, Paragraph())
+                elif content is not None:
+                    paragraphs.extend(self._read_blocks(content))
+        return paragraphs
+
+    def _read_paragraph(self, element: ET.Element) -> Paragraph:
+        paragraph = Paragraph()
+        field = None
+        in_result = False
+
+        for node in self._runs(element):
+            if node.tag == W + "sdt":
+                self._add_control(node, paragraph)
+                continue
+
+            for part in node:
+                if part.tag == W + "fldChar":
+                    kind = part.get(W + "fldCharType")
+                    if kind == "begin":
+                        field = self._begin_field(part)
+                        in_result = False
+                    elif kind == "separate":
+                        in_result = True
+                    elif kind == "end" and field is not None:
+                        field.value = _clean(field.value)
+                        paragraph.tokens.append(field)
+                        self.fields.append(field)
+                        field, in_result = None, False
+                elif part.tag == W + "t":
+                    self.after_page_break = False
+                    if field is None:
+                        paragraph.tokens.append(part.text or "")
+                    elif in_result and not field.checkbox:
+                        field.value += part.text or ""
+                elif part.tag in WHITESPACE_TAGS and field is None:
+                    paragraph.tokens.append(WHITESPACE_TAGS[part.tag])
+                    if part.tag == W + "br" and part.get(W + "type") == "page":
+                        self.page += 1
+                        self.after_page_break = True
+                elif part.tag == W + "lastRenderedPageBreak":
+                    # Where Word last broke the page when it laid the document out. Word
+                    # also marks the page that follows a hard page break, already counted
+                    if not self.after_page_break:
+                        self.page += 1
+                    self.after_page_break = False
+        return paragraph
+
+    def _runs(self, element: ET.Element):
+        """
+        Yields the runs and inline content controls of a paragraph in order, looking
+        through hyperlinks, insertions and smart tags but skipping deleted text
+        """
+        for child in element:
+            if child.tag == W + "r" or (child.tag == W + "sdt" and _is_control(child)):
+                yield child
+            elif child.tag == W + "sdt":
+                content = child.find(W + "sdtContent")
+                if content is not None:
+                    yield from self._runs(content)
+            elif child.tag in (W + "hyperlink", W + "ins", W + "smartTag", W + "customXml", W + "fldSimple"):
+                yield from self._runs(child)
+
+    def _begin_field(self, fld_char: ET.Element):
+        form_data = fld_char.find(W + "ffData")
+        if form_data is None:
+            # Not a form field (PAGE, HYPERLINK, ...); its result is ordinary text
+            return None
+        checkbox = form_data.find(W + "checkBox")
+        if checkbox is not None:
+            state = checkbox.find(W + "checked")
+            if state is None:
+                state = checkbox.find(W + "default")
+            checked = state is not None and state.get(W + "val", "1") in ("1", "true", "on")
+            return Field(SELECTED if checked else NOT_SELECTED, self.page, checkbox=True)
+        return Field("", self.page)
+
+    def _add_control(self, sdt: ET.Element, paragraph: Paragraph) -> None:
+        """
+        Adds a content control as a field, labelled by its title or tag
+        """
+        properties = sdt.find(W + "sdtPr")
+        label = ""
+        for name in ("alias", "tag"):
+            node = properties.find(W + name) if properties is not None else None
+            if node is not None and node.get(W + "val"):
+                label = node.get(W + "val")
+                break
+
+        checkbox = properties.find(W14 + "checkbox") if properties is not None else None
+        if checkbox is not None:
+            checked = checkbox.find(W14 + "checked")
+            checked = checked is not None and checked.get(W14 + "val") in ("1", "true")
+            field = Field(SELECTED if checked else NOT_SELECTED, self.page, checkbox=True, label=label)
+        else:
+            placeholder = properties is not None and properties.find(W + "showingPlcHdr") is not None
+            content = sdt.find(W + "sdtContent")
+            text = "" if placeholder or content is None else "".join(t.text or "" for t in content.iter(W + "t"))
+            field = Field(_clean(text), self.page, label=label)
+
+        paragraph.tokens.append(field)
+        self.fields.append(field)
+
+    def _label_inline(self, paragraph: Paragraph) -> None:
+        """
+        Labels fields from the text beside them in the same paragraph: checkboxes by
+        the text after them, other fields by the text before them ("Label: [field]")
+        """
+        tokens = paragraph.tokens
+        for index, token in enumerate(tokens):
+            if not isinstance(token, Field) or token.label:
+                continue
+            before = _text_between(tokens, index, -1)
+            after = _text_between(tokens, index, 1)
+            token.label = (after or before) if token.checkbox else before
+
+    def _read_label_value(self, paragraph: Paragraph) -> None:
+        """
+        Reads a plain "Label: value" paragraph, as left by filling a form in by typing
+        """
+        if paragraph.fields:
+            return
+        match = LABEL_VALUE.match(paragraph.text)
+        if match and not match.group(2).startswith("//"):
+            self.fields.append(Field(match.group(2), self.page, label=match.group(1)))
+
+    def _read_table(self, table: ET.Element) -> None:
+        rows = []
+        for row in table.iter(W + "tr"):
+            if _parent_table(row, table) is not table:
+                continue
+            cells = []
+            column = 0
+            for cell in row.findall(W + "tc"):
+                span_node = cell.find(f"{W}tcPr/{W}gridSpan")
+                span = int(span_node.get(W + "val", 1)) if span_node is not None else 1
+                paragraphs = self._read_blocks(cell)
+                fields = [f for p in paragraphs for f in p.fields]
+                cells.append({
+                    "column": column,
+                    "span": span,
+                    "page": self.page,
+                    "text": _clean(" ".join(p.text for p in paragraphs)),
+                    "has_fields": bool(fields),
+                    "fields": [f for f in fields if not f.label]
+                })
+                column += span
+            rows.append(cells)
+        self._label_table(rows)
+
+    def _label_table(self, rows: list) -> None:
+        """
+        Labels the fields left unlabelled in table cells. Forms put the label below the
+        value (a row of fields over a row of captions), to its left, or above it. Cells of
+        plain text after a "Label:" cell are read as values too
+        """
+        for index, cells in enumerate(rows):
+            below = rows[index + 1] if index + 1 < len(rows) and _is_caption_row(rows[index + 1]) else None
+            above = rows[index - 1] if index > 0 and _is_caption_row(rows[index - 1]) else None
+            for position, cell in enumerate(cells):
+                left = cells[position - 1] if position > 0 else None
+                left_label = left["text"] if left is not None and not left["has_fields"] else ""
+                if not cell["has_fields"]:
+                    if left_label.endswith(":") and cell["text"] and not cell["text"].endswith(":"):
+                        self.fields.append(Field(cell["text"], cell["page"], label=left_label))
+                    continue
+                label = (
+                    _caption_at(below, cell["column"])
+                    or left_label
+                    or _caption_at(above, cell["column"])
+                )
+                for field in cell["fields"]:
+                    field.label = label
+
+
+def _clean(text: str) -> str:
+    # Legacy text fields show their empty state as en spaces
+    return " ".join(text.replace("\u2002", " ").split())
+
+
+def _text_between(tokens: list, index: int, step: int) -> str:
+    """
+    Returns the text next to tokens[index] in the given direction, up to the next field
+    """
+    parts = []
+    position = index + step
+    while 0 <= position < len(tokens) and not isinstance(tokens[position], Field):
+        parts.append(tokens[position])
+        position += step
+    if step < 0:
+        parts.reverse()
+    return _clean("".join(parts))
+
+
+def _is_control(sdt: ET.Element) -> bool:
+    """
+    Whether a content control holds a value (plain text, date, drop-down or checkbox)
+    rather than grouping other content
+    """
+    properties = sdt.find(W + "sdtPr")
+    if properties is None:
+        return False
+    kinds = (W + "text", W + "date", W + "dropDownList", W + "comboBox", W14 + "checkbox")
+    return any(properties.find(kind) is not None for kind in kinds)
+
+
+def _parent_table(row: ET.Element, table: ET.Element):
+    """
+    Finds the table a row belongs to, so rows of nested tables aren't read twice
+    """
+    for candidate in table.iter(W + "tbl"):
+        if any(child is row for child in candidate.findall(W + "tr")):
+            return candidate
+    return None
+
+
+def _is_caption_row(cells: list) -> bool:
+    return any(cell["text"] for cell in cells) and not any(cell["has_fields"] for cell in cells)
+
+
+def _caption_at(cells, column: int) -> str:
+    if cells is None:
+        return ""
+    for cell in cells:
+        if cell["column"] <= column < cell["column"] + cell["span"]:
+            return cell["text"]
+    return ""
+
+
+def extract_docx_fields(docx_bytes: bytes) -> dict:
+    """
+    A Utility Function that reads the form fields of a DOCX directly from its XML
+
+    Input:
+        docx_bytes = the DOCX file
+
+    Output:
+        returns a dict with "fields", the records in the same Key/Value/Confidence/
+        PageNumber shape as the OCR output, "confident", whether the extraction can be
+        used instead of OCR, and "reason" when it can't
+    """
+    try:
+        with zipfile.ZipFile(BytesIO(docx_bytes)) as archive:
+            body = ET.fromstring(archive.read("word/document.xml")).find(W + "body")
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        return {"fields": [], "confident": False, "reason": f"Not a readable DOCX: {e}"}
+
+    reader = DocxReader()
+    if body is not None:
+        reader.read_body(body)
+
+    if not reader.fields:
+        return {"fields": [], "confident": False, "reason": "No form fields or content controls found"}
+
+    records = []
+    key_counts = {}
+    for field in reader.fields:
+        key = field.label or "Field"
+        key_counts[key] = key_counts.get(key, 0) + 1
+        if key_counts[key] > 1:
+            key = f"{key}_{key_counts[key]}"
+        records.append({
+            "Key": key,
+            "Value": field.value,
+            "Confidence": FIELD_CONFIDENCE,
+            "PageNumber": field.page
+        })
+
+    labeled = sum(1 for field in reader.fields if field.label) / len(reader.fields)
+    result = {"fields": records, "confident": labeled >= MIN_LABELED_FRACTION}
+    if not result["confident"]:
+        result["reason"] = f"Only {labeled:.0%} of fields have a label"
+    return result
+
+
+@traced_handler
+def lambda_handler(event, context):
+    """
+    Handles the lambda for reading the form fields of a DOCX without converting it
+
+    Input:
+        event:
+            base64_docx = the file to read, in base64
+        context:
+            Not used
+
+    Output:
+        returns the fields in the OCR output shape and whether they can be used. When
+        "confident" is false the client should use the conversion and OCR pipeline
+    """
+    try:
+        if event.get("httpMethod") == "OPTIONS":
+            return {
+                "statusCode": 200,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "CORS preflight success"})
+            }
+
+        body = request_body(event)
+        base64_docx_string = body.get('base64_docx')
+
+        if not base64_docx_string:
+            return {
+                'statusCode': 400,
+                "headers": CORS_HEADERS,
+                'body': json.dumps({'error': "Input Error: 'base64_docx' key not found or is empty in the event payload."})
+            }
+
+        try:
+            docx_bytes = base64.b64decode(base64_docx_string)
+        except binascii.Error:
+            return {
+                'statusCode': 400,
+                "headers": CORS_HEADERS,
+                'body': json.dumps({'error': 'Input Error: Invalid Base64 encoding for DOCX file.'})
+            }
+
+        result = extract_docx_fields(docx_bytes)
+        logger.info(f"Read {len(result['fields'])} DOCX fields, confident: {result['confident']}")
+
+        return {
+            'statusCode': 200,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({
+                'message': 'File read successfully.',
+                **result
+            })
+        }
+
+    except Exception as e:
+        logger.exception(f"An unexpected error occurred: {e}")
+        return {
+            'statusCode': 500,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({'error': f'An unexpected internal server error occurred: {e}'})
+        }
@@ -1,27 +1,13 @@
 import base64
+import hashlib
 import json
 import logging
 import os
-import uuid
-import time
-
-try:
-    # Adobe PDF Services SDK is used for converting DOCX to PDF.
-    # This library is licensed under Adobe’s license terms.
-    # Please refer to LICENSE.md for full attribution and license details.
-    from adobe.pdfservices.operation.auth.service_principal_credentials import ServicePrincipalCredentials
-    from adobe.pdfservices.operation.exception.exceptions import ServiceApiException, ServiceUsageException, SdkException
-    from adobe.pdfservices.operation.io.cloud_asset import CloudAsset
-    from adobe.pdfservices.operation.io.stream_asset import StreamAsset
-    from adobe.pdfservices.operation.pdf_services import PDFServices
-    from adobe.pdfservices.operation.pdf_services_media_type import PDFServicesMediaType
-    from adobe.pdfservices.operation.pdfjobs.jobs.create_pdf_job import CreatePDFJob
-    from adobe.pdfservices.operation.pdfjobs.result.create_pdf_result import CreatePDFResult
-except ImportError as e:
-    logging.error(f"Adobe PDF Services SDK not found. Please include it in your deployment package or layer. {e}")
-    # Define dummy classes or raise an error if you want to prevent execution without the SDK
-    raise Exception("Adobe PDF Services SDK not found.")
-
+from collections import OrderedDict
+from types import SimpleNamespace
+from trace_util import span, traced_handler
+from request_util import request_body
+from docx_extract import extract_docx_fields
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -32,6 +18,164 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+# Converted PDFs kept in memory for the container's lifetime, keyed by the DOCX's SHA-256
+CACHE_MAX_BYTES = int(os.environ.get("DOCX_CACHE_MB", 64)) * 1024 * 1024
+
+# The authenticated PDF Services session, reused while the container stays warm
+_pdf_services = None
+# The Adobe SDK's classes, imported on the first conversion so preflights and cache
+# hits don't load it
+_sdk = None
+_conversion_cache = OrderedDict()
+_conversion_cache_bytes = 0
+
+
+def load_sdk():
+    """
+    A Utility Function that imports the Adobe PDF Services SDK on first use
+
+    Output:
+        returns a namespace of the SDK classes the conversion uses
+        Raises RuntimeError if the SDK isn't in the deployment package or layer
+    """
+    global _sdk
+    if _sdk is None:
+        try:
+            # Adobe PDF Services SDK is used for converting DOCX to PDF.
+            # This library is licensed under Adobe’s license terms.
+            # Please refer to LICENSE.md for full attribution and license details.
+            from adobe.pdfservices.operation.auth.service_principal_credentials import ServicePrincipalCredentials
+            from adobe.pdfservices.operation.exception.exceptions import ServiceApiException, ServiceUsageException, SdkException
+            from adobe.pdfservices.operation.pdf_services import PDFServices
+            from adobe.pdfservices.operation.pdf_services_media_type import PDFServicesMediaType
+            from adobe.pdfservices.operation.pdfjobs.jobs.create_pdf_job import CreatePDFJob
+            from adobe.pdfservices.operation.pdfjobs.result.create_pdf_result import CreatePDFResult
+        except ImportError as e:
+            logger.error(f"Adobe PDF Services SDK not found. Please include it in your deployment package or layer. {e}")
+            raise RuntimeError("Adobe PDF Services SDK not found.") from e
+        _sdk = SimpleNamespace(
+            ServicePrincipalCredentials=ServicePrincipalCredentials,
+            PDFServices=PDFServices,
+            PDFServicesMediaType=PDFServicesMediaType,
+            CreatePDFJob=CreatePDFJob,
+            CreatePDFResult=CreatePDFResult,
+            ServiceApiException=ServiceApiException,
+            errors=(ServiceApiException, ServiceUsageException, SdkException)
+        )
+    return _sdk
+
+
+def sdk_errors() -> tuple:
+    """
+    A Utility Function that returns the SDK's exception types once it has been
+    imported, and an empty tuple (which matches nothing) before
+    """
+    return _sdk.errors if _sdk is not None else ()
+
+
+def get_pdf_services(client_id: str, client_secret: str):
+    """
+    A Utility Function that returns the PDF Services session, authenticating only
+    on the container's first call
+
+    Input:
+        client_id = the Adobe service principal's client id
+        client_secret = the Adobe service principal's client secret
+
+    Output:
+        returns the cached PDFServices instance
+    """
+    global _pdf_services
+    if _pdf_services is None:
+        sdk = load_sdk()
+        logger.info("Initializing Adobe PDF Services SDK...")
+        credentials = sdk.ServicePrincipalCredentials(
+            client_id=client_id,
+            client_secret=client_secret
+        )
+        _pdf_services = sdk.PDFServices(credentials=credentials)
+    return _pdf_services
+
+
+def reset_pdf_services() -> None:
+    """
+    A Utility Function that drops the cached session so the next call authenticates again
+    """
+    global _pdf_services
+    _pdf_services = None
+
+
+def convert_docx(pdf_services, docx_bytes: bytes) -> bytes:
+    """
+    A Utility Function that converts a DOCX to PDF without touching the disk
+
+    Input:
+        pdf_services = the PDFServices session
+        docx_bytes = the DOCX file
+
+    Output:
+        returns the PDF file
+    """
+    sdk = load_sdk()
+    input_asset = pdf_services.upload(input_stream=docx_bytes, mime_type=sdk.PDFServicesMediaType.DOCX)
+
+    create_pdf_job = sdk.CreatePDFJob(input_asset)
+
+    logger.info("Executing PDF creation operation...")
+    location = pdf_services.submit(create_pdf_job)
+    pdf_services_response = pdf_services.get_job_result(location, sdk.CreatePDFResult)
+    logger.info("PDF creation successful.")
+
+    result_asset = pdf_services_response.get_result().get_asset()
+    stream_asset = pdf_services.get_content(result_asset)
+    return stream_asset.get_input_stream()
+
+
+def cache_get(key: str):
+    """
+    A Utility Function that returns a cached PDF and marks it most recently used, or None
+    """
+    pdf_bytes = _conversion_cache.get(key)
+    if pdf_bytes is not None:
+        _conversion_cache.move_to_end(key)
+    return pdf_bytes
+
+
+def cache_put(key: str, pdf_bytes: bytes) -> None:
+    """
+    A Utility Function that caches a PDF, evicting the least recently used ones to
+    stay within CACHE_MAX_BYTES
+    """
+    global _conversion_cache_bytes
+    if len(pdf_bytes) > CACHE_MAX_BYTES or key in _conversion_cache:
+        return
+    _conversion_cache[key] = pdf_bytes
+    _conversion_cache_bytes += len(pdf_bytes)
+    while _conversion_cache_bytes > CACHE_MAX_BYTES:
+        _, evicted = _conversion_cache.popitem(last=False)
+        _conversion_cache_bytes -= len(evicted)
+
+
+def read_fields(docx_bytes: bytes) -> dict:
+    """
+    A Utility Function that reads the DOCX's form fields alongside the conversion, so
+    the client can skip OCR when they can be trusted
+
+    Input:
+        docx_bytes = the DOCX file
+
+    Output:
+        returns the result of extract_docx_fields. A failure to read them only means
+        the pages are OCR'd, so it is logged and reported as not confident
+    """
+    try:
+        return extract_docx_fields(docx_bytes)
+    except Exception as e:
+        logger.warning(f"Could not read the DOCX fields: {e}")
+        return {"fields": [], "confident": False, "reason": f"Could not read the DOCX fields: {e}"}
+
+
+@traced_handler
 def lambda_handler(event, context):
     """
     Handles the lambda for getting converting the provided base64 DOCX file to a base64 PDF file
@@ -43,13 +187,10 @@ def lambda_handler(event, context):
             Not used
 
     Output: 
-        returns the response from executing the statement with a json message
+        returns the response from executing the statement with a json message, and
+        the DOCX's form fields as docx_fields (see docx_extract)
     """
 
-    input_docx_path = None
-    output_pdf_path = None
-    start_time = time.time()
-
     try:
         if event.get("httpMethod") == "OPTIONS":
             return {
@@ -75,10 +216,10 @@ def lambda_handler(event, context):
             return {
                 'statusCode': 400,
                 "headers": CORS_HEADERS,
-                'body': json.dumps({'error': f"event is a string: {e}"})
+                'body': json.dumps({'error': f"event is a string: {event}"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
         base64_docx_string = body.get('base64_docx')
 
         if not base64_docx_string:
@@ -90,7 +231,8 @@ def lambda_handler(event, context):
             }
 
         try:
-            docx_bytes = base64.b64decode(base64_docx_string)
+            with span("base64_decode"):
+                docx_bytes = base64.b64decode(base64_docx_string)
         except base64.binascii.Error as e:
              logger.error(f"Invalid Base64 input string: {e}")
              return {
@@ -99,78 +241,56 @@ def lambda_handler(event, context):
                  'body': json.dumps({'error': 'Input Error: Invalid Base64 encoding for DOCX file.'})
              }
 
-        unique_id = uuid.uuid4()
-        input_docx_path = f"/tmp/{unique_id}_input.docx"
-        output_pdf_path = f"/tmp/{unique_id}_output.pdf"
-
-        logger.info(f"Writing decoded DOCX to temporary file: {input_docx_path}")
-        with open(input_docx_path, "wb") as f:
-            f.write(docx_bytes)
-        logger.info(f"Input DOCX file size: {os.path.getsize(input_docx_path)} bytes")
-
-        logger.info("Initializing Adobe PDF Services SDK...")
-        credentials = ServicePrincipalCredentials(
-            client_id=client_id,
-            client_secret=client_secret
-        )
-
-        pdf_services = PDFServices(credentials=credentials)
+        cache_key = hashlib.sha256(docx_bytes).hexdigest()
+        pdf_bytes = cache_get(cache_key)
+        cached = pdf_bytes is not None
 
-        # maybe streamline later
-        file = open(input_docx_path, 'rb')
-        input_stream = file.read()
-        file.close()
+        if cached:
+            logger.info(f"Conversion cache hit for {cache_key}")
+        else:
+            logger.info(f"Input DOCX file size: {len(docx_bytes)} bytes")
+            with span("convert", docx_bytes=len(docx_bytes)) as convert:
+                try:
+                    pdf_bytes = convert_docx(get_pdf_services(client_id, client_secret), docx_bytes)
+                except sdk_errors() as e:
+                    if not isinstance(e, _sdk.ServiceApiException) or e.get_status_code() != 401:
+                        raise
+                    # The cached session's token was rejected; authenticate again once
+                    logger.warning("PDF Services session expired, re-authenticating")
+                    reset_pdf_services()
+                    convert.set(reauthenticated=True)
+                    pdf_bytes = convert_docx(get_pdf_services(client_id, client_secret), docx_bytes)
+                convert.set(pdf_bytes=len(pdf_bytes))
+            cache_put(cache_key, pdf_bytes)
+            logger.info(f"Output PDF file size: {len(pdf_bytes)} bytes")
 
-        input_asset = pdf_services.upload(input_stream=input_stream, mime_type=PDFServicesMediaType.DOCX)
+        with span("extract_fields"):
+            docx_fields = read_fields(docx_bytes)
+        logger.info(f"Read {len(docx_fields['fields'])} DOCX fields, confident: {docx_fields['confident']}")
 
-        create_pdf_job = CreatePDFJob(input_asset)
-
-        logger.info("Executing PDF creation operation...")
-        location = pdf_services.submit(create_pdf_job)
-        pdf_services_response = pdf_services.get_job_result(location, CreatePDFResult)
-        logger.info("PDF creation successful.")
-
-        result_asset: CloudAsset = pdf_services_response.get_result().get_asset()
-        stream_asset: StreamAsset = pdf_services.get_content(result_asset)
-
-        with open(output_pdf_path, "wb") as file:
-            file.write(stream_asset.get_input_stream())
-        logger.info(f"Output PDF saved temporarily to: {output_pdf_path}")
-        logger.info(f"Output PDF file size: {os.path.getsize(output_pdf_path)} bytes")
-
-        logger.info("Reading generated PDF and encoding to Base64...")
-        with open(output_pdf_path, "rb") as pdf_file:
-            pdf_bytes = pdf_file.read()
-
-        base64_pdf_string = base64.b64encode(pdf_bytes).decode('utf-8')
+        with span("serialize"):
+            base64_pdf_string = base64.b64encode(pdf_bytes).decode('utf-8')
+            response_body = json.dumps({
+                'message': 'File converted successfully.',
+                'base64_pdf': base64_pdf_string,
+                'cached': cached,
+                'docx_fields': docx_fields
+            })
         logger.info("PDF encoded successfully.")
 
-        end_time = time.time()
-        logger.info(f"Total execution time: {end_time - start_time:.2f} seconds")
-
         return {
             'statusCode': 200,
             "headers": CORS_HEADERS,
-            'body': json.dumps({
-                'message': 'File converted successfully.',
-                'base64_pdf': base64_pdf_string
-            }),
+            'body': response_body,
         }
 
-    except (ServiceApiException, ServiceUsageException, SdkException) as e:
+    except sdk_errors() as e:
         logger.exception(f"Adobe SDK Error: {e}")
         return {
             'statusCode': 500,
             "headers": CORS_HEADERS,
             'body': json.dumps({'error': f'Adobe PDF Services API error: {e}'})
         }
-    except FileNotFoundError as e:
-         logger.exception(f"File system error (likely /tmp access): {e}")
-         return {
-             'statusCode': 500,
-             "headers": CORS_HEADERS,
-             'body': json.dumps({'error': f'Internal server error: File system issue ({e})'})
-         }
     except Exception as e:
         logger.exception(f"An unexpected error occurred: {e}")
         return {
@@ -178,18 +298,3 @@ def lambda_handler(event, context):
             "headers": CORS_HEADERS,
             'body': json.dumps({'error': f'An unexpected internal server error occurred: {e}'})
         }
-
-    finally:
-        logger.info("Cleaning up temporary files...")
-        if input_docx_path and os.path.exists(input_docx_path):
-            try:
-                os.remove(input_docx_path)
-                logger.info(f"Removed temporary input file: {input_docx_path}")
-            except OSError as e:
-                 logger.error(f"Error removing temporary input file {input_docx_path}: {e}")
-        if output_pdf_path and os.path.exists(output_pdf_path):
-            try:
-                os.remove(output_pdf_path)
-                logger.info(f"Removed temporary output file: {output_pdf_path}")
-            except OSError as e:
-                logger.error(f"Error removing temporary output file {output_pdf_path}: {e}")
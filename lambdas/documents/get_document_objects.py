@@ -5,6 +5,7 @@ import base64
 # See LICENSE.md for full details
 import boto3
 from botocore.exceptions import ClientError
+from trace_util import traced_handler
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -15,6 +16,7 @@ S3_METADATA_FOLDER = "metadata/"
 
 s3 = boto3.client('s3')
 
+@traced_handler
 def lambda_handler(event, context):
     try:
         if event.get("httpMethod") == "OPTIONS":
@@ -1,7 +1,16 @@
 import base64
 import json
-from io import BytesIO
-from PIL import Image
+import logging
+from lazy_util import lazy_import
+from trace_util import span, traced_handler
+from request_util import request_body
+
+# Loaded on first use, so preflights don't import the imaging engines
+image_util = lazy_import("image_util")
+imaging_backend = lazy_import("imaging_backend")
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -10,43 +19,50 @@ CORS_HEADERS = {
 }
 
 
-def resize_image_to_letter_width(base64_image: str, dpi: int = 200) -> str:
-    image_data = base64.b64decode(base64_image)
-    image = Image.open(BytesIO(image_data))
+def resize_image_to_letter_width(base64_image: str, dpi: int = 200, profile: str = "auto", backend: str = None) -> str:
+    with span("base64_decode"):
+        image_data = base64.b64decode(base64_image)
+    engine = imaging_backend.get_backend(backend)
 
     # Target width in pixels for US Letter width (8.5 inches at 200 DPI)
     letter_width_px = int(8.5 * dpi)
 
-    # Calculate new height to maintain aspect ratio
-    width_percent = letter_width_px / float(image.width)
-    new_height = int((float(image.height) * float(width_percent)))
+    # JPEGs are decoded at a reduced DCT scale, oversized PNGs strip by strip, and turned upright before resizing
+    with span("image_decode", engine=engine.name):
+        image, source_format, _ = engine.decode(image_data, letter_width_px)
+    source_format = source_format or "JPEG"
 
-    resized_image = image.resize((letter_width_px, new_height), Image.LANCZOS)
+    resized_image = engine.resize_to_width(image, letter_width_px)
 
-    buffer = BytesIO()
-    resized_image.save(buffer, format=image.format)
-    buffer.seek(0)
+    # Black-and-white and grayscale pages are stored without colour
+    if profile == "auto":
+        content_class = engine.classify(resized_image)
+        encoded_bytes, _ = engine.encode_for_content(resized_image, content_class, source_format)
+        return base64.b64encode(encoded_bytes).decode('utf-8')
 
-    return base64.b64encode(buffer.read()).decode('utf-8')
+    encoded_bytes = engine.encode(resized_image, source_format if source_format in ("PNG", "TIFF") else "JPEG")
+    return base64.b64encode(encoded_bytes).decode('utf-8')
 
 
+@traced_handler
 def lambda_handler(event, context):
     try:
-        if event.get("httpMethod") == "OPTIONS":
+        # Checked first, as a string has no .get for the preflight check below
+        if isinstance(event, str):
             return {
-                "statusCode": 200,
+                'statusCode': 400,
                 "headers": CORS_HEADERS,
-                "body": json.dumps({"message": "CORS preflight success"})
+                'body': json.dumps({'error': f"event is a string: {event}"})
             }
 
-        if isinstance(event, str):
+        if event.get("httpMethod") == "OPTIONS":
             return {
-                'statusCode': 400,
+                "statusCode": 200,
                 "headers": CORS_HEADERS,
-                'body': json.dumps({'error': f"event is a string: {e}"})
+                "body": json.dumps({"message": "CORS preflight success"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
         image_base64 = body.get('image_base64')
 
         if not image_base64:
@@ -57,7 +73,8 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': "Input Error: 'image_base64' key not found or is empty in the event payload."})
             }
 
-        resized_image = resize_image_to_letter_width(image_base64)
+        resized_image = resize_image_to_letter_width(image_base64, profile=body.get('profile', "auto"),
+                                                     backend=body.get('backend'))
 
         return {
             'statusCode': 200,
@@ -68,6 +85,18 @@ def lambda_handler(event, context):
             })
         }
 
+    except imaging_backend.UnknownBackendError as e:
+        return {
+            'statusCode': 400,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({'error': f"Input Error: {e}"})
+        }
+    except image_util.ImageTooLargeError as e:
+        return {
+            'statusCode': 413,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({'error': f"Image too large: {e}"})
+        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -1,10 +1,21 @@
 import base64
 import json
 import io
+import logging
+import zlib
+from lazy_util import lazy_import
+from trace_util import span, traced_handler
+from request_util import request_body
+
+# Loaded on first use, so preflights don't import Pillow or the imaging engines
 # Pillow (PIL) is used for image processing.
 # Licensed under the Pillow License (HPND).
 # See LICENSE.md for full attribution details.
-from PIL import Image
+Image = lazy_import("PIL.Image")
+imaging_backend = lazy_import("imaging_backend")
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -12,6 +23,117 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+# Pages are sized at 72 DPI, one point per pixel, as Pillow's PDF writer did
+RESOLUTION = 72.0
+
+EXIF_ORIENTATION = 0x0112
+# EXIF orientations a page /Rotate can express, mapped to the clockwise rotation
+ORIENTATION_ROTATION = {1: 0, 3: 180, 6: 90, 8: 270}
+
+JPEG_COLOR_SPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}
+
+
+class StreamingPdfWriter:
+    """
+    Writes a PDF of full-page images one page at a time. Each page's objects are
+    written to the output as soon as the page is added, so only the current image
+    is ever held in memory. JPEG data is embedded as-is with /DCTDecode
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, output):
+        self.output = output
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3
+        self.output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _allocate(self) -> int:
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id: int, dictionary: str, stream: bytes = None) -> None:
+        self.offsets[obj_id] = self.output.tell()
+        if stream is None:
+            self.output.write(f"{obj_id} 0 obj\n{dictionary}\nendobj\n".encode("latin-1"))
+            return
+        header = dictionary[:-2] + f" /Length {len(stream)} >>"
+        self.output.write(f"{obj_id} 0 obj\n{header}\nstream\n".encode("latin-1"))
+        self.output.write(stream)
+        self.output.write(b"\nendstream\nendobj\n")
+
+    def add_image_page(self, image_dictionary: str, image_data: bytes, width: int, height: int,
+                       rotate: int = 0) -> None:
+        """
+        Adds a page showing one image. image_dictionary holds the image XObject's
+        entries other than /Length, e.g. its filter and colour space
+        """
+        image_id, content_id, page_id = self._allocate(), self._allocate(), self._allocate()
+        page_width = width * 72.0 / RESOLUTION
+        page_height = height * 72.0 / RESOLUTION
+
+        self._write_object(image_id, f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                                     f"{image_dictionary} >>", image_data)
+        self._write_object(content_id, "<< >>",
+                           f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q".encode("latin-1"))
+        self._write_object(page_id, f"<< /Type /Page /Parent {self.PAGES_ID} 0 R "
+                                    f"/MediaBox [0 0 {page_width:.2f} {page_height:.2f}] /Rotate {rotate} "
+                                    f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                                    f"/Contents {content_id} 0 R >>")
+        self.page_ids.append(page_id)
+
+    def close(self) -> None:
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._write_object(self.PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>")
+        self._write_object(self.CATALOG_ID, f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>")
+
+        xref_offset = self.output.tell()
+        self.output.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode("latin-1"))
+        for obj_id in range(1, self.next_id):
+            self.output.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode("latin-1"))
+        self.output.write(f"trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R >>\n"
+                          f"startxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
+
+
+def add_image(writer: StreamingPdfWriter, image_data: bytes, backend: str = None) -> bool:
+    """
+    A Utility Function that adds one image to the PDF as a page. JPEGs that a PDF
+    reader can display directly are embedded byte-for-byte; anything else is decoded
+    and stored losslessly with /FlateDecode
+
+    Input:
+        writer = the StreamingPdfWriter to add the page to
+        image_data = the encoded image
+        backend = the imaging engine used to decode images that are transcoded
+
+    Output:
+        returns True if the image was embedded without decoding, False if it was transcoded
+    """
+    # Opening only reads the header; nothing is decoded unless the image is transcoded
+    image = Image.open(io.BytesIO(image_data))
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1) if image.format == "JPEG" else 1
+
+    if image.format == "JPEG" and image.mode in JPEG_COLOR_SPACES and orientation in ORIENTATION_ROTATION:
+        dictionary = f"/ColorSpace {JPEG_COLOR_SPACES[image.mode]} /BitsPerComponent 8 /Filter /DCTDecode"
+        if image.mode == "CMYK" and "adobe" in image.info:
+            # Adobe CMYK JPEGs are stored inverted
+            dictionary += " /Decode [1 0 1 0 1 0 1 0]"
+        writer.add_image_page(dictionary, image_data, image.width, image.height, ORIENTATION_ROTATION[orientation])
+        return True
+
+    # The engine decodes upright and the samples come back flattened onto white
+    engine = imaging_backend.get_backend(backend)
+    samples, width, height, bands, bits = engine.samples(engine.decode(image_data)[0])
+    color_space = "/DeviceRGB" if bands == 3 else "/DeviceGray"
+    dictionary = f"/ColorSpace {color_space} /BitsPerComponent {bits} /Filter /FlateDecode"
+    writer.add_image_page(dictionary, zlib.compress(samples, 6), width, height)
+    return False
+
+
+@traced_handler
 def lambda_handler(event, context):
     try:
         if event.get("httpMethod") == "OPTIONS":
@@ -25,10 +147,10 @@ def lambda_handler(event, context):
             return {
                 'statusCode': 400,
                 "headers": CORS_HEADERS,
-                'body': json.dumps({'error': f"event is a string: {e}"})
+                'body': json.dumps({'error': f"event is a string: {event}"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
         # Assume input format: { "images": ["base64string1", "base64string2", ...] }
         base64_images = body.get("images", [])
 
@@ -39,23 +161,23 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': "Input Error: 'base64_images' key not found or is empty in the event payload."})
             }
 
-        # Convert base64 strings to PIL images
-        pil_images = []
-        for b64_img in base64_images:
-            image_data = base64.b64decode(b64_img)
-            image = Image.open(io.BytesIO(image_data)).convert("RGB")
-            pil_images.append(image)
-
-        # Create PDF in memory
+        # Create PDF in memory, one page at a time
         pdf_bytes_io = io.BytesIO()
-        pil_images[0].save(
-            pdf_bytes_io,
-            format="PDF",
-            save_all=True,
-            append_images=pil_images[1:]
-        )
+        writer = StreamingPdfWriter(pdf_bytes_io)
+        passed_through = 0
+        for page_number, b64_img in enumerate(base64_images, start=1):
+            with span("base64_decode", page=page_number):
+                image_data = base64.b64decode(b64_img)
+            with span("add_page", page=page_number) as add_page:
+                embedded = add_image(writer, image_data, body.get("backend"))
+                add_page.set(embedded=embedded)
+            if embedded:
+                passed_through += 1
+        writer.close()
         pdf_bytes = pdf_bytes_io.getvalue()
 
+        logger.info(f"Built {len(base64_images)} page PDF, {passed_through} JPEG pages embedded without transcoding")
+
         # Encode PDF to base64
         encoded_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
 
@@ -68,6 +190,12 @@ def lambda_handler(event, context):
             })
         }
 
+    except imaging_backend.UnknownBackendError as e:
+        return {
+            'statusCode': 400,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({'error': f"Input Error: {e}"})
+        }
     except Exception as e:
         return {
             "statusCode": 500,
@@ -1,14 +1,21 @@
+from __future__ import annotations
 import base64
 import json
+import logging
+import re
+from lazy_util import lazy_import
+from trace_util import span, traced_handler
+from request_util import request_body
+
+# Loaded on first use, so preflights don't import PyMuPDF or the imaging engines
 # PyMuPDF (fitz) is used for PDF processing.
 # Licensed under GPL v3 (or AGPL v3) - verify your version.
 # See THIRD_PARTY_LICENSES.md for full attribution details.
-import fitz  
-from io import BytesIO
-# Pillow (PIL) is used for image processing.
-# Licensed under the Pillow License (HPND).
-# See LICENSE.md for full attribution details.
-from PIL import Image
+fitz = lazy_import("fitz")
+imaging_backend = lazy_import("imaging_backend")
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -16,6 +23,195 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+# Fields read from the PDF itself are exact, like decoded barcodes
+FIELD_CONFIDENCE = 100.0
+# Pages with less text than this, or mostly covered by an image, are treated as scans
+MIN_TEXT_CHARACTERS = 100
+SCAN_IMAGE_COVERAGE = 0.5
+# Headers and footers in this share of the page are not read as form captions
+MARGIN_FRACTION = 0.05
+# Captions are set smaller than the page's body text
+CAPTION_SIZE_RATIO = 0.9
+# A value may sit this many caption heights above its caption
+CAPTION_GAP = 1.5
+# Longest "Label:" read from inside a span, so sentences with colons aren't split
+MAX_LABEL_WORDS = 4
+
+# Bidi marks and en spaces some PDF generators pad form text with
+PADDING = re.compile("[\u2002\u200e\u200f\u202a-\u202e]")
+
+SELECTED = "SELECTED"
+NOT_SELECTED = "NOT_SELECTED"
+
+
+def _clean(text: str) -> str:
+    return " ".join(PADDING.sub(" ", text).split())
+
+
+def _normalized_bbox(page: fitz.Page, rect) -> dict:
+    """
+    Converts a rectangle in PDF points to the 0-1 BBox the OCR output uses, relative
+    to the page as rendered (after its /Rotate)
+    """
+    rect = fitz.Rect(rect) * page.rotation_matrix
+    width, height = page.rect.width, page.rect.height
+    return {
+        "Left": max(0.0, rect.x0 / width),
+        "Top": max(0.0, rect.y0 / height),
+        "Width": rect.width / width,
+        "Height": rect.height / height
+    }
+
+
+def _is_image_only(page: fitz.Page, text_length: int) -> bool:
+    """
+    Whether the page has to be OCR'd: too little text, or a scan covering most of it
+    (scanners often add an invisible text layer on top)
+    """
+    if text_length < MIN_TEXT_CHARACTERS:
+        return True
+    page_area = abs(page.rect)
+    return any(abs(fitz.Rect(image["bbox"]) & page.rect) >= SCAN_IMAGE_COVERAGE * page_area
+               for image in page.get_image_info())
+
+
+def widget_fields(page: fitz.Page) -> list:
+    """
+    A Utility Function that reads the AcroForm fields on a page
+
+    Input:
+        page = the PDF page
+
+    Output:
+        returns a list of Key/Value/Confidence/BBox records, one per widget
+    """
+    records = []
+    for widget in page.widgets():
+        key = _clean(widget.field_label or widget.field_name or "")
+        if widget.field_type in (fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_RADIOBUTTON):
+            value = NOT_SELECTED if widget.field_value in (None, False, "", "Off") else SELECTED
+        elif isinstance(widget.field_value, (list, tuple)):
+            value = ", ".join(str(item) for item in widget.field_value)
+        else:
+            value = _clean(str(widget.field_value or ""))
+        records.append({
+            "Key": key,
+            "Value": value,
+            "Confidence": FIELD_CONFIDENCE,
+            "BBox": _normalized_bbox(page, widget.rect)
+        })
+    return records
+
+
+def text_layer_fields(page: fitz.Page, spans: list) -> list:
+    """
+    A Utility Function that pairs the labels and values of a flattened form from its
+    text layer: "Label:" followed by a value on the same line, and captions set under
+    the value they describe
+
+    Input:
+        page = the PDF page
+        spans = the page's text spans, dicts with "text", "rect" and "size"
+
+    Output:
+        returns a list of Key/Value/Confidence/BBox records
+    """
+    pairs = []
+    used = set()
+
+    # "Label: value", either in one span or as a label span with its value to the right
+    for index, span in enumerate(spans):
+        text = span["text"]
+        if text.endswith(":"):
+            same_line = [other for other in range(len(spans)) if other != index and other not in used
+                         and spans[other]["rect"].x0 >= span["rect"].x1
+                         and abs((spans[other]["rect"].y0 + spans[other]["rect"].y1)
+                                 - (span["rect"].y0 + span["rect"].y1)) < span["rect"].height
+                         and not spans[other]["text"].endswith(":")]
+            if same_line:
+                value = min(same_line, key=lambda other: spans[other]["rect"].x0)
+                pairs.append((span, text, spans[value]["text"]))
+                used.update((index, value))
+        elif ":" in text:
+            label, value = text.split(":", 1)
+            if value.strip() and len(label.split()) <= MAX_LABEL_WORDS and not value.startswith("//"):
+                pairs.append((span, label + ":", value.strip()))
+                used.add(index)
+
+    # Captions: smaller text with the value it names just above it
+    sizes = {}
+    for span in spans:
+        sizes[round(span["size"])] = sizes.get(round(span["size"]), 0) + len(span["text"])
+    body_size = max(sizes, key=sizes.get) if sizes else 0
+    top_margin = page.rect.height * MARGIN_FRACTION
+    bottom_margin = page.rect.height - top_margin
+
+    for index, span in enumerate(spans):
+        rect = span["rect"]
+        if (index in used or span["size"] >= body_size * CAPTION_SIZE_RATIO
+                or rect.y0 < top_margin or rect.y1 > bottom_margin):
+            continue
+        above = [other for other in range(len(spans)) if other not in used
+                 and spans[other]["size"] > span["size"]
+                 and spans[other]["rect"].y1 <= rect.y0 + rect.height / 2
+                 and rect.y0 - spans[other]["rect"].y1 <= rect.height * CAPTION_GAP
+                 and min(rect.x1, spans[other]["rect"].x1) > max(rect.x0, spans[other]["rect"].x0)]
+        value = ""
+        if above:
+            nearest = max(above, key=lambda other: spans[other]["rect"].y1)
+            value = spans[nearest]["text"]
+            used.add(nearest)
+        pairs.append((span, span["text"], value))
+        used.add(index)
+
+    return [{
+        "Key": key,
+        "Value": value,
+        "Confidence": FIELD_CONFIDENCE,
+        "BBox": _normalized_bbox(page, span["rect"])
+    } for span, key, value in pairs]
+
+
+def page_fields(page: fitz.Page):
+    """
+    A Utility Function that reads a digital page's fields without OCR
+
+    Input:
+        page = the PDF page
+
+    Output:
+        returns the page's Key/Value/Confidence/BBox records in the order and with the
+        key numbering of the OCR output, or None if the page is a scan or no fields
+        were found in its text, and it needs OCR
+    """
+    spans = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                text = _clean(span["text"])
+                if text:
+                    spans.append({"text": text, "rect": fitz.Rect(span["bbox"]), "size": span["size"]})
+
+    records = widget_fields(page)
+    if not records:
+        if _is_image_only(page, sum(len(span["text"]) for span in spans)):
+            return None
+        records = text_layer_fields(page, spans)
+        if not records:
+            # Text we couldn't pair up is no answer; OCR may still find the fields
+            return None
+
+    records.sort(key=lambda record: (record["BBox"]["Top"], record["BBox"]["Left"]))
+    key_counts = {}
+    for record in records:
+        key = record["Key"]
+        key_counts[key] = key_counts.get(key, 0) + 1
+        if key_counts[key] > 1:
+            record["Key"] = f"{key}_{key_counts[key]}"
+    return records
+
+
+@traced_handler
 def lambda_handler(event, context):
     try:
         if event.get("httpMethod") == "OPTIONS":
@@ -29,11 +225,14 @@ def lambda_handler(event, context):
             return {
                 'statusCode': 400,
                 "headers": CORS_HEADERS,
-                'body': json.dumps({'error': f"event is a string: {e}"})
+                'body': json.dumps({'error': f"event is a string: {event}"})
             }
 
-        body = json.loads(event["body"])
+        body = request_body(event)
         pdf_base64 = body.get('pdf_base64')
+        profile = body.get('profile', "auto")
+        # Digital pages are read from the PDF itself unless the caller opts out
+        text_layer_enabled = body.get('textLayer', True)
 
         if not pdf_base64:
             logger.error("Missing 'pdf_base64' in input event.")
@@ -43,34 +242,64 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': "Input Error: 'pdf_base64' key not found or is empty in the event payload."})
             }
 
+        engine = imaging_backend.get_backend(body.get('backend'))
+
         # Decode base64 PDF to bytes
-        pdf_bytes = base64.b64decode(pdf_base64)
+        with span("base64_decode"):
+            pdf_bytes = base64.b64decode(pdf_base64)
 
         # Open PDF from bytes
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")
 
         image_base64_list = []
+        content_classes = []
+        # Per page, the fields read from the PDF, or None where the page needs OCR
+        text_layer = []
 
         for page in doc:
-            pix = page.get_pixmap(dpi=100) # 200 for better quality but with some timeout issues
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            with span("text_layer", page=page.number + 1):
+                text_layer.append(page_fields(page) if text_layer_enabled else None)
+
+            with span("render", page=page.number + 1):
+                pix = page.get_pixmap(dpi=100) # 200 for better quality but with some timeout issues
+                img = engine.from_samples(pix.samples, pix.width, pix.height, 3)
 
-            # Convert image to base64-encoded PNG
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+            if profile == "auto":
+                # Black-and-white pages become 1-bit PNG, grayscale pages 8-bit PNG
+                content_class = engine.classify(img)
+                png_bytes, _ = engine.encode_for_content(img, content_class, "PNG")
+                content_classes.append(content_class)
+            else:
+                # Convert image to base64-encoded PNG
+                png_bytes = engine.encode(img, "PNG")
 
+            img_base64 = base64.b64encode(png_bytes).decode("utf-8")
             image_base64_list.append(img_base64)
 
+        ocr_pages = [idx for idx, fields in enumerate(text_layer) if fields is None]
+        logger.info(f"Read {len(text_layer) - len(ocr_pages)} of {len(text_layer)} pages from the PDF, "
+                    f"{len(ocr_pages)} need OCR")
+
+        with span("serialize"):
+            response_body = json.dumps({
+                'message': 'File converted successfully.',
+                'image_list': image_base64_list,
+                'content_classes': content_classes,
+                'text_layer': text_layer,
+                'ocr_pages': ocr_pages
+            })
         return {
             'statusCode': 200,
             "headers": CORS_HEADERS,
-            'body': json.dumps({
-                'message': 'File converted successfully.',
-                'image_list': image_base64_list
-            })
+            'body': response_body
         }
 
+    except imaging_backend.UnknownBackendError as e:
+        return {
+            'statusCode': 400,
+            "headers": CORS_HEADERS,
+            'body': json.dumps({'error': f"Input Error: {e}"})
+        }
     except Exception as e:
         return {
             'statusCode': 500,
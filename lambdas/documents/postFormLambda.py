@@ -5,6 +5,8 @@ import base64
 # See LICENSE.md for full details
 import boto3
 from botocore.exceptions import BotoCoreError, ClientError
+from trace_util import traced_handler
+from request_util import request_body
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -15,6 +17,7 @@ S3_METADATA_FOLDER = "metadata/"
 
 s3_client = boto3.client("s3")
 
+@traced_handler
 def lambda_handler(event, context):
     try:
         if event.get("httpMethod") == "OPTIONS":
@@ -24,7 +27,7 @@ def lambda_handler(event, context):
                 "body": json.dumps({"message": "CORS preflight success"})
             }
         
-        body = json.loads(event["body"])
+        body = request_body(event)
 
         file = body.get("file")    
         file_name = body.get("fileName")
@@ -1,5 +1,7 @@
 import json
 from db_util import execute
+from trace_util import traced_handler
+from request_util import request_body
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -7,6 +9,7 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "POST,OPTIONS"
 }
 
+@traced_handler
 def lambda_handler(event, context):
     """
     Handles the lambda for adding a document
@@ -29,7 +32,7 @@ def lambda_handler(event, context):
             "body": json.dumps({"message": "CORS preflight success"})
         }
 
-    body = json.loads(event["body"])
+    body = request_body(event)
 
     filename_identifier = body.get('filename')
     bucket = body.get('bucket')
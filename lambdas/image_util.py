@@ -0,0 +1,368 @@
+import math
+import os
+import struct
+import zlib
+from io import BytesIO
+import numpy as np
+# Pillow (PIL) is used for image processing.
+# Licensed under the Pillow License (HPND).
+# See LICENSE.md for full attribution details.
+from PIL import Image, ImageOps
+from trace_util import span
+
+# Content classes returned by classify_content
+BILEVEL = "bilevel"
+GRAYSCALE = "grayscale"
+COLOR = "color"
+
+# The classifier only looks at a thumbnail of the page
+CLASSIFIER_THUMBNAIL_SIZE = 512
+# A pixel is coloured when its channels spread by more than this
+CHROMA_THRESHOLD = 40
+# Share of coloured pixels above which the page keeps its colour
+COLOR_PIXEL_FRACTION = 0.005
+# Share of mid-tone pixels below which a grayscale page is treated as black and white
+BILEVEL_MIDTONE_FRACTION = 0.06
+
+EXIF_ORIENTATION = 0x0112
+# Orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# The final resampling filter gets at least this much oversampling to work with
+REDUCE_HEADROOM = 2
+
+# Most pixels a decoded image may have; larger images are reduced while decoding
+PIXEL_BUDGET = int(os.environ.get("IMAGE_PIXEL_BUDGET", 40_000_000))
+# Memory the decoded image and its working copies may use, a quarter of the function's by default
+MEMORY_BUDGET = int(os.environ.get("IMAGE_MEMORY_BUDGET_MB",
+                                   int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", 1024)) // 4)) * 1024 * 1024
+# Resizing, classifying and encoding keep about this many copies of the decoded image alive
+WORKING_COPIES = 3
+# PNGs over budget are decoded in strips of about this many pixels
+STRIP_PIXELS = 2_000_000
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# (bit depth, colour type) of the PNGs strip decoding supports, with their bytes per pixel
+STRIP_PNG_TYPES = {(1, 0): 1 / 8, (8, 0): 1, (8, 2): 3, (8, 3): 1, (8, 4): 2, (8, 6): 4}
+
+
+class ImageTooLargeError(ValueError):
+    """
+    Raised when an image can't be decoded within the pixel and memory budget
+    """
+
+
+def classify_content(image: Image.Image) -> str:
+    """
+    A Utility Function that decides how many colours a page needs
+
+    Input:
+        image = the PIL image to classify
+
+    Output:
+        returns BILEVEL for black-and-white pages, GRAYSCALE for pages without
+        meaningful colour and COLOR for IDs, photos and other colour content
+    """
+    # Nearest-neighbour sampling keeps the tone distribution; averaging would invent mid-tones
+    ratio = min(1.0, CLASSIFIER_THUMBNAIL_SIZE / max(image.width, image.height))
+    size = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+    thumbnail = image.resize(size, Image.NEAREST)
+
+    if thumbnail.mode not in ("1", "L", "LA", "I", "I;16"):
+        rgb = np.asarray(thumbnail.convert("RGB"), dtype=np.int16)
+        chroma = rgb.max(axis=2) - rgb.min(axis=2)
+        if np.mean(chroma > CHROMA_THRESHOLD) > COLOR_PIXEL_FRACTION:
+            return COLOR
+
+    gray = np.asarray(thumbnail.convert("L"), dtype=np.float32)
+    low, high = np.percentile(gray, [0.5, 99])
+    if high - low < 32:
+        # Blank or nearly blank page
+        return BILEVEL
+
+    normalized = (gray - low) / (high - low)
+    midtones = np.mean((normalized > 0.25) & (normalized < 0.75))
+    return BILEVEL if midtones < BILEVEL_MIDTONE_FRACTION else GRAYSCALE
+
+
+def otsu_threshold(image: Image.Image) -> int:
+    """
+    A Utility Function that computes Otsu's threshold from the luminance histogram
+    """
+    return otsu_from_histogram(image.convert("L").histogram())
+
+
+def otsu_from_histogram(histogram) -> int:
+    """
+    A Utility Function that computes Otsu's threshold from a 256 bin histogram
+    """
+    histogram = np.asarray(histogram, dtype=np.float64).ravel()
+    levels = np.arange(256)
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    sum_dark = np.cumsum(histogram * levels)
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_light = (sum_dark[-1] - sum_dark) / np.maximum(weight_light, 1)
+    between = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    return int(np.argmax(between))
+
+
+def to_bilevel(image: Image.Image) -> Image.Image:
+    """
+    A Utility Function that converts an image to 1-bit with Otsu's threshold
+    """
+    gray = image.convert("L")
+    threshold = otsu_threshold(gray)
+    return gray.point(lambda p: 255 if p > threshold else 0, mode="1")
+
+
+def apply_content_profile(image: Image.Image, content_class: str) -> Image.Image:
+    """
+    A Utility Function that converts an image to the mode its content class needs
+    """
+    if content_class == BILEVEL:
+        return to_bilevel(image)
+    if content_class == GRAYSCALE:
+        return image.convert("L")
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def encode_image(image: Image.Image, format: str, quality: int = None) -> bytes:
+    """
+    A Utility Function that encodes an image to bytes in the given format
+    """
+    buffer = BytesIO()
+    format = format.upper()
+    with span("image_encode", engine="pillow", format=format) as encode:
+        if format == "PNG":
+            image.save(buffer, format="PNG", optimize=True)
+        elif format == "TIFF":
+            compression = "group4" if image.mode == "1" else "tiff_deflate"
+            image.save(buffer, format="TIFF", compression=compression)
+        else:
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            options = {"optimize": True}
+            if quality is not None:
+                options["quality"] = quality
+            image.save(buffer, format="JPEG", **options)
+        encode.set(bytes=buffer.tell())
+    return buffer.getvalue()
+
+
+def encode_for_content(image: Image.Image, content_class: str, format: str = None,
+                       quality: int = None, bilevel_format: str = "PNG") -> tuple:
+    """
+    A Utility Function that encodes an image using the smallest representation its
+    content allows. Bilevel pages become 1-bit PNG (or Group4 TIFF), grayscale pages
+    become 8-bit and colour pages keep the requested format
+
+    Input:
+        image = the PIL image to encode
+        content_class = the class returned by classify_content
+        format = the preferred output format, defaults to the image's own format or JPEG
+        quality = the JPEG quality, if JPEG is used
+        bilevel_format = PNG or TIFF for bilevel pages
+
+    Output:
+        returns a tuple of the encoded bytes and the format that was used
+    """
+    format = (format or image.format or "JPEG").upper()
+    converted = apply_content_profile(image, content_class)
+
+    if content_class == BILEVEL:
+        format = bilevel_format.upper()
+    elif format not in ("PNG", "TIFF"):
+        format = "JPEG"
+
+    return encode_image(converted, format, quality), format
+
+
+def pixel_budget(mode: str) -> int:
+    """
+    A Utility Function that returns how many pixels of the given mode fit in the budget
+    """
+    try:
+        bands = Image.getmodebands(mode) if mode != "P" else 4
+    except (KeyError, ValueError):
+        bands = 4
+    return min(PIXEL_BUDGET, MEMORY_BUDGET // (bands * WORKING_COPIES))
+
+
+def open_within_budget(image_data: bytes, max_pixels: int = None, target_width: int = None) -> tuple:
+    """
+    A Utility Function that decodes an image without holding more than the pixel budget
+    in memory. Images over budget are reduced while decoding, JPEGs in the DCT domain
+    and PNGs strip by strip, and the EXIF orientation is applied
+
+    Input:
+        image_data = the encoded image
+        max_pixels = the pixel budget, defaults to pixel_budget() for the image's mode
+        target_width = the displayed width the caller will resize to, if any. The image
+            is reduced no further than this allows
+
+    Output:
+        returns a tuple of the decoded, upright PIL image, its source format and the
+        factor it was reduced by. Raises ImageTooLargeError if it can't be reduced enough
+    """
+    try:
+        image = Image.open(BytesIO(image_data))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+
+    source_format = image.format
+    original_width = image.width
+    orientation = 1
+    # Pillow decodes a whole PNG looking for an EXIF chunk after the image data
+    if source_format != "PNG" or "exif" in image.info:
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    displayed_width = image.height if orientation in TRANSPOSED_ORIENTATIONS else image.width
+    if max_pixels is None:
+        max_pixels = pixel_budget(image.mode)
+
+    # Smallest integer reduction that brings the image within budget
+    budget_factor = max(1, math.ceil(math.sqrt(image.width * image.height / max_pixels)))
+    while math.ceil(image.width / budget_factor) * math.ceil(image.height / budget_factor) > max_pixels:
+        budget_factor += 1
+
+    if source_format == "JPEG":
+        # draft picks the smallest DCT scale (1, 1/2, 1/4 or 1/8) at least the requested size
+        reduction = 2 ** math.ceil(math.log2(budget_factor))
+        requested = (max(1, image.width // reduction), max(1, image.height // reduction))
+        if target_width is not None and target_width < displayed_width:
+            scale = target_width / displayed_width
+            requested = (min(requested[0], math.ceil(image.width * scale)),
+                         min(requested[1], math.ceil(image.height * scale)))
+        if requested != image.size:
+            image.draft(image.mode, requested)
+    elif budget_factor > 1:
+        factor = budget_factor
+        if target_width is not None:
+            factor = max(factor, displayed_width // (target_width * REDUCE_HEADROOM))
+        if source_format != "PNG":
+            raise ImageTooLargeError(f"{source_format} image of {image.width}x{image.height} pixels "
+                                     f"exceeds the {max_pixels} pixel budget")
+        image = _decode_png_in_strips(image_data, factor)
+
+    if image.width * image.height > max_pixels:
+        raise ImageTooLargeError(f"Image of {image.width}x{image.height} pixels exceeds the "
+                                 f"{max_pixels} pixel budget even when reduced")
+
+    factor = original_width / image.width
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    return image, source_format, factor
+
+
+def decode_for_width(image_data: bytes, target_width: int) -> tuple:
+    """
+    A Utility Function that decodes an image no larger than needed for target_width.
+    JPEGs are scaled down in the DCT domain while decoding, and the EXIF orientation
+    is applied
+
+    Input:
+        image_data = the encoded image
+        target_width = the displayed width the image will be resized to
+
+    Output:
+        returns a tuple of the decoded, upright PIL image and its source format
+    """
+    image, source_format, _ = open_within_budget(image_data, target_width=target_width)
+    return image, source_format
+
+
+def _png_chunks(image_data: bytes):
+    """
+    Yields the (type, data) of each chunk of a PNG without copying the data
+    """
+    view = memoryview(image_data)
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(image_data):
+        length, chunk_type = struct.unpack(">I4s", view[position:position + 8])
+        yield chunk_type, view[position + 8:position + 8 + length]
+        position += 12 + length
+        if chunk_type == b"IEND":
+            return
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def _decode_png_in_strips(image_data: bytes, factor: int) -> Image.Image:
+    """
+    Decodes a PNG a strip of rows at a time, reducing each strip by factor before
+    decoding the next. Each strip is decoded by Pillow as a small PNG of its own,
+    led by the previous strip's last row so the row filters have what they refer to
+    """
+    chunks = list(_png_chunks(image_data))
+    if not chunks or chunks[0][0] != b"IHDR":
+        raise ImageTooLargeError("Oversized PNG has no header")
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    if interlace or (bit_depth, color_type) not in STRIP_PNG_TYPES:
+        raise ImageTooLargeError(f"Oversized PNG of {width}x{height} pixels can't be decoded in strips "
+                                 f"(bit depth {bit_depth}, colour type {color_type}, interlace {interlace})")
+
+    palette = b"".join(_png_chunk(bytes(chunk_type), bytes(data)) for chunk_type, data in chunks
+                       if chunk_type in (b"PLTE", b"tRNS"))
+    stride = math.ceil(width * STRIP_PNG_TYPES[(bit_depth, color_type)]) + 1
+    rows_per_strip = max(factor, STRIP_PIXELS // width // factor * factor)
+    compressed = (data for chunk_type, data in chunks if chunk_type == b"IDAT")
+    decompressor = zlib.decompressobj()
+
+    output = None
+    previous_row = None
+    pending = bytearray()
+    for top in range(0, height, rows_per_strip):
+        rows = min(rows_per_strip, height - top)
+        needed = rows * stride
+        while len(pending) < needed:
+            data = decompressor.unconsumed_tail or next(compressed, None)
+            if data is None:
+                raise ValueError("PNG image data is truncated")
+            # Bounding the output keeps a highly compressed chunk from inflating all at once
+            pending += decompressor.decompress(data, needed - len(pending))
+        filtered = bytes(pending[:needed])
+        del pending[:needed]
+
+        strip_height = rows
+        if previous_row is not None:
+            filtered = b"\x00" + previous_row + filtered
+            strip_height += 1
+        header = struct.pack(">IIBBBBB", width, strip_height, bit_depth, color_type, 0, 0, 0)
+        strip_png = (PNG_SIGNATURE + _png_chunk(b"IHDR", header) + palette
+                     + _png_chunk(b"IDAT", zlib.compress(filtered, 0)) + _png_chunk(b"IEND", b""))
+
+        strip = Image.open(BytesIO(strip_png))
+        strip.load()
+        previous_row = strip.crop((0, strip.height - 1, width, strip.height)).tobytes()
+        if strip_height > rows:
+            strip = strip.crop((0, 1, width, strip_height))
+
+        if strip.mode == "1":
+            strip = strip.convert("L")
+        elif strip.mode == "P":
+            strip = strip.convert("RGBA" if "transparency" in strip.info else "RGB")
+        reduced = strip.reduce(factor)
+
+        if output is None:
+            output = Image.new(reduced.mode, (math.ceil(width / factor), math.ceil(height / factor)))
+        output.paste(reduced, (0, top // factor))
+
+    return output
+
+
+def resize_to_width(image: Image.Image, target_width: int, target_height: int = None) -> Image.Image:
+    """
+    A Utility Function that resizes an image to target_width, keeping the aspect ratio
+    unless target_height is given. Large reductions first shrink by an integer factor
+    with reduce(), so LANCZOS only runs over a few times the output size
+    """
+    if target_height is None:
+        target_height = max(1, int(image.height * target_width / image.width))
+
+    factor = min(image.width // (target_width * REDUCE_HEADROOM), image.height // (target_height * REDUCE_HEADROOM))
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize((target_width, target_height), Image.LANCZOS)
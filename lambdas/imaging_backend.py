@@ -0,0 +1,286 @@
+import logging
+import math
+import os
+# Pillow (PIL) is used for image processing.
+# Licensed under the Pillow License (HPND).
+# See LICENSE.md for full attribution details.
+from PIL import Image, ImageOps
+from image_util import (classify_content, encode_for_content, encode_image, open_within_budget, otsu_from_histogram,
+                        pixel_budget, resize_to_width, BILEVEL, CLASSIFIER_THUMBNAIL_SIZE, GRAYSCALE)
+from trace_util import span
+
+try:
+    # pyvips (libvips) is an optional, faster imaging engine.
+    # Licensed under the MIT License (pyvips) and LGPL 2.1 (libvips).
+    # See LICENSE.md for full attribution details.
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+logger = logging.getLogger()
+
+PILLOW = "pillow"
+VIPS = "vips"
+# The engine used when a request doesn't name one
+DEFAULT_BACKEND = os.environ.get("IMAGING_BACKEND", PILLOW)
+
+# Formats reported by libvips loaders, by loader name prefix
+VIPS_LOADER_FORMATS = {"jpegload": "JPEG", "pngload": "PNG", "tiffload": "TIFF", "webpload": "WEBP",
+                       "gifload": "GIF", "heifload": "HEIF"}
+# Largest height libvips accepts, used to resize by width alone
+VIPS_MAX_COORD = 10_000_000
+
+
+class ImagingBackend:
+    """
+    The raster operations the document handlers need. Images are opaque to callers
+    and are only passed back into the backend that created them
+    """
+
+    name = None
+
+    def decode(self, image_data: bytes, target_width: int = None) -> tuple:
+        """
+        Decodes an upright image, no larger than needed for target_width if given.
+        Returns a tuple of the image, its source format and the factor it was reduced by
+        """
+        raise NotImplementedError
+
+    def from_samples(self, samples: bytes, width: int, height: int, bands: int):
+        """
+        Wraps raw 8-bit samples, 1 (gray) or 3 (RGB) bands per pixel
+        """
+        raise NotImplementedError
+
+    def size(self, image) -> tuple:
+        raise NotImplementedError
+
+    def resize_to_width(self, image, target_width: int, target_height: int = None):
+        raise NotImplementedError
+
+    def classify(self, image) -> str:
+        raise NotImplementedError
+
+    def needs_flattening(self, image) -> bool:
+        """
+        Whether the image is transparent or paletted, so it has to be flattened to
+        plain colour, which is then stored as JPEG
+        """
+        raise NotImplementedError
+
+    def encode(self, image, format: str, quality: int = None) -> bytes:
+        raise NotImplementedError
+
+    def encode_for_content(self, image, content_class: str, format: str = None,
+                           quality: int = None, bilevel_format: str = "PNG") -> tuple:
+        raise NotImplementedError
+
+    def samples(self, image) -> tuple:
+        """
+        Flattens the image onto white and returns a tuple of its raw samples, width,
+        height, bands (1 or 3) and bits per sample (1 or 8)
+        """
+        raise NotImplementedError
+
+
+class PillowBackend(ImagingBackend):
+    """
+    The default engine, built on the image_util functions
+    """
+
+    name = PILLOW
+
+    def decode(self, image_data: bytes, target_width: int = None) -> tuple:
+        return open_within_budget(image_data, target_width=target_width)
+
+    def from_samples(self, samples: bytes, width: int, height: int, bands: int):
+        return Image.frombytes("L" if bands == 1 else "RGB", (width, height), samples)
+
+    def size(self, image) -> tuple:
+        return image.size
+
+    def resize_to_width(self, image, target_width: int, target_height: int = None):
+        return resize_to_width(image, target_width, target_height)
+
+    def classify(self, image) -> str:
+        return classify_content(image)
+
+    def needs_flattening(self, image) -> bool:
+        return image.mode in ("RGBA", "P")
+
+    def encode(self, image, format: str, quality: int = None) -> bytes:
+        return encode_image(image, format, quality)
+
+    def encode_for_content(self, image, content_class: str, format: str = None,
+                           quality: int = None, bilevel_format: str = "PNG") -> tuple:
+        return encode_for_content(image, content_class, format, quality, bilevel_format)
+
+    def samples(self, image) -> tuple:
+        image = ImageOps.exif_transpose(image)
+        if image.mode == "P":
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        if image.mode in ("RGBA", "LA", "PA"):
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image.convert("RGBA"), mask=image.getchannel("A"))
+            image = background
+        elif image.mode in ("I", "I;16", "F"):
+            image = image.convert("L")
+        elif image.mode not in ("1", "L", "RGB"):
+            image = image.convert("RGB")
+
+        bands = 3 if image.mode == "RGB" else 1
+        bits = 1 if image.mode == "1" else 8
+        return image.tobytes(), image.width, image.height, bands, bits
+
+
+class VipsBackend(ImagingBackend):
+    """
+    The libvips engine. Decoding shrinks while loading and libvips runs each pipeline
+    on all cores, so large inputs resize and encode several times faster than Pillow
+    """
+
+    name = VIPS
+
+    def decode(self, image_data: bytes, target_width: int = None) -> tuple:
+        # Opening only reads the header
+        original = pyvips.Image.new_from_buffer(image_data, "")
+        pixels = original.width * original.height
+        budget = pixel_budget("L" if original.bands < 3 else "RGB")
+
+        if target_width is not None:
+            # thumbnail_buffer shrinks on load (JPEG DCT scaling, streamed PNG rows) and
+            # applies the EXIF orientation; images narrower than target_width are kept
+            image = pyvips.Image.thumbnail_buffer(image_data, target_width, height=VIPS_MAX_COORD, size="down")
+        elif pixels > budget:
+            side = int(max(original.width, original.height) * math.sqrt(budget / pixels))
+            image = pyvips.Image.thumbnail_buffer(image_data, side, height=side, size="down")
+        else:
+            image = original.autorot()
+
+        loader = image.get("vips-loader") if image.get_typeof("vips-loader") else ""
+        source_format = next((format for prefix, format in VIPS_LOADER_FORMATS.items()
+                              if loader.startswith(prefix)), None)
+        factor = max(original.width, original.height) / max(image.width, image.height)
+        # Render once so the image can be read more than once, e.g. to classify then encode
+        return image.copy_memory(), source_format, factor
+
+    def from_samples(self, samples: bytes, width: int, height: int, bands: int):
+        image = pyvips.Image.new_from_memory(samples, width, height, bands, "uchar")
+        return image.copy(interpretation="b-w" if bands == 1 else "srgb")
+
+    def size(self, image) -> tuple:
+        return image.width, image.height
+
+    def resize_to_width(self, image, target_width: int, target_height: int = None):
+        if target_height is None:
+            target_height = max(1, int(image.height * target_width / image.width))
+        if (image.width, image.height) == (target_width, target_height):
+            return image
+        return image.resize(target_width / image.width, vscale=target_height / image.height, kernel="lanczos3")
+
+    def classify(self, image) -> str:
+        return classify_content(self._to_pillow(image))
+
+    def needs_flattening(self, image) -> bool:
+        return image.hasalpha()
+
+    def encode(self, image, format: str, quality: int = None) -> bytes:
+        format = format.upper()
+        with span("image_encode", engine=VIPS, format=format) as encode:
+            if format == "PNG":
+                data = image.pngsave_buffer(compression=9, keep="none")
+            elif format == "TIFF":
+                data = image.tiffsave_buffer(compression="deflate")
+            else:
+                options = {"optimize_coding": True, "keep": "none"}
+                if quality is not None:
+                    options["Q"] = quality
+                data = self._normalize(image).jpegsave_buffer(**options)
+            encode.set(bytes=len(data))
+        return data
+
+    def encode_for_content(self, image, content_class: str, format: str = None,
+                           quality: int = None, bilevel_format: str = "PNG") -> tuple:
+        format = (format or "JPEG").upper()
+        image = self._normalize(image)
+
+        if content_class == BILEVEL:
+            gray = self._gray(image)
+            threshold = otsu_from_histogram(gray.hist_find().numpy())
+            bilevel = (gray > threshold).cast("uchar")
+            if bilevel_format.upper() == "TIFF":
+                return bilevel.tiffsave_buffer(compression="ccittfax4", bitdepth=1), "TIFF"
+            return bilevel.pngsave_buffer(compression=9, bitdepth=1, keep="none"), "PNG"
+
+        if content_class == GRAYSCALE:
+            image = self._gray(image)
+        if format not in ("PNG", "TIFF"):
+            format = "JPEG"
+        return self.encode(image, format, quality), format
+
+    def samples(self, image) -> tuple:
+        image = self._normalize(image)
+        return image.write_to_memory(), image.width, image.height, image.bands, 8
+
+    @staticmethod
+    def _gray(image):
+        return image if image.bands == 1 else image.colourspace("b-w")
+
+    @staticmethod
+    def _normalize(image):
+        """
+        Flattens transparency onto white and converts to 8-bit gray or sRGB
+        """
+        if image.hasalpha():
+            image = image.flatten(background=[255] * (image.bands - 1))
+        if image.bands == 1:
+            image = image.colourspace("b-w")
+        elif image.interpretation != "srgb" or image.bands != 3:
+            image = image.colourspace("srgb")[:3]
+        if image.format != "uchar":
+            image = image.cast("uchar")
+        return image
+
+    def _to_pillow(self, image) -> Image.Image:
+        """
+        Samples a nearest-neighbour thumbnail for the classifier, which works on Pillow images
+        """
+        image = self._normalize(image)
+        ratio = min(1.0, CLASSIFIER_THUMBNAIL_SIZE / max(image.width, image.height))
+        if ratio < 1.0:
+            image = image.resize(ratio, kernel="nearest")
+        pixels = image.numpy()
+        return Image.fromarray(pixels.reshape(pixels.shape[:2]) if image.bands == 1 else pixels)
+
+
+BACKENDS = {PILLOW: PillowBackend, VIPS: VipsBackend}
+_instances = {}
+
+
+class UnknownBackendError(ValueError):
+    """
+    Raised when a request names an imaging engine that doesn't exist
+    """
+
+
+def get_backend(name: str = None) -> ImagingBackend:
+    """
+    A Utility Function that returns the imaging engine to use
+
+    Input:
+        name = "pillow" or "vips", defaults to the IMAGING_BACKEND environment variable
+
+    Output:
+        returns the backend. Falls back to Pillow, with a warning, when libvips isn't
+        installed. Raises UnknownBackendError for an unknown name
+    """
+    name = (name or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise UnknownBackendError(f"Unknown imaging backend '{name}', expected one of {sorted(BACKENDS)}")
+    if name == VIPS and pyvips is None:
+        logger.warning("pyvips is not installed, using the Pillow imaging backend")
+        name = PILLOW
+
+    if name not in _instances:
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
@@ -0,0 +1,234 @@
+import base64
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from trace_util import span
+
+logger = logging.getLogger()
+
+COGNITO_USER_POOL_ID = os.environ.get("COGNITO_USER_POOL_ID")
+# One client id, or several separated by commas
+COGNITO_CLIENT_ID = os.environ.get("COGNITO_CLIENT_ID")
+
+JWKS_URL = "https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/jwks.json"
+ISSUER = "https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+JWKS_TIMEOUT_SECONDS = 3
+# An unknown key id triggers a refetch (Cognito rotated its keys) at most this often
+JWKS_MIN_REFRESH_SECONDS = 60
+# Allowed clock difference when checking exp and nbf
+CLOCK_SKEW_SECONDS = 30
+# Verified tokens kept in memory until they expire
+DECISION_CACHE_SIZE = 1024
+
+# ASN.1 DigestInfo prefix for SHA-256, from RFC 8017 section 9.2
+SHA256_DIGEST_INFO = bytes.fromhex("3031300d060960864801650304020105000420")
+
+
+class TokenError(ValueError):
+    """
+    The token is malformed, forged, expired or not meant for this application
+    """
+
+
+class JwksUnavailableError(RuntimeError):
+    """
+    The signing keys could not be fetched, so the token could not be checked either way
+    """
+
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def decode_unverified(token: str) -> tuple:
+    """
+    A Utility Function that splits a JWT without checking it. Only use the claims of
+    a token that came straight from Cognito, or after verify_token
+
+    Input:
+        token = the compact JWT
+
+    Output:
+        returns a tuple of the header, the claims, the signed bytes and the signature.
+        Raises TokenError if the token is malformed
+    """
+    try:
+        header_segment, claims_segment, signature_segment = token.split(".")
+        header = json.loads(b64url_decode(header_segment))
+        claims = json.loads(b64url_decode(claims_segment))
+        signature = b64url_decode(signature_segment)
+    except (AttributeError, ValueError) as e:
+        raise TokenError(f"Malformed token: {e}")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise TokenError("Malformed token: header and claims must be objects")
+    return header, claims, f"{header_segment}.{claims_segment}".encode("ascii"), signature
+
+
+def verify_rs256(signing_input: bytes, signature: bytes, modulus: int, exponent: int) -> bool:
+    """
+    A Utility Function that checks an RSASSA-PKCS1-v1_5 SHA-256 signature (RFC 8017
+    section 8.2.2) with Python's modular exponentiation, so no crypto library is needed
+
+    Input:
+        signing_input = the signed bytes
+        signature = the signature bytes
+        modulus, exponent = the RSA public key
+
+    Output:
+        returns whether the signature is valid
+    """
+    length = (modulus.bit_length() + 7) // 8
+    if len(signature) != length:
+        return False
+    value = int.from_bytes(signature, "big")
+    if value >= modulus:
+        return False
+    encoded = pow(value, exponent, modulus).to_bytes(length, "big")
+
+    digest_info = SHA256_DIGEST_INFO + hashlib.sha256(signing_input).digest()
+    padding = length - len(digest_info) - 3
+    if padding < 8:
+        return False
+    expected = b"\x00\x01" + b"\xff" * padding + b"\x00" + digest_info
+    return hmac.compare_digest(encoded, expected)
+
+
+class JwksCache:
+    """
+    The user pool's public signing keys by key id. Keys are fetched on first use and
+    again when a token names a key we don't have, which is how Cognito key rotation
+    shows up
+    """
+
+    def __init__(self, url: str, fetch=None):
+        self.url = url
+        self.fetch = fetch or self._fetch
+        self.keys = {}
+        self.fetched_at = None
+        self.lock = threading.Lock()
+
+    def _fetch(self) -> dict:
+        try:
+            with urllib.request.urlopen(self.url, timeout=JWKS_TIMEOUT_SECONDS) as response:
+                return json.loads(response.read())
+        # URLError and socket timeouts are OSErrors; a dropped connection mid-response
+        # is an HTTPException
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            raise JwksUnavailableError(f"Could not fetch {self.url}: {e}")
+
+    def refresh(self) -> None:
+        with span("jwks_fetch"):
+            jwks = self.fetch()
+        keys = {}
+        for key in jwks.get("keys", []):
+            if key.get("kty") == "RSA" and key.get("kid") and key.get("use", "sig") == "sig":
+                keys[key["kid"]] = (int.from_bytes(b64url_decode(key["n"]), "big"),
+                                    int.from_bytes(b64url_decode(key["e"]), "big"))
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+        logger.info(f"Loaded {len(keys)} signing keys from {self.url}")
+
+    def get_key(self, kid: str):
+        """
+        Returns the (modulus, exponent) for a key id, or None if the pool has no such key
+        """
+        with self.lock:
+            if kid not in self.keys and (self.fetched_at is None
+                                         or time.monotonic() - self.fetched_at >= JWKS_MIN_REFRESH_SECONDS):
+                self.refresh()
+            return self.keys.get(kid)
+
+
+class TokenVerifier:
+    """
+    Verifies Cognito tokens locally: the RS256 signature against the pool's JWKS, then
+    exp, iss, token_use and the app client. Tokens that pass are remembered by their
+    hash until they expire.
+
+    Local checks can't see a token revoked by a sign-out before it expires; Cognito
+    access tokens live an hour by default
+    """
+
+    def __init__(self, user_pool_id: str, client_ids, region: str = None, jwks: JwksCache = None):
+        region = region or user_pool_id.split("_", 1)[0]
+        self.issuer = ISSUER.format(region=region, user_pool_id=user_pool_id)
+        self.client_ids = set(client_ids)
+        self.jwks = jwks or JwksCache(JWKS_URL.format(region=region, user_pool_id=user_pool_id))
+        self.decisions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def verify(self, token: str, token_use: str = "access", now: float = None) -> dict:
+        """
+        Returns the token's claims, or raises TokenError (or JwksUnavailableError when the
+        keys can't be fetched)
+        """
+        now = time.time() if now is None else now
+        cache_key = (hashlib.sha256(token.encode("utf-8")).hexdigest(), token_use)
+
+        with self.lock:
+            cached = self.decisions.get(cache_key)
+            if cached is not None:
+                if cached["exp"] > now:
+                    self.decisions.move_to_end(cache_key)
+                    return cached
+                del self.decisions[cache_key]
+
+        claims = self._verify(token, token_use, now)
+
+        with self.lock:
+            self.decisions[cache_key] = claims
+            while len(self.decisions) > DECISION_CACHE_SIZE:
+                self.decisions.popitem(last=False)
+        return claims
+
+    def _verify(self, token: str, token_use: str, now: float) -> dict:
+        header, claims, signing_input, signature = decode_unverified(token)
+
+        if header.get("alg") != "RS256":
+            raise TokenError(f"Unsupported algorithm {header.get('alg')}")
+        key = self.jwks.get_key(header.get("kid"))
+        if key is None:
+            raise TokenError(f"Unknown signing key {header.get('kid')}")
+        if not verify_rs256(signing_input, signature, *key):
+            raise TokenError("Invalid signature")
+
+        if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] + CLOCK_SKEW_SECONDS <= now:
+            raise TokenError("Token expired")
+        if isinstance(claims.get("nbf"), (int, float)) and claims["nbf"] - CLOCK_SKEW_SECONDS > now:
+            raise TokenError("Token not yet valid")
+        if claims.get("iss") != self.issuer:
+            raise TokenError(f"Unexpected issuer {claims.get('iss')}")
+        if claims.get("token_use") != token_use:
+            raise TokenError(f"Expected an {token_use} token, got {claims.get('token_use')}")
+
+        # Access tokens name the app client in client_id, ID tokens in aud
+        client_id = claims.get("client_id") if token_use == "access" else claims.get("aud")
+        if client_id not in self.client_ids:
+            raise TokenError(f"Token issued to another app client {client_id}")
+        return claims
+
+
+_verifier = None
+
+
+def get_verifier():
+    """
+    A Utility Function that returns the verifier for the user pool and app client in
+    COGNITO_USER_POOL_ID and COGNITO_CLIENT_ID, kept for the life of the container
+
+    Output:
+        returns the TokenVerifier, or None if the user pool or app client isn't configured
+    """
+    global _verifier
+    client_ids = [client_id.strip() for client_id in (COGNITO_CLIENT_ID or "").split(",") if client_id.strip()]
+    if _verifier is None and COGNITO_USER_POOL_ID and client_ids:
+        # The pool lives in the region its id starts with, whichever region this runs in
+        _verifier = TokenVerifier(COGNITO_USER_POOL_ID, client_ids, COGNITO_USER_POOL_ID.split("_")[0])
+    return _verifier
@@ -0,0 +1,70 @@
+import importlib
+import logging
+import threading
+import time
+import types
+
+logger = logging.getLogger()
+
+# Seconds each lazily bound module took to import on first use, by module name
+load_times = {}
+_load_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module and imports it the first time one of its attributes is
+    used. Handlers bind their heavy dependencies this way so requests that never
+    need them, such as CORS preflights, don't pay for importing them
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with _load_lock:
+                module = self.__dict__["_module"]
+                if module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self.__name__)
+                    load_times[self.__name__] = time.perf_counter() - start
+                    logger.info(f"Imported {self.__name__} on first use in {load_times[self.__name__] * 1000:.0f} ms")
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    A Utility Function that binds a module without importing it yet
+
+    Input:
+        name = the absolute module name, e.g. "cv2" or "imaging_backend"
+
+    Output:
+        returns a stand-in that imports the module when an attribute is first used.
+        Import errors surface at that point rather than when the handler loads
+    """
+    return LazyModule(name)
+
+
+def is_loaded(module) -> bool:
+    """
+    A Utility Function that tells whether a module bound with lazy_import has been
+    imported yet. Ordinary modules always are
+    """
+    if isinstance(module, LazyModule):
+        return module.__dict__["_module"] is not None
+    return True
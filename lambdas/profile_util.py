@@ -0,0 +1,274 @@
+"""
+Opt-in profiling of single invocations in a deployed environment, for the requests
+that are slow in production and can't be reproduced locally.
+
+A profiled invocation runs under cProfile (or pyinstrument, when it's installed and
+PROFILER=pyinstrument) with tracemalloc on, and writes the profile and a summary of
+the slowest functions and largest allocations to PROFILE_SINK. An invocation is
+profiled when:
+- PROFILE_ENABLED=true, for a PROFILE_SAMPLE_RATE fraction of invocations, or
+- the request carries a valid X-Owl-Profile header signed with PROFILE_SECRET. Make
+  one with `python -c "import profile_util; print(profile_util.sign(secret))"`
+  (valid for 5 minutes by default).
+
+PROFILE_SINK is a folder (default /tmp/profiles) or an s3://bucket/prefix. Only one
+invocation per container is profiled at a time, and cProfile and pyinstrument only
+see the handler's own thread; tracemalloc sees every thread.
+
+Every handler wrapped by trace_util.traced_handler can be profiled; when neither
+trigger is set up, the check is a couple of attribute lookups.
+"""
+import cProfile
+import functools
+import hashlib
+import hmac
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger()
+
+PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "1.0"))
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET")
+PROFILE_HEADER = "x-owl-profile"
+PROFILER = os.environ.get("PROFILER", "cprofile").lower()
+PROFILE_SINK = os.environ.get("PROFILE_SINK", "/tmp/profiles")
+# Functions and allocation sites listed in the summary
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "25"))
+# How long a signed header stays valid by default
+SIGNATURE_TTL_SECONDS = 300
+
+# Held while an invocation is profiled; tracemalloc and the profilers are per process
+_profiling = threading.Lock()
+_s3_client = None
+
+
+def sign(secret: str, ttl_seconds: int = SIGNATURE_TTL_SECONDS, now: float = None) -> str:
+    """
+    A Utility Function that makes an X-Owl-Profile header value
+
+    Input:
+        secret = the PROFILE_SECRET of the environment to profile
+        ttl_seconds = how long the header is accepted for
+
+    Output:
+        returns "<expiry>.<signature>", the expiry in epoch seconds
+    """
+    expires = int((now or time.time()) + ttl_seconds)
+    signature = hmac.new(secret.encode("utf-8"), str(expires).encode("ascii"), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify(value: str, secret: str, now: float = None) -> bool:
+    """
+    A Utility Function that checks an X-Owl-Profile header value against the secret
+
+    Output:
+        returns True if it was signed with the secret and hasn't expired
+    """
+    expires, _, signature = (value or "").partition(".")
+    if not expires.isdigit() or int(expires) < (now or time.time()):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), expires.encode("ascii"), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def trigger(event) -> str:
+    """
+    A Utility Function that decides whether an invocation is profiled
+
+    Output:
+        returns "header" or "sampled" for profiled invocations, otherwise None
+    """
+    if PROFILE_SECRET and isinstance(event, dict) and event.get("headers"):
+        value = next((value for name, value in event["headers"].items() if name.lower() == PROFILE_HEADER), None)
+        if value is not None:
+            if verify(value, PROFILE_SECRET):
+                return "header"
+            logger.warning("Ignoring a profiling header with an invalid or expired signature")
+    if PROFILE_ENABLED and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class Profile:
+    """
+    The profiler and allocation tracing of one invocation
+    """
+
+    def __init__(self, profiler: str = PROFILER):
+        self.profiler = None
+        if profiler == "pyinstrument":
+            try:
+                # pyinstrument is optional; cProfile is always available
+                from pyinstrument import Profiler
+                self.profiler = Profiler(interval=0.001)
+                self.kind = "pyinstrument"
+            except ImportError:
+                logger.warning("pyinstrument is not installed, profiling with cProfile")
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.kind = "cprofile"
+
+    def start(self) -> None:
+        tracemalloc.start()
+        self.start_time = time.perf_counter()
+        if self.kind == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self) -> None:
+        if self.kind == "pyinstrument":
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+        self.duration_ms = round((time.perf_counter() - self.start_time) * 1000, 3)
+        self.snapshot = tracemalloc.take_snapshot()
+        _, self.peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    def files(self) -> dict:
+        """
+        Returns the profile's files by extension: the raw profile (.prof for pstats or
+        snakeviz, .html for pyinstrument) and a text report
+        """
+        if self.kind == "pyinstrument":
+            return {"html": self.profiler.output_html().encode("utf-8"),
+                    "txt": self.profiler.output_text(unicode=True).encode("utf-8")}
+
+        report = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=report)
+        # Sorting doesn't change stats.stats, which is what gets dumped
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+        # What Profile.dump_stats writes, without going through a file
+        return {"prof": marshal.dumps(stats.stats), "txt": report.getvalue().encode("utf-8")}
+
+    def summary(self, handler: str, request_id: str, trigger: str) -> dict:
+        allocations = [{
+            "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "kb": round(stat.size / 1024, 1),
+            "count": stat.count
+        } for stat in self.snapshot.statistics("lineno")[:PROFILE_TOP_N]]
+
+        summary = {
+            "handler": handler,
+            "request_id": request_id,
+            "trigger": trigger,
+            "profiler": self.kind,
+            "duration_ms": self.duration_ms,
+            "peak_traced_kb": round(self.peak_bytes / 1024, 1),
+            "allocations": allocations
+        }
+        if self.kind == "cprofile":
+            stats = pstats.Stats(self.profiler)
+            slowest = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_N]
+            summary["functions"] = [{
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "own_ms": round(own * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3)
+            } for (filename, line, name), (_, calls, own, cumulative, _) in slowest]
+        return summary
+
+
+def write(name: str, data: bytes) -> str:
+    """
+    A Utility Function that writes one profile file to PROFILE_SINK
+
+    Input:
+        name = the file's path under the sink
+
+    Output:
+        returns where it was written, a path or an s3:// URI
+    """
+    global _s3_client
+    if PROFILE_SINK.startswith("s3://"):
+        bucket, _, prefix = PROFILE_SINK[len("s3://"):].partition("/")
+        key = f"{prefix.rstrip('/')}/{name}" if prefix else name
+        if _s3_client is None:
+            import boto3
+            _s3_client = boto3.client("s3")
+        _s3_client.put_object(Bucket=bucket, Key=key, Body=data)
+        return f"s3://{bucket}/{key}"
+
+    path = os.path.join(PROFILE_SINK, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
+
+
+def profiled_handler(handler, name: str = None):
+    """
+    A Utility Function that wraps a lambda_handler so invocations picked by trigger()
+    are profiled. trace_util.traced_handler applies it to every traced handler
+
+    Input:
+        handler = the lambda_handler(event, context) function
+        name = the handler's name in the sink's paths, its module by default
+
+    Output:
+        returns the wrapped handler
+    """
+    name = name or handler.__module__
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not (PROFILE_ENABLED or PROFILE_SECRET):
+            return handler(event, context)
+        reason = trigger(event)
+        if reason is None or not _profiling.acquire(blocking=False):
+            return handler(event, context)
+
+        try:
+            request_id = getattr(context, "aws_request_id", None) or str(uuid.uuid4())
+            profile = Profile()
+            try:
+                profile.start()
+            except ValueError as e:
+                # Another profiler (a debugger, coverage) already owns the hooks
+                tracemalloc.stop()
+                logger.warning(f"Could not start profiling: {e}")
+                return handler(event, context)
+            try:
+                return handler(event, context)
+            finally:
+                profile.stop()
+                save(profile, name, request_id, reason)
+        finally:
+            _profiling.release()
+
+    return wrapper
+
+
+def save(profile: Profile, handler: str, request_id: str, reason: str) -> None:
+    """
+    A Utility Function that writes a finished profile and its summary to the sink and
+    notes where on the running trace. Failures are logged, never raised, so the
+    invocation's response is unaffected
+    """
+    prefix = f"{handler}/{time.strftime('%Y-%m-%d')}/{request_id}"
+    try:
+        summary = profile.summary(handler, request_id, reason)
+        for extension, data in profile.files().items():
+            summary.setdefault("files", []).append(write(f"{prefix}.{extension}", data))
+        location = write(f"{prefix}.json", json.dumps(summary, indent=2).encode("utf-8"))
+    except Exception as e:
+        logger.exception(f"Could not save the profile of {request_id}: {e}")
+        return
+
+    logger.info(f"Profiled {handler} ({reason}) in {profile.duration_ms} ms, written to {location}")
+    import trace_util
+    trace = trace_util.current_trace()
+    if trace is not None:
+        trace.profile = location
@@ -0,0 +1,125 @@
+import logging
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# Error codes AWS services use when a caller is going too fast, or failed on their side
+RETRYABLE_ERROR_CODES = {
+    "TooManyRequestsException",
+    "ThrottlingException",
+    "Throttling",
+    "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException",
+    "InternalErrorException",
+    "ServiceUnavailable"
+}
+MAX_ATTEMPTS = 6
+BASE_DELAY_SECONDS = 0.2
+MAX_DELAY_SECONDS = 5.0
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: rate tokens are added per second, up to capacity, and
+    each call takes one. Shared by worker threads to keep a service under its quota
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Takes the tokens if they are available. Returns 0 on success, otherwise the
+        seconds until they will be
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: float = None) -> bool:
+        """
+        Waits for the tokens. Returns False if they weren't available within timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def set_rate(self, rate: float, capacity: float = None) -> None:
+        """
+        Changes the refill rate, e.g. as an adaptive limiter backs off. Tokens earned
+        so far are kept, up to the new capacity
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.capacity = capacity if capacity is not None else max(1.0, rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def penalize(self, tokens: float = 1.0) -> None:
+        """
+        Drains tokens after the service throttled us, so every worker slows down
+        rather than only the one that was refused
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+
+
+def backoff_delay(attempt: int, base: float = BASE_DELAY_SECONDS, cap: float = MAX_DELAY_SECONDS) -> float:
+    """
+    A Utility Function that returns the "full jitter" exponential backoff delay for a
+    retry: a random time up to base * 2^attempt, capped
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_backoff(function, *args, bucket: TokenBucket = None, max_attempts: int = MAX_ATTEMPTS,
+                      retry_codes: set = RETRYABLE_ERROR_CODES, **kwargs):
+    """
+    A Utility Function that calls an AWS client method under a rate limit, retrying
+    throttling and transient errors with jittered exponential backoff
+
+    Input:
+        function = the client method, e.g. cognito_client.admin_create_user
+        bucket = the TokenBucket to take a token from before each attempt, if any
+        max_attempts = the most calls to make
+        retry_codes = the error codes worth retrying
+        args, kwargs = the method's arguments
+
+    Output:
+        returns the method's response. Raises the last ClientError once attempts run
+        out, and other errors straight away
+    """
+    for attempt in range(max_attempts):
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            return function(*args, **kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in retry_codes or attempt == max_attempts - 1:
+                raise
+            if bucket is not None:
+                bucket.penalize()
+            delay = backoff_delay(attempt)
+            logger.info(f"{code} from {getattr(function, '__name__', 'call')}, retrying in {delay:.2f}s")
+            time.sleep(delay)
@@ -0,0 +1,30 @@
+"""
+Reading the JSON body of API Gateway proxy requests.
+
+router.py parses a body once to reject ones that aren't JSON, and passes the result
+on in the event under PARSED_BODY_KEY, so a handler doesn't parse a large body (base64
+pages or documents) a second time. Events straight from API Gateway don't have it and
+are parsed here.
+"""
+import json
+
+PARSED_BODY_KEY = "parsedBody"
+
+
+def request_body(event: dict, default=None):
+    """
+    A Utility Function that returns the request's JSON body, parsed
+
+    Input:
+        event = the API Gateway proxy event
+        default = returned when the request has no body; without one, a missing body
+                  is an error as for json.loads
+
+    Output:
+        returns the parsed body. Raises ValueError if it isn't JSON
+    """
+    if PARSED_BODY_KEY in event:
+        return event[PARSED_BODY_KEY]
+    if default is not None and not event.get("body"):
+        return default
+    return json.loads(event["body"])
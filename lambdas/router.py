@@ -0,0 +1,233 @@
+"""
+Routes API Gateway proxy events to the existing handlers, so the whole API can run in
+one process: the local server in scripts/local_server.py uses it, and it can be
+deployed as a single function with router.lambda_handler as the handler behind a
+{proxy+} resource (every handler module and its dependencies bundled with it).
+
+Paths are the ones in src/globals.tsx, relative to ROUTE_PREFIX. The router answers
+CORS preflights for every route itself, rejects bodies that aren't JSON (passing the
+parsed body on to the handler, see request_util), and runs the API authorizer on the
+routes API Gateway protects, unless the event has already been authorized by the
+gateway.
+"""
+import base64
+import fnmatch
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+from request_util import PARSED_BODY_KEY
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+LAMBDAS = os.path.dirname(os.path.abspath(__file__))
+# When running from the repository the handlers sit in their folders; a monolith
+# bundle has them next to this file
+for folder in ("auth", "documents", os.path.join("documents", "OCRPackage"), "users"):
+    path = os.path.join(LAMBDAS, folder)
+    if os.path.isdir(path) and path not in sys.path:
+        sys.path.append(path)
+
+# The API's base path; anything before it (such as the stage) is ignored
+ROUTE_PREFIX = os.environ.get("ROUTE_PREFIX", "/api/v1")
+# Set to "false" when something in front of the router already checks tokens
+AUTHORIZE = os.environ.get("ROUTER_AUTHORIZE", "true").lower() != "false"
+# API Gateway's payload limit
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Path to the handler module of each method
+ROUTES = {
+    "/auth/login": {"POST": "login"},
+    "/auth/register": {"POST": "register"},
+    "/auth/register/bulk": {"POST": "bulk_register"},
+    "/documents/OCR": {"POST": "getOCRDataLambda"},
+    "/documents/OCR/jobs": {"GET": "get_ocr_job", "POST": "submit_ocr_job"},
+    "/documents/s3": {"GET": "get_document_objects", "POST": "postFormLambda", "PUT": "updateDocLambda"},
+    "/documents/rds": {"GET": "get_documents_by_userid", "POST": "create_document", "PUT": "updateDocument",
+                       "DELETE": "delete_document"},
+    "/documents/docxpdf": {"POST": "docx_to_pdf"},
+    "/documents/docxfields": {"POST": "docx_extract"},
+    "/documents/pdfimages": {"POST": "pdf_to_images"},
+    "/documents/imagespdf": {"POST": "images_to_pdf"},
+    "/documents/compresspdf": {"POST": "compress_pdf"},
+    "/documents/compressimage": {"POST": "compress_image"},
+    "/documents/resizeimage": {"POST": "image_resize"},
+    "/users": {"GET": "get_user", "DELETE": "delete_user"},
+}
+# Routes API Gateway serves without the authorizer
+PUBLIC_ROUTES = {"/auth/login", "/auth/register"}
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+
+def cors_headers(path: str) -> dict:
+    """
+    A Utility Function that returns the CORS headers of a route, allowing its methods
+    """
+    return {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Headers": "Content-Type,Authorization",
+        "Access-Control-Allow-Methods": ",".join(["OPTIONS"] + sorted(ROUTES.get(path, {})))
+    }
+
+
+def respond(status_code: int, path: str, body: dict, headers: dict = None) -> dict:
+    """
+    A Utility Function that builds the router's own proxy responses
+    """
+    return {
+        "statusCode": status_code,
+        "headers": dict(cors_headers(path), **(headers or {})),
+        "body": json.dumps(body)
+    }
+
+
+def route_path(path: str) -> str:
+    """
+    A Utility Function that turns a request path into a ROUTES key: the part after
+    ROUTE_PREFIX, without a trailing slash
+    """
+    path = (path or "/").split("?", 1)[0]
+    index = path.find(ROUTE_PREFIX + "/")
+    if index != -1:
+        path = path[index + len(ROUTE_PREFIX):]
+    return path.rstrip("/") or "/"
+
+
+def get_handler(module_name: str):
+    """
+    A Utility Function that imports a handler module on its route's first request
+
+    Output:
+        returns the module's lambda_handler
+    """
+    handler = _handlers.get(module_name)
+    if handler is None:
+        with _handlers_lock:
+            handler = _handlers.get(module_name)
+            if handler is None:
+                handler = importlib.import_module(module_name).lambda_handler
+                _handlers[module_name] = handler
+    return handler
+
+
+def warm(paths=None) -> list:
+    """
+    A Utility Function that imports the handlers of the given routes (all by default)
+    ahead of their first request
+
+    Output:
+        returns the module names imported
+    """
+    modules = sorted({module for path in (paths or ROUTES) for module in ROUTES[path].values()})
+    for module in modules:
+        get_handler(module)
+    return modules
+
+
+def authorize(event: dict, method: str, path: str):
+    """
+    A Utility Function that runs the API authorizer on the request's Authorization
+    header, as API Gateway does before calling a protected route
+
+    Output:
+        returns the authorizer context for requestContext, None if the token was
+        rejected, or False if the policy doesn't let it call this route
+    """
+    headers = {key.lower(): value for key, value in (event.get("headers") or {}).items()}
+    region = os.environ.get("AWS_REGION", "us-east-2")
+    method_arn = f"arn:aws:execute-api:{region}:000000000000:local/local/{method}{ROUTE_PREFIX}{path}"
+    authorizer_event = {
+        "type": "TOKEN",
+        "authorizationToken": headers.get("authorization") or "",
+        "methodArn": method_arn
+    }
+    try:
+        policy = get_handler("api_authorizer")(authorizer_event, None)
+    except Exception as e:
+        if str(e) != "Unauthorized":
+            logger.exception(f"Authorizer failed: {e}")
+        return None
+
+    def matches(effect):
+        # An explicit Deny wins over any Allow, as in API Gateway
+        return any(statement.get("Effect") == effect
+                   and any(fnmatch.fnmatchcase(method_arn, resource) for resource in statement.get("Resource", []))
+                   for statement in policy.get("policyDocument", {}).get("Statement", []))
+
+    if matches("Deny") or not matches("Allow"):
+        return False
+    return dict(policy.get("context") or {}, principalId=policy.get("principalId"))
+
+
+def dispatch(event: dict, context) -> dict:
+    """
+    A Utility Function that calls the handler for the event's method and path
+
+    Input:
+        event = an API Gateway proxy event (httpMethod, path, headers, body, ...)
+        context = the Lambda context, passed on to the handler
+
+    Output:
+        returns the handler's proxy response, or the router's own for preflights,
+        unknown routes, invalid bodies and rejected tokens
+    """
+    method = (event.get("httpMethod") or "GET").upper()
+    path = route_path(event.get("path") or event.get("resource"))
+    methods = ROUTES.get(path)
+
+    if methods is None:
+        return respond(404, path, {"message": "Not Found"})
+    if method == "OPTIONS":
+        return respond(200, path, {"message": "CORS preflight success"})
+    if method not in methods:
+        return respond(405, path, {"message": "Method Not Allowed"}, {"Allow": ",".join(sorted(methods))})
+
+    body = event.get("body")
+    if body is not None:
+        if event.get("isBase64Encoded"):
+            try:
+                body = base64.b64decode(body).decode("utf-8")
+            except (ValueError, UnicodeDecodeError):
+                return respond(400, path, {"message": "Request body is not valid JSON"})
+            event = dict(event, body=body, isBase64Encoded=False)
+        if len(body) > MAX_BODY_BYTES:
+            return respond(413, path, {"message": "Request body is too large"})
+        if body.strip():
+            try:
+                # Handed on so the handler doesn't parse it again, see request_util
+                event = dict(event, **{PARSED_BODY_KEY: json.loads(body)})
+            except ValueError:
+                return respond(400, path, {"message": "Request body is not valid JSON"})
+
+    request_context = event.get("requestContext") or {}
+    if AUTHORIZE and path not in PUBLIC_ROUTES and not request_context.get("authorizer"):
+        authorizer_context = authorize(event, method, path)
+        if authorizer_context is None:
+            return respond(401, path, {"message": "Unauthorized"})
+        if authorizer_context is False:
+            return respond(403, path, {"message": "User is not authorized to access this resource"})
+        event = dict(event, requestContext=dict(request_context, authorizer=authorizer_context))
+
+    try:
+        response = get_handler(methods[method])(event, context)
+    except Exception as e:
+        logger.exception(f"{methods[method]} failed on {method} {path}: {e}")
+        return respond(500, path, {"message": "Internal Server Error", "error": str(e)})
+
+    if not isinstance(response, dict) or "statusCode" not in response:
+        logger.error(f"{methods[method]} returned a response without a statusCode")
+        return respond(502, path, {"message": "Internal server error"})
+    response["headers"] = dict(cors_headers(path), **(response.get("headers") or {}))
+    return response
+
+
+def lambda_handler(event, context):
+    """
+    Handles the lambda for the whole API as a single function
+    """
+    return dispatch(event, context)
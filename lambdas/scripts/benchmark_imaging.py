@@ -0,0 +1,89 @@
+"""
+Benchmarks the imaging backends against each other on the work image_resize and
+compress_image do: decode, resize to US Letter width, classify and encode.
+
+Usage (from the lambdas folder):
+    python scripts/benchmark_imaging.py [--runs 5] [--backends pillow vips] [image ...]
+
+Without files, a synthetic 12 megapixel phone photo and a 600 DPI A4 text scan are
+generated. Backends that aren't installed are skipped.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from benchmark_resize import synthetic_photo
+from imaging_backend import get_backend, BACKENDS
+
+LETTER_WIDTH = int(8.5 * 200)
+
+
+def synthetic_scan(width: int = 4960, height: int = 7016) -> bytes:
+    """
+    Builds a grayscale PNG of a typed page, the size of an A4 page scanned at 600 DPI
+    """
+    page = Image.new("L", (width, height), 245)
+    draw = ImageDraw.Draw(page)
+    for top in range(300, height - 300, 90):
+        draw.text((300, top), "Membership application, section 4: applicant details " * 3, fill=0, font_size=56)
+    buffer = BytesIO()
+    page.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def resize(backend, image_data: bytes) -> bytes:
+    image, source_format, _ = backend.decode(image_data, LETTER_WIDTH)
+    resized = backend.resize_to_width(image, LETTER_WIDTH)
+    return backend.encode_for_content(resized, backend.classify(resized), source_format)[0]
+
+
+def compress(backend, image_data: bytes) -> bytes:
+    image, source_format, _ = backend.decode(image_data)
+    return backend.encode_for_content(image, backend.classify(image), source_format, 60)[0]
+
+
+def time_runs(function, backend, image_data: bytes, runs: int) -> tuple:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = function(backend, image_data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="images to benchmark, defaults to a synthetic photo and scan")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=sorted(BACKENDS), choices=sorted(BACKENDS))
+    args = parser.parse_args()
+
+    backends = []
+    for name in args.backends:
+        backend = get_backend(name)
+        if backend.name != name:
+            print(f"{name}: not installed, skipped")
+            continue
+        backends.append(backend)
+
+    samples = [(path, open(path, "rb").read()) for path in args.files] or [
+        ("synthetic photo 4032x3024 JPEG", synthetic_photo()),
+        ("synthetic scan 4960x7016 PNG", synthetic_scan())
+    ]
+
+    for name, image_data in samples:
+        print(f"{name} ({len(image_data)} bytes), median of {args.runs}:")
+        for operation in (resize, compress):
+            results = {backend.name: time_runs(operation, backend, image_data, args.runs) for backend in backends}
+            line = ", ".join(f"{engine} {ms:.0f} ms ({size} bytes)" for engine, (ms, size) in results.items())
+            print(f"  {operation.__name__}: {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmarks image_resize's fast path (JPEG draft decoding, reduce() pre-shrink and
+EXIF transpose) against a full decode followed by a single LANCZOS resize.
+
+Usage (from the lambdas folder):
+    python scripts/benchmark_resize.py [--runs 5] [--width 1700] [photo.jpg ...]
+
+Without files, a synthetic 12 megapixel phone photo is generated.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+from image_util import decode_for_width, resize_to_width
+
+
+def synthetic_photo(width: int = 4032, height: int = 3024) -> bytes:
+    """
+    Builds a JPEG with gradients and sensor-like noise, similar in size to a phone photo
+    """
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=2)
+    pixels += rng.normal(0, 6, pixels.shape)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def baseline_resize(image_data: bytes, width: int) -> Image.Image:
+    image = Image.open(BytesIO(image_data))
+    height = int(image.height * width / image.width)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def fast_resize(image_data: bytes, width: int) -> Image.Image:
+    image, _ = decode_for_width(image_data, width)
+    return resize_to_width(image, width)
+
+
+def time_runs(function, image_data: bytes, width: int, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(image_data, width)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="images to benchmark, defaults to a synthetic photo")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--width", type=int, default=int(8.5 * 200))
+    args = parser.parse_args()
+
+    samples = [(path, open(path, "rb").read()) for path in args.files] or [("synthetic 4032x3024", synthetic_photo())]
+
+    for name, image_data in samples:
+        baseline = time_runs(baseline_resize, image_data, args.width, args.runs)
+        fast = time_runs(fast_resize, image_data, args.width, args.runs)
+        baseline_ms, fast_ms = statistics.median(baseline), statistics.median(fast)
+        print(f"{name}: baseline {baseline_ms:.1f} ms, fast path {fast_ms:.1f} ms, "
+              f"speedup {baseline_ms / fast_ms:.1f}x (median of {args.runs})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Measures each handler's cold start, the way a new Lambda container pays for it, and
+fails when one is over its budget.
+
+Every run starts a fresh interpreter with -X importtime, imports the handler module
+and, if it handles CORS preflights, answers one. Nothing else is invoked, so handlers
+like the authorizer are only imported. A handler fails when:
+- the median import time is over its budget in cold_start_budgets.json, or
+- the import or the preflight loaded a heavy dependency (OpenCV, NumPy, PyMuPDF,
+  ...), which should only load on first use through lazy_util.
+
+Usage (from the lambdas folder):
+    python scripts/cold_start.py [--runs 5] [--budgets scripts/cold_start_budgets.json] [--json] [handler ...]
+
+Handlers are paths relative to the lambdas folder, e.g. documents/pdf_to_images.py.
+By default every module with a lambda_handler outside scripts/ is measured. Run it in an environment
+with the deployment's packages and layers installed.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+LAMBDAS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGETS = os.path.join(LAMBDAS, "scripts", "cold_start_budgets.json")
+# Top-level modules neither loading a handler nor a preflight may import
+HEAVY_MODULES = ("adobe", "cv2", "fitz", "numpy", "PIL", "pypdf", "pyvips", "zxingcpp")
+# Slowest imports listed for a handler that fails
+SLOWEST_SHOWN = 5
+
+HANDLER = re.compile(r"^def lambda_handler\(", re.MULTILINE)
+PREFLIGHT = re.compile(r"httpMethod[\"']\)\s*==\s*[\"']OPTIONS")
+
+# Runs inside the fresh interpreter: argv[1] is the handler's folder, argv[2] its
+# module and argv[3] "1" when it handles preflights
+PROBE = """
+import json, sys, time
+sys.path[:0] = [sys.argv[1], {lambdas!r}]
+start = time.perf_counter()
+# __import__ rather than importlib, which -X importtime doesn't report
+module = __import__(sys.argv[2])
+imported = time.perf_counter()
+response = None
+if sys.argv[3] == "1":
+    response = module.lambda_handler({{"httpMethod": "OPTIONS", "headers": {{}}, "body": None}}, None)
+answered = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "options_ms": (answered - imported) * 1000,
+    "status": response.get("statusCode") if isinstance(response, dict) else None,
+    "heavy": sorted(name for name in {heavy!r} if name in sys.modules)
+}}))
+"""
+
+
+def find_handlers() -> list:
+    """
+    A Utility Function that lists every module under the lambdas folder that defines
+    a lambda_handler, as paths relative to it. The scripts are left out, since their
+    handlers reset or seed environments
+    """
+    handlers = []
+    for folder, folders, files in os.walk(LAMBDAS):
+        folders[:] = [name for name in folders if name not in ("__pycache__", "scripts")]
+        for name in files:
+            path = os.path.join(folder, name)
+            if name.endswith(".py") and HANDLER.search(open(path, encoding="utf-8").read()):
+                handlers.append(os.path.relpath(path, LAMBDAS).replace(os.sep, "/"))
+    return sorted(handlers)
+
+
+def parse_importtime(stderr: str, module: str) -> list:
+    """
+    A Utility Function that reads the -X importtime report of a probe run
+
+    Output:
+        returns (milliseconds, name) for each import made while loading the handler,
+        cumulative (including the imports it made itself), slowest first
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((int(cumulative) / 1000, name.rstrip()))
+
+    # Imports are reported as they finish, so the handler's own line comes after
+    # everything it pulled in
+    handler_index = next((index for index, (_, name) in enumerate(entries) if name.strip() == module), None)
+    if handler_index is None:
+        return []
+    depth = len(entries[handler_index][1]) - len(entries[handler_index][1].lstrip())
+    start = handler_index
+    while start > 0 and len(entries[start - 1][1]) - len(entries[start - 1][1].lstrip()) > depth:
+        start -= 1
+    # Nesting is shown with two more spaces per level; only the direct imports are kept
+    loaded = [(ms, name.strip()) for ms, name in entries[start:handler_index]
+              if len(name) - len(name.lstrip()) == depth + 2]
+    return sorted(loaded, reverse=True)
+
+
+def measure(handler: str, runs: int) -> dict:
+    """
+    A Utility Function that cold starts a handler runs times in fresh interpreters
+
+    Output:
+        returns the median import and preflight times, the heavy modules the
+        preflight loaded and the slowest imports of the median run, or the error
+    """
+    folder = os.path.join(LAMBDAS, os.path.dirname(handler))
+    module = os.path.splitext(os.path.basename(handler))[0]
+    probe = PROBE.format(lambdas=LAMBDAS, heavy=HEAVY_MODULES)
+    with open(os.path.join(LAMBDAS, handler), encoding="utf-8") as file:
+        preflight = "1" if PREFLIGHT.search(file.read()) else "0"
+    env = dict(os.environ)
+    # Module level clients need a region, not credentials
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", probe, folder, module, preflight],
+                                   capture_output=True, text=True, cwd=LAMBDAS, env=env)
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()
+            return {"handler": handler, "error": error[-1] if error else f"exit code {completed.returncode}"}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result["slowest"] = parse_importtime(completed.stderr, module)[:SLOWEST_SHOWN]
+        samples.append(result)
+
+    samples.sort(key=lambda sample: sample["import_ms"])
+    median = samples[len(samples) // 2]
+    return {
+        "handler": handler,
+        "import_ms": round(statistics.median(sample["import_ms"] for sample in samples), 1),
+        "options_ms": round(statistics.median(sample["options_ms"] for sample in samples), 2) if preflight == "1" else None,
+        "status": median["status"],
+        "heavy": sorted(set(name for sample in samples for name in sample["heavy"])),
+        "slowest": [(round(ms, 1), name) for ms, name in median["slowest"]]
+    }
+
+
+def check(result: dict, budgets: dict) -> list:
+    """
+    A Utility Function that lists the reasons a measured handler fails, if any
+    """
+    if "error" in result:
+        return [f"could not be loaded: {result['error']}"]
+    problems = []
+    budget = budgets.get("handlers", {}).get(result["handler"], budgets.get("default_ms"))
+    result["budget_ms"] = budget
+    if budget is not None and result["import_ms"] > budget:
+        problems.append(f"import took {result['import_ms']} ms, budget is {budget} ms")
+    if result["heavy"]:
+        problems.append(f"{'the preflight' if result['options_ms'] is not None else 'the import'} loaded "
+                        f"{', '.join(result['heavy'])}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handlers", nargs="*", help="handler paths relative to the lambdas folder")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per handler, the median is used")
+    parser.add_argument("--budgets", default=DEFAULT_BUDGETS)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    with open(args.budgets, encoding="utf-8") as file:
+        budgets = json.load(file)
+
+    failures = 0
+    results = []
+    for handler in args.handlers or find_handlers():
+        result = measure(handler, args.runs)
+        result["problems"] = check(result, budgets)
+        failures += bool(result["problems"])
+        results.append(result)
+
+        if args.json:
+            continue
+        if "error" in result:
+            print(f"FAIL {handler}: {result['problems'][0]}")
+            continue
+        print(f"{'FAIL' if result['problems'] else 'ok  '} {handler}: import {result['import_ms']} ms "
+              f"(budget {result['budget_ms']} ms)"
+              + (f", preflight {result['options_ms']} ms" if result["options_ms"] is not None else ""))
+        for problem in result["problems"]:
+            print(f"     {problem}")
+        if result["problems"]:
+            for ms, name in result["slowest"]:
+                print(f"       {ms:8.1f} ms  {name}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(results) - failures} of {len(results)} handlers within budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,614 @@
+"""
+Replays a weighted mix of API requests (upload, OCR, list, fetch) at a set
+concurrency or arrival rate, and reports latency percentiles, throughput and errors
+per endpoint, from HDR histograms.
+
+The target is either a deployed API (--url, e.g. the SERVER_URL in src/globals.tsx)
+or, with --local, the whole API in this process through router.py with AWS replaced
+by the fakes in local_fakes.py. The test user signs in once and its token is used
+for every request.
+
+Without --rate, each of --concurrency workers sends requests back to back (closed
+loop). With --rate, operations arrive at that many per second whatever the response
+times (open loop, Poisson arrivals), run by up to --concurrency workers. Operation
+latency is then measured from the arrival, so queueing behind a saturated API shows
+up instead of being hidden. --steps runs one stage per concurrency level and
+reports where the API stops keeping up.
+
+Usage (from the lambdas folder):
+    python scripts/load_test.py --local [--mix upload=1,ocr=1,list=4,fetch=4] [--concurrency 16]
+                                [--rate 50] [--duration 30] [--textract-latency 0.5]
+    python scripts/load_test.py --url https://.../test/api/v1 --steps 1,2,4,8,16,32 [--slo-ms 3000]
+                                [--max-error-rate 0.01] [--hgrm-dir results] [--json]
+
+Upload is create_document then postFormLambda, as the frontend does; fetch reads back
+one of the documents uploaded by this run.
+"""
+import argparse
+import base64
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+LAMBDAS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("", "scripts"):
+    sys.path.insert(0, os.path.join(LAMBDAS, folder))
+
+# The account the API tests sign in with
+TEST_USER = {"email": "aTestUser@gmail.com", "password": "P@ssword123"}
+DEFAULT_MIX = "upload=1,ocr=1,list=4,fetch=4"
+# Documents uploaded before the run, so fetches have something to read
+PRELOADED_DOCUMENTS = 5
+REQUEST_TIMEOUT_SECONDS = 30
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    An HDR histogram of latencies in microseconds: values are bucketed with three
+    significant digits over any range, so percentiles are exact to 0.1% whatever the
+    spread, at a fixed cost per value. Compatible with HdrHistogram's .hgrm output
+    """
+
+    # 2048 sub-buckets per power of two keep three significant digits
+    SUB_BUCKET_HALF_MAGNITUDE = 10
+    SUB_BUCKET_HALF = 1 << SUB_BUCKET_HALF_MAGNITUDE
+    SUB_BUCKET_COUNT = 2 * SUB_BUCKET_HALF
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.sum = 0
+        self.sum_squares = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        bucket = max(0, value.bit_length() - self.SUB_BUCKET_HALF_MAGNITUDE - 1)
+        return ((bucket + 1) << self.SUB_BUCKET_HALF_MAGNITUDE) + (value >> bucket) - self.SUB_BUCKET_HALF
+
+    def _value_range(self, index: int) -> tuple:
+        # The lowest and highest values that share the index
+        bucket = (index >> self.SUB_BUCKET_HALF_MAGNITUDE) - 1
+        sub_bucket = (index & (self.SUB_BUCKET_HALF - 1)) + self.SUB_BUCKET_HALF
+        if bucket < 0:
+            sub_bucket -= self.SUB_BUCKET_HALF
+            bucket = 0
+        low = sub_bucket << bucket
+        return low, low + (1 << bucket) - 1
+
+    def record(self, seconds: float) -> None:
+        value = max(0, int(seconds * 1_000_000))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.sum_squares += value * value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile_ms(self, percentile: float) -> float:
+        """
+        Returns the latency in milliseconds that percentile% of values are at or below
+        """
+        if not self.total:
+            return 0.0
+        target = max(1, math.ceil(percentile / 100 * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._value_range(index)[1], self.max) / 1000
+        return self.max / 1000
+
+    def mean_ms(self) -> float:
+        return self.sum / self.total / 1000 if self.total else 0.0
+
+    def hgrm(self, ticks_per_half_distance: int = 5) -> str:
+        """
+        Returns the percentile distribution in HdrHistogram's .hgrm text format, in
+        milliseconds, for the HdrHistogram plotter and similar tools
+        """
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}", ""]
+        if self.total:
+            step = 0
+            while True:
+                percentile = 100 * (1 - 0.5 ** (step / ticks_per_half_distance))
+                count = min(self.total, max(1, math.ceil(percentile / 100 * self.total)))
+                fraction = count / self.total
+                inverse = f"{1 / (1 - fraction):14.2f}" if fraction < 1 else ""
+                lines.append(f"{self.percentile_ms(percentile):12.3f} {fraction:14.12f} {count:10d} {inverse}".rstrip())
+                if fraction >= 1:
+                    break
+                step += 1
+        variance = self.sum_squares / self.total - (self.sum / self.total) ** 2 if self.total else 0.0
+        lines.append(f"#[Mean    = {self.mean_ms():12.3f}, StdDeviation   = {math.sqrt(max(0.0, variance)) / 1000:12.3f}]")
+        lines.append(f"#[Max     = {self.max / 1000:12.3f}, Total count    = {self.total:12d}]")
+        lines.append(f"#[Buckets = {max([0] + [(index >> self.SUB_BUCKET_HALF_MAGNITUDE) for index in self.counts]):12d}, "
+                     f"SubBuckets     = {self.SUB_BUCKET_COUNT:12d}]")
+        return "\n".join(lines) + "\n"
+
+
+class EndpointStats:
+    """
+    The latencies and outcomes of one endpoint or operation in a stage
+    """
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, error: str = None) -> None:
+        with self.lock:
+            self.histogram.record(seconds)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        count = self.histogram.total
+        errors = sum(self.errors.values())
+        return {
+            "requests": count,
+            "errors": errors,
+            "error_rate": round(errors / count, 4) if count else 0.0,
+            "throughput": round(count / elapsed, 2) if elapsed else 0.0,
+            **{f"p{percentile}_ms": round(self.histogram.percentile_ms(percentile), 2) for percentile in PERCENTILES},
+            "max_ms": round(self.histogram.max / 1000, 2),
+            "mean_ms": round(self.histogram.mean_ms(), 2),
+            "error_breakdown": dict(sorted(self.errors.items(), key=lambda item: -item[1]))
+        }
+
+
+class Recorder:
+    """
+    Collects the stats of a stage, by endpoint ("POST /documents/rds") and by
+    operation ("upload")
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, table: dict, name: str) -> EndpointStats:
+        stats = table.get(name)
+        if stats is None:
+            with self.lock:
+                stats = table.setdefault(name, EndpointStats())
+        return stats
+
+    def endpoint(self, name: str) -> EndpointStats:
+        return self._stats(self.endpoints, name)
+
+    def operation(self, name: str) -> EndpointStats:
+        return self._stats(self.operations, name)
+
+
+class HttpTarget:
+    """
+    Sends requests to a deployed API over keep-alive connections, one per worker thread
+    """
+
+    def __init__(self, base_url: str, timeout: float = REQUEST_TIMEOUT_SECONDS):
+        url = urlsplit(base_url.rstrip("/"))
+        self.https = url.scheme == "https"
+        self.netloc = url.netloc
+        self.prefix = url.path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            kind = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            connection = self.local.connection = kind(self.netloc, timeout=self.timeout)
+        return connection
+
+    def send(self, method: str, path: str, body: dict = None, token: str = None, query: dict = None) -> tuple:
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = token
+        target = self.prefix + path + (f"?{urlencode(query)}" if query else "")
+        payload = json.dumps(body) if body is not None else None
+        connection = self._connection()
+        try:
+            connection.request(method, target, body=payload, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except Exception:
+            # The connection's state is unknown; the next request opens a new one
+            connection.close()
+            self.local.connection = None
+            raise
+
+
+class InProcessTarget:
+    """
+    Calls router.dispatch directly with the API Gateway events local_server.py would
+    build, against the in-memory fakes
+    """
+
+    def __init__(self, textract_latency: float = 0.0):
+        # One EMF line per invocation would drown the report
+        os.environ.setdefault("TRACE_ENABLED", "false")
+        os.environ.pop("COGNITO_USER_POOL_ID", None)
+        os.environ.pop("COGNITO_CLIENT_ID", None)
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+        import local_fakes
+        local_fakes.install(textract=local_fakes.FakeTextract(textract_latency))
+        from seed_data import seed
+        seed(0, 0)
+
+        import local_server
+        import router
+        self.to_event = local_server.to_event
+        self.context = local_server.LocalContext
+        self.dispatch = router.dispatch
+        self.prefix = router.ROUTE_PREFIX
+
+    def send(self, method: str, path: str, body: dict = None, token: str = None, query: dict = None) -> tuple:
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = token
+        target = self.prefix + path + (f"?{urlencode(query)}" if query else "")
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        response = self.dispatch(self.to_event(method, target, headers, payload, "127.0.0.1"), self.context())
+        return int(response.get("statusCode", 200)), (response.get("body") or "").encode("utf-8")
+
+
+class Session:
+    """
+    The signed in test user and the documents this run uploaded
+    """
+
+    def __init__(self, target, recorder: Recorder = None):
+        self.target = target
+        self.recorder = recorder
+        self.token = None
+        self.user_id = None
+        self.documents = []
+        self.documents_lock = threading.Lock()
+        from filestring import FILESTRING
+        self.document_base64 = FILESTRING
+        self.page_base64 = synthetic_page()
+
+    def call(self, method: str, path: str, body: dict = None, query: dict = None, authorized: bool = True):
+        """
+        A Utility Function that sends one request and records it under its endpoint
+
+        Output:
+            returns the parsed JSON body of a 2xx response, or None if the request failed
+        """
+        start = time.perf_counter()
+        error = None
+        parsed = None
+        try:
+            status, payload = self.target.send(method, path, body, self.token if authorized else None, query)
+            if status >= 400:
+                error = f"HTTP {status}"
+            else:
+                try:
+                    parsed = json.loads(payload or b"null")
+                except ValueError:
+                    error = "invalid JSON"
+        except Exception as e:
+            error = type(e).__name__
+        if self.recorder is not None:
+            self.recorder.endpoint(f"{method} {path}").record(time.perf_counter() - start, error)
+        return None if error else parsed
+
+    def login(self) -> None:
+        response = self.call("POST", "/auth/login", TEST_USER, authorized=False)
+        if response is None:
+            sys.exit("Could not sign in as the test user")
+        self.token = response["accessToken"]
+        user_info = response.get("user_info") or {}
+        attributes = {attribute["Name"]: attribute["Value"] for attribute in user_info.get("UserAttributes", [])}
+        self.user_id = attributes.get("sub") or user_info.get("Username")
+
+    def upload(self) -> bool:
+        created = self.call("POST", "/documents/rds", {
+            "original_filename": "testform123.pdf",
+            "bucket": "owl-forms",
+            "user_id": self.user_id,
+            "doc_type": "forms",
+            "device": "PC"
+        })
+        if created is None:
+            return False
+        filename = created["data"]["filename"]
+        uploaded = self.call("POST", "/documents/s3", {
+            "file": self.document_base64,
+            "fileName": filename,
+            "type": "forms",
+            "metadata": {"Membership Number:": "1234567", "City": "Vancouver", "Prov": "BC"}
+        })
+        if uploaded is None:
+            return False
+        with self.documents_lock:
+            self.documents.append(filename)
+        return True
+
+    def ocr(self) -> bool:
+        return self.call("POST", "/documents/OCR", {"images": [self.page_base64], "docType": "form"}) is not None
+
+    def list(self) -> bool:
+        return self.call("GET", "/documents/rds", query={"user_id": self.user_id}) is not None
+
+    def fetch(self) -> bool:
+        with self.documents_lock:
+            filename = random.choice(self.documents) if self.documents else None
+        if filename is None:
+            return self.upload()
+        return self.call("GET", "/documents/s3", query={"type": "forms", "filename": filename}) is not None
+
+
+OPERATIONS = ("upload", "ocr", "list", "fetch")
+
+
+def synthetic_page() -> str:
+    """
+    Builds a small JPEG of a form page for the OCR requests, in base64
+    """
+    # Pillow (PIL) is used for image processing.
+    # Licensed under the Pillow License (HPND).
+    # See LICENSE.md for full attribution details.
+    from PIL import Image, ImageDraw
+    page = Image.new("L", (850, 1100), 250)
+    draw = ImageDraw.Draw(page)
+    for top, label in enumerate(["First Name:", "Last Name:", "Date of Birth:", "Address:", "Signature:"]):
+        draw.text((80, 120 + top * 90), label, fill=0, font_size=28)
+        draw.line((320, 150 + top * 90, 760, 150 + top * 90), fill=0, width=2)
+    buffer = BytesIO()
+    page.save(buffer, format="JPEG", quality=80)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def parse_mix(mix: str) -> dict:
+    """
+    A Utility Function that reads a request mix like "upload=1,ocr=1,list=4,fetch=4"
+
+    Output:
+        returns the weight of each operation
+    """
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    if not any(weight > 0 for weight in weights.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return weights
+
+
+def run_operation(session: Session, recorder: Recorder, name: str, started: float) -> None:
+    ok = getattr(session, name)()
+    recorder.operation(name).record(time.perf_counter() - started, None if ok else "failed")
+
+
+def run_stage(session: Session, weights: dict, concurrency: int, rate: float, duration: float,
+              total: int = None, seed_value: int = 0) -> dict:
+    """
+    A Utility Function that runs the mix for one stage of the test
+
+    Input:
+        session = the signed in Session
+        weights = the mix, from parse_mix
+        concurrency = workers sending requests
+        rate = operations started per second (open loop), or None to send back to back
+        duration = the stage's length in seconds
+        total = stop after this many operations instead, if set
+
+    Output:
+        returns the stage's Recorder and elapsed seconds
+    """
+    recorder = Recorder()
+    session.recorder = recorder
+    names, cumulative = list(weights), []
+    for name in names:
+        cumulative.append((cumulative[-1] if cumulative else 0) + weights[name])
+    rng = random.Random(seed_value)
+    rng_lock = threading.Lock()
+    issued = [0]
+
+    def pick():
+        with rng_lock:
+            if total is not None and issued[0] >= total:
+                return None
+            issued[0] += 1
+            point = rng.random() * cumulative[-1]
+        return next(name for name, bound in zip(names, cumulative) if point < bound)
+
+    start = time.perf_counter()
+    deadline = start + duration
+    if rate is None:
+        def worker():
+            while time.perf_counter() < deadline:
+                name = pick()
+                if name is None:
+                    return
+                run_operation(session, recorder, name, time.perf_counter())
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as executor:
+            arrival = start
+            while True:
+                arrival += rng.expovariate(rate)
+                if arrival >= deadline:
+                    break
+                name = pick()
+                if name is None:
+                    break
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                # Latency counts from the scheduled arrival, including any wait for a worker
+                executor.submit(run_operation, session, recorder, name, arrival)
+    elapsed = time.perf_counter() - start
+
+    return {"recorder": recorder, "elapsed": elapsed}
+
+
+def stage_report(stage: dict) -> dict:
+    """
+    A Utility Function that summarises a finished stage by endpoint and operation
+    """
+    recorder, elapsed = stage["recorder"], stage["elapsed"]
+    overall = EndpointStats()
+    for stats in recorder.endpoints.values():
+        overall.histogram.merge(stats.histogram)
+        for error, count in stats.errors.items():
+            overall.errors[error] = overall.errors.get(error, 0) + count
+    return {
+        "concurrency": stage["concurrency"],
+        "rate": stage["rate"],
+        "elapsed_seconds": round(elapsed, 2),
+        "overall": overall.summary(elapsed),
+        "endpoints": {name: stats.summary(elapsed) for name, stats in sorted(recorder.endpoints.items())},
+        "operations": {name: stats.summary(elapsed) for name, stats in sorted(recorder.operations.items())}
+    }
+
+
+def print_stage(report: dict) -> None:
+    load = f"{report['rate']} ops/s" if report["rate"] else "back to back"
+    print(f"\n=== concurrency {report['concurrency']}, {load}, {report['elapsed_seconds']} s ===")
+    header = f"{'':28} {'requests':>8} {'errors':>7} {'req/s':>8} " + \
+             " ".join(f"{'p' + str(percentile):>9}" for percentile in PERCENTILES) + f" {'max':>9}"
+    print(header)
+    for section in ("endpoints", "operations"):
+        rows = report[section].items() if section == "endpoints" else \
+            ((f"op {name}", summary) for name, summary in report[section].items())
+        for name, summary in rows:
+            print(f"{name:28} {summary['requests']:8d} {summary['errors']:7d} {summary['throughput']:8.1f} "
+                  + " ".join(f"{summary[f'p{percentile}_ms']:9.1f}" for percentile in PERCENTILES)
+                  + f" {summary['max_ms']:9.1f}")
+    overall = report["overall"]
+    print(f"{'all requests':28} {overall['requests']:8d} {overall['errors']:7d} {overall['throughput']:8.1f} "
+          + " ".join(f"{overall[f'p{percentile}_ms']:9.1f}" for percentile in PERCENTILES)
+          + f" {overall['max_ms']:9.1f}")
+    for name, summary in report["endpoints"].items():
+        if summary["error_breakdown"]:
+            errors = ", ".join(f"{error} x{count}" for error, count in summary["error_breakdown"].items())
+            print(f"  {name} errors: {errors}")
+
+
+def write_hgrm(directory: str, stage: dict) -> None:
+    """
+    A Utility Function that writes each endpoint's histogram of a stage as a .hgrm file
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, stats in stage["recorder"].endpoints.items():
+        slug = name.replace(" /", "_").replace("/", "_")
+        path = os.path.join(directory, f"c{stage['concurrency']}-{slug}.hgrm")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(stats.histogram.hgrm())
+
+
+def breaking_point(reports: list, slo_ms: float, max_error_rate: float):
+    """
+    A Utility Function that finds the first stage that misses the p99 objective or the
+    error rate limit
+
+    Output:
+        returns the stage's report and the reasons, or None if every stage held up
+    """
+    for report in reports:
+        reasons = []
+        overall = report["overall"]
+        if max_error_rate is not None and overall["error_rate"] > max_error_rate:
+            reasons.append(f"error rate {overall['error_rate']:.2%}")
+        if slo_ms is not None and overall["p99_ms"] > slo_ms:
+            reasons.append(f"p99 {overall['p99_ms']} ms")
+        if reasons:
+            return report, reasons
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a deployed API, up to /api/v1")
+    target.add_argument("--local", action="store_true", help="run the API in this process against the fakes")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=10, help="workers sending requests")
+    parser.add_argument("--steps", help="comma separated concurrency levels to run one after another")
+    parser.add_argument("--rate", type=float, help="operations started per second; back to back if not set")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per stage")
+    parser.add_argument("--requests", type=int, help="operations per stage, instead of running for --duration")
+    parser.add_argument("--textract-latency", type=float, default=0.0, help="seconds each fake Textract call takes")
+    parser.add_argument("--slo-ms", type=float, help="p99 latency a stage must stay under")
+    parser.add_argument("--max-error-rate", type=float, help="error rate a stage must stay under, e.g. 0.01")
+    parser.add_argument("--hgrm-dir", help="write each endpoint's histogram as .hgrm files here")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    try:
+        weights = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    levels = [int(level) for level in args.steps.split(",")] if args.steps else [args.concurrency]
+    duration = math.inf if args.requests else args.duration
+
+    session = Session(InProcessTarget(args.textract_latency) if args.local else HttpTarget(args.url))
+    session.login()
+    if "fetch" in weights:
+        for _ in range(PRELOADED_DOCUMENTS):
+            session.upload()
+
+    reports = []
+    for level in levels:
+        stage = run_stage(session, weights, level, args.rate, duration, args.requests, args.seed)
+        stage.update(concurrency=level, rate=args.rate)
+        report = stage_report(stage)
+        reports.append(report)
+        if args.hgrm_dir:
+            write_hgrm(args.hgrm_dir, stage)
+        if not args.json:
+            print_stage(report)
+
+    broken = breaking_point(reports, args.slo_ms, args.max_error_rate)
+    if args.json:
+        print(json.dumps({"stages": reports, "breaking_concurrency": broken[0]["concurrency"] if broken else None},
+                         indent=2))
+    elif len(reports) > 1 or broken:
+        print()
+        for report in reports:
+            overall = report["overall"]
+            print(f"concurrency {report['concurrency']:4d}: {overall['throughput']:8.1f} req/s, "
+                  f"p99 {overall['p99_ms']:9.1f} ms, errors {overall['error_rate']:.2%}")
+        if broken:
+            print(f"Breaks at concurrency {broken[0]['concurrency']}: {', '.join(broken[1])}")
+        elif args.slo_ms is not None or args.max_error_rate is not None:
+            print("Every stage held up")
+    sys.exit(1 if broken else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+In-memory stand-ins for the AWS services the lambdas use, for seeding, load testing
+and running handlers on a laptop: Cognito (cognito-idp), the RDS Data API (rds-data,
+backed by SQLite) and S3. Each fake implements the client methods the handlers and
+scripts call, with the same request and response shapes and the same ClientError
+codes, including paginators. Textract answers every page with the same few form
+fields after a configurable delay, standing in for its latency.
+
+Usage:
+    import local_fakes
+    fakes = local_fakes.install()   # before importing any handler module
+    import register                 # its boto3.client("cognito-idp") is now a fake
+"""
+import base64
+import io
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+# The tables cognito_reset creates, in SQLite's dialect
+SCHEMA = [
+    "CREATE TABLE users ( user_id VARCHAR(255) NOT NULL PRIMARY KEY, email VARCHAR(255) NOT NULL UNIQUE, firstname VARCHAR(255) NOT NULL, lastname VARCHAR(255) NOT NULL );",
+    "CREATE TABLE documents ( filename VARCHAR(255) NOT NULL, original_filename VARCHAR(255) NOT NULL, bucket VARCHAR(255) NOT NULL, user_id VARCHAR(255) NOT NULL, doc_type VARCHAR(255) NOT NULL, upload_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, category VARCHAR(255) NULL, device VARCHAR(63) NULL, ip VARCHAR(127) NULL, PRIMARY KEY (filename, bucket), FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE );",
+    "CREATE TABLE ocr_leases ( lease_key VARCHAR(64) NOT NULL PRIMARY KEY, owner VARCHAR(36) NOT NULL, expires_at BIGINT NOT NULL, result TEXT NULL );",
+    "CREATE TABLE ocr_jobs ( job_id VARCHAR(36) NOT NULL PRIMARY KEY, principal_id VARCHAR(255) NOT NULL, doc_type VARCHAR(255) NOT NULL, options TEXT NOT NULL, pages INT NOT NULL, status VARCHAR(15) NOT NULL, created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP );",
+    "CREATE TABLE ocr_job_pages ( job_id VARCHAR(36) NOT NULL, page_index INT NOT NULL, status VARCHAR(15) NOT NULL, attempts INT NOT NULL DEFAULT 0, result TEXT NULL, PRIMARY KEY (job_id, page_index), FOREIGN KEY (job_id) REFERENCES ocr_jobs(job_id) ON DELETE CASCADE );"
+]
+
+
+class _Exceptions:
+    """
+    Mirrors client.exceptions: every attribute is a ClientError subclass, so handlers
+    can catch e.g. cognito_client.exceptions.UsernameExistsException
+    """
+
+    def __init__(self):
+        self._classes = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._classes:
+            self._classes[name] = type(name, (ClientError,), {})
+        return self._classes[name]
+
+
+class _Paginator:
+    def __init__(self, method, input_token: str, output_token: str):
+        self.method = method
+        self.input_token = input_token
+        self.output_token = output_token
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            token = page.get(self.output_token)
+            if not token:
+                return
+            kwargs[self.input_token] = token
+
+
+class FakeClient:
+    # Paginated operations by name: (request token, response token)
+    paginators = {}
+
+    def __init__(self):
+        self.exceptions = _Exceptions()
+        self.lock = threading.RLock()
+
+    def error(self, code: str, message: str, operation: str) -> ClientError:
+        return getattr(self.exceptions, code)({"Error": {"Code": code, "Message": message},
+                                               "ResponseMetadata": {"HTTPStatusCode": 400}}, operation)
+
+    def get_paginator(self, operation: str) -> _Paginator:
+        input_token, output_token = self.paginators[operation]
+        return _Paginator(getattr(self, operation), input_token, output_token)
+
+
+def _ok(response: dict = None) -> dict:
+    response = dict(response or {})
+    response["ResponseMetadata"] = {"HTTPStatusCode": 200}
+    return response
+
+
+def _fake_jwt(claims: dict) -> str:
+    """
+    An unsigned token with the given claims, enough for code that only decodes claims
+    """
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{encode({'alg': 'none', 'kid': 'local'})}.{encode(claims)}.local"
+
+
+class FakeCognito(FakeClient):
+    """
+    A user pool keyed by email, with generated usernames like a pool that signs in by
+    email
+    """
+
+    paginators = {"list_users": ("PaginationToken", "PaginationToken")}
+
+    def __init__(self, user_pool_id: str = "local_pool", client_id: str = "local-client"):
+        super().__init__()
+        self.user_pool_id = user_pool_id
+        self.client_id = client_id
+        self.users = {}
+        self.by_email = {}
+        self.groups = {}
+
+    def _find(self, username: str, operation: str) -> dict:
+        user = self.users.get(username) or self.users.get(self.by_email.get(username))
+        if user is None:
+            raise self.error("UserNotFoundException", "User does not exist.", operation)
+        return user
+
+    @staticmethod
+    def _public(user: dict) -> dict:
+        return {key: value for key, value in user.items() if key not in ("password", "groups")}
+
+    def admin_create_user(self, UserPoolId, Username, UserAttributes=(), TemporaryPassword=None, **kwargs):
+        with self.lock:
+            if Username in self.by_email:
+                raise self.error("UsernameExistsException", "An account with the given email already exists.",
+                                 "AdminCreateUser")
+            username = str(uuid.uuid4())
+            now = datetime.now(timezone.utc)
+            user = {
+                "Username": username,
+                "Attributes": [{"Name": "sub", "Value": username}] + list(UserAttributes),
+                "UserCreateDate": now,
+                "UserLastModifiedDate": now,
+                "Enabled": True,
+                "UserStatus": "FORCE_CHANGE_PASSWORD",
+                "password": TemporaryPassword,
+                "groups": []
+            }
+            self.users[username] = user
+            self.by_email[Username] = username
+            return _ok({"User": self._public(user)})
+
+    def admin_set_user_password(self, UserPoolId, Username, Password, Permanent=False):
+        with self.lock:
+            user = self._find(Username, "AdminSetUserPassword")
+            user["password"] = Password
+            user["UserStatus"] = "CONFIRMED" if Permanent else "FORCE_CHANGE_PASSWORD"
+            return _ok()
+
+    def admin_delete_user(self, UserPoolId, Username):
+        with self.lock:
+            user = self._find(Username, "AdminDeleteUser")
+            del self.users[user["Username"]]
+            self.by_email = {email: name for email, name in self.by_email.items() if name != user["Username"]}
+            return _ok()
+
+    def admin_get_user(self, UserPoolId, Username):
+        with self.lock:
+            user = self._find(Username, "AdminGetUser")
+            public = self._public(user)
+            public["UserAttributes"] = public.pop("Attributes")
+            return _ok(public)
+
+    def admin_add_user_to_group(self, UserPoolId, Username, GroupName):
+        with self.lock:
+            user = self._find(Username, "AdminAddUserToGroup")
+            self.groups.setdefault(GroupName, {"GroupName": GroupName, "UserPoolId": UserPoolId})
+            if GroupName not in user["groups"]:
+                user["groups"].append(GroupName)
+            return _ok()
+
+    def admin_list_groups_for_user(self, Username, UserPoolId, **kwargs):
+        with self.lock:
+            user = self._find(Username, "AdminListGroupsForUser")
+            return _ok({"Groups": [self.groups[name] for name in user["groups"]]})
+
+    def list_users(self, UserPoolId, Limit=60, PaginationToken=None, Filter=None, **kwargs):
+        with self.lock:
+            users = list(self.users.values())
+            if Filter:
+                match = re.match(r'\s*(\w+)\s*=\s*"(.*)"\s*$', Filter)
+                if match:
+                    name, value = match.groups()
+                    users = [user for user in users if user["Username"] == value and name == "username"
+                             or {"Name": name, "Value": value} in user["Attributes"]]
+            start = int(PaginationToken or 0)
+            page = users[start:start + Limit]
+            response = {"Users": [self._public(user) for user in page]}
+            if start + Limit < len(users):
+                response["PaginationToken"] = str(start + Limit)
+            return _ok(response)
+
+    def initiate_auth(self, ClientId, AuthFlow, AuthParameters, **kwargs):
+        with self.lock:
+            username = self.by_email.get(AuthParameters.get("USERNAME"))
+            user = self.users.get(username)
+            if user is None or user["password"] != AuthParameters.get("PASSWORD"):
+                raise self.error("NotAuthorizedException", "Incorrect username or password.", "InitiateAuth")
+            now = int(time.time())
+            claims = {"sub": username, "cognito:username": username, "token_use": "id", "aud": ClientId,
+                      "iss": f"local/{self.user_pool_id}", "iat": now, "exp": now + 3600}
+            if user["groups"]:
+                claims["cognito:groups"] = list(user["groups"])
+            for attribute in user["Attributes"]:
+                claims.setdefault(attribute["Name"], attribute["Value"])
+            access_claims = {"sub": username, "username": username, "token_use": "access", "client_id": ClientId,
+                             "iss": claims["iss"], "iat": now, "exp": now + 3600}
+            return _ok({"AuthenticationResult": {
+                "IdToken": _fake_jwt(claims),
+                "AccessToken": _fake_jwt(access_claims),
+                "RefreshToken": str(uuid.uuid4()),
+                "ExpiresIn": 3600,
+                "TokenType": "Bearer"
+            }})
+
+    def get_user(self, AccessToken):
+        try:
+            claims = json.loads(base64.urlsafe_b64decode(AccessToken.split(".")[1] + "=="))
+        except (IndexError, ValueError):
+            raise self.error("NotAuthorizedException", "Invalid Access Token", "GetUser")
+        if claims.get("exp", 0) < time.time():
+            raise self.error("NotAuthorizedException", "Access Token has expired", "GetUser")
+        with self.lock:
+            user = self._find(claims.get("username"), "GetUser")
+            return _ok({"Username": user["Username"], "UserAttributes": list(user["Attributes"])})
+
+
+class FakeRdsData(FakeClient):
+    """
+    The RDS Data API over an in-memory SQLite database. NOW() is rewritten to SQLite's
+    CURRENT_TIMESTAMP; other SQL the handlers use is common to both
+    """
+
+    def __init__(self, schema=SCHEMA):
+        super().__init__()
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        for statement in schema:
+            self.connection.execute(statement)
+
+    @staticmethod
+    def _translate(sql: str) -> str:
+        return re.sub(r"\bNOW\(\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+
+    @staticmethod
+    def _values(parameters) -> dict:
+        values = {}
+        for parameter in parameters or []:
+            value = parameter["value"]
+            if value.get("isNull"):
+                values[parameter["name"]] = None
+            else:
+                values[parameter["name"]] = next(iter(value.values()))
+        return values
+
+    @staticmethod
+    def _field(value) -> dict:
+        if value is None:
+            return {"isNull": True}
+        if isinstance(value, bool):
+            return {"booleanValue": value}
+        if isinstance(value, int):
+            return {"longValue": value}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def execute_statement(self, sql, parameters=None, **kwargs):
+        with self.lock:
+            try:
+                cursor = self.connection.execute(self._translate(sql), self._values(parameters))
+            except sqlite3.Error as e:
+                raise self.error("BadRequestException", str(e), "ExecuteStatement")
+            response = {"numberOfRecordsUpdated": max(cursor.rowcount, 0), "generatedFields": []}
+            if cursor.description is not None:
+                response["records"] = [[self._field(value) for value in row] for row in cursor.fetchall()]
+                if kwargs.get("includeResultMetadata"):
+                    response["columnMetadata"] = [{"name": column[0], "label": column[0]}
+                                                  for column in cursor.description]
+            return _ok(response)
+
+    def batch_execute_statement(self, sql, parameterSets=(), **kwargs):
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(self._translate(sql), [self._values(p) for p in parameterSets])
+                self.connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                self.connection.execute("ROLLBACK")
+                raise self.error("BadRequestException", str(e), "BatchExecuteStatement")
+            return _ok({"updateResults": [{"generatedFields": []} for _ in parameterSets]})
+
+
+class _Body(io.BytesIO):
+    """
+    The StreamingBody of get_object: read() and iteration over chunks
+    """
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class FakeS3(FakeClient):
+    """
+    Buckets as dicts of key to bytes. Buckets are created on first write
+    """
+
+    paginators = {"list_objects_v2": ("ContinuationToken", "NextContinuationToken")}
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = {}
+
+    def put_object(self, Bucket, Key, Body=b"", ContentType="binary/octet-stream", **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        with self.lock:
+            self.buckets.setdefault(Bucket, {})[Key] = {"Body": bytes(Body), "ContentType": ContentType,
+                                                        "LastModified": datetime.now(timezone.utc)}
+        return _ok({"ETag": f'"{uuid.uuid4().hex}"'})
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            stored = self.buckets.get(Bucket, {}).get(Key)
+        if stored is None:
+            raise self.error("NoSuchKey", "The specified key does not exist.", "GetObject")
+        return _ok({"Body": _Body(stored["Body"]), "ContentLength": len(stored["Body"]),
+                    "ContentType": stored["ContentType"], "LastModified": stored["LastModified"]})
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.buckets.get(Bucket, {}).pop(Key, None)
+        return _ok()
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        objects = Delete.get("Objects", [])
+        if len(objects) > 1000:
+            raise self.error("MalformedXML", "At most 1000 keys can be deleted per request.", "DeleteObjects")
+        with self.lock:
+            bucket = self.buckets.get(Bucket, {})
+            for item in objects:
+                bucket.pop(item["Key"], None)
+        response = {"Errors": []}
+        if not Delete.get("Quiet"):
+            response["Deleted"] = [{"Key": item["Key"]} for item in objects]
+        return _ok(response)
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None, **kwargs):
+        with self.lock:
+            # Like S3, the token is the last key returned, so deleting listed keys
+            # between pages doesn't skip any
+            keys = sorted(key for key in self.buckets.get(Bucket, {})
+                          if key.startswith(Prefix) and (ContinuationToken is None or key > ContinuationToken))
+            page = keys[:MaxKeys]
+            response = {"KeyCount": len(page), "IsTruncated": MaxKeys < len(keys), "Prefix": Prefix}
+            if page:
+                response["Contents"] = [{"Key": key, "Size": len(self.buckets[Bucket][key]["Body"]),
+                                         "LastModified": self.buckets[Bucket][key]["LastModified"]} for key in page]
+            if response["IsTruncated"]:
+                response["NextContinuationToken"] = page[-1]
+            return _ok(response)
+
+
+class FakeTextract(FakeClient):
+    """
+    AnalyzeDocument with a fixed set of form fields for every page. latency is the
+    seconds each call takes, like the real service's response time
+    """
+
+    # Key text to value text of the fields every page "contains"
+    FIELDS = {"First Name:": "Jordan", "Last Name:": "Nguyen", "Date of Birth:": "1990-04-12"}
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    def analyze_document(self, Document, FeatureTypes=(), **kwargs):
+        if not Document.get("Bytes"):
+            raise self.error("InvalidParameterException", "Request has invalid parameters", "AnalyzeDocument")
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        blocks = []
+        for index, (key, value) in enumerate(self.FIELDS.items()):
+            top = 0.1 + index * 0.05
+            geometry = {"BoundingBox": {"Left": 0.1, "Top": top, "Width": 0.2, "Height": 0.03}}
+            ids = {name: f"{name}-{index}" for name in ("key", "value", "key-word", "value-word")}
+            blocks.extend([
+                {"Id": ids["key"], "BlockType": "KEY_VALUE_SET", "EntityTypes": ["KEY"], "Confidence": 99.0,
+                 "Geometry": geometry, "Relationships": [{"Type": "VALUE", "Ids": [ids["value"]]},
+                                                         {"Type": "CHILD", "Ids": [ids["key-word"]]}]},
+                {"Id": ids["value"], "BlockType": "KEY_VALUE_SET", "EntityTypes": ["VALUE"], "Confidence": 98.0,
+                 "Relationships": [{"Type": "CHILD", "Ids": [ids["value-word"]]}]},
+                {"Id": ids["key-word"], "BlockType": "WORD", "Text": key, "Confidence": 99.5},
+                {"Id": ids["value-word"], "BlockType": "WORD", "Text": value, "Confidence": 97.5}
+            ])
+        return _ok({"Blocks": blocks, "DocumentMetadata": {"Pages": 1}})
+
+
+def install(**fakes) -> dict:
+    """
+    A Utility Function that makes boto3.client return the fakes, so handler modules
+    imported afterwards use them. Services without a fake still get real clients
+
+    Input:
+        fakes = fakes to use instead of the defaults, by service name
+
+    Output:
+        returns the fakes by service name ("cognito-idp", "rds-data", "s3", "textract")
+    """
+    services = {"cognito-idp": FakeCognito(), "rds-data": FakeRdsData(), "s3": FakeS3(), "textract": FakeTextract()}
+    services.update(fakes)
+    real_client = boto3.client
+
+    def client(service_name, *args, **kwargs):
+        if service_name in services:
+            return services[service_name]
+        return real_client(service_name, *args, **kwargs)
+
+    boto3.client = client
+    return services
@@ -0,0 +1,250 @@
+"""
+Serves the whole API from one process through router.py, on the same paths as API
+Gateway, so the frontend, the API tests or a load test can run against a laptop.
+
+Requests are read with asyncio and each is handed to the handler on a worker thread,
+since the handlers block. By default AWS is replaced with the in-memory fakes in
+local_fakes.py and the test user is seeded; --aws uses the real services from the
+environment's credentials instead.
+
+Usage (from the lambdas folder):
+    python scripts/local_server.py [--port 8000] [--workers 32] [--users 100 --documents 1000]
+                                   [--textract-latency 0.5] [--warm] [--aws]
+
+Then point SERVER_URL and the other URLs in src/globals.tsx at
+http://localhost:8000/api/v1.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+LAMBDAS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("", "scripts"):
+    sys.path.insert(0, os.path.join(LAMBDAS, folder))
+
+logger = logging.getLogger("local_server")
+
+# API Gateway's integration timeout, reported as the handlers' remaining time
+TIMEOUT_MS = 29_000
+MAX_HEADER_LINES = 100
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+class LocalContext:
+    """
+    The parts of the Lambda context object the handlers use
+    """
+
+    function_name = "owl-local"
+    memory_limit_in_mb = 3008
+    invoked_function_arn = "arn:aws:lambda:local:000000000000:function:owl-local"
+
+    def __init__(self):
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + TIMEOUT_MS / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class BadRequest(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader: asyncio.StreamReader):
+    """
+    A Utility Function that reads one HTTP/1.1 request from the connection
+
+    Output:
+        returns (method, target, version, headers, body), or None when the client has
+        closed the connection. Raises BadRequest for requests the server won't handle
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise BadRequest(400, "Malformed request line")
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip()] = value.strip()
+    else:
+        raise BadRequest(431, "Too many headers")
+
+    lowered = {name.lower(): value for name, value in headers.items()}
+    if "chunked" in lowered.get("transfer-encoding", "").lower():
+        raise BadRequest(411, "Send a Content-Length instead of a chunked body")
+    length = int(lowered.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        raise BadRequest(413, "Request body is too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, version, headers, body
+
+
+def to_event(method: str, target: str, headers: dict, body: bytes, source_ip: str) -> dict:
+    """
+    A Utility Function that builds the API Gateway proxy event for a request
+    """
+    url = urlsplit(target)
+    query = parse_qsl(url.query, keep_blank_values=True)
+    try:
+        text, encoded = (body.decode("utf-8"), False) if body else (None, False)
+    except UnicodeDecodeError:
+        text, encoded = base64.b64encode(body).decode("ascii"), True
+
+    return {
+        "resource": url.path,
+        "path": url.path,
+        "httpMethod": method,
+        "headers": headers,
+        "multiValueHeaders": {name: [value] for name, value in headers.items()},
+        "queryStringParameters": dict(query) or None,
+        "multiValueQueryStringParameters": {name: [v for n, v in query if n == name] for name, _ in query} or None,
+        "pathParameters": None,
+        "body": text,
+        "isBase64Encoded": encoded,
+        "requestContext": {
+            "requestId": str(uuid.uuid4()),
+            "stage": "local",
+            "httpMethod": method,
+            "path": url.path,
+            "identity": {"sourceIp": source_ip}
+        }
+    }
+
+
+def encode_response(response: dict, keep_alive: bool) -> bytes:
+    """
+    A Utility Function that writes a proxy response as an HTTP/1.1 response
+    """
+    status = int(response.get("statusCode", 200))
+    body = response.get("body") or ""
+    if response.get("isBase64Encoded"):
+        payload = base64.b64decode(body)
+    else:
+        payload = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+
+    headers = dict(response.get("headers") or {})
+    headers.setdefault("Content-Type", "application/json")
+    headers["Content-Length"] = str(len(payload))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    lines = [f"HTTP/1.1 {status} {reason}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    for name, values in (response.get("multiValueHeaders") or {}).items():
+        lines += [f"{name}: {value}" for value in values]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+
+class LocalServer:
+    def __init__(self, workers: int):
+        import router
+        self.router = router
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self.requests = 0
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        source_ip = (writer.get_extra_info("peername") or ("127.0.0.1",))[0]
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as e:
+                    writer.write(encode_response({"statusCode": e.status, "body": json.dumps({"message": str(e)})},
+                                                 False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+
+                method, target, version, headers, body = request
+                connection = {name.lower(): value for name, value in headers.items()}.get("connection", "").lower()
+                keep_alive = connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+
+                start = time.perf_counter()
+                event = to_event(method, target, headers, body, source_ip)
+                response = await loop.run_in_executor(self.executor, self.router.dispatch, event, LocalContext())
+                writer.write(encode_response(response, keep_alive))
+                await writer.drain()
+                self.requests += 1
+                logger.info(f"{method} {target.split('?')[0]} {response.get('statusCode')} "
+                            f"{(time.perf_counter() - start) * 1000:.1f} ms")
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        logger.info(f"Serving the API on http://{host}:{port}{self.router.ROUTE_PREFIX}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=32, help="handler threads")
+    parser.add_argument("--users", type=int, default=0, help="synthetic users to seed besides the test user")
+    parser.add_argument("--documents", type=int, default=0, help="synthetic documents to seed")
+    parser.add_argument("--textract-latency", type=float, default=0.0,
+                        help="seconds each fake Textract call takes")
+    parser.add_argument("--warm", action="store_true", help="import every handler before serving")
+    parser.add_argument("--aws", action="store_true", help="use the real AWS services instead of the fakes")
+    parser.add_argument("--quiet", action="store_true", help="don't log each request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger.setLevel(logging.WARNING if args.quiet else logging.INFO)
+
+    # OCR jobs are read by worker threads of this process rather than through SQS
+    os.environ.setdefault("OCR_JOB_QUEUE", "memory")
+    if not args.aws:
+        import local_fakes
+        # Tokens from the fake pool are unsigned; without an app client configured the
+        # authorizer checks them with the fake Cognito instead
+        os.environ["COGNITO_USER_POOL_ID"] = local_fakes.FakeCognito().user_pool_id
+        os.environ.pop("COGNITO_CLIENT_ID", None)
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+        local_fakes.install(textract=local_fakes.FakeTextract(args.textract_latency))
+
+        from seed_data import seed
+        seeded = seed(args.users, args.documents)
+        logger.info(f"Seeded {seeded['users']} users and {seeded['documents']} documents "
+                       f"(test user aTestUser@gmail.com)")
+
+    server = LocalServer(args.workers)
+    if args.warm:
+        server.router.warm()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
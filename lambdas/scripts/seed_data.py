@@ -0,0 +1,218 @@
+"""
+Seeds an environment with synthetic users and documents through the handler code:
+users go through bulk_register (Cognito and the users table), document rows are
+batch inserted the way create_document names them, and the files and their metadata
+are uploaded with the postFormLambda handler.
+
+Usage (from the lambdas folder):
+    python scripts/seed_data.py --users 500 --documents 5000 [--local] [--reset]
+
+--local runs everything against the in-memory fakes in local_fakes.py, to try the
+seeder or measure it without an AWS account. Otherwise the AWS credentials in the
+environment are used, with COGNITO_USER_POOL_ID set as for the auth lambdas.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+LAMBDAS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("", "auth", "documents", "scripts"):
+    sys.path.insert(0, os.path.join(LAMBDAS, folder))
+
+# The account the API tests sign in with, always seeded first
+TEST_USER = {"email": "aTestUser@gmail.com", "password": "P@ssword123",
+             "firstName": "Testing User's Name", "lastName": "[Yes My Last Name Has Bracke$s]"}
+SEED_PASSWORD = "P@ssword123"
+INSERT_BATCH_SIZE = 100
+UPLOAD_CONCURRENCY = 16
+
+FIRST_NAMES = ["Avery", "Jordan", "Morgan", "Riley", "Casey", "Jamie", "Quinn", "Harper", "Rowan", "Emerson",
+               "Sasha", "Devon", "Parker", "Reese", "Skyler", "Dakota"]
+LAST_NAMES = ["Nguyen", "Singh", "Smith", "Tremblay", "Martin", "Roy", "Lee", "Wilson", "Gagnon", "Chen",
+              "Brown", "Patel", "Taylor", "Kim", "Campbell", "Wong"]
+CITIES = [("Vancouver", "BC"), ("Toronto", "ON"), ("Calgary", "AB"), ("Montreal", "QC"), ("Halifax", "NS"),
+          ("Winnipeg", "MB"), ("Victoria", "BC"), ("Ottawa", "ON")]
+STREETS = ["University Blvd.", "Main St.", "King St. W", "Granville St.", "Jasper Ave.", "Rue Sainte-Catherine"]
+ID_CATEGORIES = ["Passport", "Drivers License", "Health Card", "Citizenship Card"]
+FORM_CATEGORIES = ["Membership Application", "Business Customer Application", "Address Change"]
+DEVICES = ["PC", "Mobile", "Tablet"]
+
+
+def synthetic_users(count: int, rng: random.Random) -> list:
+    """
+    A Utility Function that makes users with unique emails, in bulk_register's shape
+    """
+    run = uuid.uuid4().hex[:6]
+    return [{
+        "email": f"seed.{run}.{index}@example.com",
+        "password": SEED_PASSWORD,
+        "firstName": rng.choice(FIRST_NAMES),
+        "lastName": rng.choice(LAST_NAMES)
+    } for index in range(count)]
+
+
+def synthetic_metadata(user: dict, doc_type: str, rng: random.Random) -> dict:
+    """
+    A Utility Function that makes the validated fields of a document, as the upload
+    page saves them: field name to value
+    """
+    city, province = rng.choice(CITIES)
+    metadata = {
+        "First Name": user["firstName"],
+        "Last Name": user["lastName"],
+        "Date of Birth": f"{rng.randint(1940, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "Address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}",
+        "City": city,
+        "Prov": province,
+        "Postal Code": f"{rng.choice('VTKMHRB')}{rng.randint(1, 9)}{rng.choice('ABCEGHJ')} "
+                       f"{rng.randint(1, 9)}{rng.choice('KLMNPRS')}{rng.randint(1, 9)}"
+    }
+    if doc_type == "ids":
+        metadata["ID Number"] = f"{rng.randint(10_000_000, 99_999_999)}"
+        metadata["Expiry Date"] = f"{rng.randint(2026, 2035)}-{rng.randint(1, 12):02d}-01"
+    else:
+        metadata["Membership Number"] = f"{rng.randint(1_000_000, 9_999_999)}"
+        metadata["Phone"] = f"{rng.randint(200, 999)}{rng.randint(200, 999)}{rng.randint(1000, 9999)}"
+    return metadata
+
+
+def seed_users(users: list) -> dict:
+    """
+    A Utility Function that registers users through bulk_register
+
+    Output:
+        returns a dict of email to user id for every user that exists afterwards
+    """
+    from bulk_register import bulk_register, CREATED
+
+    results, _ = bulk_register(users)
+    failed = [result for result in results if result["status"] != CREATED]
+    for result in failed:
+        print(f"Could not register {result['email']}: {result.get('error')}")
+    return {result["email"]: result["user_id"] for result in results if result["status"] == CREATED}
+
+
+def seed_documents(user_ids: dict, users: list, count: int, rng: random.Random, document_bytes: bytes) -> int:
+    """
+    A Utility Function that adds documents spread over the users: rows in the documents
+    table, then the file and metadata of each in S3
+
+    Output:
+        returns the number of documents fully created
+    """
+    from db_util import execute_batch_statement
+    import postFormLambda
+
+    owners = [user for user in users if user["email"] in user_ids]
+    if not owners or count <= 0:
+        return 0
+
+    documents = []
+    for _ in range(count):
+        user = rng.choice(owners)
+        doc_type = rng.choice(["forms", "ids"])
+        user_id = user_ids[user["email"]]
+        documents.append({
+            # The name create_document gives a new document
+            "filename": user_id + "_" + doc_type + "_" + str(uuid.uuid4()),
+            "original_filename": f"{rng.choice(ID_CATEGORIES if doc_type == 'ids' else FORM_CATEGORIES)}.pdf",
+            "bucket": f"owl-{doc_type}",
+            "user_id": user_id,
+            "doc_type": doc_type,
+            "category": rng.choice(ID_CATEGORIES if doc_type == "ids" else FORM_CATEGORIES),
+            "device": rng.choice(DEVICES),
+            "ip": f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            "metadata": synthetic_metadata(user, doc_type, rng)
+        })
+
+    sql = ("INSERT INTO documents (filename, original_filename, bucket, user_id, doc_type, upload_date, category, device, ip) "
+           "VALUES (:filename, :original_filename, :bucket, :user_id, :doc_type, NOW(), :category, :device, :ip)")
+    inserted = []
+    for start in range(0, len(documents), INSERT_BATCH_SIZE):
+        batch = documents[start:start + INSERT_BATCH_SIZE]
+        response = execute_batch_statement(sql, [{key: value for key, value in document.items() if key != "metadata"}
+                                                 for document in batch])
+        if response.get("statusCode", 200) != 200:
+            print(f"Could not insert {len(batch)} documents: {response['body']}")
+            continue
+        inserted.extend(batch)
+
+    file_base64 = base64.b64encode(document_bytes).decode("utf-8")
+
+    def upload(document):
+        response = postFormLambda.lambda_handler({"body": json.dumps({
+            "file": file_base64,
+            "fileName": document["filename"],
+            "type": document["doc_type"],
+            "metadata": document["metadata"]
+        })}, None)
+        return response["statusCode"] == 200
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+        uploaded = sum(executor.map(upload, inserted))
+    return uploaded
+
+
+def seed(user_count: int, document_count: int, seed_value: int = 0, document_bytes: bytes = None) -> dict:
+    """
+    A Utility Function that seeds the test user, user_count synthetic users and
+    document_count synthetic documents
+
+    Input:
+        user_count = synthetic users to add besides the test user
+        document_count = documents to add, spread over all seeded users
+        seed_value = the random seed, for repeatable names and fields
+        document_bytes = the file stored for every document, defaults to the test form PDF
+
+    Output:
+        returns a dict of the counts created and the seconds taken
+    """
+    rng = random.Random(seed_value)
+    if document_bytes is None:
+        from filestring import FILESTRING
+        document_bytes = base64.b64decode(FILESTRING)
+
+    start = time.perf_counter()
+    users = [TEST_USER] + synthetic_users(user_count, rng)
+    user_ids = seed_users(users)
+    users_done = time.perf_counter()
+    documents = seed_documents(user_ids, users, document_count, rng, document_bytes)
+    end = time.perf_counter()
+
+    return {
+        "users": len(user_ids),
+        "documents": documents,
+        "user_seconds": round(users_done - start, 2),
+        "document_seconds": round(end - users_done, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="synthetic users besides the test user")
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--local", action="store_true", help="use the in-memory fakes instead of AWS")
+    parser.add_argument("--reset", action="store_true", help="empty Cognito, the tables and the buckets first")
+    args = parser.parse_args()
+
+    if args.local:
+        import local_fakes
+        local_fakes.install()
+
+    if args.reset:
+        import cognito_reset
+        if not (cognito_reset.reset_rds() and cognito_reset.delete_users() and cognito_reset.reset_s3()):
+            sys.exit("Reset failed")
+
+    print(json.dumps(seed(args.users, args.documents, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
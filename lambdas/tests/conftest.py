@@ -0,0 +1,113 @@
+"""
+Puts the shared modules and the handler folders on the path the way the Lambda
+packages see them, so the tests import them flat.
+
+Run from the repository root with: python -m pytest lambdas/tests
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+
+import pytest
+
+LAMBDAS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("", "auth", "documents", os.path.join("documents", "OCRPackage"), "users", "scripts"):
+    path = os.path.join(LAMBDAS, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# The handlers create their boto3 clients on import
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+# ASN.1 DigestInfo prefix for SHA-256, as in jwt_util
+SHA256_DIGEST_INFO = bytes.fromhex("3031300d060960864801650304020105000420")
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _is_probable_prime(n: int, rounds: int = 32) -> bool:
+    if n < 4:
+        return n in (2, 3)
+    for prime in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29):
+        if n % prime == 0:
+            return n == prime
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+    for _ in range(rounds):
+        x = pow(random.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _random_prime(bits: int) -> int:
+    while True:
+        candidate = random.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if _is_probable_prime(candidate):
+            return candidate
+
+
+class RsaKey:
+    """
+    A throwaway RSA key that signs RS256 JWTs, so the tests need no crypto library
+    """
+
+    def __init__(self, kid: str, bits: int = 1024, exponent: int = 65537):
+        self.kid = kid
+        self.e = exponent
+        while True:
+            p, q = _random_prime(bits // 2), _random_prime(bits // 2)
+            phi = (p - 1) * (q - 1)
+            if p != q and phi % exponent:
+                break
+        self.n = p * q
+        self.d = pow(exponent, -1, phi)
+
+    def jwk(self) -> dict:
+        length = (self.n.bit_length() + 7) // 8
+        return {"kty": "RSA", "kid": self.kid, "use": "sig", "alg": "RS256",
+                "n": b64url(self.n.to_bytes(length, "big")), "e": b64url(self.e.to_bytes(3, "big"))}
+
+    def sign(self, claims: dict, kid: str = None) -> str:
+        header = b64url(json.dumps({"alg": "RS256", "kid": kid or self.kid}).encode())
+        payload = b64url(json.dumps(claims).encode())
+        length = (self.n.bit_length() + 7) // 8
+        digest_info = SHA256_DIGEST_INFO + hashlib.sha256(f"{header}.{payload}".encode()).digest()
+        encoded = b"\x00\x01" + b"\xff" * (length - len(digest_info) - 3) + b"\x00" + digest_info
+        signature = pow(int.from_bytes(encoded, "big"), self.d, self.n).to_bytes(length, "big")
+        return f"{header}.{payload}.{b64url(signature)}"
+
+
+@pytest.fixture(scope="session")
+def rsa_keys():
+    """
+    Two signing keys, "key-1" and "key-2"
+    """
+    return RsaKey("key-1"), RsaKey("key-2")
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """
+    The local_fakes services by name, with db_util's RDS client replaced by the SQLite
+    one. Tests put the other fakes on the modules they exercise
+    """
+    import db_util
+    import local_fakes
+
+    services = {"cognito-idp": local_fakes.FakeCognito(), "rds-data": local_fakes.FakeRdsData(),
+                "s3": local_fakes.FakeS3(), "textract": local_fakes.FakeTextract()}
+    monkeypatch.setattr(db_util, "rds_client", services["rds-data"])
+    return services
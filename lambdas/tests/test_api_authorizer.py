@@ -0,0 +1,128 @@
+import time
+
+import pytest
+
+import api_authorizer
+from jwt_util import JwksCache, JwksUnavailableError, TokenVerifier
+
+POOL_ID = "us-east-2_TestPool"
+CLIENT_ID = "test-client"
+ISSUER = f"https://cognito-idp.us-east-2.amazonaws.com/{POOL_ID}"
+METHOD_ARN = "arn:aws:execute-api:us-east-2:123456789012:abcdef1234/prod/GET/api/v1/users"
+# Taken from the real client before the fixtures replace it
+NotAuthorizedException = api_authorizer.cognito_client.exceptions.NotAuthorizedException
+
+
+class StubCognito:
+    """
+    The two Cognito calls the authorizer makes on its fallback path
+    """
+
+    def __init__(self, groups=()):
+        self.groups = list(groups)
+        self.calls = []
+
+    def get_user(self, AccessToken):
+        self.calls.append("get_user")
+        if AccessToken == "revoked":
+            raise NotAuthorizedException(
+                {"Error": {"Code": "NotAuthorizedException", "Message": "Access Token has been revoked"}}, "GetUser")
+        return {"Username": "user-1", "UserAttributes": [{"Name": "sub", "Value": "user-1"}]}
+
+    def admin_list_groups_for_user(self, Username, UserPoolId):
+        self.calls.append("admin_list_groups_for_user")
+        return {"Groups": [{"GroupName": group, "UserPoolId": UserPoolId} for group in self.groups]}
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    stub = StubCognito()
+    monkeypatch.setattr(api_authorizer, "cognito_client", stub)
+    monkeypatch.setattr(api_authorizer, "COGNITO_USER_POOL_ID", POOL_ID)
+    return stub
+
+
+@pytest.fixture
+def verifier(monkeypatch, rsa_keys):
+    verifier = TokenVerifier(POOL_ID, [CLIENT_ID], jwks=JwksCache("unused", lambda: {"keys": [rsa_keys[0].jwk()]}))
+    monkeypatch.setattr(api_authorizer, "get_verifier", lambda: verifier)
+    return verifier
+
+
+def access_token(key, **overrides) -> str:
+    claims = {"sub": "user-1", "username": "user-1", "iss": ISSUER, "token_use": "access",
+              "client_id": CLIENT_ID, "exp": time.time() + 3600}
+    claims.update(overrides)
+    return key.sign(claims)
+
+
+def authorize(token: str) -> dict:
+    return api_authorizer.lambda_handler({"type": "TOKEN", "authorizationToken": token, "methodArn": METHOD_ARN},
+                                         None)
+
+
+def effects(policy: dict) -> dict:
+    return {statement["Effect"]: statement["Resource"] for statement in policy["policyDocument"]["Statement"]}
+
+
+def test_valid_token_is_allowed(verifier, cognito, rsa_keys):
+    policy = authorize(access_token(rsa_keys[0]))
+    assert effects(policy)["Allow"] == ["arn:aws:execute-api:us-east-2:123456789012:abcdef1234/prod/*/*"]
+    assert policy["principalId"] == "user-1"
+    # Checked locally, without calling Cognito
+    assert cognito.calls == []
+
+
+def test_non_admin_is_denied_admin_routes(verifier, cognito, rsa_keys):
+    denied = effects(authorize(access_token(rsa_keys[0])))["Deny"]
+    assert "arn:aws:execute-api:us-east-2:123456789012:abcdef1234/prod/POST/*/auth/register/bulk" in denied
+    assert "arn:aws:execute-api:us-east-2:123456789012:abcdef1234/prod/DELETE/*/users" in denied
+
+
+def test_admin_may_bulk_register(verifier, cognito, rsa_keys):
+    policy = authorize(access_token(rsa_keys[0], **{"cognito:groups": ["admin"]}))
+    assert "Deny" not in effects(policy)
+    assert policy["context"]["groups"] == "admin"
+
+
+@pytest.mark.parametrize("overrides", [
+    {"exp": time.time() - 3600},
+    {"token_use": "id"},
+    {"client_id": "another-client"},
+    {"iss": "https://cognito-idp.us-east-2.amazonaws.com/us-east-2_OtherPool"},
+])
+def test_invalid_token_is_unauthorized(verifier, cognito, rsa_keys, overrides):
+    with pytest.raises(Exception, match="Unauthorized"):
+        authorize(access_token(rsa_keys[0], **overrides))
+    assert cognito.calls == []
+
+
+def test_bad_signature_is_unauthorized(verifier, cognito, rsa_keys):
+    with pytest.raises(Exception, match="Unauthorized"):
+        authorize(rsa_keys[1].sign({"sub": "user-1", "iss": ISSUER, "token_use": "access", "client_id": CLIENT_ID,
+                                    "exp": time.time() + 3600}, kid="key-1"))
+
+
+def test_falls_back_to_get_user_when_jwks_unavailable(verifier, cognito, rsa_keys):
+    def unavailable():
+        raise JwksUnavailableError("Could not fetch the keys")
+
+    verifier.jwks.fetch = unavailable
+    cognito.groups = ["admin"]
+    policy = authorize(access_token(rsa_keys[0]))
+    assert cognito.calls == ["get_user", "admin_list_groups_for_user"]
+    assert "Deny" not in effects(policy)
+
+
+def test_falls_back_to_get_user_without_a_pool(monkeypatch, cognito):
+    monkeypatch.setattr(api_authorizer, "get_verifier", lambda: None)
+    policy = authorize("opaque-token")
+    assert cognito.calls[0] == "get_user"
+    assert policy["principalId"] == "user-1"
+    assert "Allow" in effects(policy)
+
+
+def test_fallback_rejects_revoked_token(monkeypatch, cognito):
+    monkeypatch.setattr(api_authorizer, "get_verifier", lambda: None)
+    with pytest.raises(Exception, match="Unauthorized"):
+        authorize("revoked")
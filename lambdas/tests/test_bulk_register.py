@@ -0,0 +1,73 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import bulk_register
+import rate_util
+
+
+def user(email: str) -> dict:
+    return {"email": email, "password": "P@ssword123", "firstName": "Test", "lastName": "User"}
+
+
+def unavailable(operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": "ServiceUnavailable", "Message": "Service unavailable"}}, operation)
+
+
+@pytest.fixture
+def cognito(monkeypatch, fakes):
+    monkeypatch.setattr(rate_util, "backoff_delay", lambda attempt: 0.0)
+    monkeypatch.setattr(bulk_register, "COGNITO_USER_POOL_ID", "local_pool")
+    monkeypatch.setattr(bulk_register, "cognito_client", fakes["cognito-idp"])
+    return fakes["cognito-idp"]
+
+
+def user_ids(fakes) -> list:
+    response = fakes["rds-data"].execute_statement("SELECT user_id FROM users ORDER BY email")
+    return [record[0]["stringValue"] for record in response["records"]]
+
+
+def test_registers_users(cognito, fakes):
+    results, checkpoint = bulk_register.bulk_register([user("a@example.com"), user("b@example.com")])
+    assert [result["status"] for result in results] == [bulk_register.CREATED] * 2
+    assert checkpoint == {"done": ["a@example.com", "b@example.com"], "pending_insert": {}}
+    assert user_ids(fakes) == [result["user_id"] for result in results]
+    assert cognito.admin_get_user(UserPoolId="local_pool", Username="a@example.com")["UserStatus"] == "CONFIRMED"
+
+
+def test_lost_create_response_is_not_a_failure(cognito, fakes, monkeypatch):
+    create = cognito.admin_create_user
+
+    def create_then_fail(**kwargs):
+        # The user is made, but the response never arrives
+        create(**kwargs)
+        monkeypatch.setattr(cognito, "admin_create_user", create)
+        raise unavailable("AdminCreateUser")
+
+    monkeypatch.setattr(cognito, "admin_create_user", create_then_fail)
+    results, checkpoint = bulk_register.bulk_register([user("a@example.com")])
+
+    assert results[0]["status"] == bulk_register.CREATED
+    assert results[0]["user_id"] == cognito.by_email["a@example.com"]
+    assert checkpoint["done"] == ["a@example.com"]
+    assert user_ids(fakes) == [results[0]["user_id"]]
+
+
+def test_existing_user_fails_on_the_first_attempt(cognito, fakes):
+    bulk_register.bulk_register([user("a@example.com")])
+    results, checkpoint = bulk_register.bulk_register([user("a@example.com")])
+
+    assert results[0]["status"] == bulk_register.FAILED
+    assert results[0]["code"] == "UsernameExistsException"
+    assert checkpoint["done"] == []
+
+
+def test_checkpoint_skips_finished_users(cognito, fakes):
+    _, checkpoint = bulk_register.bulk_register([user("a@example.com")])
+    results, _ = bulk_register.bulk_register([user("a@example.com"), user("b@example.com")], checkpoint)
+    assert [result["status"] for result in results] == [bulk_register.ALREADY_DONE, bulk_register.CREATED]
+
+
+def test_out_of_time_users_are_not_started(cognito, fakes):
+    results, checkpoint = bulk_register.bulk_register([user("a@example.com")], remaining_time_ms=lambda: 0)
+    assert results[0]["status"] == bulk_register.NOT_STARTED
+    assert checkpoint == {"done": [], "pending_insert": {}}
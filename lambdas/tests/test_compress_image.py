@@ -0,0 +1,97 @@
+import base64
+import json
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+import compress_image
+import image_util
+
+
+def encoded(image: Image.Image, image_format: str, **options) -> str:
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def photo(width: int, height: int) -> Image.Image:
+    image = Image.new("RGB", (width, height), (200, 180, 150))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 40):
+        draw.line((x, 0, x, height), fill=(x % 255, 90, 160), width=6)
+    return image
+
+
+def noise(width: int, height: int) -> Image.Image:
+    # Incompressible, so a small budget can only be met well below the quality floor
+    generator = random.Random(0)
+    return Image.frombytes("RGB", (width, height), bytes(generator.getrandbits(8) for _ in range(width * height * 3)))
+
+
+def text_page() -> Image.Image:
+    image = Image.new("L", (1000, 1300), 255)
+    draw = ImageDraw.Draw(image)
+    for y in range(50, 1250, 30):
+        draw.text((60, y), "The quick brown fox jumps over the lazy dog " * 2, fill=0)
+    return image
+
+
+def compress(image_base64: str, **options) -> tuple:
+    response = compress_image.lambda_handler({"httpMethod": "POST", "body": json.dumps(dict(
+        image_base64=image_base64, **options))}, None)
+    body = json.loads(response["body"]) if response["statusCode"] != 500 else response["body"]
+    return response["statusCode"], body
+
+
+def test_budget_is_met_above_the_quality_floor():
+    status, body = compress(encoded(photo(1200, 900), "JPEG", quality=95), max_bytes=60000)
+    assert status == 200
+    parameters = body["parameters"]
+    assert parameters["bytes"] <= 60000
+    assert parameters["bytes"] == len(base64.b64decode(body["compressed_image"]))
+    assert parameters["met_quality_floor"] is True
+    assert parameters["ssim"] >= compress_image.DEFAULT_MIN_SSIM
+
+
+def test_smallest_passing_candidate_is_chosen():
+    result = compress_image.compress_base64_image_to_budget(encoded(photo(1200, 900), "JPEG", quality=95),
+                                                            max_bytes=60000)
+    strict = compress_image.compress_base64_image_to_budget(encoded(photo(1200, 900), "JPEG", quality=95),
+                                                            max_bytes=60000, min_ssim=0.99)
+    # A higher floor can only cost bytes
+    assert strict["parameters"]["bytes"] >= result["parameters"]["bytes"]
+
+
+def test_tight_budget_reports_the_missed_floor():
+    status, body = compress(encoded(noise(600, 600), "JPEG", quality=95), max_bytes=8000)
+    assert status == 200
+    parameters = body["parameters"]
+    assert parameters["bytes"] <= 8000
+    assert parameters["met_quality_floor"] is False
+    assert parameters["ssim"] < parameters["min_ssim"]
+
+
+def test_budget_nothing_fits_is_an_input_error():
+    status, body = compress(encoded(noise(600, 600), "JPEG"), max_bytes=50)
+    assert status == 400
+    assert "No encoding of the image fits within 50 bytes" in body["error"]
+
+
+def test_text_page_is_encoded_without_colour():
+    result = compress_image.compress_base64_image_to_budget(encoded(text_page(), "PNG"), max_bytes=200000)
+    assert result["parameters"]["content_class"] == image_util.BILEVEL
+    assert result["parameters"]["met_quality_floor"] is True
+    image = Image.open(BytesIO(base64.b64decode(result["image"])))
+    assert image.format == "PNG"
+    assert image.mode in ("1", "L", "P")
+
+
+@pytest.mark.parametrize("profile, mode", [("auto", "1"), ("color", "L")])
+def test_without_a_budget_the_profile_picks_the_encoding(profile, mode):
+    status, body = compress(encoded(text_page(), "PNG"), profile=profile)
+    assert status == 200
+    image = Image.open(BytesIO(base64.b64decode(body["compressed_image"])))
+    assert image.format == "PNG"
+    assert image.mode == mode
@@ -0,0 +1,192 @@
+import base64
+import json
+from io import BytesIO
+
+import fitz
+import numpy as np
+import pypdf
+import pytest
+from PIL import Image, ImageDraw
+from pypdf.generic import ArrayObject, BooleanObject, DictionaryObject, NameObject, NumberObject
+
+import compress_pdf
+
+
+def photo(width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    A smooth colour image with fine noise: large as Flate, small as JPEG
+    """
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.linspace(0, 255, width), np.linspace(0, 255, height))
+    pixels = np.stack([x, y, 255 - x], axis=-1) + rng.normal(0, 12, (height, width, 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def scan(width: int, height: int) -> Image.Image:
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    for row in range(height // 30):
+        draw.text((40, 20 + row * 30), "Scanned text on a white page " * 6, fill=0)
+    return page
+
+
+def png(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_pdf(*pages) -> bytes:
+    """
+    A PDF with one page per list of (image, rect) placements; the same PNG bytes
+    placed twice are stored once
+    """
+    doc = fitz.open()
+    for placements in pages:
+        page = doc.new_page()
+        for image_bytes, rect in placements:
+            page.insert_image(fitz.Rect(rect), stream=image_bytes)
+    return doc.tobytes(garbage=3)
+
+
+def compress(pdf_bytes: bytes, **options) -> tuple:
+    output, report = compress_pdf.compress_pdf_with_report(base64.b64encode(pdf_bytes).decode("ascii"), **options)
+    return base64.b64decode(output), report
+
+
+def images(pdf_bytes: bytes) -> list:
+    reader = pypdf.PdfReader(BytesIO(pdf_bytes))
+    found = []
+    for page in reader.pages:
+        xobjects = page["/Resources"]["/XObject"]
+        found.append([xobjects[name].get_object() for name in xobjects])
+    return found
+
+
+def test_image_drawn_small_is_downsampled_to_jpeg():
+    # 1600 px drawn 2 inches wide is 800 dpi
+    pdf_bytes = make_pdf([(png(photo(1600, 1200)), (72, 72, 216, 180))])
+    output, report = compress(pdf_bytes)
+
+    assert report["compressed"] is True
+    assert report["pages"][0]["recompressed"] == 1
+    assert report["pages"][0]["downsampled"] == 1
+    assert len(output) < len(pdf_bytes) / 4
+
+    image = images(output)[0][0]
+    assert image["/Filter"] == "/DCTDecode"
+    # Down to the 150 dpi target over 2 inches
+    assert image["/Width"] == 300
+    assert image["/Height"] == 225
+
+
+def test_image_drawn_large_keeps_its_size():
+    pdf_bytes = make_pdf([(png(photo(1200, 900)), (0, 0, 612, 459))])
+    output, report = compress(pdf_bytes)
+    assert "downsampled" not in report["pages"][0]
+    assert images(output)[0][0]["/Width"] == 1200
+
+
+def test_shared_image_is_replaced_once():
+    image_bytes = png(photo(1600, 1200, seed=1))
+    pdf_bytes = make_pdf([(image_bytes, (72, 72, 216, 180))], [(image_bytes, (72, 72, 288, 234))])
+    output, report = compress(pdf_bytes)
+
+    assert [page["images"] for page in report["pages"]] == [1, 0]
+    first, second = (page_images[0] for page_images in images(output))
+    assert first.indirect_reference.idnum == second.indirect_reference.idnum
+    # Sized for the larger of the two placements, 3 inches
+    assert first["/Width"] == 450
+
+
+def test_black_and_white_scan_becomes_1_bit():
+    pdf_bytes = make_pdf([(png(scan(2400, 3200)), (0, 0, 612, 792))])
+    output, report = compress(pdf_bytes)
+
+    image = images(output)[0][0]
+    assert report["pages"][0].get("bilevel") == 1
+    assert image["/BitsPerComponent"] == 1
+    assert image["/Filter"] == "/FlateDecode"
+
+
+def test_soft_mask_is_kept():
+    transparent = photo(1600, 1200, seed=2).convert("RGBA")
+    transparent.putalpha(180)
+    output, _ = compress(make_pdf([(png(transparent), (72, 72, 216, 180))]))
+    image = images(output)[0][0]
+    assert image["/Filter"] == "/DCTDecode"
+    assert "/SMask" in image
+
+
+def test_output_renders():
+    output, _ = compress(make_pdf([(png(photo(1600, 1200)), (72, 72, 216, 180))],
+                                  [(png(scan(2400, 3200)), (0, 0, 612, 792))]))
+    with fitz.open(stream=output, filetype="pdf") as doc:
+        for page in doc:
+            pixmap = page.get_pixmap(dpi=30)
+            assert pixmap.width > 0
+
+
+@pytest.mark.parametrize("length", range(0, 9))
+def test_decoded_length(length):
+    data = bytes(range(length))
+    assert compress_pdf.decoded_length(base64.b64encode(data).decode("ascii")) == length
+
+
+def test_small_pdf_is_returned_untouched():
+    pdf_base64 = base64.b64encode(make_pdf([(png(photo(200, 150)), (72, 72, 216, 180))])).decode("ascii")
+    output, report = compress_pdf.compress_pdf_with_report(pdf_base64)
+    assert output is pdf_base64
+    assert report["compressed"] is False
+    assert report["input_bytes"] == report["output_bytes"] == compress_pdf.decoded_length(pdf_base64)
+
+
+def image_dictionary(**entries) -> DictionaryObject:
+    """
+    A 1000x1000 RGB image's dictionary, with entries given as PDF objects
+    """
+    values = {"Width": NumberObject(1000), "Height": NumberObject(1000), "BitsPerComponent": NumberObject(8),
+              "ColorSpace": NameObject("/DeviceRGB"), "Filter": NameObject("/FlateDecode")}
+    values.update(entries)
+    return DictionaryObject({NameObject(f"/{name}"): value for name, value in values.items()})
+
+
+def numbers(*values) -> ArrayObject:
+    return ArrayObject(NumberObject(value) for value in values)
+
+
+@pytest.mark.parametrize("entries, reason", [
+    ({"ImageMask": BooleanObject(True)}, "stencil mask"),
+    ({"BitsPerComponent": NumberObject(1)}, "bilevel image"),
+    ({"Filter": NameObject("/CCITTFaxDecode")}, "bilevel image"),
+    ({"Filter": ArrayObject([NameObject("/JBIG2Decode")])}, "bilevel image"),
+    ({"Mask": numbers(250, 255, 250, 255, 250, 255)}, "colour key mask"),
+    ({"Decode": numbers(1, 0, 1, 0, 1, 0)}, "decode array"),
+])
+def test_skip_reason(entries, reason):
+    assert compress_pdf._skip_reason(image_dictionary(**entries), 3_000_000) == reason
+
+
+def test_plain_decode_array_is_recompressed():
+    assert compress_pdf._skip_reason(image_dictionary(Decode=numbers(0, 1, 0, 1, 0, 1)),
+                                     3_000_000) is None
+
+
+def test_low_estimated_gain_is_skipped():
+    # A 1000x1000 colour JPEG is estimated at 120 KB
+    assert compress_pdf._skip_reason(image_dictionary(), 130_000).startswith("estimated gain")
+    assert compress_pdf._skip_reason(image_dictionary(), 400_000) is None
+    # Drawn small enough to be halved, it's estimated at a quarter of that
+    assert compress_pdf._skip_reason(image_dictionary(), 130_000, downsample_factor=0.5) is None
+
+
+def test_jpeg_drawn_at_size_is_left_alone():
+    buffer = BytesIO()
+    photo(1200, 900).save(buffer, "JPEG", quality=40)
+    padding = png(photo(900, 700, seed=3))
+    pdf_bytes = make_pdf([(buffer.getvalue(), (0, 0, 612, 459)), (padding, (0, 459, 612, 792))])
+    output, report = compress(pdf_bytes)
+
+    assert report["pages"][0]["skipped"] == 1
+    jpeg = next(image for image in images(output)[0] if image["/Filter"] == "/DCTDecode")
+    assert jpeg.get_data() == buffer.getvalue()
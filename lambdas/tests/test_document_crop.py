@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+import pytest
+
+import document_crop
+
+# A page photographed on a dark desk, a little turned
+PAGE_CORNERS = np.array([[420, 180], [1230, 240], [1180, 1080], [360, 1010]], dtype=np.float32)
+
+
+def page_with_text(width: int = 850, height: int = 1100) -> np.ndarray:
+    page = np.full((height, width, 3), 245, np.uint8)
+    for y in range(80, height - 80, 40):
+        cv2.putText(page, "Name Address Date of birth", (60, y), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (20, 20, 20), 2)
+    return page
+
+
+def photograph(corners: np.ndarray = PAGE_CORNERS, size: tuple = (1600, 1200)) -> np.ndarray:
+    width, height = size
+    desk = np.full((height, width, 3), (40, 70, 110), np.uint8)
+    page = page_with_text()
+    source = np.array([[0, 0], [page.shape[1], 0], [page.shape[1], page.shape[0]], [0, page.shape[0]]],
+                      dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(source, corners)
+    warped = cv2.warpPerspective(page, matrix, size)
+    mask = cv2.warpPerspective(np.full(page.shape[:2], 255, np.uint8), matrix, size)
+    desk[mask > 0] = warped[mask > 0]
+    return desk
+
+
+def jpeg(image: np.ndarray) -> bytes:
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+
+def test_order_corners():
+    shuffled = np.array([[1180, 1080], [420, 180], [360, 1010], [1230, 240]], dtype=np.float32)
+    assert document_crop.order_corners(shuffled).tolist() == PAGE_CORNERS.tolist()
+
+
+def test_photographed_page_is_found():
+    corners = document_crop.find_document_quad(photograph())
+    assert corners is not None
+    assert np.abs(corners - PAGE_CORNERS).max() < 15
+
+
+def test_crop_is_straightened_to_the_page():
+    cropped, transform = document_crop.crop_document(jpeg(photograph()))
+    assert transform is not None
+
+    image = cv2.imdecode(np.frombuffer(cropped, np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape[:2] == (transform.crop_height, transform.crop_width)
+    # As tall as the longer of the left and right edges, about 840 px
+    assert abs(transform.crop_height - 840) < 20
+    # Nothing of the desk is left along the edges
+    assert image[5:-5, 5:-5].mean() > 200
+
+
+def test_boxes_map_back_to_the_photo():
+    _, transform = document_crop.crop_document(jpeg(photograph()))
+    whole = transform.remap_bbox({"Left": 0.0, "Top": 0.0, "Width": 1.0, "Height": 1.0})
+    expected_left, expected_top = PAGE_CORNERS.min(axis=0) / (1600, 1200)
+    expected_right, expected_bottom = PAGE_CORNERS.max(axis=0) / (1600, 1200)
+    assert whole["Left"] == pytest.approx(expected_left, abs=0.01)
+    assert whole["Top"] == pytest.approx(expected_top, abs=0.01)
+    assert whole["Left"] + whole["Width"] == pytest.approx(expected_right, abs=0.01)
+    assert whole["Top"] + whole["Height"] == pytest.approx(expected_bottom, abs=0.01)
+
+    corners = transform.to_dict()["Corners"]
+    assert [corner["X"] for corner in corners] == pytest.approx((PAGE_CORNERS[:, 0] / 1600).tolist(), abs=0.01)
+
+
+def test_box_printed_on_a_scan_is_not_cropped():
+    scan = page_with_text(1700, 2200)
+    cv2.rectangle(scan, (300, 400), (1400, 1800), (20, 20, 20), 4)
+    image_bytes = jpeg(scan)
+    assert document_crop.crop_document(image_bytes) == (image_bytes, None)
+
+
+def test_page_filling_the_frame_is_not_cropped():
+    image_bytes = jpeg(photograph(np.array([[5, 5], [1595, 5], [1595, 1195], [5, 1195]], dtype=np.float32)))
+    assert document_crop.crop_document(image_bytes) == (image_bytes, None)
+
+
+def test_undecodable_bytes_are_returned_as_they_are():
+    assert document_crop.crop_document(b"not an image") == (b"not an image", None)
@@ -0,0 +1,121 @@
+import base64
+import json
+import os
+import zipfile
+from io import BytesIO
+
+import pytest
+
+import docx_extract
+
+ASSETS = os.path.join(os.path.dirname(__file__), "..", "..", "src", "assets")
+SAMPLES = ["blank personal membership application.docx", "blank personal membership resaved.docx"]
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+W14_NS = "http://schemas.microsoft.com/office/word/2010/wordml"
+
+
+def read_sample(name: str) -> bytes:
+    with open(os.path.join(ASSETS, name), "rb") as f:
+        return f.read()
+
+
+def make_docx(body: str) -> bytes:
+    """
+    A DOCX holding just a document.xml with the given body content
+    """
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", f'<w:document xmlns:w="{W_NS}" xmlns:w14="{W14_NS}">'
+                                              f'<w:body>{body}</w:body></w:document>')
+    return buffer.getvalue()
+
+
+def text_field(label: str, value: str) -> str:
+    return (f'<w:p><w:r><w:t xml:space="preserve">{label} </w:t></w:r>'
+            '<w:r><w:fldChar w:fldCharType="begin"><w:ffData><w:textInput/></w:ffData></w:fldChar></w:r>'
+            '<w:r><w:instrText> FORMTEXT </w:instrText></w:r>'
+            '<w:r><w:fldChar w:fldCharType="separate"/></w:r>'
+            f'<w:r><w:t>{value}</w:t></w:r>'
+            '<w:r><w:fldChar w:fldCharType="end"/></w:r></w:p>')
+
+
+def checkbox(label: str, checked: bool) -> str:
+    state = "<w:checked/>" if checked else ""
+    return ('<w:p><w:r><w:fldChar w:fldCharType="begin"><w:ffData>'
+            f'<w:checkBox><w:sizeAuto/>{state}</w:checkBox></w:ffData></w:fldChar></w:r>'
+            '<w:r><w:instrText> FORMCHECKBOX </w:instrText></w:r>'
+            '<w:r><w:fldChar w:fldCharType="end"/></w:r>'
+            f'<w:r><w:t xml:space="preserve"> {label}</w:t></w:r></w:p>')
+
+
+def content_control(alias: str, value: str) -> str:
+    return (f'<w:sdt><w:sdtPr><w:alias w:val="{alias}"/><w:text/></w:sdtPr>'
+            f'<w:sdtContent><w:p><w:r><w:t>{value}</w:t></w:r></w:p></w:sdtContent></w:sdt>')
+
+
+def values(result: dict) -> dict:
+    return {field["Key"]: field["Value"] for field in result["fields"]}
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_blank_membership_application(name):
+    result = docx_extract.extract_docx_fields(read_sample(name))
+    assert result["confident"] is True
+    fields = values(result)
+    assert fields["First Name"] == ""
+    assert fields["Last Name"] == ""
+    assert fields["Membership Number:"] == ""
+    assert fields["New Membership"] == docx_extract.NOT_SELECTED
+    # Repeated labels are numbered the way the OCR output numbers them
+    assert "Date of Birth_2" in fields
+    assert all(field["Confidence"] == docx_extract.FIELD_CONFIDENCE for field in result["fields"])
+
+
+def test_resaved_copy_reads_the_same():
+    original, resaved = (docx_extract.extract_docx_fields(read_sample(name)) for name in SAMPLES)
+    assert original["fields"] == resaved["fields"]
+
+
+def test_filled_fields():
+    result = docx_extract.extract_docx_fields(make_docx(
+        text_field("First Name:", "Jane") + checkbox("New Membership", True) + checkbox("Revised Membership", False)
+        + content_control("City", "Victoria") + '<w:p><w:r><w:t>Branch: Downtown</w:t></w:r></w:p>'))
+    assert result["confident"] is True
+    assert values(result) == {"First Name:": "Jane", "New Membership": docx_extract.SELECTED,
+                              "Revised Membership": docx_extract.NOT_SELECTED, "City": "Victoria",
+                              "Branch:": "Downtown"}
+
+
+def test_page_breaks_number_the_pages():
+    result = docx_extract.extract_docx_fields(make_docx(
+        text_field("First Name:", "Jane") + '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+        + text_field("Last Name:", "Doe")))
+    assert [field["PageNumber"] for field in result["fields"]] == [1, 2]
+
+
+def test_unlabelled_fields_are_not_confident():
+    unlabelled = ('<w:p><w:r><w:fldChar w:fldCharType="begin"><w:ffData><w:textInput/></w:ffData></w:fldChar></w:r>'
+                  '<w:r><w:fldChar w:fldCharType="separate"/></w:r><w:r><w:t>Jane</w:t></w:r>'
+                  '<w:r><w:fldChar w:fldCharType="end"/></w:r></w:p>')
+    result = docx_extract.extract_docx_fields(make_docx(unlabelled * 2 + text_field("City:", "Victoria")))
+    assert result["confident"] is False
+    assert "have a label" in result["reason"]
+
+
+@pytest.mark.parametrize("docx_bytes, reason", [
+    (b"not a zip", "Not a readable DOCX"),
+    (make_docx('<w:p><w:r><w:t>Just a letter, no form in it</w:t></w:r></w:p>'), "No form fields"),
+])
+def test_documents_without_fields_are_not_confident(docx_bytes, reason):
+    result = docx_extract.extract_docx_fields(docx_bytes)
+    assert result["confident"] is False
+    assert result["fields"] == []
+    assert reason in result["reason"]
+
+
+def test_handler():
+    response = docx_extract.lambda_handler({"httpMethod": "POST", "body": json.dumps({
+        "base64_docx": base64.b64encode(read_sample(SAMPLES[0])).decode("ascii")})}, None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["confident"] is True
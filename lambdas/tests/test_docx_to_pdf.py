@@ -0,0 +1,208 @@
+import base64
+import importlib
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+
+class ServiceApiException(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def get_status_code(self) -> int:
+        return self.status_code
+
+
+class FakeSdk:
+    """
+    Stands in for the Adobe PDF Services SDK. Each conversion returns b"%PDF-" and
+    the DOCX bytes; expire() makes the current session's next call fail with a 401
+    """
+
+    def __init__(self):
+        self.loads = 0
+        self.sessions = []
+        self.conversions = 0
+        sdk = self
+
+        class PDFServices:
+            def __init__(self, credentials):
+                self.credentials = credentials
+                self.expired = False
+                sdk.sessions.append(self)
+
+            def upload(self, input_stream, mime_type):
+                if self.expired:
+                    raise ServiceApiException("Unauthorized", 401)
+                return input_stream
+
+            def submit(self, job):
+                return job.asset
+
+            def get_job_result(self, location, result_type):
+                return SimpleNamespace(get_result=lambda: SimpleNamespace(get_asset=lambda: location))
+
+            def get_content(self, asset):
+                sdk.conversions += 1
+                return SimpleNamespace(get_input_stream=lambda: b"%PDF-" + asset)
+
+        self.namespace = SimpleNamespace(
+            ServicePrincipalCredentials=lambda client_id, client_secret: (client_id, client_secret),
+            PDFServices=PDFServices,
+            PDFServicesMediaType=SimpleNamespace(DOCX="docx"),
+            CreatePDFJob=lambda asset: SimpleNamespace(asset=asset),
+            CreatePDFResult=object,
+            ServiceApiException=ServiceApiException,
+            errors=(ServiceApiException,)
+        )
+
+    def expire(self):
+        self.sessions[-1].expired = True
+
+
+@pytest.fixture
+def sdk():
+    return FakeSdk()
+
+
+@pytest.fixture
+def docx_to_pdf(monkeypatch, sdk):
+    """
+    A fresh copy of the handler, with a 1 MB cache and the fake SDK behind load_sdk
+    """
+    monkeypatch.setenv("CLIENT_ID", "client")
+    monkeypatch.setenv("CLIENT_SECRET", "secret")
+    monkeypatch.setenv("DOCX_CACHE_MB", "1")
+    module = importlib.reload(importlib.import_module("docx_to_pdf"))
+
+    def load_sdk():
+        sdk.loads += 1
+        module._sdk = sdk.namespace
+        return sdk.namespace
+
+    monkeypatch.setattr(module, "load_sdk", load_sdk)
+    return module
+
+
+def convert(module, docx_bytes: bytes) -> tuple:
+    response = module.lambda_handler({"httpMethod": "POST", "body": json.dumps({
+        "base64_docx": base64.b64encode(docx_bytes).decode("ascii")
+    })}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_sdk_is_loaded_lazily(docx_to_pdf, sdk):
+    response = docx_to_pdf.lambda_handler({"httpMethod": "OPTIONS"}, None)
+    assert response["statusCode"] == 200
+    assert sdk.loads == 0
+    assert docx_to_pdf.sdk_errors() == ()
+
+    status, body = convert(docx_to_pdf, b"document")
+    assert status == 200
+    assert base64.b64decode(body["base64_pdf"]) == b"%PDF-document"
+    assert sdk.loads > 0
+
+
+def test_session_is_reused(docx_to_pdf, sdk):
+    for document in (b"first", b"second", b"third"):
+        assert convert(docx_to_pdf, document)[0] == 200
+    assert len(sdk.sessions) == 1
+    assert sdk.conversions == 3
+
+
+def test_cache_hit_skips_the_sdk(docx_to_pdf, sdk):
+    assert convert(docx_to_pdf, b"document")[1]["cached"] is False
+    loads = sdk.loads
+
+    status, body = convert(docx_to_pdf, b"document")
+    assert status == 200
+    assert body["cached"] is True
+    assert base64.b64decode(body["base64_pdf"]) == b"%PDF-document"
+    assert sdk.loads == loads
+    assert sdk.conversions == 1
+
+
+def test_expired_session_is_reauthenticated_once(docx_to_pdf, sdk):
+    convert(docx_to_pdf, b"first")
+    sdk.expire()
+
+    status, body = convert(docx_to_pdf, b"second")
+    assert status == 200
+    assert base64.b64decode(body["base64_pdf"]) == b"%PDF-second"
+    assert len(sdk.sessions) == 2
+
+
+def test_repeated_401_is_an_error(docx_to_pdf, sdk, monkeypatch):
+    convert(docx_to_pdf, b"first")
+    sdk.expire()
+    original = sdk.namespace.PDFServices
+
+    def always_expired(credentials):
+        session = original(credentials)
+        session.expired = True
+        return session
+
+    monkeypatch.setattr(sdk.namespace, "PDFServices", always_expired)
+    status, body = convert(docx_to_pdf, b"second")
+    assert status == 500
+    assert "Adobe PDF Services API error" in body["error"]
+    # One retry with a new session, not a loop
+    assert len(sdk.sessions) == 2
+
+
+def test_other_sdk_errors_are_not_retried(docx_to_pdf, sdk, monkeypatch):
+    convert(docx_to_pdf, b"first")
+
+    def upload(input_stream, mime_type):
+        raise ServiceApiException("Bad request", 400)
+
+    monkeypatch.setattr(sdk.sessions[-1], "upload", upload)
+    status, _ = convert(docx_to_pdf, b"second")
+    assert status == 500
+    assert len(sdk.sessions) == 1
+
+
+def test_cache_evicts_least_recently_used(docx_to_pdf, sdk):
+    assert docx_to_pdf.CACHE_MAX_BYTES == 1024 * 1024
+    # Each PDF is a little over 400 KB, so two fit in the 1 MB cache
+    documents = [bytes([index]) * 400 * 1024 for index in range(3)]
+
+    convert(docx_to_pdf, documents[0])
+    convert(docx_to_pdf, documents[1])
+    # Using the first again makes the second the least recently used
+    assert convert(docx_to_pdf, documents[0])[1]["cached"] is True
+    convert(docx_to_pdf, documents[2])
+
+    assert docx_to_pdf._conversion_cache_bytes <= docx_to_pdf.CACHE_MAX_BYTES
+    assert convert(docx_to_pdf, documents[0])[1]["cached"] is True
+    assert convert(docx_to_pdf, documents[2])[1]["cached"] is True
+    assert convert(docx_to_pdf, documents[1])[1]["cached"] is False
+
+
+def test_pdf_larger_than_the_cache_is_not_kept(docx_to_pdf, sdk):
+    document = b"x" * (1024 * 1024 + 1)
+    convert(docx_to_pdf, document)
+    assert convert(docx_to_pdf, document)[1]["cached"] is False
+    assert docx_to_pdf._conversion_cache_bytes == 0
+
+
+def test_docx_fields_come_with_the_pdf(docx_to_pdf, sdk):
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "src", "assets",
+                           "blank personal membership application.docx"), "rb") as f:
+        document = f.read()
+
+    status, body = convert(docx_to_pdf, document)
+    assert status == 200
+    assert body["docx_fields"]["confident"] is True
+    assert len(body["docx_fields"]["fields"]) > 0
+    # Read again on a cache hit
+    assert convert(docx_to_pdf, document)[1]["docx_fields"] == body["docx_fields"]
+
+
+def test_unreadable_docx_is_still_converted(docx_to_pdf, sdk):
+    status, body = convert(docx_to_pdf, b"document")
+    assert status == 200
+    assert body["docx_fields"]["confident"] is False
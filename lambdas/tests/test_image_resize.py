@@ -0,0 +1,73 @@
+import base64
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+import image_resize
+
+LETTER_WIDTH = int(8.5 * 200)
+
+
+def encoded(image: Image.Image, image_format: str, **options) -> str:
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def photo(width: int, height: int) -> Image.Image:
+    image = Image.new("RGB", (width, height), (200, 180, 150))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 40):
+        draw.line((x, 0, x, height), fill=(x % 255, 90, 160), width=6)
+    return image
+
+
+def resize(image_base64: str, **options) -> tuple:
+    response = image_resize.lambda_handler({"httpMethod": "POST", "body": json.dumps(dict(
+        image_base64=image_base64, **options))}, None)
+    body = json.loads(response["body"]) if response["statusCode"] != 500 else response["body"]
+    return response["statusCode"], body
+
+
+def decoded(image_base64: str) -> Image.Image:
+    return Image.open(BytesIO(base64.b64decode(image_base64)))
+
+
+@pytest.mark.parametrize("width, height", [(4000, 3000), (850, 1100)])
+def test_resized_to_letter_width(width, height):
+    status, body = resize(encoded(photo(width, height), "JPEG", quality=90), profile="color")
+    assert status == 200
+    image = decoded(body["resized_image"])
+    assert image.format == "JPEG"
+    assert image.width == LETTER_WIDTH
+    assert abs(image.height - round(height * LETTER_WIDTH / width)) <= 1
+
+
+def test_exif_rotation_is_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    status, body = resize(encoded(photo(3000, 2000), "JPEG", exif=exif), profile="color")
+    assert status == 200
+    image = decoded(body["resized_image"])
+    # Turned upright, so the 2000 px side is now the width
+    assert image.size == (LETTER_WIDTH, round(3000 * LETTER_WIDTH / 2000))
+
+
+def test_png_stays_png():
+    status, body = resize(encoded(photo(1000, 1200), "PNG"), profile="color")
+    assert status == 200
+    assert decoded(body["resized_image"]).format == "PNG"
+
+
+def test_string_event_is_rejected():
+    response = image_resize.lambda_handler("not an event", None)
+    assert response["statusCode"] == 400
+    assert "not an event" in json.loads(response["body"])["error"]
+
+
+def test_missing_image_is_rejected():
+    status, body = resize("")
+    assert status == 400
+    assert "image_base64" in body["error"]
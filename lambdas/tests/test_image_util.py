@@ -0,0 +1,145 @@
+import base64
+import importlib
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+import image_util
+
+
+def text_page(width: int = 1700, height: int = 2200, line_height: int = 40, font_size: int = 10) -> Image.Image:
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(100, height - 100, line_height):
+        draw.text((100, y), "The quick brown fox jumps over the lazy dog " * 12, fill="black", font_size=font_size)
+    return image
+
+
+def gradient(width: int = 800, height: int = 600) -> Image.Image:
+    return Image.linear_gradient("L").resize((width, height)).convert("RGB")
+
+
+def photo(width: int = 800, height: int = 600) -> Image.Image:
+    image = Image.new("RGB", (width, height), (200, 180, 150))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 40):
+        draw.line((x, 0, x, height), fill=(x % 255, 90, 160), width=6)
+    return image
+
+
+def encoded(image: Image.Image, image_format: str, **options) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def decoded(data: bytes) -> Image.Image:
+    return Image.open(BytesIO(data))
+
+
+@pytest.mark.parametrize("image, content_class", [
+    (text_page(), image_util.BILEVEL),
+    (text_page().convert("L"), image_util.BILEVEL),
+    (Image.new("RGB", (1000, 1000), "white"), image_util.BILEVEL),
+    (gradient(), image_util.GRAYSCALE),
+    (photo(), image_util.COLOR),
+])
+def test_classify_content(image, content_class):
+    assert image_util.classify_content(image) == content_class
+
+
+def test_thin_text_is_not_averaged_into_midtones():
+    # A 300 dpi page is sampled down to the classifier thumbnail; averaging would turn
+    # its strokes grey and call it grayscale
+    assert image_util.classify_content(text_page(2550, 3300, 30, 20)) == image_util.BILEVEL
+
+
+def test_a_little_colour_makes_a_page_colour():
+    image = text_page()
+    ImageDraw.Draw(image).ellipse((1300, 1800, 1600, 2100), fill=(200, 30, 30))
+    assert image_util.classify_content(image) == image_util.COLOR
+
+
+@pytest.mark.parametrize("bilevel_format", ["PNG", "TIFF"])
+def test_bilevel_pages_are_one_bit(bilevel_format):
+    data, used = image_util.encode_for_content(text_page(), image_util.BILEVEL, "JPEG", 80, bilevel_format)
+    image = decoded(data)
+    assert used == bilevel_format
+    assert (image.format, image.mode) == (bilevel_format, "1")
+    if bilevel_format == "TIFF":
+        assert image.info["compression"] == "group4"
+    # Smaller than the JPEG that was asked for
+    assert len(data) < len(image_util.encode_image(text_page(), "JPEG", 80))
+
+
+def test_grayscale_pages_are_eight_bit():
+    data, used = image_util.encode_for_content(gradient(), image_util.GRAYSCALE, "JPEG", 80)
+    assert used == "JPEG"
+    assert decoded(data).mode == "L"
+
+
+@pytest.mark.parametrize("image_format, used", [("PNG", "PNG"), ("JPEG", "JPEG"), ("WEBP", "JPEG")])
+def test_colour_pages_keep_their_format(image_format, used):
+    data, chosen = image_util.encode_for_content(photo(), image_util.COLOR, image_format, 80)
+    assert chosen == used
+    assert decoded(data).format == used
+    assert decoded(data).mode == "RGB"
+
+
+
+def test_image_within_budget_is_decoded_whole():
+    image, source_format, factor = image_util.open_within_budget(encoded(photo(), "PNG"), max_pixels=800 * 600)
+    assert (image.size, source_format, factor) == ((800, 600), "PNG", 1)
+
+
+def test_jpeg_over_budget_is_reduced_while_decoding():
+    image, source_format, factor = image_util.open_within_budget(encoded(photo(1600, 1200), "JPEG"),
+                                                                 max_pixels=500_000)
+    assert source_format == "JPEG"
+    assert image.size == (800, 600)
+    assert factor == 2
+
+
+def test_png_over_budget_is_decoded_in_strips(monkeypatch):
+    # Strips of a few rows, so the page takes many
+    monkeypatch.setattr(image_util, "STRIP_PIXELS", 8000)
+    source = photo(1600, 1200)
+    image, _, factor = image_util.open_within_budget(encoded(source, "PNG"), max_pixels=500_000)
+    assert factor == 2
+    assert image.size == (800, 600)
+    assert image.tobytes() == source.reduce(2).tobytes()
+
+
+@pytest.mark.parametrize("image_format, options", [("TIFF", {}), ("PNG", {"interlace": True})])
+def test_over_budget_without_a_reduced_decode_is_too_large(image_format, options):
+    data = encoded(photo(1600, 1200), image_format, **options)
+    if options:
+        # Pillow can't write interlaced PNGs, so set the flag in the header
+        data = data[:8] + image_util._png_chunk(b"IHDR", data[16:28] + b"\x01") + data[33:]
+    with pytest.raises(image_util.ImageTooLargeError):
+        image_util.open_within_budget(data, max_pixels=500_000)
+
+
+def test_jpeg_too_large_even_at_an_eighth_is_too_large():
+    with pytest.raises(image_util.ImageTooLargeError, match="even when reduced"):
+        image_util.open_within_budget(encoded(photo(1600, 1200), "JPEG"), max_pixels=10_000)
+
+
+def test_budget_follows_the_memory_limit(monkeypatch):
+    monkeypatch.setattr(image_util, "PIXEL_BUDGET", 10 ** 9)
+    monkeypatch.setattr(image_util, "MEMORY_BUDGET", 1200 * image_util.WORKING_COPIES)
+    assert image_util.pixel_budget("L") == 1200
+    assert image_util.pixel_budget("RGB") == 400
+
+
+@pytest.mark.parametrize("handler, options", [("compress_image", {"max_bytes": 100000}),
+                                              ("image_resize", {})])
+def test_handlers_answer_413(monkeypatch, handler, options):
+    monkeypatch.setattr(image_util, "PIXEL_BUDGET", 10_000)
+    module = importlib.import_module(handler)
+    response = module.lambda_handler({"httpMethod": "POST", "body": json.dumps(dict(
+        image_base64=base64.b64encode(encoded(photo(1600, 1200), "TIFF")).decode("ascii"), **options))}, None)
+    assert response["statusCode"] == 413
+    assert "Image too large" in json.loads(response["body"])["error"]
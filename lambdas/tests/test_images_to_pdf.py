@@ -0,0 +1,106 @@
+import base64
+import json
+from io import BytesIO
+
+import fitz
+import pypdf
+import pytest
+from PIL import Image, ImageDraw
+
+import images_to_pdf
+
+
+def photo(width: int, height: int, mode: str = "RGB") -> Image.Image:
+    image = Image.new("RGB", (width, height), (200, 180, 150))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 40):
+        draw.line((x, 0, x, height), fill=(x % 255, 90, 160), width=6)
+    return image.convert(mode)
+
+
+def encoded(image: Image.Image, image_format: str, **options) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def with_orientation(orientation: int) -> Image.Exif:
+    exif = Image.Exif()
+    exif[images_to_pdf.EXIF_ORIENTATION] = orientation
+    return exif
+
+
+def build(*images: bytes) -> tuple:
+    response = images_to_pdf.lambda_handler({"httpMethod": "POST", "body": json.dumps({
+        "images": [base64.b64encode(image).decode("ascii") for image in images]
+    })}, None)
+    body = json.loads(response["body"]) if response["statusCode"] != 500 else response["body"]
+    return response["statusCode"], body
+
+
+def pages(body: dict) -> list:
+    reader = pypdf.PdfReader(BytesIO(base64.b64decode(body["pdf_base64"])))
+    return [(page, page["/Resources"]["/XObject"]["/Im0"].get_object()) for page in reader.pages]
+
+
+@pytest.mark.parametrize("mode, color_space", [("RGB", "/DeviceRGB"), ("L", "/DeviceGray")])
+def test_jpeg_is_embedded_byte_for_byte(mode, color_space):
+    jpeg = encoded(photo(800, 600, mode), "JPEG", quality=85)
+    status, body = build(jpeg)
+    assert status == 200
+
+    [(page, image)] = pages(body)
+    assert image["/Filter"] == "/DCTDecode"
+    assert image["/ColorSpace"] == color_space
+    assert image._data == jpeg
+    assert page["/Rotate"] == 0
+    assert [float(value) for value in page.mediabox] == [0, 0, 800, 600]
+
+
+@pytest.mark.parametrize("orientation, rotate", [(1, 0), (3, 180), (6, 90), (8, 270)])
+def test_exif_orientation_becomes_page_rotation(orientation, rotate):
+    jpeg = encoded(photo(800, 600), "JPEG", exif=with_orientation(orientation))
+    [(page, image)] = pages(build(jpeg)[1])
+    assert page["/Rotate"] == rotate
+    # The stored image is the camera's, unturned
+    assert image._data == jpeg
+    assert (image["/Width"], image["/Height"]) == (800, 600)
+
+
+def test_mirrored_jpeg_is_transcoded_upright():
+    # A mirror can't be expressed with /Rotate, so the image is decoded and turned
+    jpeg = encoded(photo(800, 600), "JPEG", exif=with_orientation(5))
+    [(page, image)] = pages(build(jpeg)[1])
+    assert image["/Filter"] == "/FlateDecode"
+    assert (image["/Width"], image["/Height"]) == (600, 800)
+    assert page["/Rotate"] == 0
+
+
+def test_adobe_cmyk_jpeg_is_inverted():
+    jpeg = encoded(photo(400, 300, "CMYK"), "JPEG")
+    [(_, image)] = pages(build(jpeg)[1])
+    assert image["/ColorSpace"] == "/DeviceCMYK"
+    assert list(image["/Decode"]) == [1, 0] * 4
+
+
+def test_png_is_stored_losslessly():
+    source = photo(500, 400)
+    [(_, image)] = pages(build(encoded(source, "PNG"))[1])
+    assert image["/Filter"] == "/FlateDecode"
+    assert image.decode_as_image().tobytes() == source.tobytes()
+
+
+def test_pages_keep_their_order_and_render():
+    status, body = build(encoded(photo(800, 600), "JPEG"), encoded(photo(300, 500), "PNG"),
+                         encoded(photo(640, 480, "L"), "JPEG"))
+    assert status == 200
+    with fitz.open(stream=base64.b64decode(body["pdf_base64"]), filetype="pdf") as doc:
+        assert [(page.rect.width, page.rect.height) for page in doc] == [(800, 600), (300, 500), (640, 480)]
+        for page in doc:
+            assert page.get_pixmap(dpi=10).width > 0
+
+
+def test_no_images_is_an_input_error():
+    status, body = build()
+    assert status == 400
+    assert "Input Error" in body["error"]
@@ -0,0 +1,91 @@
+import base64
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+import image_resize
+import image_util
+import imaging_backend
+import pdf_to_images
+
+ENGINES = [imaging_backend.PILLOW] + ([imaging_backend.VIPS] if imaging_backend.pyvips is not None else [])
+
+
+def encoded(image: Image.Image, image_format: str, **options) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def text_page(mode: str = "L") -> Image.Image:
+    page = Image.new(mode, (1200, 1600), "white")
+    draw = ImageDraw.Draw(page)
+    for row in range(40):
+        draw.text((100, 100 + row * 35), "The quick brown fox jumps over the lazy dog " * 2, fill="black")
+    return page
+
+
+@pytest.mark.parametrize("name", ENGINES)
+def test_engines_decode_resize_and_encode(name):
+    engine = imaging_backend.get_backend(name)
+    assert engine.name == name
+
+    image, source_format, _ = engine.decode(encoded(text_page("RGB"), "JPEG", quality=90), 600)
+    assert source_format == "JPEG"
+    resized = engine.resize_to_width(image, 600)
+    assert engine.size(resized) == (600, 800)
+
+    png = Image.open(BytesIO(engine.encode(resized, "PNG")))
+    assert (png.format, png.size) == ("PNG", (600, 800))
+
+
+@pytest.mark.parametrize("name", ENGINES)
+def test_engines_classify_pages_alike(name):
+    engine = imaging_backend.get_backend(name)
+    black_and_white = engine.decode(encoded(text_page(), "PNG"))[0]
+    assert engine.classify(black_and_white) == image_util.BILEVEL
+
+    photo = Image.linear_gradient("L").resize((600, 600)).convert("RGB")
+    photo.paste((220, 40, 40), (100, 100, 400, 400))
+    assert engine.classify(engine.decode(encoded(photo, "PNG"))[0]) == image_util.COLOR
+
+
+@pytest.mark.parametrize("name", ENGINES)
+def test_engines_flatten_samples_onto_white(name):
+    engine = imaging_backend.get_backend(name)
+    transparent = Image.new("RGBA", (4, 4), (0, 0, 0, 0))
+    samples, width, height, bands, bits = engine.samples(engine.decode(encoded(transparent, "PNG"))[0])
+    assert (width, height, bits) == (4, 4, 8)
+    assert set(bytes(samples)) == {255}
+    assert bands in (1, 3)
+
+
+def test_default_backend(monkeypatch):
+    monkeypatch.setattr(imaging_backend, "DEFAULT_BACKEND", imaging_backend.PILLOW)
+    assert imaging_backend.get_backend().name == imaging_backend.PILLOW
+    assert imaging_backend.get_backend("Pillow") is imaging_backend.get_backend()
+
+
+def test_missing_vips_falls_back_to_pillow(monkeypatch):
+    monkeypatch.setattr(imaging_backend, "pyvips", None)
+    assert imaging_backend.get_backend(imaging_backend.VIPS).name == imaging_backend.PILLOW
+
+
+def test_unknown_backend():
+    with pytest.raises(imaging_backend.UnknownBackendError, match="pillow"):
+        imaging_backend.get_backend("imagemagick")
+
+
+@pytest.mark.parametrize("handler, body", [
+    (image_resize, {"image_base64": base64.b64encode(encoded(text_page(), "PNG")).decode("ascii")}),
+    (pdf_to_images, {"pdf_base64": base64.b64encode(b"%PDF-1.4").decode("ascii")}),
+])
+def test_handlers_reject_unknown_backends(handler, body):
+    response = handler.lambda_handler({"httpMethod": "POST", "body": json.dumps(dict(body, backend="imagemagick"))},
+                                      None)
+    assert response["statusCode"] == 400
+    error = json.loads(response["body"])["error"]
+    assert "imagemagick" in error
+    assert "'pillow', 'vips'" in error
@@ -0,0 +1,147 @@
+import http.client
+import time
+
+import pytest
+
+import jwt_util
+from jwt_util import JwksCache, JwksUnavailableError, TokenError, TokenVerifier
+
+POOL_ID = "us-east-2_TestPool"
+CLIENT_ID = "test-client"
+ISSUER = f"https://cognito-idp.us-east-2.amazonaws.com/{POOL_ID}"
+
+
+@pytest.fixture
+def jwks(rsa_keys):
+    """
+    The pool's published keys, which a test can change, and a count of the fetches
+    """
+    state = {"keys": [rsa_keys[0].jwk()], "fetches": 0}
+
+    def fetch():
+        state["fetches"] += 1
+        return {"keys": list(state["keys"])}
+
+    state["fetch"] = fetch
+    return state
+
+
+@pytest.fixture
+def verifier(jwks):
+    return TokenVerifier(POOL_ID, [CLIENT_ID], jwks=JwksCache("unused", jwks["fetch"]))
+
+
+def access_claims(**overrides) -> dict:
+    claims = {"sub": "user-1", "username": "user-1", "iss": ISSUER, "token_use": "access",
+              "client_id": CLIENT_ID, "exp": time.time() + 3600, "cognito:groups": ["admin"]}
+    claims.update(overrides)
+    return claims
+
+
+def test_valid_token(verifier, rsa_keys):
+    claims = verifier.verify(rsa_keys[0].sign(access_claims()), "access")
+    assert claims["sub"] == "user-1"
+    assert claims["cognito:groups"] == ["admin"]
+
+
+def test_valid_id_token(verifier, rsa_keys):
+    token = rsa_keys[0].sign(access_claims(token_use="id", aud=CLIENT_ID, client_id=None))
+    assert verifier.verify(token, "id")["sub"] == "user-1"
+
+
+def test_bad_signature(verifier, rsa_keys):
+    # Signed by another key under the published key's id
+    with pytest.raises(TokenError, match="Invalid signature"):
+        verifier.verify(rsa_keys[1].sign(access_claims(), kid="key-1"), "access")
+
+
+def test_tampered_claims(verifier, rsa_keys):
+    header, _, signature = rsa_keys[0].sign(access_claims()).split(".")
+    _, forged, _ = rsa_keys[0].sign(access_claims(sub="someone-else")).split(".")
+    with pytest.raises(TokenError, match="Invalid signature"):
+        verifier.verify(f"{header}.{forged}.{signature}", "access")
+
+
+def test_malformed_token(verifier):
+    with pytest.raises(TokenError, match="Malformed"):
+        verifier.verify("not-a-jwt", "access")
+
+
+def test_expired_token(verifier, rsa_keys):
+    expired = time.time() - jwt_util.CLOCK_SKEW_SECONDS - 1
+    with pytest.raises(TokenError, match="expired"):
+        verifier.verify(rsa_keys[0].sign(access_claims(exp=expired)), "access")
+
+
+def test_cached_token_expires(verifier, rsa_keys):
+    token = rsa_keys[0].sign(access_claims(exp=time.time() + 60))
+    verifier.verify(token, "access")
+    with pytest.raises(TokenError, match="expired"):
+        verifier.verify(token, "access", now=time.time() + 120)
+
+
+@pytest.mark.parametrize("overrides, message", [
+    ({"token_use": "id"}, "Expected an access token"),
+    ({"client_id": "another-client"}, "another app client"),
+    ({"iss": "https://cognito-idp.us-east-2.amazonaws.com/us-east-2_OtherPool"}, "Unexpected issuer"),
+])
+def test_wrong_claims(verifier, rsa_keys, overrides, message):
+    with pytest.raises(TokenError, match=message):
+        verifier.verify(rsa_keys[0].sign(access_claims(**overrides)), "access")
+
+
+def test_unknown_kid_refetch_is_rate_limited(verifier, jwks, rsa_keys):
+    verifier.verify(rsa_keys[0].sign(access_claims()), "access")
+    assert jwks["fetches"] == 1
+
+    # Cognito rotates in key-2, but the keys were fetched too recently to look again
+    jwks["keys"].append(rsa_keys[1].jwk())
+    rotated = rsa_keys[1].sign(access_claims())
+    for _ in range(3):
+        with pytest.raises(TokenError, match="Unknown signing key"):
+            verifier.verify(rotated, "access")
+    assert jwks["fetches"] == 1
+
+    verifier.jwks.fetched_at -= jwt_util.JWKS_MIN_REFRESH_SECONDS
+    assert verifier.verify(rotated, "access")["sub"] == "user-1"
+    assert jwks["fetches"] == 2
+
+
+def test_known_kid_does_not_refetch(verifier, jwks, rsa_keys):
+    verifier.jwks.fetched_at = None
+    for sub in ("user-1", "user-2", "user-3"):
+        verifier.verify(rsa_keys[0].sign(access_claims(sub=sub)), "access")
+    assert jwks["fetches"] == 1
+
+
+@pytest.mark.parametrize("error", [
+    OSError("Connection reset by peer"),
+    TimeoutError("timed out"),
+    http.client.IncompleteRead(b"{\"keys\""),
+])
+def test_fetch_failures_are_unavailable(monkeypatch, error):
+    def urlopen(url, timeout):
+        raise error
+
+    monkeypatch.setattr(jwt_util.urllib.request, "urlopen", urlopen)
+    with pytest.raises(JwksUnavailableError):
+        JwksCache("https://example.invalid/jwks.json").get_key("key-1")
+
+
+def test_get_verifier_uses_the_pools_region(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "us-west-2")
+    monkeypatch.setattr(jwt_util, "COGNITO_USER_POOL_ID", "eu-west-1_TestPool")
+    monkeypatch.setattr(jwt_util, "COGNITO_CLIENT_ID", "client-a, client-b")
+    monkeypatch.setattr(jwt_util, "_verifier", None)
+
+    verifier = jwt_util.get_verifier()
+    assert verifier.issuer == "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_TestPool"
+    assert verifier.jwks.url.startswith("https://cognito-idp.eu-west-1.amazonaws.com/")
+    assert verifier.client_ids == {"client-a", "client-b"}
+
+
+def test_get_verifier_needs_a_client(monkeypatch):
+    monkeypatch.setattr(jwt_util, "COGNITO_USER_POOL_ID", POOL_ID)
+    monkeypatch.setattr(jwt_util, "COGNITO_CLIENT_ID", None)
+    monkeypatch.setattr(jwt_util, "_verifier", None)
+    assert jwt_util.get_verifier() is None
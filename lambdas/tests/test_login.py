@@ -0,0 +1,153 @@
+import base64
+import json
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import login
+
+POOL_ID = "us-east-2_TestPool"
+
+
+def b64url(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode("ascii")
+
+
+def id_token(**claims) -> str:
+    # login.py reads the ID token without checking it, so any signature will do
+    return f"{b64url({'alg': 'RS256', 'kid': 'key-1'})}.{b64url(claims)}.c2lnbmF0dXJl"
+
+
+USER_CLAIMS = {
+    "sub": "user-1",
+    "cognito:username": "user-1",
+    "cognito:groups": ["admin"],
+    "email": "aTestUser@gmail.com",
+    "email_verified": True,
+    "given_name": "Test",
+    "family_name": "User",
+    "iss": f"https://cognito-idp.us-east-2.amazonaws.com/{POOL_ID}",
+    "aud": "test-client",
+    "token_use": "id",
+    "auth_time": 1700000000,
+    "iat": 1700000000,
+    "exp": 1700003600,
+}
+
+
+class StubCognito:
+    """
+    initiate_auth plus the two lookups login falls back to. The lookups wait for each
+    other at a barrier, so they only both return if they run at the same time
+    """
+
+    def __init__(self, id_token=None, wrong_password=False):
+        self.id_token = id_token
+        self.wrong_password = wrong_password
+        self.calls = []
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def initiate_auth(self, ClientId, AuthFlow, AuthParameters):
+        self.calls.append("initiate_auth")
+        if self.wrong_password:
+            raise ClientError({"Error": {"Code": "NotAuthorizedException",
+                                         "Message": "Incorrect username or password."}}, "InitiateAuth")
+        result = {"AccessToken": "access-token", "RefreshToken": "refresh-token"}
+        if self.id_token is not None:
+            result["IdToken"] = self.id_token
+        return {"AuthenticationResult": result}
+
+    def get_user(self, AccessToken):
+        self.calls.append("get_user")
+        self.barrier.wait()
+        return {"Username": "user-1", "UserAttributes": [{"Name": "email", "Value": "aTestUser@gmail.com"}]}
+
+    def admin_list_groups_for_user(self, Username, UserPoolId):
+        self.calls.append("admin_list_groups_for_user")
+        self.barrier.wait()
+        return {"Groups": [{"GroupName": "admin", "UserPoolId": UserPoolId}]}
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    monkeypatch.setattr(login, "COGNITO_USER_POOL_ID", POOL_ID)
+
+    def install(**kwargs):
+        stub = StubCognito(**kwargs)
+        monkeypatch.setattr(login, "cognito_client", stub)
+        return stub
+
+    return install
+
+
+def sign_in(password: str = "P@ssword123") -> tuple:
+    response = login.lambda_handler({"httpMethod": "POST", "body": json.dumps({
+        "email": "aTestUser@gmail.com", "password": password
+    })}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_user_from_id_token(monkeypatch):
+    monkeypatch.setattr(login, "COGNITO_USER_POOL_ID", POOL_ID)
+    user_info, user_groups = login.user_from_id_token(id_token(**USER_CLAIMS))
+
+    assert user_info["Username"] == "user-1"
+    attributes = {attribute["Name"]: attribute["Value"] for attribute in user_info["UserAttributes"]}
+    assert attributes == {"sub": "user-1", "email": "aTestUser@gmail.com", "email_verified": "true",
+                          "given_name": "Test", "family_name": "User"}
+    assert user_groups == [{"GroupName": "admin", "UserPoolId": POOL_ID}]
+
+
+def test_user_from_id_token_without_groups():
+    claims = {name: value for name, value in USER_CLAIMS.items() if name != "cognito:groups"}
+    _, user_groups = login.user_from_id_token(id_token(**claims))
+    assert user_groups == []
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "not-a-jwt",
+    id_token(**{name: value for name, value in USER_CLAIMS.items() if name != "email"}),
+    id_token(**{name: value for name, value in USER_CLAIMS.items() if name != "cognito:username"}),
+])
+def test_user_from_id_token_needs_the_user_claims(token):
+    assert login.user_from_id_token(token) is None
+
+
+def test_fetch_user_makes_both_calls_at_once(cognito):
+    stub = cognito()
+    user_info, user_groups = login.fetch_user("access-token", "aTestUser@gmail.com")
+
+    assert user_info["Username"] == "user-1"
+    assert user_groups == [{"GroupName": "admin", "UserPoolId": POOL_ID}]
+    assert sorted(stub.calls) == ["admin_list_groups_for_user", "get_user"]
+
+
+def test_login_uses_the_id_token(cognito):
+    stub = cognito(id_token=id_token(**USER_CLAIMS))
+    status, body = sign_in()
+
+    assert status == 200
+    assert stub.calls == ["initiate_auth"]
+    assert body["accessToken"] == "access-token"
+    assert body["user_info"]["Username"] == "user-1"
+    assert [group["GroupName"] for group in body["user_groups"]] == ["admin"]
+
+
+def test_login_falls_back_to_cognito(cognito):
+    stub = cognito(id_token=id_token(sub="user-1"))
+    status, body = sign_in()
+
+    assert status == 200
+    assert sorted(stub.calls) == ["admin_list_groups_for_user", "get_user", "initiate_auth"]
+    assert body["user_info"]["Username"] == "user-1"
+    assert [group["GroupName"] for group in body["user_groups"]] == ["admin"]
+
+
+def test_login_rejects_wrong_password(cognito):
+    cognito(wrong_password=True)
+    status, body = sign_in("wrong")
+
+    assert status == 401
+    assert body["code"] == "NotAuthorizedException"
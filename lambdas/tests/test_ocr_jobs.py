@@ -0,0 +1,205 @@
+import base64
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import get_ocr_job
+import ocr_job_worker
+import ocr_jobs
+from textract_limiter import Throttled
+
+PAGE = base64.b64encode(b"page image").decode("ascii")
+
+
+class RecordingQueue:
+    """
+    Keeps the page messages submit sends, for the tests to deliver
+    """
+
+    def __init__(self, fail: bool = False):
+        self.bodies = []
+        self.fail = fail
+
+    def send(self, bodies: list) -> None:
+        if self.fail:
+            raise ocr_jobs.JobError("SQS refused 1 page messages")
+        self.bodies.extend(bodies)
+
+
+class StubAnalysis:
+    """
+    getOCRDataLambda's process_page, reading every page into one field unless told
+    to throttle or fail
+    """
+
+    def __init__(self):
+        self.reads = []
+        self.error = None
+
+    def process_page(self, image_bytes, doc_type, page_number, crop_enabled, deadline):
+        self.reads.append(page_number)
+        if self.error is not None:
+            raise self.error
+        return [{"Key": "Name", "Value": image_bytes.decode(), "PageNumber": page_number}], None
+
+
+@pytest.fixture
+def jobs(monkeypatch, fakes):
+    """
+    ocr_jobs over the SQLite database and fake S3, with a queue that only records
+    """
+    analysis, sent = StubAnalysis(), RecordingQueue()
+    monkeypatch.setattr(ocr_jobs, "s3_client", fakes["s3"])
+    monkeypatch.setattr(ocr_jobs, "getOCRDataLambda", analysis)
+    monkeypatch.setattr(ocr_jobs, "_queue", sent)
+    monkeypatch.setattr(ocr_jobs, "OCR_JOB_MAX_ATTEMPTS", 3)
+    return SimpleNamespace(analysis=analysis, queue=sent, s3=fakes["s3"], db=fakes["rds-data"])
+
+
+def deliver(body: dict, receives: int = 1) -> dict:
+    return ocr_job_worker.lambda_handler({"Records": [{
+        "messageId": "message-1",
+        "body": json.dumps(body),
+        "eventSource": "aws:sqs",
+        "attributes": {"ApproximateReceiveCount": str(receives)}
+    }]}, None)
+
+
+def staged(jobs) -> list:
+    return sorted(jobs.s3.buckets.get(ocr_jobs.OCR_JOBS_BUCKET, {}))
+
+
+def test_submit_stages_and_queues_pages(jobs):
+    job = ocr_jobs.submit([PAGE, PAGE], "form", skip_enabled=False, principal_id="user-1")
+
+    assert job["Status"] == ocr_jobs.QUEUED
+    assert (job["Pages"], job["Queued"]) == (2, 2)
+    assert jobs.queue.bodies == [{"JobId": job["JobId"], "Page": 0}, {"JobId": job["JobId"], "Page": 1}]
+    assert staged(jobs) == [ocr_jobs.page_key(job["JobId"], 0), ocr_jobs.page_key(job["JobId"], 1)]
+
+    progress = ocr_jobs.get_job(job["JobId"], "user-1")
+    assert progress["Status"] == ocr_jobs.QUEUED
+    assert [page["Status"] for page in progress["Progress"]] == [ocr_jobs.QUEUED, ocr_jobs.QUEUED]
+
+
+def test_text_layer_pages_are_not_queued(jobs):
+    job = ocr_jobs.submit([PAGE, PAGE], "form", skip_enabled=False, principal_id="user-1",
+                          text_layer=[[{"Key": "Name", "Value": "Ada"}], None])
+
+    assert job["Queued"] == 1
+    assert jobs.queue.bodies == [{"JobId": job["JobId"], "Page": 1}]
+    result = ocr_jobs.get_job(job["JobId"], "user-1")["Results"][0]
+    assert result["Source"] == "textLayer"
+    assert result["Result"] == [{"Key": "Name", "Value": "Ada", "PageNumber": 1}]
+
+
+def test_only_the_submitter_can_read_a_job(jobs):
+    job_id = ocr_jobs.submit([PAGE], "id", skip_enabled=False, principal_id="user-1")["JobId"]
+
+    assert ocr_jobs.get_job(job_id, "user-1") is not None
+    assert ocr_jobs.get_job(job_id, "user-2") is None
+    assert ocr_jobs.get_job(job_id) is None
+
+    response = get_ocr_job.lambda_handler({"httpMethod": "GET", "queryStringParameters": {"jobId": job_id},
+                                           "requestContext": {"authorizer": {"principalId": "user-2"}}}, None)
+    assert response["statusCode"] == 404
+
+
+def test_worker_reads_a_page_and_removes_its_image(jobs):
+    job_id = ocr_jobs.submit([PAGE], "form", skip_enabled=False, principal_id="user-1")["JobId"]
+
+    assert deliver(jobs.queue.bodies[0]) == {"batchItemFailures": []}
+    job = ocr_jobs.get_job(job_id, "user-1")
+    assert job["Status"] == ocr_jobs.DONE
+    assert job["Progress"] == [{"DocumentIndex": 0, "Status": ocr_jobs.DONE, "Attempts": 1}]
+    assert job["Results"] == [{"DocumentIndex": 0,
+                               "Result": [{"Key": "Name", "Value": "page image", "PageNumber": 1}]}]
+    assert staged(jobs) == []
+
+
+def test_a_page_delivered_twice_is_read_once(jobs):
+    ocr_jobs.submit([PAGE], "form", skip_enabled=False)
+    deliver(jobs.queue.bodies[0])
+
+    assert deliver(jobs.queue.bodies[0], receives=2) == {"batchItemFailures": []}
+    assert jobs.analysis.reads == [1]
+
+
+def test_throttled_page_is_retried_until_the_attempt_limit(jobs):
+    job_id = ocr_jobs.submit([PAGE], "form", skip_enabled=False)["JobId"]
+    jobs.analysis.error = Throttled("Textract kept throttling", "ThrottlingException")
+
+    for receives in range(1, ocr_jobs.OCR_JOB_MAX_ATTEMPTS):
+        assert deliver(jobs.queue.bodies[0], receives) == {"batchItemFailures": [{"itemIdentifier": "message-1"}]}
+        assert ocr_jobs.get_job(job_id)["Progress"][0]["Status"] == ocr_jobs.QUEUED
+
+    assert deliver(jobs.queue.bodies[0], ocr_jobs.OCR_JOB_MAX_ATTEMPTS) == {"batchItemFailures": []}
+    job = ocr_jobs.get_job(job_id)
+    assert job["Status"] == ocr_jobs.DONE
+    assert job["Progress"][0] == {"DocumentIndex": 0, "Status": ocr_jobs.FAILED,
+                                  "Attempts": ocr_jobs.OCR_JOB_MAX_ATTEMPTS}
+    assert job["Results"][0]["Result"] == {"Error": "Throttled", "ErrorMessage": "Textract kept throttling",
+                                           "Retryable": True}
+    assert len(jobs.analysis.reads) == ocr_jobs.OCR_JOB_MAX_ATTEMPTS
+
+
+def test_page_whose_workers_died_is_given_up(jobs):
+    job_id = ocr_jobs.submit([PAGE], "form", skip_enabled=False)["JobId"]
+    # Every earlier delivery took the page and died before finishing it
+    jobs.db.connection.execute("UPDATE ocr_job_pages SET status = 'running', attempts = ?",
+                               (ocr_jobs.OCR_JOB_MAX_ATTEMPTS,))
+
+    assert deliver(jobs.queue.bodies[0], ocr_jobs.OCR_JOB_MAX_ATTEMPTS + 1) == {"batchItemFailures": []}
+    result = ocr_jobs.get_job(job_id)["Results"][0]["Result"]
+    assert result == {"Error": "ProcessingError",
+                      "ErrorMessage": f"Gave up after {ocr_jobs.OCR_JOB_MAX_ATTEMPTS} attempts"}
+    assert jobs.analysis.reads == []
+    assert staged(jobs) == []
+
+
+def test_other_errors_fail_the_page_at_once(jobs):
+    job_id = ocr_jobs.submit([PAGE], "form", skip_enabled=False)["JobId"]
+    jobs.analysis.error = ValueError("Unreadable page")
+
+    assert deliver(jobs.queue.bodies[0]) == {"batchItemFailures": []}
+    job = ocr_jobs.get_job(job_id)
+    assert job["Progress"][0]["Status"] == ocr_jobs.FAILED
+    assert job["Results"][0]["Result"] == {"Error": "ProcessingError", "ErrorMessage": "Unreadable page"}
+
+
+def test_job_that_could_not_be_queued_is_failed(jobs, monkeypatch):
+    monkeypatch.setattr(ocr_jobs, "_queue", RecordingQueue(fail=True))
+
+    with pytest.raises(ocr_jobs.JobError):
+        ocr_jobs.submit([PAGE], "form", skip_enabled=False, principal_id="user-1")
+    assert staged(jobs) == []
+    job_id = jobs.db.connection.execute("SELECT job_id FROM ocr_jobs").fetchone()[0]
+    assert ocr_jobs.get_job(job_id, "user-1")["Status"] == ocr_jobs.FAILED
+
+    # A message that got onto the queue before the failure fails its page unread
+    assert deliver({"JobId": job_id, "Page": 0}) == {"batchItemFailures": []}
+    assert ocr_jobs.get_job(job_id, "user-1")["Results"][0]["Result"]["ErrorMessage"] == \
+        "The job could not be queued"
+    assert jobs.analysis.reads == []
+
+
+def test_memory_queue_drops_a_message_after_the_attempt_limit(monkeypatch):
+    monkeypatch.setattr(ocr_jobs, "OCR_JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(ocr_jobs, "backoff_delay", lambda attempt, base, cap: 0)
+    receives, dropped = [], threading.Event()
+
+    def always_fails(event, context):
+        receives.append(int(event["Records"][0]["attributes"]["ApproximateReceiveCount"]))
+        return {"batchItemFailures": [{"itemIdentifier": event["Records"][0]["messageId"]}]}
+
+    monkeypatch.setattr(ocr_job_worker, "lambda_handler", always_fails)
+    monkeypatch.setattr(ocr_jobs.logger, "error", lambda message: dropped.set())
+
+    ocr_jobs.MemoryQueue(workers=1).send([{"JobId": "job-1", "Page": 0}])
+    assert dropped.wait(5)
+    # Nothing is put back after the message is dropped
+    time.sleep(0.1)
+    assert receives == [1, 2, 3]
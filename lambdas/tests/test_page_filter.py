@@ -0,0 +1,60 @@
+import base64
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+import page_filter
+
+LABELS = ["First Name", "Last Name", "Date of Birth", "Address", "City", "Phone"]
+
+
+def form_page(values=(), image_format="PNG") -> str:
+    """
+    A letter-sized form page, with the given values written into its first boxes
+    """
+    page = Image.new("L", (850, 1100), 255)
+    draw = ImageDraw.Draw(page)
+    draw.text((80, 60), "PERSONAL MEMBERSHIP APPLICATION", fill=0)
+    for row, label in enumerate(LABELS):
+        top = 140 + row * 120
+        draw.text((80, top), label, fill=0)
+        draw.rectangle((80, top + 20, 770, top + 70), outline=0, width=2)
+        if row < len(values):
+            draw.text((95, top + 38), values[row], fill=0)
+    buffer = BytesIO()
+    page.save(buffer, image_format)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def blank_page() -> str:
+    buffer = BytesIO()
+    Image.new("L", (850, 1100), 250).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def test_exact_duplicate_is_skipped():
+    page = form_page(["Jane", "Doe"])
+    assert page_filter.plan_pages([page, form_page(["Sam", "Lee"]), page]) == {
+        2: {"Reason": page_filter.DUPLICATE, "DuplicateOf": 0}
+    }
+
+
+def test_filled_copies_of_one_form_are_not_duplicates():
+    pages = [form_page(["Jane", "Doe"]), form_page(["Jane", "Roe"]), form_page(["Jane", "Doe", "1990-01-01"]),
+             form_page()]
+    assert page_filter.plan_pages(pages) == {}
+
+
+def test_one_character_difference_is_not_a_duplicate():
+    assert page_filter.plan_pages([form_page(["Jane Doe", "", "1990-01-01"]),
+                                   form_page(["Jane Doe", "", "1990-01-07"])]) == {}
+
+
+def test_blank_page_is_skipped():
+    skipped = page_filter.plan_pages([form_page(["Jane"]), blank_page()])
+    assert list(skipped) == [1]
+    assert skipped[1]["Reason"] == page_filter.BLANK
+
+
+def test_undecodable_page_is_left_for_ocr():
+    assert page_filter.plan_pages(["not base64!", base64.b64encode(b"not an image").decode("ascii")]) == {}
@@ -0,0 +1,58 @@
+import base64
+import json
+
+import fitz
+import pytest
+
+import pdf_to_images
+
+PARAGRAPH = ("This membership application must be completed in full and returned to the office "
+             "before the start of the season so that the committee can review it in time")
+
+
+def make_pdf(*pages) -> bytes:
+    """
+    A PDF with one page per list of lines, set in 11 pt type
+    """
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        for index, line in enumerate(lines):
+            page.insert_text((72, 100 + 20 * index), line, fontsize=11)
+    return doc.tobytes()
+
+
+def convert(pdf_bytes: bytes, **options) -> tuple:
+    response = pdf_to_images.lambda_handler({"httpMethod": "POST", "body": json.dumps(dict(
+        pdf_base64=base64.b64encode(pdf_bytes).decode("ascii"), **options))}, None)
+    body = response["body"]
+    return response["statusCode"], json.loads(body) if response["statusCode"] != 500 else body
+
+
+def test_digital_form_is_read_from_the_text_layer():
+    status, body = convert(make_pdf([PARAGRAPH[:90], PARAGRAPH[90:], "Name: Jane Doe", "City: Victoria"]))
+    assert status == 200
+    assert body["ocr_pages"] == []
+    fields = {field["Key"]: field["Value"] for field in body["text_layer"][0]}
+    assert fields == {"Name:": "Jane Doe", "City:": "Victoria"}
+
+
+def test_page_without_fields_needs_ocr():
+    # Plenty of text, but nothing that pairs up as a label and value
+    status, body = convert(make_pdf([PARAGRAPH[:90], PARAGRAPH[90:]]))
+    assert status == 200
+    assert body["text_layer"] == [None]
+    assert body["ocr_pages"] == [0]
+
+
+def test_scanned_page_needs_ocr():
+    status, body = convert(make_pdf(["Name: Jane Doe"]))
+    assert body["text_layer"] == [None]
+    assert body["ocr_pages"] == [0]
+
+
+def test_text_layer_can_be_turned_off():
+    status, body = convert(make_pdf([PARAGRAPH[:90], PARAGRAPH[90:], "Name: Jane Doe"]), textLayer=False)
+    assert status == 200
+    assert body["text_layer"] == [None]
+    assert len(body["image_list"]) == 1
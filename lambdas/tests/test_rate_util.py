@@ -0,0 +1,143 @@
+import random
+
+import pytest
+from botocore.exceptions import ClientError
+
+import rate_util
+from rate_util import TokenBucket
+
+
+class Clock:
+    """
+    Stands in for the time module: sleeping moves the clock on at once
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(rate_util, "time", fake)
+    return fake
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "AdminCreateUser")
+
+
+class Service:
+    """
+    Raises the given errors in turn, then answers
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def admin_create_user(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"User": kwargs}
+
+
+def test_bucket_starts_full(clock):
+    bucket = TokenBucket(rate=5)
+    assert [bucket.try_acquire() for _ in range(5)] == [0.0] * 5
+    # The sixth token comes a fifth of a second later
+    assert bucket.try_acquire() == pytest.approx(0.2)
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    for _ in range(4):
+        bucket.try_acquire()
+
+    clock.now += 1.0
+    assert bucket.try_acquire(2) == 0.0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now += 60.0
+    assert bucket.try_acquire(4) == 0.0
+    assert bucket.try_acquire() > 0.0
+
+
+def test_acquire_waits_for_a_token(clock):
+    bucket = TokenBucket(rate=4, capacity=1)
+    assert bucket.acquire()
+    assert bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.25)]
+
+
+def test_acquire_gives_up_at_the_timeout(clock):
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.acquire()
+    assert bucket.acquire(timeout=0.5) is False
+    assert clock.sleeps == []
+    assert bucket.acquire(timeout=1.0) is True
+
+
+def test_penalize_slows_every_caller(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    bucket.penalize(3)
+    # Both the penalty and the next token have to be earned back
+    assert bucket.try_acquire() == pytest.approx(1.0)
+
+
+def test_set_rate_keeps_earned_tokens_up_to_the_new_capacity(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.set_rate(2)
+    assert bucket.capacity == 2
+    assert bucket.try_acquire(2) == 0.0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+
+def test_backoff_delay_is_capped_full_jitter(monkeypatch):
+    monkeypatch.setattr(rate_util.random, "uniform", lambda low, high: high)
+    assert [rate_util.backoff_delay(attempt, base=0.2, cap=1.0) for attempt in range(4)] == \
+        [0.2, 0.4, 0.8, 1.0]
+    monkeypatch.setattr(rate_util.random, "uniform", random.uniform)
+    assert 0.0 <= rate_util.backoff_delay(10) <= rate_util.MAX_DELAY_SECONDS
+
+
+def test_throttling_is_retried(clock):
+    service = Service(client_error("TooManyRequestsException"), client_error("ThrottlingException"))
+    response = rate_util.call_with_backoff(service.admin_create_user, Username="ada")
+    assert response == {"User": {"Username": "ada"}}
+    assert service.calls == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_other_errors_are_raised_at_once(clock):
+    service = Service(client_error("UsernameExistsException"))
+    with pytest.raises(ClientError, match="UsernameExistsException"):
+        rate_util.call_with_backoff(service.admin_create_user, Username="ada")
+    assert service.calls == 1
+    assert clock.sleeps == []
+
+
+def test_last_error_is_raised_when_attempts_run_out(clock):
+    service = Service(*[client_error("ThrottlingException")] * 5)
+    with pytest.raises(ClientError, match="ThrottlingException"):
+        rate_util.call_with_backoff(service.admin_create_user, max_attempts=3, Username="ada")
+    assert service.calls == 3
+
+
+def test_each_attempt_takes_a_token_and_throttling_drains_one(clock, monkeypatch):
+    monkeypatch.setattr(rate_util, "backoff_delay", lambda attempt: 0.0)
+    bucket = TokenBucket(rate=1, capacity=2)
+    service = Service(client_error("ThrottlingException"))
+    start = clock.now
+    rate_util.call_with_backoff(service.admin_create_user, bucket=bucket, Username="ada")
+    # Two attempts and the penalty took three tokens, one more than the bucket held
+    assert clock.now - start == pytest.approx(1.0)
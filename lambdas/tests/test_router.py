@@ -0,0 +1,188 @@
+import base64
+import json
+import time
+
+import pytest
+
+import api_authorizer
+import router
+from jwt_util import JwksCache, TokenVerifier
+from request_util import PARSED_BODY_KEY, request_body
+
+POOL_ID = "us-east-2_TestPool"
+CLIENT_ID = "test-client"
+ISSUER = f"https://cognito-idp.us-east-2.amazonaws.com/{POOL_ID}"
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """
+    Stands in for every handler module; each call is recorded with the event it got
+    """
+    calls = []
+
+    def handler_for(module):
+        def handler(event, context):
+            calls.append((module, event))
+            return {"statusCode": 200, "headers": {"X-Handler": module},
+                    "body": json.dumps({"module": module, "body": request_body(event, {})})}
+        return handler
+
+    for methods in router.ROUTES.values():
+        for module in methods.values():
+            monkeypatch.setitem(router._handlers, module, handler_for(module))
+    monkeypatch.setattr(router, "AUTHORIZE", True)
+    return calls
+
+
+@pytest.fixture
+def token(monkeypatch, rsa_keys):
+    """
+    Signs access tokens the real authorizer accepts, in or out of the admin group
+    """
+    verifier = TokenVerifier(POOL_ID, [CLIENT_ID], jwks=JwksCache("unused", lambda: {"keys": [rsa_keys[0].jwk()]}))
+    monkeypatch.setattr(api_authorizer, "get_verifier", lambda: verifier)
+
+    def sign(*groups):
+        return rsa_keys[0].sign({"sub": "user-1", "username": "user-1", "iss": ISSUER, "token_use": "access",
+                                 "client_id": CLIENT_ID, "exp": time.time() + 3600, "cognito:groups": list(groups)})
+
+    return sign
+
+
+def request(method: str, path: str, body=None, token: str = None, **event) -> tuple:
+    event = dict(event, httpMethod=method, path=path, body=body,
+                 headers={"Authorization": token} if token else {})
+    response = router.lambda_handler(event, None)
+    return response["statusCode"], json.loads(response["body"]), response["headers"]
+
+
+@pytest.mark.parametrize("path, route", [
+    ("/api/v1/users", "/users"),
+    ("/prod/api/v1/users/", "/users"),
+    ("/api/v1/documents/OCR/jobs?jobId=1", "/documents/OCR/jobs"),
+    ("/users", "/users"),
+    ("", "/"),
+])
+def test_route_path(path, route):
+    assert router.route_path(path) == route
+
+
+def test_request_goes_to_its_handler(handlers, token):
+    status, body, headers = request("POST", "/api/v1/documents/compressimage", json.dumps({"image_base64": "x"}),
+                                    token())
+    assert status == 200
+    assert body == {"module": "compress_image", "body": {"image_base64": "x"}}
+    assert headers["X-Handler"] == "compress_image"
+    assert headers["Access-Control-Allow-Methods"] == "OPTIONS,POST"
+    # The handler got the body the router parsed, and the caller's principal
+    event = handlers[0][1]
+    assert event[PARSED_BODY_KEY] == {"image_base64": "x"}
+    assert event["requestContext"]["authorizer"]["principalId"] == "user-1"
+
+
+def test_method_picks_the_handler(handlers, token):
+    assert request("GET", "/api/v1/documents/OCR/jobs", token=token())[1]["module"] == "get_ocr_job"
+    assert request("POST", "/api/v1/documents/OCR/jobs", "{}", token())[1]["module"] == "submit_ocr_job"
+
+
+def test_unknown_route_is_404(handlers):
+    assert request("GET", "/api/v1/nowhere")[0] == 404
+    assert handlers == []
+
+
+def test_preflight_is_answered_by_the_router(handlers):
+    status, _, headers = request("OPTIONS", "/api/v1/documents/s3")
+    assert status == 200
+    assert headers["Access-Control-Allow-Methods"] == "OPTIONS,GET,POST,PUT"
+    assert handlers == []
+
+
+def test_other_methods_are_405(handlers, token):
+    status, _, headers = request("PATCH", "/api/v1/users", "{}", token())
+    assert status == 405
+    assert headers["Allow"] == "DELETE,GET"
+
+
+@pytest.mark.parametrize("body, encoded", [("{not json", False), (base64.b64encode(b"\xff\xfe").decode(), True)])
+def test_invalid_body_is_400(handlers, token, body, encoded):
+    status, response, _ = request("POST", "/api/v1/documents/OCR", body, token(), isBase64Encoded=encoded)
+    assert status == 400
+    assert response["message"] == "Request body is not valid JSON"
+    assert handlers == []
+
+
+def test_base64_body_is_decoded(handlers, token):
+    body = base64.b64encode(json.dumps({"images": []}).encode()).decode()
+    status, response, _ = request("POST", "/api/v1/documents/imagespdf", body, token(), isBase64Encoded=True)
+    assert status == 200
+    assert response["body"] == {"images": []}
+
+
+def test_body_over_the_payload_limit_is_413(handlers, token, monkeypatch):
+    monkeypatch.setattr(router, "MAX_BODY_BYTES", 16)
+    assert request("POST", "/api/v1/documents/OCR", json.dumps({"images": ["x" * 16]}), token())[0] == 413
+
+
+def test_missing_or_bad_token_is_401(handlers, token):
+    assert request("GET", "/api/v1/users")[0] == 401
+    assert request("GET", "/api/v1/users", token="not-a-jwt")[0] == 401
+    assert handlers == []
+
+
+def test_public_routes_need_no_token(handlers):
+    assert request("POST", "/api/v1/auth/login", "{}")[0] == 200
+
+
+def test_gateway_authorized_event_is_not_checked_again(handlers):
+    status, _, _ = request("DELETE", "/api/v1/users", "{}",
+                           requestContext={"authorizer": {"principalId": "user-1", "groups": "admin"}})
+    assert status == 200
+
+
+@pytest.mark.parametrize("method, path", [("DELETE", "/api/v1/users"), ("POST", "/api/v1/auth/register/bulk")])
+def test_admin_routes_need_the_admin_group(handlers, token, method, path):
+    status, body, _ = request(method, path, "{}", token())
+    assert status == 403
+    assert body["message"] == "User is not authorized to access this resource"
+    assert handlers == []
+
+    assert request(method, path, "{}", token("admin"))[0] == 200
+    assert handlers[0][1]["requestContext"]["authorizer"]["groups"] == "admin"
+
+
+def test_non_admin_keeps_the_other_methods(handlers, token):
+    assert request("GET", "/api/v1/users", token=token())[0] == 200
+
+
+def test_handler_errors_are_500(handlers, token, monkeypatch):
+    def broken(event, context):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setitem(router._handlers, "get_user", broken)
+    status, body, headers = request("GET", "/api/v1/users", token=token())
+    assert status == 500
+    assert body["error"] == "database is down"
+    assert headers["Access-Control-Allow-Origin"] == "*"
+
+
+def test_response_without_a_status_is_502(handlers, token, monkeypatch):
+    monkeypatch.setitem(router._handlers, "get_user", lambda event, context: {"body": "{}"})
+    assert request("GET", "/api/v1/users", token=token())[0] == 502
+
+
+def test_request_body_uses_the_parsed_body():
+    assert request_body({PARSED_BODY_KEY: {"a": 1}, "body": "{not json"}) == {"a": 1}
+
+
+def test_request_body_parses_the_raw_body():
+    assert request_body({"body": json.dumps({"a": 1})}) == {"a": 1}
+    with pytest.raises(ValueError):
+        request_body({"body": "{not json"})
+
+
+def test_request_body_default_is_only_for_a_missing_body():
+    assert request_body({"body": None}, {}) == {}
+    assert request_body({}, {"a": 1}) == {"a": 1}
+    with pytest.raises(TypeError):
+        request_body({"body": None})
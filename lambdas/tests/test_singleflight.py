@@ -0,0 +1,208 @@
+import threading
+import time
+
+import pytest
+
+import singleflight
+from singleflight import LeaseError, MemoryLeaseStore, SingleFlight
+
+
+class Waits(threading.Event):
+    """
+    An Event that counts the threads waiting on it
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = 0
+
+    def wait(self, timeout=None):
+        self.waiting += 1
+        return super().wait(timeout)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    The calls the SingleFlights start, so a test can wait for callers to join one
+    """
+    started = []
+
+    class Call(singleflight._Call):
+        def __init__(self):
+            super().__init__()
+            self.done = Waits()
+            started.append(self)
+
+    monkeypatch.setattr(singleflight, "_Call", Call)
+    return started
+
+
+def until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def run_together(flight, key, leader_function, waiters: int, retry=None, waiter_function=None) -> list:
+    """
+    Starts a leader, then waiters that join its call once it is running, and returns
+    each caller's (result, shared) or exception, leader first
+    """
+    outcomes = [None] * (waiters + 1)
+    release = threading.Event()
+
+    def leader():
+        release.wait(5)
+        return leader_function()
+
+    def run(index, function):
+        try:
+            outcomes[index] = flight.do(key, function, retry)
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=run, args=(0, leader))]
+    threads[0].start()
+    until(lambda: key in flight.calls)
+    call = flight.calls[key]
+    threads += [threading.Thread(target=run, args=(index, waiter_function or leader))
+                for index in range(1, waiters + 1)]
+    for thread in threads[1:]:
+        thread.start()
+    until(lambda: call.done.waiting == waiters)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_concurrent_callers_share_one_call(calls):
+    runs = []
+    outcomes = run_together(SingleFlight(), "page", lambda: runs.append(1) or "fields", waiters=3)
+    assert runs == [1]
+    assert outcomes == [("fields", False)] + [("fields", True)] * 3
+
+
+def test_leader_error_reaches_the_waiters(calls):
+    error = RuntimeError("Textract failed")
+
+    def fail():
+        raise error
+
+    outcomes = run_together(SingleFlight(), "page", fail, waiters=2)
+    assert all(outcome is error for outcome in outcomes)
+
+
+def test_waiters_retry_errors_that_were_the_leaders_own(calls):
+    flight = SingleFlight()
+    runs = []
+
+    def throttled():
+        raise TimeoutError("out of time")
+
+    def own_call():
+        runs.append(1)
+        return "fields"
+
+    outcomes = run_together(flight, "page", throttled, waiters=2,
+                            retry=lambda error: isinstance(error, TimeoutError), waiter_function=own_call)
+    assert isinstance(outcomes[0], TimeoutError)
+    # One waiter led the second call and the other joined it, or both ran in turn
+    assert sorted(outcomes[1:], key=lambda outcome: outcome[1]) in (
+        [("fields", False), ("fields", True)], [("fields", False), ("fields", False)])
+    assert len(runs) in (1, 2)
+    assert flight.calls == {}
+
+
+def test_retry_declining_raises(calls):
+    outcomes = run_together(SingleFlight(), "page", lambda: 1 / 0, waiters=1, retry=lambda error: False)
+    assert all(isinstance(outcome, ZeroDivisionError) for outcome in outcomes)
+
+
+def test_keys_are_independent():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("b", lambda: 2) == (2, False)
+    assert flight.calls == {}
+
+
+def test_work_key_depends_on_the_options():
+    key = singleflight.work_key(b"page", docType="form", crop=True)
+    assert key == singleflight.work_key(b"page", crop=True, docType="form")
+    assert key != singleflight.work_key(b"page", docType="id", crop=True)
+    assert key != singleflight.work_key(b"other page", docType="form", crop=True)
+
+
+@pytest.fixture
+def quick(monkeypatch):
+    monkeypatch.setattr(singleflight, "POLL_SECONDS", 0.01)
+    monkeypatch.setattr(singleflight, "MAX_WAIT_SECONDS", 0.5)
+
+
+def test_run_leased_shares_the_result(quick):
+    store = MemoryLeaseStore()
+    assert singleflight.run_leased("page", lambda: {"fields": 1}, store) == ({"fields": 1}, "computed")
+    assert singleflight.run_leased("page", lambda: pytest.fail("ran twice"), store) == ({"fields": 1}, "lease")
+
+
+def test_run_leased_waits_for_the_holder(quick):
+    store = MemoryLeaseStore()
+    assert store.acquire("page", "other-worker", 60)
+
+    def finish():
+        time.sleep(0.1)
+        store.complete("page", "other-worker", ["fields"], 60)
+
+    threading.Thread(target=finish).start()
+    assert singleflight.run_leased("page", lambda: pytest.fail("ran twice"), store) == (["fields"], "lease")
+
+
+def test_run_leased_takes_over_an_expired_lease(quick):
+    store = MemoryLeaseStore()
+    # A worker that died holding the lease
+    assert store.acquire("page", "dead-worker", -1)
+    assert singleflight.run_leased("page", lambda: "fields", store) == ("fields", "computed")
+    assert store.lookup("page") == (singleflight.DONE, "fields")
+
+
+def test_run_leased_stops_waiting_for_a_slow_holder(quick):
+    store = MemoryLeaseStore()
+    assert store.acquire("page", "slow-worker", 60)
+    start = time.monotonic()
+    assert singleflight.run_leased("page", lambda: "fields", store) == ("fields", "computed")
+    assert time.monotonic() - start >= singleflight.MAX_WAIT_SECONDS
+
+
+def test_run_leased_releases_the_lease_on_error(quick):
+    store = MemoryLeaseStore()
+    with pytest.raises(ZeroDivisionError):
+        singleflight.run_leased("page", lambda: 1 / 0, store)
+    assert store.lookup("page") == (singleflight.MISSING, None)
+    assert singleflight.run_leased("page", lambda: "fields", store) == ("fields", "computed")
+
+
+class BrokenStore(MemoryLeaseStore):
+    def __init__(self, failing: str):
+        super().__init__()
+        self.failing = failing
+
+    def __getattribute__(self, name):
+        if name == object.__getattribute__(self, "failing"):
+            def fail(*args):
+                raise LeaseError("The database is unreachable")
+            return fail
+        return super().__getattribute__(name)
+
+
+@pytest.mark.parametrize("failing", ["acquire", "complete"])
+def test_run_leased_fails_open(quick, failing):
+    assert singleflight.run_leased("page", lambda: "fields", BrokenStore(failing)) == ("fields", "computed")
+
+
+def test_coalesce_with_a_lease_store(quick, monkeypatch):
+    store = MemoryLeaseStore()
+    monkeypatch.setattr(singleflight, "get_lease_store", lambda: store)
+    assert singleflight.coalesce("page", lambda: "fields") == "fields"
+    assert singleflight.coalesce("page", lambda: pytest.fail("ran twice")) == "fields"
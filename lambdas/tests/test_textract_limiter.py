@@ -0,0 +1,151 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+import rate_util
+import textract_limiter
+from textract_limiter import AdaptiveRateLimiter, Throttled
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "AnalyzeDocument")
+
+
+class Textract:
+    """
+    Raises the given errors in turn, then answers
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def analyze_document(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"Blocks": [], "DocumentMetadata": {"Pages": 1}}
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """
+    The backoff delays the limiter asked for; it doesn't actually wait
+    """
+    requested = []
+
+    def backoff_delay(attempt):
+        requested.append(attempt)
+        return 0.0
+
+    monkeypatch.setattr(textract_limiter, "backoff_delay", backoff_delay)
+    return requested
+
+
+def test_success(delays):
+    limiter = AdaptiveRateLimiter(max_rate=100)
+    textract = Textract()
+    assert limiter.call(textract.analyze_document, Document={})["DocumentMetadata"] == {"Pages": 1}
+    assert limiter.snapshot()["calls"] == 1
+    assert delays == []
+
+
+def test_throttling_is_retried_and_lowers_the_rate(delays):
+    limiter = AdaptiveRateLimiter(max_rate=100)
+    textract = Textract(client_error("ThrottlingException"), client_error("ThrottlingException"))
+
+    limiter.call(textract.analyze_document, Document={})
+    snapshot = limiter.snapshot()
+    assert textract.calls == 3
+    assert (snapshot["throttles"], snapshot["retries"]) == (2, 2)
+    # Halved once: the second throttle came within the cooldown
+    assert 50 <= snapshot["rate"] < 51
+    assert delays == [0, 1]
+
+
+def test_rate_recovers_after_throttling(delays):
+    limiter = AdaptiveRateLimiter(max_rate=10, increase=5)
+    limiter.call(Textract(client_error("ThrottlingException")).analyze_document)
+    lowered = limiter.rate
+    for _ in range(5):
+        limiter.call(Textract().analyze_document)
+    assert lowered < limiter.rate <= 10
+
+
+def test_rate_stays_above_the_minimum(monkeypatch):
+    monkeypatch.setattr(textract_limiter, "DECREASE_COOLDOWN_SECONDS", 0.0)
+    limiter = AdaptiveRateLimiter(max_rate=100, min_rate=30)
+    for _ in range(4):
+        limiter.on_throttle("ThrottlingException")
+    assert limiter.rate == 30
+
+
+@pytest.mark.parametrize("error", [
+    EndpointConnectionError(endpoint_url="https://textract.us-east-2.amazonaws.com"),
+    ReadTimeoutError(endpoint_url="https://textract.us-east-2.amazonaws.com"),
+    client_error("InternalServerError"),
+])
+def test_network_and_server_errors_are_retried_without_slowing_down(delays, error):
+    limiter = AdaptiveRateLimiter(max_rate=100)
+    textract = Textract(error)
+    limiter.call(textract.analyze_document)
+    assert textract.calls == 2
+    assert limiter.snapshot()["throttles"] == 0
+    assert limiter.rate == 100
+
+
+def test_other_errors_are_raised_at_once(delays):
+    limiter = AdaptiveRateLimiter(max_rate=100)
+    textract = Textract(client_error("InvalidParameterException"))
+    with pytest.raises(ClientError):
+        limiter.call(textract.analyze_document)
+    assert textract.calls == 1
+    assert delays == []
+
+
+def test_gives_up_after_max_attempts_without_a_deadline(delays):
+    limiter = AdaptiveRateLimiter(max_rate=100)
+    textract = Textract(*[client_error("ThrottlingException")] * (rate_util.MAX_ATTEMPTS + 1))
+    with pytest.raises(Throttled) as raised:
+        limiter.call(textract.analyze_document)
+    assert raised.value.code == "ThrottlingException"
+    assert textract.calls == rate_util.MAX_ATTEMPTS
+    assert limiter.snapshot()["gave_up"] == 1
+
+
+def test_gives_up_before_the_deadline(monkeypatch):
+    monkeypatch.setattr(textract_limiter, "backoff_delay", lambda attempt: 5.0)
+    limiter = AdaptiveRateLimiter(max_rate=100)
+    textract = Textract(client_error("ThrottlingException"), client_error("ThrottlingException"))
+
+    start = time.monotonic()
+    with pytest.raises(Throttled, match="after 1 attempts"):
+        limiter.call(textract.analyze_document, deadline=time.monotonic() + 1.0)
+    # Didn't sleep into the deadline
+    assert time.monotonic() - start < 1.0
+    assert textract.calls == 1
+
+
+def test_no_token_before_the_deadline(delays):
+    limiter = AdaptiveRateLimiter(max_rate=0.5)
+    limiter.call(Textract().analyze_document)
+    textract = Textract()
+    # The next token is two seconds away
+    with pytest.raises(Throttled, match="No Textract capacity"):
+        limiter.call(textract.analyze_document, deadline=time.monotonic() + 0.1)
+    assert textract.calls == 0
+
+
+def test_request_deadline():
+    now = time.monotonic()
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: 10_000)
+    assert textract_limiter.request_deadline(context) == pytest.approx(
+        now + 10 - textract_limiter.DEADLINE_MARGIN_SECONDS, abs=0.5)
+    assert textract_limiter.request_deadline(None) == pytest.approx(
+        now + textract_limiter.REQUEST_TIMEOUT_SECONDS - textract_limiter.DEADLINE_MARGIN_SECONDS, abs=0.5)
+    # Queue workers are only bound by the Lambda's own timeout
+    long_context = SimpleNamespace(get_remaining_time_in_millis=lambda: 600_000)
+    assert textract_limiter.request_deadline(long_context, limit=None) == pytest.approx(
+        now + 600 - textract_limiter.DEADLINE_MARGIN_SECONDS, abs=0.5)
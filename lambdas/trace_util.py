@@ -0,0 +1,336 @@
+"""
+Per-invocation tracing: each traced handler call collects spans and logs them as one
+CloudWatch Embedded Metric Format (EMF) line when it returns. The span list is kept
+as a log property for Logs Insights, and per-stage totals become metrics.
+
+- traced_handler wraps a lambda_handler and starts the trace, keyed by the Lambda
+  request id.
+- span("name", key=value) times a stage of the handler, nested under the span open
+  around it.
+- Every botocore API call made while a trace is active becomes a span on its own,
+  with the service, operation, bytes sent and received, HTTP status and retries.
+  install() hooks the default boto3 session, so it has to run (by importing this
+  module) before the handler creates its clients.
+- metric("Name", value) adds a metric of the handler's own, such as a count of
+  retries, to the invocation's record.
+
+Set TRACE_ENABLED=false to turn tracing off.
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from profile_util import profiled_handler
+
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "true").lower() != "false"
+NAMESPACE = os.environ.get("TRACE_NAMESPACE", "OWL/Traces")
+# Spans kept per invocation; the rest are only counted, to bound the log line
+MAX_SPANS = 500
+# Prefix of the per-stage metric names
+STAGE_METRIC = "Stage."
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+# Traces in progress in this process. A Lambda container runs one at a time, which
+# lets spans from the handler's own worker threads find it
+_active_traces = set()
+_active_lock = threading.Lock()
+_cold_start = True
+
+
+class Trace:
+    """
+    The spans of one invocation
+    """
+
+    def __init__(self, handler: str, request_id: str):
+        self.handler = handler
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        # Totals include dropped spans, so the metrics stay exact on long invocations
+        self.stages = {}
+        self.aws_calls, self.aws_time, self.aws_retries = 0, 0.0, 0
+        # Metrics added with metric(), by name: [value, unit]
+        self.metrics = {}
+        self.lock = threading.RLock()
+        self.next_id = 0
+        # Where profile_util wrote the invocation's profile, if it was profiled
+        self.profile = None
+
+    def add(self, name: str, start: float, end: float, parent, attributes: dict, span_id: int = None) -> int:
+        with self.lock:
+            if span_id is None:
+                span_id = self.reserve_id()
+            duration = (end - start) * 1000
+            if attributes.get("service"):
+                self.aws_calls += 1
+                self.aws_time += duration
+                self.aws_retries += attributes.get("retries", 0)
+            else:
+                self.stages[name] = self.stages.get(name, 0.0) + duration
+            if len(self.spans) >= MAX_SPANS:
+                self.dropped += 1
+                return span_id
+            self.spans.append({
+                "id": span_id,
+                "parent": parent,
+                "name": name,
+                "start_ms": round((start - self.start) * 1000, 3),
+                "duration_ms": round(duration, 3),
+                **attributes
+            })
+            return span_id
+
+    def metric(self, name: str, value: float, unit: str, add: bool) -> None:
+        with self.lock:
+            if add and name in self.metrics:
+                self.metrics[name][0] += value
+            else:
+                self.metrics[name] = [value, unit]
+
+    def reserve_id(self) -> int:
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def record(self, status_code, cold_start: bool) -> dict:
+        """
+        Builds the EMF record of the finished invocation
+        """
+        duration = (time.perf_counter() - self.start) * 1000
+        stages = {STAGE_METRIC + name: round(total, 3) for name, total in self.stages.items()}
+
+        metrics = [{"Name": "Duration", "Unit": "Milliseconds"},
+                   {"Name": "AwsCalls", "Unit": "Count"},
+                   {"Name": "AwsCallTime", "Unit": "Milliseconds"},
+                   {"Name": "AwsRetries", "Unit": "Count"}]
+        metrics += [{"Name": name, "Unit": "Milliseconds"} for name in sorted(stages)]
+        metrics += [{"Name": name, "Unit": unit} for name, (_, unit) in sorted(self.metrics.items())]
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{"Namespace": NAMESPACE, "Dimensions": [["Handler"]], "Metrics": metrics}]
+            },
+            "Handler": self.handler,
+            "RequestId": self.request_id,
+            "ColdStart": cold_start,
+            "StatusCode": status_code,
+            "Duration": round(duration, 3),
+            "AwsCalls": self.aws_calls,
+            "AwsCallTime": round(self.aws_time, 3),
+            "AwsRetries": self.aws_retries,
+            **stages,
+            **{name: round(value, 3) for name, (value, _) in self.metrics.items()},
+            "Spans": self.spans,
+            "DroppedSpans": self.dropped
+        }
+        if self.profile is not None:
+            record["Profile"] = self.profile
+        return record
+
+
+def current_trace():
+    """
+    A Utility Function that returns the trace of the running invocation, or None.
+    Threads the handler started find it when it's the only one in progress
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        with _active_lock:
+            if len(_active_traces) == 1:
+                trace = next(iter(_active_traces))
+    return trace
+
+
+def emit(record: dict) -> None:
+    """
+    Writes a record as a bare JSON line on stdout, which is how EMF has to reach the
+    Lambda log (the logging module would prefix it). Replaced by tools that collect
+    traces in process
+    """
+    sys.stdout.write(json.dumps(record, default=str) + "\n")
+    sys.stdout.flush()
+
+
+def metric(name: str, value: float, unit: str = "Count", add: bool = True) -> None:
+    """
+    A Utility Function that records a metric on the running invocation's record.
+    Does nothing outside a trace
+
+    Input:
+        name = the metric's name, e.g. "TextractThrottles"
+        value = the amount to add, or the value to report when add is False
+        unit = a CloudWatch unit, e.g. "Count" or "Milliseconds"
+        add = whether values recorded during the invocation are summed (counts and
+              times) or the last one is kept (gauges)
+    """
+    trace = current_trace() if TRACE_ENABLED else None
+    if trace is not None:
+        trace.metric(name, value, unit, add)
+
+
+class span:
+    """
+    Times a stage of the running invocation: use as `with span("decode", pages=3):`
+    or as a decorator. Does nothing outside a trace
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.trace = current_trace() if TRACE_ENABLED else None
+        if self.trace is not None:
+            self.parent = _current_span.get()
+            self.id = self.trace.reserve_id()
+            self.token = _current_span.set(self.id)
+            self.start = time.perf_counter()
+        return self
+
+    def set(self, **attributes) -> None:
+        """
+        Adds attributes known only once the stage has run, such as output sizes
+        """
+        self.attributes.update(attributes)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None:
+            return False
+        end = time.perf_counter()
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.trace.add(self.name, self.start, end, self.parent, self.attributes, self.id)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(self.name, **self.attributes):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+def traced_handler(handler):
+    """
+    A Utility Function that wraps a lambda_handler so each invocation is traced and
+    logged as an EMF record, and can be profiled through profile_util
+
+    Input:
+        handler = the lambda_handler(event, context) function
+
+    Output:
+        returns the wrapped handler
+    """
+    name = handler.__module__
+    handler = profiled_handler(handler, name)
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold_start
+        if not TRACE_ENABLED or _current_trace.get() is not None:
+            return handler(event, context)
+
+        request_id = getattr(context, "aws_request_id", None)
+        if request_id is None and isinstance(event, dict):
+            request_id = (event.get("requestContext") or {}).get("requestId")
+        trace = Trace(name, request_id or str(uuid.uuid4()))
+        cold_start, _cold_start = _cold_start, False
+
+        token = _current_trace.set(trace)
+        with _active_lock:
+            _active_traces.add(trace)
+        status_code = None
+        try:
+            response = handler(event, context)
+            if isinstance(response, dict):
+                status_code = response.get("statusCode")
+            return response
+        except Exception:
+            status_code = "error"
+            raise
+        finally:
+            with _active_lock:
+                _active_traces.discard(trace)
+            _current_trace.reset(token)
+            emit(trace.record(status_code, cold_start))
+
+    return wrapper
+
+
+def _request_bytes(body) -> int:
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    if isinstance(body, dict):
+        return len(json.dumps(body, default=str))
+    return 0
+
+
+def _before_call(params=None, context=None, **kwargs):
+    if context is not None and current_trace() is not None:
+        context["trace_util"] = {"start": time.perf_counter(), "parent": _current_span.get(),
+                                 "request_bytes": _request_bytes((params or {}).get("body"))}
+
+
+def _after_call(event_name, http_response=None, parsed=None, context=None, exception=None, **kwargs):
+    started = (context or {}).pop("trace_util", None)
+    trace = current_trace()
+    if started is None or trace is None:
+        return
+    _, service, operation = event_name.split(".", 2)
+    attributes = {"service": service, "operation": operation, "request_bytes": started["request_bytes"]}
+    if http_response is not None:
+        attributes["http_status"] = http_response.status_code
+        # From the header, since reading the content would consume streamed bodies
+        attributes["response_bytes"] = int(http_response.headers.get("content-length") or 0)
+    metadata = (parsed or {}).get("ResponseMetadata", {})
+    attributes["retries"] = metadata.get("RetryAttempts", 0)
+    if "Error" in (parsed or {}):
+        attributes["error"] = parsed["Error"].get("Code")
+    if exception is not None:
+        attributes["error"] = type(exception).__name__
+    trace.add(f"{service}.{operation}", started["start"], time.perf_counter(), started["parent"], attributes)
+
+
+def instrument(events) -> None:
+    """
+    A Utility Function that times the API calls of a botocore event emitter: the
+    default session's, so every client created afterwards inherits the hooks, or an
+    existing client's (client.meta.events)
+    """
+    events.register("before-call", _before_call, unique_id="trace_util.before-call")
+    events.register("after-call", _after_call, unique_id="trace_util.after-call")
+    events.register("after-call-error", _after_call, unique_id="trace_util.after-call-error")
+
+
+def install() -> bool:
+    """
+    A Utility Function that instruments the default boto3 session
+
+    Output:
+        returns False when boto3 isn't available or tracing is off
+    """
+    if not TRACE_ENABLED:
+        return False
+    try:
+        import boto3
+    except ImportError:
+        return False
+    try:
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        instrument(boto3.DEFAULT_SESSION.events)
+    except AttributeError:
+        # A boto3 without the session API, e.g. a stand-in; clients are untraced
+        return False
+    return True
+
+
+install()
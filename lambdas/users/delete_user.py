@@ -1,5 +1,6 @@
 import json
-from lambdas.db_util import execute_statement
+from db_util import execute_statement
+from trace_util import traced_handler
 
 
 # rds_client = boto3.client('rds-data')
@@ -7,31 +8,55 @@ from lambdas.db_util import execute_statement
 # db_cluster_arn: str = 'arn:aws:rds:us-east-2:536697256476:cluster:owl-db-cluster'
 # db_credentials_secrets_store_arn: str = 'arn:aws:secretsmanager:us-east-2:536697256476:secret:rds!cluster-bc988741-caee-489a-81b0-4261cfcbea3e-4Gs3QE'
 
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+    "Access-Control-Allow-Methods": "OPTIONS,DELETE,GET"
+}
+
+@traced_handler
 def lambda_handler(event, context):
     """
     Handles the lambda for deleting a specifc user with this user_id
 
     Input:
         event: 
-            user_id = The User's id
+            user_id = The User's id, in the query string of DELETE /users, or in
+                      the event itself when invoked directly
         context:
             Not used
 
     Output: 
         returns the response from executing the statement with a json message
     """
-    user_id = event.get('user_id')
+    if event.get("httpMethod") == "OPTIONS":
+        return {
+            "statusCode": 200,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({"message": "CORS preflight success"})
+        }
+
+    user_id = (event.get('queryStringParameters') or {}).get('user_id') or event.get('user_id')
 
     if not user_id:
         return {
             "statusCode": 400,
+            "headers": CORS_HEADERS,
             "body": json.dumps("Missing user_id")
         }
 
     sql = "DELETE FROM users WHERE user_id = :user_id"
     response = execute_statement(sql, {'user_id': user_id})
-    # return user_id
-    return response
+    if "statusCode" in response:
+        # execute_statement's error response
+        return dict(response, headers=CORS_HEADERS, body=json.dumps(response["body"], default=str))
+
+    return {
+        "statusCode": 200,
+        "headers": CORS_HEADERS,
+        "body": json.dumps({"message": "User deletion successful",
+                            "data": {"deletedCount": response.get("numberOfRecordsUpdated", 0)}})
+    }
 
 # def execute_statement(sql: str, parameters: dict):
 #     response = rds_client.execute_statement(
@@ -1,5 +1,6 @@
 import json
 from db_util import execute_statement
+from trace_util import traced_handler
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -7,6 +8,7 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "OPTIONS,POST"
 }
 
+@traced_handler
 def lambda_handler(event, context):
     """
     Handles the lambda for getting a specifc user with specific user_id/email or all users if no user_id or email is provided
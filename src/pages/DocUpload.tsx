@@ -13,6 +13,17 @@ import { useAuthedFetch } from "../hooks/UseAuthedFetch";
 interface myFile extends File {
   id: string;
 }
+
+interface PageImages {
+  images: string[];
+  textLayer: (object[] | null)[];
+}
+
+interface DocxFields {
+  fields: { PageNumber: number }[];
+  confident: boolean;
+  reason?: string;
+}
 function DocUpload() {
   const isMobile = useIsMobile();
   const user = JSON.parse(localStorage.getItem("user") ?? "");
@@ -318,9 +329,10 @@ function DocUpload() {
         return;
       }
 
-      const base64Files: string[] = (
-        await Promise.all(files.map((file) => getBase64Images(file)))
-      ).flat();
+      const pages: PageImages[] = await Promise.all(files.map((file) => getBase64Images(file)));
+      const base64Files: string[] = pages.flatMap((page) => page.images);
+      // Fields read from digital PDF pages; those pages skip OCR
+      const textLayer: (object[] | null)[] = pages.flatMap((page) => page.textLayer);
 
       const base64ResizedFiles: string[] = await Promise.all(base64Files.map((file) => resizeb64Image(file)));
 
@@ -332,6 +344,7 @@ function DocUpload() {
       const payload = {
         docType: selectedDocType,
         images: base64ResizedFiles, // Now this contains the list of all base64 images
+        textLayer: textLayer,
       };
 
       // Call the OCR API
@@ -424,9 +437,10 @@ function DocUpload() {
    * Convert a base64 PDF files to a list of images (one per page).
    *
    * @param b64PDF The base64 PDF file to convert.
-   * @returns The list of base64-encoded images.
+   * @returns The list of base64-encoded images, and the fields read from each page's
+   * text layer (null where the page needs OCR).
    */
-  async function convertPDFb64ToImagesb64(b64PDF: string): Promise<string[]> {
+  async function convertPDFb64ToImagesb64(b64PDF: string): Promise<PageImages> {
     console.log("Converting PDF to list of images...");
 
     const body = {
@@ -445,7 +459,11 @@ function DocUpload() {
       throw new Error("Failed to convert PDF to Images.");
     }
 
-    return responseJson.image_list;
+    const images: string[] = responseJson.image_list;
+    return {
+      images: images,
+      textLayer: responseJson.text_layer ?? images.map(() => null),
+    };
   }
 
   /**
@@ -480,9 +498,9 @@ function DocUpload() {
    * Convert a DOCX to a base64 PDF file.
    *
    * @param file The DOCX file to convert.
-   * @returns The converted base64 PDF file.
+   * @returns The converted base64 PDF file, and the form fields read from the DOCX.
    */
-  async function convertDOCXToPDFb64(file: File): Promise<string> {
+  async function convertDOCXToPDFb64(file: File): Promise<{ b64PDF: string; docxFields?: DocxFields }> {
     console.log("Converting DOCX to PDF...");
     const base64Docx = await fileToBase64(file);
 
@@ -502,7 +520,7 @@ function DocUpload() {
       throw new Error("Failed to convert DOCX to PDF.");
     }
 
-    return responseJson.base64_pdf;
+    return { b64PDF: responseJson.base64_pdf, docxFields: responseJson.docx_fields };
   }
 
   /**
@@ -565,14 +583,15 @@ function DocUpload() {
    * Convert the given file to a list of base64-encoded images.
    *
    * @param file The file to convert.
-   * @returns The list of converted base64 images.
+   * @returns The list of converted base64 images, and any fields read from their
+   * text layer.
    */
-  async function getBase64Images(file: File): Promise<string[]> {
+  async function getBase64Images(file: File): Promise<PageImages> {
     console.log("File type:", file.type);
     if (["image/png", "image/jpeg"].includes(file.type)) {
       const b64 = await fileToBase64(file);
       const b64Compressed = await compressb64Image(b64);
-      return [b64Compressed];
+      return { images: [b64Compressed], textLayer: [null] };
     } else if (["", "image/heic", "image/heif"].includes(file.type)) {
       let convertedFile: File = file;
       try {
@@ -582,15 +601,24 @@ function DocUpload() {
       }
       const b64 = await fileToBase64(convertedFile);
       const b64Compressed = await compressb64Image(b64);
-      return [b64Compressed];
+      return { images: [b64Compressed], textLayer: [null] };
     } else if (file.type === "application/pdf") {
       const b64PDF = await fileToBase64(file);
       const b64CompressedPDF = await compressb64PDF(b64PDF);
       return await convertPDFb64ToImagesb64(b64CompressedPDF);
     } else if (file.type === "application/vnd.openxmlformats-officedocument.wordprocessingml.document") {
-      const b64PDF = await convertDOCXToPDFb64(file);
+      const { b64PDF, docxFields } = await convertDOCXToPDFb64(file);
       const b64CompressedPDF = await compressb64PDF(b64PDF);
-      return await convertPDFb64ToImagesb64(b64CompressedPDF);
+      const pages = await convertPDFb64ToImagesb64(b64CompressedPDF);
+      if (docxFields?.confident) {
+        // The fields were read from the DOCX itself, so no page needs OCR. Word's page
+        // breaks can differ from the PDF's, so fields past the last page go on it
+        pages.textLayer = pages.images.map((_, index) => docxFields.fields.filter(
+          (field) => Math.min(field.PageNumber, pages.images.length) === index + 1));
+      } else {
+        console.log("DOCX fields not used:", docxFields?.reason);
+      }
+      return pages;
     } else {
       throw new Error("File type is not supported"); 
     }